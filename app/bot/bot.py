@@ -4,8 +4,9 @@ from dotenv import load_dotenv
 from .handlers import (
     start_command,
     campaigns_handler,
-    show_active_campaigns,
+    show_campaigns,
     budget_handler,
+    budget_forecast_handler,
     stats_handler,
     settings_handler,
     connect_fb_handler,
@@ -29,8 +30,9 @@ def create_bot():
     
     # Добавляем обработчики callback-запросов
     app.add_handler(CallbackQueryHandler(campaigns_handler, pattern="^campaigns$"))
-    app.add_handler(CallbackQueryHandler(show_active_campaigns, pattern="^campaigns_active$"))
+    app.add_handler(CallbackQueryHandler(show_campaigns, pattern=r"^campaigns_(active|paused)(_\d+)?$"))
     app.add_handler(CallbackQueryHandler(budget_handler, pattern="^budget$"))
+    app.add_handler(CallbackQueryHandler(budget_forecast_handler, pattern="^budget_forecast$"))
     app.add_handler(CallbackQueryHandler(stats_handler, pattern="^stats$"))
     app.add_handler(CallbackQueryHandler(settings_handler, pattern="^settings$"))
     app.add_handler(CallbackQueryHandler(connect_fb_handler, pattern="^connect_fb$"))
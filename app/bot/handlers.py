@@ -1,121 +1,253 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from datetime import datetime
 import os
+import re
 
-async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка команды /start"""
-    keyboard = [
-        [
-            InlineKeyboardButton("📊 Мои кампании", callback_data="campaigns"),
-            InlineKeyboardButton("💰 Бюджет", callback_data="budget")
-        ],
+from sqlalchemy import select
+
+from ..db.database import readonly_session_factory
+from ..db.models import CampaignSummary, User, UserDashboardSummary
+from ..services.pacing import pacing_service
+from ..services.cache import LRUCache
+from ..services.user_auth import AuthError, issue_session, user_id_for_telegram
+
+PACING_STATUS_LABELS = {
+    'on_track': '✅ в графике',
+    'underpacing': '🐢 недорасход',
+    'overpacing': '🔥 перерасход',
+}
+CAMPAIGN_LISTS = {
+    'active': ('ACTIVE', '📈 *Активные кампании*'),
+    'paused': ('PAUSED', '⏸ *Кампании на паузе*'),
+}
+CAMPAIGNS_PAGE_SIZE = 10
+
+# Клавиатуры без данных пользователя собираются один раз при импорте
+MAIN_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("📊 Мои кампании", callback_data="campaigns"),
+        InlineKeyboardButton("💰 Бюджет", callback_data="budget")
+    ],
+    [
+        InlineKeyboardButton("📈 Статистика", callback_data="stats"),
+        InlineKeyboardButton("⚙️ Настройки", callback_data="settings")
+    ],
+    [
+        InlineKeyboardButton("🔄 Подключить Facebook", callback_data="connect_fb")
+    ]
+])
+CAMPAIGNS_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("✅ Активные", callback_data="campaigns_active"),
+        InlineKeyboardButton("⏸ На паузе", callback_data="campaigns_paused")
+    ],
+    [
+        InlineKeyboardButton("➕ Создать новую", callback_data="campaign_create")
+    ],
+    [
+        InlineKeyboardButton("« Назад", callback_data="back_to_main")
+    ]
+])
+BUDGET_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("💰 Изменить бюджет", callback_data="change_budget")
+    ],
+    [
+        InlineKeyboardButton("📉 Прогноз расхода", callback_data="budget_forecast")
+    ],
+    [
+        InlineKeyboardButton("« Назад", callback_data="back_to_main")
+    ]
+])
+BACK_TO_BUDGET_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("« Назад к бюджету", callback_data="budget")]
+])
+STATS_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("📅 За сегодня", callback_data="stats_today"),
+        InlineKeyboardButton("📅 За неделю", callback_data="stats_week")
+    ],
+    [
+        InlineKeyboardButton("📅 За месяц", callback_data="stats_month"),
+        InlineKeyboardButton("📊 Сводный отчёт", callback_data="stats_summary")
+    ],
+    [
+        InlineKeyboardButton("« Назад", callback_data="back_to_main")
+    ]
+])
+SETTINGS_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("🔔 Уведомления", callback_data="settings_notifications"),
+        InlineKeyboardButton("⚙️ Общие", callback_data="settings_general")
+    ],
+    [
+        InlineKeyboardButton("« Назад", callback_data="back_to_main")
+    ]
+])
+
+def _connect_fb_keyboard(user_id) -> InlineKeyboardMarkup:
+    """Ссылка авторизации Facebook с подписанной сессией пользователя (токен привяжется к нему)"""
+    url = f"{os.getenv('BACKEND_URL', 'http://localhost:8000')}/api/facebook/auth"
+    if user_id is not None:
+        try:
+            url += f"?token={issue_session(user_id)}"
+        except AuthError:
+            pass
+    return InlineKeyboardMarkup([
         [
-            InlineKeyboardButton("📈 Статистика", callback_data="stats"),
-            InlineKeyboardButton("⚙️ Настройки", callback_data="settings")
+            InlineKeyboardButton("🔗 Подключить аккаунт", url=url)
         ],
         [
-            InlineKeyboardButton("🔄 Подключить Facebook", callback_data="connect_fb")
+            InlineKeyboardButton("« Назад", callback_data="back_to_main")
         ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
+    ])
+
+# Отрисованные экраны: ключ включает refreshed_at сводки, поэтому устаревшие записи не используются
+_rendered = LRUCache(max_size=4096, ttl_seconds=3600)
+
+def _escape(text) -> str:
+    """Экранирование Markdown для имен кампаний"""
+    return re.sub(r'([_*`\[])', r'\\\1', str(text or ''))
+
+def _campaigns_page_keyboard(list_name: str, page: int, has_next: bool) -> InlineKeyboardMarkup:
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("« Назад", callback_data=f"campaigns_{list_name}_{page - 1}"))
+    if has_next:
+        navigation.append(InlineKeyboardButton("Далее »", callback_data=f"campaigns_{list_name}_{page + 1}"))
+    rows = [navigation] if navigation else []
+    rows.append([InlineKeyboardButton("« Назад к кампаниям", callback_data="campaigns")])
+    return InlineKeyboardMarkup(rows)
+
+async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка команды /start"""
     await update.message.reply_text(
         "👋 Привет! Я помогу вам управлять рекламными кампаниями Facebook.\n\n"
         "Выберите действие:",
-        reply_markup=reply_markup
+        reply_markup=MAIN_MENU_KEYBOARD
     )
 
 async def campaigns_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка кнопки Мои кампании"""
     query = update.callback_query
     await query.answer()
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ Активные", callback_data="campaigns_active"),
-            InlineKeyboardButton("⏸ На паузе", callback_data="campaigns_paused")
-        ],
-        [
-            InlineKeyboardButton("➕ Создать новую", callback_data="campaign_create")
-        ],
-        [
-            InlineKeyboardButton("« Назад", callback_data="back_to_main")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     await query.edit_message_text(
         "📊 *Управление кампаниями*\n\n"
         "Выберите действие:",
-        reply_markup=reply_markup,
+        reply_markup=CAMPAIGNS_MENU_KEYBOARD,
         parse_mode='Markdown'
     )
 
-async def show_active_campaigns(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показ активных кампаний"""
+async def show_campaigns(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Страница списка кампаний (campaigns_<active|paused>[_<страница>]).
+    Один запрос по индексу сводок (user_id, status, campaign_id).
+    """
     query = update.callback_query
     await query.answer()
-    
-    # В режиме разработки используем тестовые данные
-    campaigns = [
-        {"name": "Test Campaign 1", "status": "ACTIVE", "budget": "1000 USD"},
-        {"name": "Test Campaign 2", "status": "ACTIVE", "budget": "500 USD"}
-    ]
-    
-    text = "📈 *Активные кампании:*\n\n"
-    for i, camp in enumerate(campaigns, 1):
-        text += f"{i}. {camp['name']}\n"
-        text += f"   Статус: {camp['status']}\n"
-        text += f"   Бюджет: {camp['budget']}\n\n"
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("⏸ Приостановить", callback_data=f"pause_{i}")
-            for i in range(len(campaigns))
-        ],
-        [
-            InlineKeyboardButton("« Назад к кампаниям", callback_data="campaigns")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text(
-        text,
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
+    _, list_name, *rest = query.data.split('_')
+    page = int(rest[0]) if rest else 0
+    status, title = CAMPAIGN_LISTS[list_name]
+
+    async with readonly_session_factory() as session:
+        rows = (await session.execute(
+            select(
+                CampaignSummary.campaign_id, CampaignSummary.name, CampaignSummary.daily_budget,
+                CampaignSummary.spend_today, CampaignSummary.roas_7d, CampaignSummary.refreshed_at
+            )
+            .join(User, User.id == CampaignSummary.user_id)
+            .where(User.telegram_id == update.effective_user.id, CampaignSummary.status == status)
+            .order_by(CampaignSummary.campaign_id)
+            .offset(page * CAMPAIGNS_PAGE_SIZE)
+            .limit(CAMPAIGNS_PAGE_SIZE + 1)
+        )).all()
+
+    has_next = len(rows) > CAMPAIGNS_PAGE_SIZE
+    rows = rows[:CAMPAIGNS_PAGE_SIZE]
+    cache_key = (update.effective_user.id, list_name, page, has_next,
+                 tuple((row.campaign_id, row.refreshed_at) for row in rows))
+    rendered = _rendered.get(cache_key)
+    if rendered is None:
+        if rows:
+            lines = [f"{title} (стр. {page + 1}):", ""]
+            for number, row in enumerate(rows, page * CAMPAIGNS_PAGE_SIZE + 1):
+                lines.append(f"{number}. {_escape(row.name)}")
+                lines.append(f"   Бюджет: ${row.daily_budget or 0:.2f}, сегодня: ${row.spend_today:.2f}, "
+                             f"ROAS 7д: {row.roas_7d:.2f}")
+            text = "\n".join(lines)
+        else:
+            text = f"{title}\n\nКампаний нет"
+        rendered = (text, _campaigns_page_keyboard(list_name, page, has_next))
+        _rendered.set(cache_key, rendered)
+
+    text, reply_markup = rendered
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
 async def budget_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка кнопки Бюджет"""
+    """Обработка кнопки Бюджет: текст из сводки пользователя (один запрос)"""
     query = update.callback_query
     await query.answer()
-    
-    # Тестовые данные о бюджете
-    total_budget = 1500
-    spent_today = 450
-    remaining = total_budget - spent_today
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("💰 Изменить бюджет", callback_data="change_budget")
-        ],
-        [
-            InlineKeyboardButton("📊 Статистика расходов", callback_data="budget_stats")
-        ],
-        [
-            InlineKeyboardButton("« Назад", callback_data="back_to_main")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
+
+    async with readonly_session_factory() as session:
+        summary = (await session.execute(
+            select(UserDashboardSummary)
+            .join(User, User.id == UserDashboardSummary.user_id)
+            .where(User.telegram_id == update.effective_user.id)
+        )).scalar_one_or_none()
+
+    if summary is None:
+        budget_text = "Бюджеты пока не настроены"
+    else:
+        cache_key = ('budget', summary.user_id, summary.refreshed_at)
+        budget_text = _rendered.get(cache_key)
+        if budget_text is None:
+            lines = [
+                f"Дневной бюджет: ${summary.daily_budget:.2f}",
+                f"Потрачено сегодня: ${summary.spend_today:.2f}",
+                f"Осталось: ${summary.remaining_budget:.2f}",
+                f"Активных кампаний: {summary.active_campaigns}",
+            ]
+            if summary.top_campaigns:
+                lines.append("\nЛучшие по ROAS за 7 дней:")
+                lines += [f"• {_escape(top['name'])}: ROAS {top['roas']:.2f}, расход ${top['spend']:.2f}"
+                          for top in summary.top_campaigns]
+            budget_text = "\n".join(lines)
+            _rendered.set(cache_key, budget_text)
+
     await query.edit_message_text(
         f"💰 *Управление бюджетом*\n\n"
-        f"Дневной бюджет: ${total_budget}\n"
-        f"Потрачено сегодня: ${spent_today}\n"
-        f"Осталось: ${remaining}\n\n"
+        f"{budget_text}\n\n"
         f"Выберите действие:",
-        reply_markup=reply_markup,
+        reply_markup=BUDGET_KEYBOARD,
+        parse_mode='Markdown'
+    )
+
+async def budget_forecast_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Прогноз расхода на конец дня и периода по действующим бюджетам"""
+    query = update.callback_query
+    await query.answer()
+
+    async with readonly_session_factory() as session:
+        user_id = (await session.execute(
+            select(User.id).where(User.telegram_id == update.effective_user.id)
+        )).scalar()
+        pacing = await pacing_service.pace_budgets(session, user_id) if user_id is not None else []
+
+    if pacing:
+        lines = [f"Прогноз на конец дня: ${sum(budget['forecast_today'] for budget in pacing):.2f}"]
+        for budget in pacing:
+            if 'forecast_flight' in budget:
+                lines.append(
+                    f"Период: ${budget['forecast_flight']:.2f} из ${budget['total_budget']:.2f} "
+                    f"({PACING_STATUS_LABELS[budget['status']]})"
+                )
+        forecast_text = "\n".join(lines)
+    else:
+        forecast_text = "Бюджеты пока не настроены"
+
+    await query.edit_message_text(
+        f"📉 *Прогноз расхода*\n\n{forecast_text}",
+        reply_markup=BACK_TO_BUDGET_KEYBOARD,
         parse_mode='Markdown'
     )
 
@@ -123,26 +255,10 @@ async def stats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка кнопки Статистика"""
     query = update.callback_query
     await query.answer()
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("📅 За сегодня", callback_data="stats_today"),
-            InlineKeyboardButton("📅 За неделю", callback_data="stats_week")
-        ],
-        [
-            InlineKeyboardButton("📅 За месяц", callback_data="stats_month"),
-            InlineKeyboardButton("📊 Сводный отчёт", callback_data="stats_summary")
-        ],
-        [
-            InlineKeyboardButton("« Назад", callback_data="back_to_main")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     await query.edit_message_text(
         "📈 *Статистика*\n\n"
         "Выберите период:",
-        reply_markup=reply_markup,
+        reply_markup=STATS_KEYBOARD,
         parse_mode='Markdown'
     )
 
@@ -150,47 +266,19 @@ async def back_to_main(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Возврат в главное меню"""
     query = update.callback_query
     await query.answer()
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("📊 Мои кампании", callback_data="campaigns"),
-            InlineKeyboardButton("💰 Бюджет", callback_data="budget")
-        ],
-        [
-            InlineKeyboardButton("📈 Статистика", callback_data="stats"),
-            InlineKeyboardButton("⚙️ Настройки", callback_data="settings")
-        ],
-        [
-            InlineKeyboardButton("🔄 Подключить Facebook", callback_data="connect_fb")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     await query.edit_message_text(
         "Главное меню:\nВыберите действие:",
-        reply_markup=reply_markup
+        reply_markup=MAIN_MENU_KEYBOARD
     )
 
 async def settings_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка кнопки Настройки"""
     query = update.callback_query
     await query.answer()
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("🔔 Уведомления", callback_data="settings_notifications"),
-            InlineKeyboardButton("⚙️ Общие", callback_data="settings_general")
-        ],
-        [
-            InlineKeyboardButton("« Назад", callback_data="back_to_main")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     await query.edit_message_text(
         "⚙️ *Настройки*\n\n"
         "Выберите раздел настроек:",
-        reply_markup=reply_markup,
+        reply_markup=SETTINGS_KEYBOARD,
         parse_mode='Markdown'
     )
 
@@ -198,24 +286,12 @@ async def connect_fb_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """Обработка кнопки Подключить Facebook"""
     query = update.callback_query
     await query.answer()
-    
-    backend_url = os.getenv("BACKEND_URL", "http://localhost:8000")
-    auth_url = f"{backend_url}/auth/facebook"
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("🔗 Подключить аккаунт", url=auth_url)
-        ],
-        [
-            InlineKeyboardButton("« Назад", callback_data="back_to_main")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
+    async with readonly_session_factory() as session:
+        user_id = await user_id_for_telegram(session, update.effective_user.id)
     await query.edit_message_text(
         "🔄 *Подключение Facebook*\n\n"
         "Для подключения вашего рекламного аккаунта Facebook нажмите кнопку ниже.\n"
         "Вы будете перенаправлены на страницу авторизации Facebook.",
-        reply_markup=reply_markup,
+        reply_markup=_connect_fb_keyboard(user_id),
         parse_mode='Markdown'
     )
@@ -8,10 +8,36 @@ class Settings(BaseSettings):
     # Переменные окружения
     DATABASE_URL: str = "sqlite+aiosqlite:///./data/ads_management.db"
     TELEGRAM_BOT_TOKEN: Optional[str] = None
+    TELEGRAM_CONCURRENT_UPDATES: int = 16  # обработчиков одновременно (по разным чатам)
+    TELEGRAM_MAX_PENDING_UPDATES: int = 256  # обновлений в работе, включая ждущие свой чат
+    # Лимиты исходящих сообщений Bot API
+    TELEGRAM_GLOBAL_MESSAGES_PER_SECOND: float = 30.0
+    TELEGRAM_CHAT_MESSAGES_PER_SECOND: float = 1.0
+    TELEGRAM_CHAT_BURST: int = 1
+    TELEGRAM_GROUP_MESSAGES_PER_MINUTE: float = 20.0
+
+    # Состояние диалогов бота (общее для воркеров, переживает перезапуск)
+    CONVERSATION_STATE_TTL_SECONDS: int = 86400
+    CONVERSATION_STATE_CACHE_TTL_SECONDS: float = 2.0  # окно, в котором другой воркер может видеть старое состояние
+    CONVERSATION_STATE_CACHE_MAX_SIZE: int = 10000
+    CONVERSATION_STATE_PURGE_INTERVAL_SECONDS: int = 3600
     
     # Настройки Facebook
     FACEBOOK_APP_ID: Optional[str] = None
     FACEBOOK_APP_SECRET: Optional[str] = None
+
+    # Хранилище токенов Facebook
+    TOKEN_ENCRYPTION_KEY: Optional[str] = None  # ключ Fernet
+    TOKEN_CACHE_TTL_SECONDS: int = 900
+    TOKEN_CACHE_MAX_SIZE: int = 1024
+    TOKEN_REFRESH_BEFORE_DAYS: int = 7
+    OAUTH_STATE_SECRET: Optional[str] = None  # ключ подписи state (по умолчанию FACEBOOK_APP_SECRET)
+    OAUTH_STATE_TTL_SECONDS: int = 600
+
+    # Идентификация пользователя в API (подписанная сессия или initData Telegram)
+    SESSION_SECRET: Optional[str] = None  # ключ подписи сессий (по умолчанию OAUTH_STATE_SECRET)
+    SESSION_TTL_SECONDS: int = 3600
+    TELEGRAM_INIT_DATA_TTL_SECONDS: int = 86400
     
     # Настройки OpenAI
     OPENAI_API_KEY: Optional[str] = None
@@ -21,10 +47,54 @@ class Settings(BaseSettings):
     MOCK_MODE: bool = True
     RENDER_EXTERNAL_URL: str = "http://localhost:8000"
 
+    # Настройки хранения исторических данных
+    RETENTION_ENABLED: bool = False
+    RETENTION_DAILY_METRICS_DAYS: int = 90
+    RETENTION_RAW_RESPONSE_DAYS: int = 30
+    RETENTION_VACUUM_PAGES: int = 2000
+    RETENTION_OFF_PEAK_START_HOUR: int = 2
+    RETENTION_OFF_PEAK_END_HOUR: int = 5
+
+    # Плановая оптимизация всех рекламных аккаунтов
+    OPTIMIZATION_RUNNER_ENABLED: bool = False
+    OPTIMIZATION_INTERVAL_SECONDS: int = 3600
+    OPTIMIZATION_MAX_WORKERS: int = 4
+    OPTIMIZATION_MAX_CONCURRENCY: int = 8
+    OPTIMIZATION_SHARD_SIZE: int = 25
+    OPTIMIZATION_DEADLINE_SECONDS: int = 900
+
+    # Обнаружение аномалий расхода и CTR
+    ANOMALY_DETECTION_ENABLED: bool = False
+    ANOMALY_CHECK_INTERVAL_SECONDS: int = 120
+
+    # Загрузка метрик кампаний для API производительности
+    PERFORMANCE_INGEST_INTERVAL_SECONDS: int = 900
+
+    # Идемпотентность создающих запросов (заголовок Idempotency-Key)
+    IDEMPOTENCY_TTL_SECONDS: int = 86400
+    IDEMPOTENCY_LEASE_SECONDS: int = 120  # сколько держится незавершенный запрос
+    IDEMPOTENCY_DEDUP_WINDOW_SECONDS: int = 10  # повторы без ключа с тем же телом; 0 — отключено
+    IDEMPOTENCY_CACHE_TTL_SECONDS: int = 300
+    IDEMPOTENCY_PURGE_INTERVAL_SECONDS: int = 3600
+
+    # Локальный фейковый Graph API для MOCK_MODE (scripts/fake_graph.py или встроенный сервер)
+    FAKE_GRAPH_URL: str = "http://127.0.0.1:8765"
+    FAKE_GRAPH_EMBEDDED: bool = True  # запускать сервер в процессе приложения
+    FAKE_GRAPH_SEED: int = 0
+    FAKE_GRAPH_LATENCY_MS: float = 80.0
+    FAKE_GRAPH_LATENCY_JITTER_MS: float = 40.0
+    FAKE_GRAPH_ERROR_RATE: float = 0.0
+    FAKE_GRAPH_RATE_LIMIT_PER_MINUTE: int = 600
+
     @property
     def FB_REDIRECT_URI(self) -> str:
         return f"{self.RENDER_EXTERNAL_URL}/auth/facebook/callback"
 
+    @property
+    def GRAPH_API_URL(self) -> str:
+        """Адрес Graph API без версии; в MOCK_MODE — фейковый сервер"""
+        return self.FAKE_GRAPH_URL.rstrip('/') if self.MOCK_MODE else "https://graph.facebook.com"
+
     @property
     def FB_SCOPE(self) -> str:
         return "ads_management,ads_read"
@@ -1,3 +1,5 @@
+from sqlalchemy import event, inspect, text, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from typing import AsyncGenerator
 import os
@@ -16,21 +18,91 @@ else:
 
 engine = create_async_engine(ASYNC_DATABASE_URL, echo=True)
 
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine.sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """WAL и busy_timeout, чтобы несколько воркеров uvicorn делили один файл БД"""
+        cursor = dbapi_connection.cursor()
+        # Действует только для новой БД; позволяет освобождать страницы частями
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
 async_session_factory = async_sessionmaker(
     engine,
     class_=AsyncSession,
     expire_on_commit=False
 )
 
+# Сессии только для чтения: без autoflush и без commit в конце запроса
+readonly_session_factory = async_sessionmaker(
+    engine,
+    class_=AsyncSession,
+    expire_on_commit=False,
+    autoflush=False
+)
+
+def insert_for(session: AsyncSession):
+    """insert с поддержкой ON CONFLICT для диалекта БД сессии"""
+    return postgresql.insert if session.bind.dialect.name == 'postgresql' else sqlite.insert
+
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Сессия на время запроса (unit of work).
+    Изменения фиксируются одним commit после успешного выполнения эндпоинта,
+    при любой ошибке выполняется rollback.
+    """
     async with async_session_factory() as session:
         try:
             yield session
-        finally:
-            await session.close()
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+
+async def get_readonly_session() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Сессия только для чтения для GET-эндпоинтов.
+    Не выполняет flush и commit; транзакция откатывается при закрытии сессии.
+    """
+    async with readonly_session_factory() as session:
+        yield session
+
+def add_missing_columns(connection, metadata) -> list:
+    """
+    Добавляет в существующие таблицы колонки, появившиеся в моделях позже
+    (create_all создает только отсутствующие таблицы). Существующие строки
+    получают значение по умолчанию колонки, индексы создаются при отсутствии.
+    Повторный вызов ничего не меняет.
+
+    Returns:
+        list: Добавленные колонки в виде "таблица.колонка"
+    """
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+    quote = connection.dialect.identifier_preparer.quote
+    added = []
+    for table in metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column_type}"))
+            if column.default is not None and (column.default.is_scalar or column.default.is_clause_element):
+                connection.execute(update(table).values({column.name: column.default.arg}))
+            added.append(f"{table.name}.{column.name}")
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    return added
 
 async def init_db():
-    """Инициализация базы данных"""
+    """Инициализация базы данных: новые таблицы и недостающие колонки существующих"""
     from .models import Base
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(add_missing_columns, Base.metadata)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, JSON, ForeignKey, func
+from sqlalchemy import Column, Integer, String, Float, DateTime, JSON, ForeignKey, LargeBinary, UniqueConstraint, Index, func
 from sqlalchemy.orm import relationship, DeclarativeBase, Mapped, mapped_column
 from datetime import datetime, timezone
 from typing import Optional
@@ -30,8 +30,8 @@ class Campaign(Base):
     name: Mapped[Optional[str]] = mapped_column(String)
     status: Mapped[Optional[str]] = mapped_column(String)
     objective: Mapped[Optional[str]] = mapped_column(String)
-    daily_budget: Mapped[Optional[float]] = mapped_column(Float)
-    lifetime_budget: Mapped[Optional[float]] = mapped_column(Float)
+    daily_budget: Mapped[Optional[float]] = mapped_column(Float)  # в валюте аккаунта, не в центах Graph API
+    lifetime_budget: Mapped[Optional[float]] = mapped_column(Float)  # в валюте аккаунта
     total_spent: Mapped[float] = mapped_column(Float, default=0.0)
     stats: Mapped[Optional[dict]] = mapped_column(JSON)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=func.now())
@@ -39,6 +39,7 @@ class Campaign(Base):
     
     user: Mapped[Optional["User"]] = relationship("User", back_populates="campaigns")
     creatives: Mapped[list["Creative"]] = relationship("Creative", back_populates="campaign")
+    metrics: Mapped[list["CampaignMetric"]] = relationship("CampaignMetric", back_populates="campaign")
 
 class Creative(Base):
     __tablename__ = 'creatives'
@@ -68,5 +69,151 @@ class Budget(Base):
     end_date: Mapped[Optional[datetime]] = mapped_column(DateTime)
     spend_strategy: Mapped[Optional[dict]] = mapped_column(JSON)  # настройки распределения бюджета
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=func.now(), onupdate=func.now(), index=True)
     
     user: Mapped[Optional["User"]] = relationship("User", back_populates="budgets")
+
+class CampaignMetric(Base):
+    __tablename__ = 'campaign_metrics'
+    __table_args__ = (
+        UniqueConstraint('campaign_id', 'granularity', 'period_start', name='uq_campaign_metrics_period'),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    campaign_id: Mapped[int] = mapped_column(Integer, ForeignKey('campaigns.id'))
+    granularity: Mapped[str] = mapped_column(String, default='day')  # hour/day/week; дневные строки ведутся всегда
+    period_start: Mapped[datetime] = mapped_column(DateTime)
+    impressions: Mapped[int] = mapped_column(Integer, default=0)
+    clicks: Mapped[int] = mapped_column(Integer, default=0)
+    conversions: Mapped[int] = mapped_column(Integer, default=0)
+    spend: Mapped[float] = mapped_column(Float, default=0.0)
+    revenue: Mapped[float] = mapped_column(Float, default=0.0)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=func.now(), onupdate=func.now(), index=True)
+
+    campaign: Mapped["Campaign"] = relationship("Campaign", back_populates="metrics")
+
+class CreativeRawResponse(Base):
+    __tablename__ = 'creative_raw_responses'
+
+    creative_id: Mapped[int] = mapped_column(Integer, ForeignKey('creatives.id'), primary_key=True)
+    compressed_response: Mapped[bytes] = mapped_column(LargeBinary)  # zlib
+    original_size: Mapped[int] = mapped_column(Integer)
+    archived_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=func.now())
+
+class TokenVault(Base):
+    __tablename__ = 'token_vault'
+
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.id'), primary_key=True)
+    encrypted_token: Mapped[bytes] = mapped_column(LargeBinary)  # Fernet
+    expires_at: Mapped[Optional[datetime]] = mapped_column(DateTime, index=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
+
+class CampaignSummary(Base):
+    __tablename__ = 'campaign_summaries'
+    __table_args__ = (
+        Index('ix_campaign_summaries_user_status', 'user_id', 'status', 'campaign_id'),
+    )
+
+    campaign_id: Mapped[int] = mapped_column(Integer, ForeignKey('campaigns.id'), primary_key=True)
+    user_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey('users.id'))
+    fb_campaign_id: Mapped[Optional[str]] = mapped_column(String)
+    name: Mapped[Optional[str]] = mapped_column(String)
+    status: Mapped[Optional[str]] = mapped_column(String)
+    daily_budget: Mapped[Optional[float]] = mapped_column(Float)
+    spend_today: Mapped[float] = mapped_column(Float, default=0.0)
+    spend_7d: Mapped[float] = mapped_column(Float, default=0.0)
+    revenue_7d: Mapped[float] = mapped_column(Float, default=0.0)
+    roas_7d: Mapped[float] = mapped_column(Float, default=0.0)
+    refreshed_at: Mapped[datetime] = mapped_column(DateTime)
+
+class UserDashboardSummary(Base):
+    __tablename__ = 'user_dashboard_summaries'
+
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.id'), primary_key=True)
+    daily_budget: Mapped[float] = mapped_column(Float, default=0.0)
+    spend_today: Mapped[float] = mapped_column(Float, default=0.0)
+    remaining_budget: Mapped[float] = mapped_column(Float, default=0.0)
+    active_campaigns: Mapped[int] = mapped_column(Integer, default=0)
+    top_campaigns: Mapped[Optional[list]] = mapped_column(JSON)  # лучшие кампании по ROAS за 7 дней
+    refreshed_at: Mapped[datetime] = mapped_column(DateTime)
+
+class OptimizerState(Base):
+    __tablename__ = 'optimizer_states'
+
+    key: Mapped[str] = mapped_column(String, primary_key=True)  # например, история оценок аккаунта
+    payload: Mapped[bytes] = mapped_column(LargeBinary)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
+
+class DecisionAudit(Base):
+    __tablename__ = 'decision_audit'
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey('users.id'), index=True)
+    campaign_id: Mapped[str] = mapped_column(String, index=True)  # fb_campaign_id
+    field: Mapped[str] = mapped_column(String)  # status/daily_budget
+    old_value: Mapped[Optional[str]] = mapped_column(String)
+    new_value: Mapped[Optional[str]] = mapped_column(String)
+    source: Mapped[Optional[str]] = mapped_column(String)  # кто принял решение: optimizer, runner, user
+    outcome: Mapped[str] = mapped_column(String)  # applied/dry_run/noop/below_min_delta/failed/rate_limited
+    error: Mapped[Optional[str]] = mapped_column(String)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=func.now(), index=True)
+
+class LaunchStep(Base):
+    """Контрольная точка шага запуска кампании: повторный запуск продолжает с незавершенных шагов"""
+    __tablename__ = 'launch_steps'
+
+    launch_id: Mapped[str] = mapped_column(String, primary_key=True)
+    step: Mapped[str] = mapped_column(String, primary_key=True)  # targeting/image/campaign/adset/creative/ad
+    status: Mapped[str] = mapped_column(String)  # done/failed
+    result: Mapped[Optional[dict]] = mapped_column(JSON)  # идентификаторы, созданные шагом
+    error: Mapped[Optional[str]] = mapped_column(String)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
+
+class CampaignPerformance(Base):
+    """Метрики кампании за 7 дней для API; производные поля считаются при загрузке"""
+    __tablename__ = 'campaign_performance'
+
+    fb_campaign_id: Mapped[str] = mapped_column(String, primary_key=True)
+    daily_metrics: Mapped[list] = mapped_column(JSON)
+    total_impressions: Mapped[int] = mapped_column(Integer, default=0)
+    total_clicks: Mapped[int] = mapped_column(Integer, default=0)
+    total_conversions: Mapped[int] = mapped_column(Integer, default=0)
+    total_spend: Mapped[float] = mapped_column(Float, default=0.0)
+    ctr: Mapped[float] = mapped_column(Float, default=0.0)
+    cost_per_click: Mapped[float] = mapped_column(Float, default=0.0)
+    cost_per_conversion: Mapped[float] = mapped_column(Float, default=0.0)
+    conversion_rate: Mapped[float] = mapped_column(Float, default=0.0)
+    etag: Mapped[str] = mapped_column(String)  # хеш содержимого; меняется только при изменении метрик
+    refreshed_at: Mapped[datetime] = mapped_column(DateTime)  # UTC, время последнего изменения метрик
+
+class UserRuleSet(Base):
+    """Правила рекомендаций пользователя; при изменении увеличивается версия"""
+    __tablename__ = 'rule_sets'
+
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey('users.id'), primary_key=True)
+    scope: Mapped[str] = mapped_column(String, primary_key=True)  # campaign/budget
+    rules: Mapped[list] = mapped_column(JSON)
+    version: Mapped[int] = mapped_column(Integer, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
+
+class IdempotencyKey(Base):
+    """Результат создающего запроса по ключу идемпотентности; повтор получает сохраненный ответ"""
+    __tablename__ = 'idempotency_keys'
+
+    key: Mapped[str] = mapped_column(String, primary_key=True)  # scope:ключ клиента или scope:auto:хеш тела
+    request_hash: Mapped[str] = mapped_column(String)
+    status: Mapped[str] = mapped_column(String)  # in_progress/completed
+    status_code: Mapped[Optional[int]] = mapped_column(Integer)
+    response: Mapped[Optional[dict]] = mapped_column(JSON)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=func.now())
+
+class ConversationState(Base):
+    """Состояние диалога пользователя с ботом; истекшие записи удаляются фоном"""
+    __tablename__ = 'conversation_states'
+
+    telegram_user_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    state: Mapped[dict] = mapped_column(JSON)  # например {"state": "awaiting_media", "analysis": {...}}
+    expires_at: Mapped[datetime] = mapped_column(DateTime, index=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
@@ -6,10 +6,22 @@ import logging
 import asyncio
 import json
 
+import httpx
+
 from .config import settings
-from .telegram_integration import start_bot, stop_bot
+from .telegram_integration import start_bot, stop_bot, send_notification
 from .db.database import init_db
-from .routers import facebook, telegram, ai_services
+from .routers import facebook, telegram, ai_services, dashboard, rules
+from .services.retention import RetentionService
+from .services.token_vault import token_vault
+from .services.dashboard_summary import dashboard_summary_service
+from .services.optimization_runner import OptimizationRunner
+from .services.anomaly_detection import AnomalyMonitor
+from .services.performance_store import performance_store
+from .services.idempotency import idempotency_store
+from .services.conversation_state import conversation_states
+from .services.fake_graph import start_fake_graph_server
+from .services.graph_api import configure_facebook_sdk
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -28,10 +40,24 @@ app = FastAPI(
 app.include_router(facebook.router)
 app.include_router(telegram.router)
 app.include_router(ai_services.router)
+app.include_router(dashboard.router)
+app.include_router(rules.router)
 
 @app.on_event("startup")
 async def startup_event():
     """Инициализация приложения"""
+    if settings.MOCK_MODE and settings.FAKE_GRAPH_EMBEDDED:
+        url = httpx.URL(settings.FAKE_GRAPH_URL)
+        start_fake_graph_server(
+            url.host, url.port or 80,
+            seed=settings.FAKE_GRAPH_SEED,
+            latency_ms=settings.FAKE_GRAPH_LATENCY_MS,
+            latency_jitter_ms=settings.FAKE_GRAPH_LATENCY_JITTER_MS,
+            error_rate=settings.FAKE_GRAPH_ERROR_RATE,
+            rate_limit_per_minute=settings.FAKE_GRAPH_RATE_LIMIT_PER_MINUTE
+        )
+    configure_facebook_sdk()
+
     try:
         await init_db()
         logger.info("База данных инициализирована")
@@ -39,11 +65,43 @@ async def startup_event():
         logger.error(f"Ошибка инициализации базы данных: {e}")
     
     asyncio.create_task(start_bot())
+    asyncio.create_task(dashboard_summary_service.run_forever())
+    asyncio.create_task(performance_store.run_forever(settings.PERFORMANCE_INGEST_INTERVAL_SECONDS))
+    asyncio.create_task(idempotency_store.run_forever())
+    asyncio.create_task(conversation_states.run_forever())
+
+    if settings.TOKEN_ENCRYPTION_KEY:
+        try:
+            await token_vault.migrate_plaintext_tokens()
+        except Exception as e:
+            logger.error(f"Ошибка переноса токенов в хранилище: {e}")
+        asyncio.create_task(token_vault.run_forever())
+
+    if settings.RETENTION_ENABLED:
+        asyncio.create_task(RetentionService().run_forever())
+
+    if settings.OPTIMIZATION_RUNNER_ENABLED:
+        runner = OptimizationRunner(
+            max_workers=settings.OPTIMIZATION_MAX_WORKERS,
+            max_concurrency=settings.OPTIMIZATION_MAX_CONCURRENCY,
+            shard_size=settings.OPTIMIZATION_SHARD_SIZE,
+            deadline_seconds=settings.OPTIMIZATION_DEADLINE_SECONDS,
+            interval_seconds=settings.OPTIMIZATION_INTERVAL_SECONDS
+        )
+        app.state.optimization_runner = runner
+        asyncio.create_task(runner.run_forever())
+
+    if settings.ANOMALY_DETECTION_ENABLED:
+        monitor = AnomalyMonitor(notify=send_notification)
+        asyncio.create_task(monitor.run_forever(settings.ANOMALY_CHECK_INTERVAL_SECONDS))
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Остановка приложения"""
     await stop_bot()
+    runner = getattr(app.state, 'optimization_runner', None)
+    if runner is not None:
+        await runner.shutdown()
 
 # Добавляем CORS middleware
 app.add_middleware(
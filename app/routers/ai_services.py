@@ -1,13 +1,25 @@
-from fastapi import APIRouter, Request, HTTPException, UploadFile, File, Form
-from fastapi.responses import JSONResponse
-from datetime import datetime
+from fastapi import APIRouter, Request, HTTPException, UploadFile, File, Form, Depends, Header
+from fastapi.responses import JSONResponse, Response
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
 import logging
 from typing import Optional
 
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..db.database import get_session, get_readonly_session
+from ..db.models import Campaign
+from ..services.campaign_store import save_campaign
+
 # Попытка импорта сервисов
 try:
     from ..services.media_analysis import MediaAnalysisService
     from ..services.campaign_automation import CampaignAutomationService
+    from ..services.performance_store import performance_store, performance_to_dict
+    from ..services.rules_engine import rules_service
+    from ..services.token_vault import token_vault
+    from ..services.idempotency import idempotency_store, IdempotencyConflict, IDEMPOTENCY_HEADER, REPLAYED_HEADER
     SERVICES_AVAILABLE = True
     media_analysis_service = MediaAnalysisService()
     campaign_automation_service = CampaignAutomationService()
@@ -66,44 +78,158 @@ async def analyze_media(
         logger.error(f"Ошибка анализа медиа: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка анализа файла: {str(e)}")
 
-@router.post("/create-campaign")
-async def create_campaign_from_analysis(request: Request):
-    """Создает рекламную кампанию на основе результатов анализа медиа"""
-    if not SERVICES_AVAILABLE:
-        raise HTTPException(status_code=503, detail="Сервис автоматизации кампаний недоступен.")
+def _caller_scope(request: Request, scope: str, data: dict) -> str:
+    """Область ключей идемпотентности вызывающего: user_id из тела, иначе адрес клиента"""
+    user_id = data.get("user_id")
+    if user_id is not None:
+        return f"{scope}:user:{user_id}"
+    return f"{scope}:client:{request.client.host if request.client else 'unknown'}"
+
+async def _launch_from_analysis(request: Request, idempotency_key: Optional[str], session: AsyncSession,
+                                scope: str, launch) -> JSONResponse:
+    """Общая часть создания кампаний по анализу: идемпотентность и сохранение кампании в БД"""
     try:
         data = await request.json()
         if "analysis_data" not in data:
             raise HTTPException(status_code=400, detail="Отсутствуют данные анализа")
-        
-        campaign_result = await campaign_automation_service.create_campaign_from_analysis(
-            data["analysis_data"], data.get("user_preferences", {})
+        scope = _caller_scope(request, scope, data)
+        preferences = data.get("user_preferences", {})
+        if idempotency_key and "launch_id" not in preferences:
+            # Повтор после сбоя на середине продолжит запуск с контрольных точек
+            preferences = {**preferences, "launch_id": f"idem-{scope}-{idempotency_key}"}
+
+        async def create():
+            campaign_result = await launch(data["analysis_data"], preferences)
+            campaign = campaign_result.get("campaign")
+            if campaign_result.get("status") == "success" and campaign:
+                # Повтор с тем же launch_id возвращает ту же кампанию — обновляем, а не дублируем
+                await save_campaign(
+                    session, campaign["campaign_id"], user_id=data.get("user_id"), name=campaign.get("name"),
+                    status=campaign.get("status"), objective=campaign.get("objective"),
+                    daily_budget=campaign.get("budget")
+                )
+                # Ключ отмечается выполненным только после сохранения кампании
+                await session.commit()
+            return 200, campaign_result
+
+        _, campaign_result, replayed = await idempotency_store.execute(
+            scope, idempotency_key, data, create,
+            store_if=lambda status_code, body: body.get("status") == "success"
         )
-        return JSONResponse(campaign_result)
+        return JSONResponse(campaign_result, headers={REPLAYED_HEADER: "true"} if replayed else None)
+    except HTTPException:
+        raise
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         logger.error(f"Ошибка создания кампании: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка создания кампании: {str(e)}")
 
+@router.post("/create-campaign")
+async def create_campaign_from_analysis(
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    session: AsyncSession = Depends(get_session)
+):
+    """
+    Создает рекламную кампанию на основе результатов анализа медиа.
+    Повтор с тем же Idempotency-Key (ключи свои у каждого user_id из тела)
+    возвращает сохраненный результат без обращения к Graph API.
+    """
+    if not SERVICES_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Сервис автоматизации кампаний недоступен.")
+    return await _launch_from_analysis(request, idempotency_key, session, "create_campaign",
+                                       campaign_automation_service.create_campaign_from_analysis)
+
+@router.post("/create-campaign-test")
+async def create_campaign_test(
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    session: AsyncSession = Depends(get_session)
+):
+    """
+    Создает тест из анализа: тексты × аудитории × размещения с равными бюджетами групп.
+    Параметры user_preferences: max_variants, similarity_threshold, ad_copies, placements.
+    """
+    if not SERVICES_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Сервис автоматизации кампаний недоступен.")
+    return await _launch_from_analysis(request, idempotency_key, session, "create_campaign_test",
+                                       campaign_automation_service.create_test_from_analysis)
+
+def _not_modified(request: Request, etag: str, last_modified: datetime) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        return etag in {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")} or if_none_match.strip() == "*"
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return last_modified.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
 @router.get("/campaign/{campaign_id}/performance")
-async def get_campaign_performance(campaign_id: str):
-    """Получает метрики производительности кампании"""
+async def get_campaign_performance(
+    campaign_id: str,
+    request: Request,
+    session: AsyncSession = Depends(get_readonly_session)
+):
+    """Метрики кампании из локального хранилища (ETag / Last-Modified, 304 без изменений)"""
     if not SERVICES_AVAILABLE:
         raise HTTPException(status_code=503, detail="Сервис автоматизации кампаний недоступен.")
     try:
-        performance = await campaign_automation_service.get_campaign_performance(campaign_id)
-        return JSONResponse(performance)
+        performance = await performance_store.get(session, campaign_id)
+        if performance is None:
+            # Кампания еще не загружалась фоновым процессом — загружаем один раз по запросу
+            # (ingest пропускает кампании, которых нет в campaigns)
+            await performance_store.ingest([campaign_id])
+            await session.rollback()  # новый снимок БД после записи
+            performance = await performance_store.get(session, campaign_id)
+        if performance is None:
+            raise HTTPException(status_code=404, detail="Метрики кампании недоступны")
+
+        etag = f'"{performance.etag}"'
+        last_modified = performance.refreshed_at.replace(tzinfo=timezone.utc)
+        headers = {
+            "ETag": etag,
+            "Last-Modified": format_datetime(last_modified, usegmt=True),
+            "Cache-Control": "no-cache",
+        }
+        if _not_modified(request, etag, last_modified):
+            return Response(status_code=304, headers=headers)
+        return JSONResponse(performance_to_dict(performance), headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка получения метрик кампании {campaign_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка получения метрик: {str(e)}")
 
 @router.post("/campaign/{campaign_id}/optimize")
-async def optimize_campaign(campaign_id: str):
-    """Запускает оптимизацию кампании на основе текущих метрик"""
+async def optimize_campaign(
+    campaign_id: str,
+    session: AsyncSession = Depends(get_readonly_session)
+):
+    """
+    Запускает оптимизацию кампании на основе текущих метрик и правил владельца кампании.
+    Метрики запрашиваются токеном владельца из token_vault.
+    """
     if not SERVICES_AVAILABLE:
         raise HTTPException(status_code=503, detail="Сервис автоматизации кампаний недоступен.")
     try:
-        optimization_result = await campaign_automation_service.optimize_campaign(campaign_id)
+        owner = (await session.execute(
+            select(Campaign.user_id).where(Campaign.fb_campaign_id == campaign_id)
+        )).one_or_none()
+        if owner is None:
+            raise HTTPException(status_code=404, detail="Кампания не найдена")
+        user_id = owner.user_id
+        access_token = None
+        if user_id is not None and token_vault.configured:
+            access_token = await token_vault.get_token(session, user_id)
+        rules = await rules_service.get_rules(session, user_id, 'campaign')
+        optimization_result = await campaign_automation_service.optimize_campaign(campaign_id, rules, access_token)
         return JSONResponse(optimization_result)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка оптимизации кампании {campaign_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка оптимизации: {str(e)}")
@@ -0,0 +1,44 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import JSONResponse
+import logging
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..db.database import get_readonly_session
+from ..services.dashboard_summary import get_user_summary, summary_to_dict
+from ..services.pacing import pacing_service
+from ..services.rules_engine import rules_service
+
+router = APIRouter(
+    prefix="/api/dashboard",
+    tags=["dashboard"],
+)
+
+logger = logging.getLogger(__name__)
+
+@router.get("/{user_id}")
+async def get_dashboard_summary(
+    user_id: int,
+    session: AsyncSession = Depends(get_readonly_session)
+):
+    """Сводка пользователя: расход за сегодня, остаток бюджета, активные и лучшие кампании"""
+    summary = await get_user_summary(session, user_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Сводка для пользователя еще не рассчитана")
+    return JSONResponse(summary_to_dict(summary))
+
+@router.get("/{user_id}/pacing")
+async def get_budget_pacing(
+    user_id: int,
+    session: AsyncSession = Depends(get_readonly_session)
+):
+    """Прогноз расхода на конец дня и периода по действующим бюджетам пользователя"""
+    return JSONResponse({"user_id": user_id, "budgets": await pacing_service.pace_budgets(session, user_id)})
+
+@router.get("/{user_id}/recommendations")
+async def get_recommendations(
+    user_id: int,
+    session: AsyncSession = Depends(get_readonly_session)
+):
+    """Рекомендации по всем кампаниям пользователя по его правилам (один проход по аккаунту)"""
+    return JSONResponse({"user_id": user_id, "campaigns": await rules_service.evaluate_account(session, user_id)})
@@ -1,9 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, Form, Request
+from fastapi import APIRouter, Depends, HTTPException, Form, Header, Request
 from fastapi.responses import RedirectResponse, JSONResponse
 import asyncio
 import httpx
 import logging
 from datetime import datetime
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from facebook_business.api import FacebookAdsApi
 from facebook_business.adobjects.adaccount import AdAccount
@@ -12,6 +15,12 @@ from facebook_business.adobjects.campaign import Campaign
 from facebook_business.exceptions import FacebookRequestError
 
 from ..config import settings
+from ..db.database import get_session, get_readonly_session
+from ..services.campaign_store import save_campaign
+from ..services.token_vault import token_vault
+from ..services.oauth_state import issue_state, verify_state, OAuthStateError
+from ..services.user_auth import current_user_id, verify_session, AuthError
+from ..services.idempotency import idempotency_store, IdempotencyConflict, IDEMPOTENCY_HEADER, REPLAYED_HEADER
 
 router = APIRouter(
     prefix="/api/facebook",
@@ -20,21 +29,17 @@ router = APIRouter(
 
 logger = logging.getLogger(__name__)
 
-# Тестовые данные для разработки
-MOCK_CAMPAIGNS = [
-    {
-        "id": "123456789",
-        "name": "Test Campaign 1",
-        "status": "ACTIVE",
-        "objective": "CONVERSIONS",
-    },
-]
-
-MOCK_AD_ACCOUNT = {
-    "id": "act_123456789",
-    "name": "Test Ad Account",
-    "currency": "USD",
-}
+# В MOCK_MODE запросы идут на фейковый Graph, который принимает любой токен
+MOCK_ACCESS_TOKEN = "mock_access_token_123"
+
+async def _get_user_token(session: AsyncSession, user_id: int) -> str:
+    """Токен пользователя из зашифрованного хранилища"""
+    access_token = await token_vault.get_token(session, user_id)
+    if not access_token and settings.MOCK_MODE:
+        return MOCK_ACCESS_TOKEN
+    if not access_token:
+        raise HTTPException(status_code=401, detail="Facebook token not found for user")
+    return access_token
 
 # Вспомогательные синхронные функции для работы с SDK
 def _get_ad_accounts_sync(api: FacebookAdsApi):
@@ -92,24 +97,47 @@ def _create_campaign_sync(api: FacebookAdsApi, ad_account_id: str, params: dict)
 
 # Эндпоинты
 @router.get("/auth")
-async def facebook_auth():
-    """Начало процесса авторизации Facebook"""
+async def facebook_auth(token: Optional[str] = None):
+    """
+    Начало процесса авторизации Facebook.
+    token — подписанная сессия из ссылки бота: user_id берется из нее,
+    передается в подписанном state и проверяется в callback.
+    """
+    user_id = None
+    if token is not None:
+        try:
+            user_id = verify_session(token)
+        except AuthError as e:
+            logger.warning(f"Rejected session token: {e}")
+            raise HTTPException(status_code=401, detail="Invalid session")
+
     logger.info(f"Starting Facebook auth process. REDIRECT_URI: {settings.FB_REDIRECT_URI}")
     
     if settings.MOCK_MODE:
         logger.info("Using mock mode - redirecting to mock callback")
-        return RedirectResponse(url=f"{settings.BASE_URL}/api/facebook/callback?code=mock_code")
+        return RedirectResponse(url=f"{settings.RENDER_EXTERNAL_URL}/api/facebook/callback?code=mock_code")
         
     if not settings.FACEBOOK_APP_ID or not settings.FACEBOOK_APP_SECRET:
         logger.error("Missing Facebook credentials")
         raise HTTPException(status_code=500, detail="Facebook credentials not configured")
     
     auth_url = f"https://www.facebook.com/v17.0/dialog/oauth?client_id={settings.FACEBOOK_APP_ID}&redirect_uri={settings.FB_REDIRECT_URI}&scope={settings.FB_SCOPE}"
+    if user_id is not None:
+        try:
+            auth_url += f"&state={issue_state(user_id)}"
+        except OAuthStateError as e:
+            logger.error(str(e))
+            raise HTTPException(status_code=500, detail="OAuth state signing is not configured")
     logger.info(f"Redirecting to Facebook auth URL: {auth_url}")
     return RedirectResponse(url=auth_url)
 
 @router.get("/callback")
-async def facebook_callback(code: str = None, error: str = None):
+async def facebook_callback(
+    code: str = None,
+    error: str = None,
+    state: str = None,
+    session: AsyncSession = Depends(get_session)
+):
     """Обработка callback от Facebook"""
     logger.info("Received Facebook callback")
     
@@ -122,39 +150,58 @@ async def facebook_callback(code: str = None, error: str = None):
         raise HTTPException(status_code=400, detail="No code provided")
         
     if settings.MOCK_MODE and code == "mock_code":
-        logger.info("Mock mode - returning test data")
-        return JSONResponse({
-            "status": "success",
-            "access_token": "mock_access_token_123",
-            "accounts": [MOCK_AD_ACCOUNT],
-            "campaigns": MOCK_CAMPAIGNS
-        })
-    
-    token_url = f"https://graph.facebook.com/v17.0/oauth/access_token"
-    params = {
-        "client_id": settings.FACEBOOK_APP_ID,
-        "client_secret": settings.FACEBOOK_APP_SECRET,
-        "redirect_uri": settings.FB_REDIRECT_URI,
-        "code": code
-    }
-    
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(token_url, params=params)
-            response.raise_for_status()
-            token_data = response.json()
-        except httpx.RequestError as exc:
-            logger.error(f"Error requesting access token: {exc}")
-            raise HTTPException(status_code=500, detail="Could not retrieve access token")
-        except httpx.HTTPStatusError as exc:
-            logger.error(f"HTTP error requesting access token: {exc.response.status_code} - {exc.response.text}")
-            raise HTTPException(status_code=exc.response.status_code, detail=f"Error from Facebook: {exc.response.text}")
+        logger.info("Mock mode - using fake Graph API")
+        token_data = {"access_token": MOCK_ACCESS_TOKEN}
+        state = None
+    else:
+        token_url = f"https://graph.facebook.com/v17.0/oauth/access_token"
+        params = {
+            "client_id": settings.FACEBOOK_APP_ID,
+            "client_secret": settings.FACEBOOK_APP_SECRET,
+            "redirect_uri": settings.FB_REDIRECT_URI,
+            "code": code
+        }
+        
+        async with httpx.AsyncClient() as client:
+            try:
+                response = await client.post(token_url, params=params)
+                response.raise_for_status()
+                token_data = response.json()
+            except httpx.RequestError as exc:
+                logger.error(f"Error requesting access token: {exc}")
+                raise HTTPException(status_code=500, detail="Could not retrieve access token")
+            except httpx.HTTPStatusError as exc:
+                logger.error(f"HTTP error requesting access token: {exc.response.status_code} - {exc.response.text}")
+                raise HTTPException(status_code=exc.response.status_code, detail=f"Error from Facebook: {exc.response.text}")
 
     access_token = token_data.get("access_token")
     if not access_token:
         logger.error(f"Access token not in response: {token_data}")
         raise HTTPException(status_code=500, detail="Access token not found in response")
 
+    user_id = None
+    if state:
+        try:
+            user_id = verify_state(state)
+        except OAuthStateError as e:
+            logger.warning(f"Rejected OAuth state: {e}")
+            raise HTTPException(status_code=400, detail="Invalid OAuth state")
+    if user_id is not None:
+        if not token_vault.configured:
+            logger.error("TOKEN_ENCRYPTION_KEY is not set, cannot store Facebook token")
+            raise HTTPException(status_code=503, detail="Token storage is not configured")
+        # Обмениваем токен на долгоживущий один раз и сохраняем в зашифрованном виде
+        try:
+            access_token, expires_at = await token_vault.exchange_token(access_token)
+        except httpx.HTTPError as exc:
+            logger.warning(f"Could not exchange token for long-lived one: {exc}")
+            expires_at = None
+        try:
+            await token_vault.store_token(session, user_id, access_token, expires_at)
+        except ValueError as e:
+            logger.error(f"Could not encrypt Facebook token: {e}")
+            raise HTTPException(status_code=503, detail="Token storage is not configured")
+
     try:
         api = FacebookAdsApi.init(
             app_id=settings.FACEBOOK_APP_ID,
@@ -167,12 +214,16 @@ async def facebook_callback(code: str = None, error: str = None):
         if accounts:
             campaigns = await asyncio.to_thread(_get_campaigns_sync, api, accounts[0]['id'])
         
-        return JSONResponse({
+        response_data = {
             "status": "success",
-            "access_token": access_token,
             "accounts": accounts,
             "campaigns": campaigns
-        })
+        }
+        if user_id is not None:
+            response_data["user_id"] = user_id
+        else:
+            response_data["access_token"] = access_token
+        return JSONResponse(response_data)
     except Exception as e:
         logger.error(f"Error fetching accounts or campaigns: {e}")
         if isinstance(e, HTTPException):
@@ -180,9 +231,11 @@ async def facebook_callback(code: str = None, error: str = None):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/ad-accounts")
-async def get_ad_accounts_endpoint(token: str):
-    if settings.MOCK_MODE:
-        return JSONResponse([MOCK_AD_ACCOUNT])
+async def get_ad_accounts_endpoint(
+    user_id: int = Depends(current_user_id),
+    session: AsyncSession = Depends(get_readonly_session)
+):
+    token = await _get_user_token(session, user_id)
     try:
         api = FacebookAdsApi.init(access_token=token, crash_log=False)
         accounts = await asyncio.to_thread(_get_ad_accounts_sync, api)
@@ -194,9 +247,12 @@ async def get_ad_accounts_endpoint(token: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/campaigns")
-async def get_campaigns_endpoint(ad_account_id: str, token: str):
-    if settings.MOCK_MODE:
-        return JSONResponse(MOCK_CAMPAIGNS)
+async def get_campaigns_endpoint(
+    ad_account_id: str,
+    user_id: int = Depends(current_user_id),
+    session: AsyncSession = Depends(get_readonly_session)
+):
+    token = await _get_user_token(session, user_id)
     try:
         api = FacebookAdsApi.init(access_token=token, crash_log=False)
         campaigns = await asyncio.to_thread(_get_campaigns_sync, api, ad_account_id)
@@ -214,35 +270,42 @@ async def create_campaign_endpoint(
     objective: str = Form(...),
     status: str = Form("PAUSED"),
     daily_budget: int = Form(None),
-    token: str = Form(...)
+    user_id: int = Depends(current_user_id),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
+    session: AsyncSession = Depends(get_session)
 ):
-    if settings.MOCK_MODE:
-        new_campaign = {
-            "id": f"mock_id_{int(datetime.now().timestamp())}",
-            "name": name,
-            "objective": objective,
-            "status": status,
-            "daily_budget": daily_budget
-        }
-        MOCK_CAMPAIGNS.append(new_campaign)
-        return JSONResponse(content=new_campaign, status_code=201)
+    params = {
+        'name': name,
+        'objective': objective,
+        'status': status,
+        'special_ad_categories': [],
+    }
+    if daily_budget:
+        params['daily_budget'] = daily_budget
 
-    try:
+    async def create():
+        token = await _get_user_token(session, user_id)
         api = FacebookAdsApi.init(access_token=token, crash_log=False)
-        params = {
-            'name': name,
-            'objective': objective,
-            'status': status,
-            'special_ad_categories': [],
-        }
-        if daily_budget:
-            params['daily_budget'] = daily_budget
-            
         campaign_data = await asyncio.to_thread(
             _create_campaign_sync, api, ad_account_id, params
         )
         logger.info(f"Successfully created campaign {campaign_data.get('id')}")
-        return JSONResponse(content=campaign_data, status_code=201)
+        await save_campaign(
+            session, campaign_data.get("id"), user_id=user_id, name=name, status=status, objective=objective,
+            daily_budget=daily_budget / 100 if daily_budget else None  # Graph принимает бюджет в центах
+        )
+        # Ключ отмечается выполненным только после сохранения кампании
+        await session.commit()
+        return 201, campaign_data
+
+    try:
+        status_code, campaign_data, replayed = await idempotency_store.execute(
+            f"facebook_campaigns:{user_id}", idempotency_key, {"ad_account_id": ad_account_id, **params}, create
+        )
+        headers = {REPLAYED_HEADER: "true"} if replayed else None
+        return JSONResponse(content=campaign_data, status_code=status_code, headers=headers)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         logger.error(f"Error in create_campaign_endpoint: {e}")
         if isinstance(e, HTTPException):
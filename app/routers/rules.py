@@ -0,0 +1,50 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse
+import json
+import logging
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..db.database import get_readonly_session, get_session
+from ..services.rules_engine import SCOPES, rules_service
+
+router = APIRouter(
+    prefix="/api/rules",
+    tags=["rules"],
+)
+
+logger = logging.getLogger(__name__)
+
+@router.get("/{user_id}/{scope}")
+async def get_rules(
+    user_id: int,
+    scope: str,
+    session: AsyncSession = Depends(get_readonly_session)
+):
+    """Правила рекомендаций пользователя (campaign или budget); без своих правил — правила по умолчанию"""
+    if scope not in SCOPES:
+        raise HTTPException(status_code=404, detail=f"Неизвестная область правил: {scope}")
+    return JSONResponse(await rules_service.rules_for(session, user_id, scope))
+
+@router.put("/{user_id}/{scope}")
+async def put_rules(
+    user_id: int,
+    scope: str,
+    request: Request,
+    session: AsyncSession = Depends(get_session)
+):
+    """Заменяет правила пользователя; применяются со следующего запроса без перезапуска"""
+    if scope not in SCOPES:
+        raise HTTPException(status_code=404, detail=f"Неизвестная область правил: {scope}")
+    try:
+        data = await request.json()
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    rules = data.get("rules") if isinstance(data, dict) else data
+    if not isinstance(rules, list):
+        raise HTTPException(status_code=400, detail="Ожидается список правил")
+    try:
+        saved = await rules_service.save_rules(session, user_id, scope, rules)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(saved)
@@ -3,7 +3,7 @@ import logging
 import json
 
 from ..config import settings
-from ..telegram_integration import process_telegram_update
+from ..telegram_integration import enqueue_telegram_update
 
 router = APIRouter(
     tags=["telegram"],
@@ -13,15 +13,15 @@ logger = logging.getLogger(__name__)
 
 @router.post("/webhook/telegram")
 async def telegram_webhook(request: Request):
-    """Webhook для обработки сообщений от Telegram"""
+    """Webhook Telegram: обновление ставится в очередь бота, ответ 200 сразу"""
     if not settings.RENDER:
         logger.warning("Вебхук получен в режиме разработки, игнорируется.")
         return {"status": "ignored_in_dev"}
         
     try:
         update_data = await request.json()
-        await process_telegram_update(update_data)
-        return {"status": "ok"}
+        queued = enqueue_telegram_update(update_data)
+        return {"status": "ok" if queued else "skipped"}
     except json.JSONDecodeError:
         logger.error("Ошибка декодирования JSON от Telegram.")
         raise HTTPException(status_code=400, detail="Invalid JSON")
@@ -0,0 +1,289 @@
+"""
+Потоковое обнаружение аномалий расхода и CTR по почасовым метрикам кампаний.
+
+Для каждой кампании и каждого часа суток хранится робастный базис —
+оценки медианы и MAD, обновляемые за O(1) без окна значений: первые
+наблюдения усредняются, дальше медиана и MAD сдвигаются на шаг,
+пропорциональный MAD, в сторону знака отклонения (frugal streaming).
+Пока сезонный слот не прогрет, используется общий базис кампании.
+Все кампании проверяются одним векторизованным проходом.
+
+Аномалии: всплеск расхода (темп расхода текущего часа сильно выше базиса)
+и обвал CTR (CTR сильно ниже базиса при достаточном числе показов).
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from ..db.database import readonly_session_factory
+from ..db.models import Campaign, CampaignMetric, User
+from .row_index import grow_rows, register_rows
+
+logger = logging.getLogger(__name__)
+
+HOURS = 24
+MAD_SCALE = 1.4826  # MAD -> стандартное отклонение для нормального распределения
+METRICS = ('spend', 'ctr')
+
+class RobustBaseline:
+    """Медиана и MAD по строкам (кампании) и слотам (часы суток)"""
+
+    def __init__(self, slots: int, warmup: int, step: float, floor_abs: float):
+        self.slots = slots
+        self.warmup = warmup
+        self.step = step
+        self.floor_abs = floor_abs
+        self.median = np.zeros((0, slots))
+        self.mad = np.zeros((0, slots))
+        self.count = np.zeros((0, slots), dtype=np.int64)
+
+    def grow(self, rows: int):
+        self.median = grow_rows(self.median, rows)
+        self.mad = grow_rows(self.mad, rows)
+        self.count = grow_rows(self.count, rows)
+
+    def scale(self, rows: np.ndarray, slots: np.ndarray) -> np.ndarray:
+        """MAD с нижней границей, чтобы стабильные ряды не давали бесконечный z"""
+        median = self.median[rows, slots]
+        return MAD_SCALE * np.maximum(self.mad[rows, slots], np.maximum(0.1 * np.abs(median), self.floor_abs))
+
+    def update(self, rows: np.ndarray, slots: np.ndarray, values: np.ndarray):
+        median = self.median[rows, slots]
+        mad = self.mad[rows, slots]
+        count = self.count[rows, slots]
+        warming = count < self.warmup
+
+        # Прогрев: скользящее среднее и среднее абсолютное отклонение
+        weight = 1.0 / (count + 1)
+        warm_median = median + weight * (values - median)
+        warm_mad = mad + weight * (np.abs(values - warm_median) - mad)
+
+        # После прогрева: шаг к медиане со знаком отклонения, масштаб — MAD
+        eta = self.step * np.maximum(mad, np.maximum(0.1 * np.abs(median), self.floor_abs))
+        frugal_median = median + eta * np.sign(values - median)
+        frugal_mad = np.maximum(mad + eta * np.sign(np.abs(values - frugal_median) - mad), 0.0)
+
+        self.median[rows, slots] = np.where(warming, warm_median, frugal_median)
+        self.mad[rows, slots] = np.where(warming, warm_mad, frugal_mad)
+        self.count[rows, slots] = count + 1
+
+class StreamingAnomalyDetector:
+    def __init__(
+        self,
+        warmup: int = 6,
+        step: float = 0.1,
+        spend_z: float = 5.0,
+        spend_ratio: float = 1.5,
+        min_spend: float = 5.0,
+        ctr_z: float = 4.0,
+        ctr_ratio: float = 0.5,
+        min_impressions: int = 200
+    ):
+        self.warmup = warmup
+        self.spend_z = spend_z
+        self.spend_ratio = spend_ratio
+        self.min_spend = min_spend
+        self.ctr_z = ctr_z
+        self.ctr_ratio = ctr_ratio
+        self.min_impressions = min_impressions
+
+        self.keys: List[int] = []
+        self.index: Dict[int, int] = {}
+        floors = {'spend': 0.5, 'ctr': 0.001}
+        self.seasonal = {metric: RobustBaseline(HOURS, warmup, step, floors[metric]) for metric in METRICS}
+        self.overall = {metric: RobustBaseline(1, warmup, step, floors[metric]) for metric in METRICS}
+
+    def rows_for(self, keys: Sequence[int]) -> np.ndarray:
+        rows = register_rows(self.index, self.keys, keys)
+        for baseline in (*self.seasonal.values(), *self.overall.values()):
+            baseline.grow(len(self.keys))
+        return rows
+
+    @staticmethod
+    def _ctr(impressions: np.ndarray, clicks: np.ndarray) -> np.ndarray:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(impressions > 0, clicks / impressions, 0.0)
+
+    def update(self, keys: Sequence[int], hour: int, spend, impressions, clicks):
+        """Учитывает завершившийся час в базисах"""
+        rows = self.rows_for(keys)
+        spend = np.asarray(spend, dtype=np.float64)
+        impressions = np.asarray(impressions, dtype=np.float64)
+        slots = np.full(len(rows), hour)
+        zero = np.zeros(len(rows), dtype=np.intp)
+        values = {'spend': spend, 'ctr': self._ctr(impressions, np.asarray(clicks, dtype=np.float64))}
+        for metric in METRICS:
+            mask = slice(None) if metric == 'spend' else impressions >= self.min_impressions
+            self.seasonal[metric].update(rows[mask], slots[mask], values[metric][mask])
+            self.overall[metric].update(rows[mask], zero[mask], values[metric][mask])
+
+    def _baseline(self, metric: str, rows: np.ndarray, hour: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Медиана, масштаб и готовность базиса: сезонный слот, иначе общий"""
+        seasonal, overall = self.seasonal[metric], self.overall[metric]
+        slots = np.full(len(rows), hour)
+        zero = np.zeros(len(rows), dtype=np.intp)
+        use_seasonal = seasonal.count[rows, slots] >= self.warmup
+        median = np.where(use_seasonal, seasonal.median[rows, slots], overall.median[rows, zero])
+        scale = np.where(use_seasonal, seasonal.scale(rows, slots), overall.scale(rows, zero))
+        ready = use_seasonal | (overall.count[rows, zero] >= self.warmup)
+        return median, scale, ready
+
+    def evaluate(self, keys: Sequence[int], hour: int, spend, impressions, clicks,
+                 elapsed: float = 1.0) -> List[Dict]:
+        """
+        Проверяет текущий (возможно, незавершенный) час.
+
+        Args:
+            elapsed: Прошедшая доля часа; расход экстраполируется до полного часа
+
+        Returns:
+            List[Dict]: Аномалии: campaign_id, kind (spend_spike/ctr_collapse), value, baseline, z
+        """
+        if len(keys) == 0:
+            return []
+        rows = self.rows_for(keys)
+        spend_rate = np.asarray(spend, dtype=np.float64) / max(elapsed, 1e-3)
+        impressions = np.asarray(impressions, dtype=np.float64)
+        ctr = self._ctr(impressions, np.asarray(clicks, dtype=np.float64))
+
+        anomalies = []
+        median, scale, ready = self._baseline('spend', rows, hour)
+        z = (spend_rate - median) / scale
+        spikes = ready & (z > self.spend_z) & (spend_rate > self.min_spend) & (spend_rate > self.spend_ratio * median)
+        for i in np.flatnonzero(spikes):
+            anomalies.append({'campaign_id': keys[i], 'kind': 'spend_spike', 'value': float(spend_rate[i]),
+                              'baseline': float(median[i]), 'z': float(z[i])})
+
+        median, scale, ready = self._baseline('ctr', rows, hour)
+        z = (ctr - median) / scale
+        collapses = (ready & (impressions >= self.min_impressions) & (median > 0)
+                     & (z < -self.ctr_z) & (ctr < self.ctr_ratio * median))
+        for i in np.flatnonzero(collapses):
+            anomalies.append({'campaign_id': keys[i], 'kind': 'ctr_collapse', 'value': float(ctr[i]),
+                              'baseline': float(median[i]), 'z': float(z[i])})
+        return anomalies
+
+def format_alert(anomaly: Dict, campaign_name: Optional[str]) -> str:
+    name = campaign_name or anomaly['campaign_id']
+    if anomaly['kind'] == 'spend_spike':
+        return (f"⚠️ *Всплеск расхода*: {name}\n"
+                f"Темп ${anomaly['value']:.2f}/час при обычных ${anomaly['baseline']:.2f}/час")
+    return (f"⚠️ *Обвал CTR*: {name}\n"
+            f"CTR {anomaly['value']:.2%} при обычном {anomaly['baseline']:.2%}")
+
+class AnomalyMonitor:
+    """Периодически проверяет текущий час всех кампаний и отправляет алерты в бота"""
+
+    def __init__(
+        self,
+        detector: Optional[StreamingAnomalyDetector] = None,
+        session_factory: async_sessionmaker = readonly_session_factory,
+        notify: Optional[Callable[[int, str], Awaitable[bool]]] = None,
+        min_elapsed: float = 0.25
+    ):
+        self.detector = detector or StreamingAnomalyDetector()
+        self.session_factory = session_factory
+        self.notify = notify
+        self.min_elapsed = min_elapsed  # в начале часа данных слишком мало для экстраполяции
+        self._folded_hour: Optional[datetime] = None
+        self._alerted: Set[Tuple[int, datetime, str]] = set()
+
+    async def _hour_rows(self, session, hour_start: datetime):
+        return (await session.execute(
+            select(
+                CampaignMetric.campaign_id, CampaignMetric.spend,
+                CampaignMetric.impressions, CampaignMetric.clicks
+            ).where(CampaignMetric.granularity == 'hour', CampaignMetric.period_start == hour_start)
+        )).all()
+
+    async def warm_up(self, days: int = 14, now: Optional[datetime] = None):
+        """Прогревает базисы по почасовой истории"""
+        now = now or datetime.now()
+        current_hour = now.replace(minute=0, second=0, microsecond=0)
+        async with self.session_factory() as session:
+            rows = (await session.execute(
+                select(
+                    CampaignMetric.period_start, CampaignMetric.campaign_id, CampaignMetric.spend,
+                    CampaignMetric.impressions, CampaignMetric.clicks
+                ).where(
+                    CampaignMetric.granularity == 'hour',
+                    CampaignMetric.period_start >= current_hour - timedelta(days=days),
+                    CampaignMetric.period_start < current_hour
+                ).order_by(CampaignMetric.period_start)
+            )).all()
+
+        by_hour: Dict[datetime, list] = {}
+        for period_start, *values in rows:
+            by_hour.setdefault(period_start, []).append(values)
+        for period_start, values in by_hour.items():
+            campaign_ids, spend, impressions, clicks = zip(*values)
+            self.detector.update(list(campaign_ids), period_start.hour, spend, impressions, clicks)
+        self._folded_hour = current_hour - timedelta(hours=1)
+
+    async def tick(self, now: Optional[datetime] = None) -> List[Dict]:
+        """
+        Учитывает завершившийся час и проверяет текущий.
+
+        Returns:
+            List[Dict]: Новые аномалии (повторно об одной аномалии в течение часа не сообщается)
+        """
+        now = now or datetime.now()
+        current_hour = now.replace(minute=0, second=0, microsecond=0)
+        previous_hour = current_hour - timedelta(hours=1)
+
+        async with self.session_factory() as session:
+            if self._folded_hour != previous_hour:
+                finished = await self._hour_rows(session, previous_hour)
+                if finished:
+                    campaign_ids, spend, impressions, clicks = zip(*finished)
+                    self.detector.update(list(campaign_ids), previous_hour.hour, spend, impressions, clicks)
+                self._folded_hour = previous_hour
+                self._alerted = {alert for alert in self._alerted if alert[1] >= previous_hour}
+
+            elapsed = (now - current_hour).total_seconds() / 3600
+            if elapsed < self.min_elapsed:
+                return []
+            current = await self._hour_rows(session, current_hour)
+            if not current:
+                return []
+            campaign_ids, spend, impressions, clicks = zip(*current)
+            anomalies = [
+                anomaly for anomaly in self.detector.evaluate(
+                    list(campaign_ids), current_hour.hour, spend, impressions, clicks, elapsed
+                )
+                if (anomaly['campaign_id'], current_hour, anomaly['kind']) not in self._alerted
+            ]
+            if not anomalies:
+                return []
+
+            recipients = {row.id: row for row in (await session.execute(
+                select(Campaign.id, Campaign.name, User.telegram_id)
+                .join(User, User.id == Campaign.user_id)
+                .where(Campaign.id.in_([anomaly['campaign_id'] for anomaly in anomalies]))
+            )).all()}
+
+        for anomaly in anomalies:
+            self._alerted.add((anomaly['campaign_id'], current_hour, anomaly['kind']))
+            recipient = recipients.get(anomaly['campaign_id'])
+            logger.warning(f"Аномалия кампании {anomaly['campaign_id']}: {anomaly}")
+            if self.notify and recipient is not None and recipient.telegram_id:
+                await self.notify(recipient.telegram_id, format_alert(anomaly, recipient.name))
+        return anomalies
+
+    async def run_forever(self, interval_seconds: int = 120):
+        """Фоновая проверка аномалий"""
+        try:
+            await self.warm_up()
+        except Exception:
+            logger.error("Ошибка прогрева детектора аномалий", exc_info=True)
+        while True:
+            try:
+                await self.tick()
+            except Exception:
+                logger.error("Ошибка проверки аномалий", exc_info=True)
+            await asyncio.sleep(interval_seconds)
@@ -0,0 +1,148 @@
+"""
+Бэктест стратегий распределения бюджета на исторических дневных метриках.
+
+Метрики (массивы дни × кампании) сохраняются в .npy и открываются воркерами
+через memmap, поэтому пул процессов не копирует их в каждый процесс.
+Каждая конфигурация — это переопределения правил BudgetOptimizer
+(SCORE_THRESHOLDS, TREND_THRESHOLD, MAX_BUDGET_SHARE и т.д.) и режим
+BudgetEngine ('rules' или 'convex'). Прогон идет день за днем: стратегия
+видит только смоделированные результаты своих прошлых решений.
+
+Отклик на бюджет моделируется вогнутой функцией, совпадающей с фактом
+при фактическом расходе s: y(x) = y_s * log2(1 + x / s).
+"""
+import itertools
+import json
+import multiprocessing
+import os
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from .budget_engine import BudgetEngine
+
+METRIC_FIELDS = ('impressions', 'clicks', 'conversions', 'spend', 'revenue')
+CONFIG_ATTRIBUTES = (
+    'SCORE_WEIGHTS', 'SCORE_THRESHOLDS', 'SCORE_MULTIPLIERS',
+    'TREND_THRESHOLD', 'TREND_MULTIPLIERS', 'MIN_BUDGET_SHARE', 'MAX_BUDGET_SHARE'
+)
+
+def save_metric_arrays(directory: str, campaign_ids: Sequence[str], arrays: Dict[str, np.ndarray]):
+    """Сохраняет метрики в каталог для открытия через memmap"""
+    os.makedirs(directory, exist_ok=True)
+    for field in METRIC_FIELDS:
+        np.save(os.path.join(directory, f"{field}.npy"), np.ascontiguousarray(arrays[field], dtype=np.float64))
+    with open(os.path.join(directory, "campaign_ids.json"), "w", encoding="utf-8") as f:
+        json.dump(list(campaign_ids), f)
+
+def load_metric_arrays(directory: str) -> Dict[str, np.ndarray]:
+    """Открывает сохраненные метрики только для чтения без копирования в память"""
+    arrays = {field: np.load(os.path.join(directory, f"{field}.npy"), mmap_mode='r') for field in METRIC_FIELDS}
+    with open(os.path.join(directory, "campaign_ids.json"), encoding="utf-8") as f:
+        arrays['campaign_ids'] = json.load(f)
+    return arrays
+
+def _configured_engine(config: Dict, daily_budget: float, days: int) -> BudgetEngine:
+    engine = BudgetEngine(daily_budget * days, daily_budget, allocation_mode=config.get('mode', 'rules'))
+    for attribute in CONFIG_ATTRIBUTES:
+        if attribute in config:
+            setattr(engine, attribute, tuple(config[attribute]) if isinstance(config[attribute], list) else config[attribute])
+    engine.allocator.min_share = engine.MIN_BUDGET_SHARE
+    engine.allocator.max_share = engine.MAX_BUDGET_SHARE
+    return engine
+
+def backtest(arrays: Dict[str, np.ndarray], config: Dict, daily_budget: float) -> Dict:
+    """
+    Прогоняет одну конфигурацию по всем дням.
+
+    Returns:
+        Dict: Конфигурация и итоги: расход, выручка, конверсии, ROAS, потраченный впустую бюджет
+    """
+    spend_history = arrays['spend']
+    days, campaigns = spend_history.shape
+    engine = _configured_engine(config, daily_budget, days)
+    rows = engine.rows_for([str(campaign_id) for campaign_id in arrays.get('campaign_ids', range(campaigns))])
+
+    # Результаты прошлого дня кампании, которые видит стратегия
+    observed_roas = np.zeros(campaigns)
+    observed_ctr = np.zeros(campaigns)
+    observed_cr = np.zeros(campaigns)
+    totals = np.zeros(4)  # расход, выручка, конверсии, расход в убыток
+    start = datetime(2000, 1, 1)  # условная дата: окно тренда считается в днях прогона
+
+    for day in range(days):
+        historical_spend = np.asarray(spend_history[day])
+        active = historical_spend > 0
+        if not active.any():
+            continue
+        revenue = np.asarray(arrays['revenue'][day])[active]
+        conversions = np.asarray(arrays['conversions'][day])[active]
+        clicks = np.asarray(arrays['clicks'][day])[active]
+        impressions = np.asarray(arrays['impressions'][day])[active]
+
+        budgets = engine.optimize_rows(
+            rows[active], observed_roas[active], observed_ctr[active], observed_cr[active],
+            now=start + timedelta(days=day)
+        )
+        response = np.log2(1.0 + budgets / historical_spend[active])
+        simulated_revenue = revenue * response
+        simulated_conversions = conversions * response
+
+        totals += [
+            budgets.sum(),
+            simulated_revenue.sum(),
+            simulated_conversions.sum(),
+            budgets[simulated_revenue < budgets].sum()
+        ]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            observed_roas[active] = np.where(budgets > 0, simulated_revenue / budgets, 0.0)
+            observed_ctr[active] = np.where(impressions > 0, clicks / impressions, 0.0)
+            observed_cr[active] = np.where(clicks > 0, conversions / clicks, 0.0)
+
+    total_spend, total_revenue, total_conversions, wasted = totals
+    return {
+        'config': config,
+        'spend': round(float(total_spend), 2),
+        'revenue': round(float(total_revenue), 2),
+        'conversions': round(float(total_conversions), 2),
+        'roas': round(float(total_revenue / total_spend), 4) if total_spend else 0.0,
+        'wasted_spend': round(float(wasted), 2),
+        'wasted_share': round(float(wasted / total_spend), 4) if total_spend else 0.0,
+    }
+
+_worker_arrays: Optional[Dict[str, np.ndarray]] = None
+
+def _init_worker(directory: str):
+    global _worker_arrays
+    _worker_arrays = load_metric_arrays(directory)
+
+def _run_chunk(configs: List[Dict], daily_budget: float) -> List[Dict]:
+    return [backtest(_worker_arrays, config, daily_budget) for config in configs]
+
+def run_sweep(
+    directory: str,
+    configs: Sequence[Dict],
+    daily_budget: float,
+    max_workers: Optional[int] = None,
+    chunk_size: int = 8
+) -> List[Dict]:
+    """
+    Параллельный прогон конфигураций по метрикам из save_metric_arrays().
+
+    Returns:
+        List[Dict]: Итоги в порядке configs
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    chunks = [list(configs[i:i + chunk_size]) for i in range(0, len(configs), chunk_size)]
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers, mp_context=context,
+                             initializer=_init_worker, initargs=(directory,)) as pool:
+        results = pool.map(_run_chunk, chunks, itertools.repeat(daily_budget))
+        return [result for chunk in results for result in chunk]
+
+def parameter_grid(**options: Iterable) -> List[Dict]:
+    """Все сочетания значений параметров: parameter_grid(TREND_THRESHOLD=[0.05, 0.1], mode=['rules'])"""
+    names = list(options)
+    return [dict(zip(names, values)) for values in itertools.product(*(options[name] for name in names))]
@@ -0,0 +1,252 @@
+"""
+Распределение бюджета по кампаниям (или креативам) через Thompson sampling.
+
+Для каждой кампании хранятся накопленные клики, конверсии и расходы.
+Апостериорные распределения:
+    клики на единицу расходов   ~ Gamma(a + clicks, b + spend)
+    конверсия клика             ~ Beta(α + conversions, β + clicks - conversions)
+Их произведение — конверсии на единицу расходов. Для всех кампаний сразу
+делается пачка выборок, и бюджет делится пропорционально вероятности
+того, что кампания лучшая. Кампании с малым объемом данных получают
+широкие апостериорные распределения и продолжают исследоваться,
+а не голодают или перефинансируются по случайной точечной оценке.
+"""
+from datetime import date
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..db.models import CampaignMetric
+from .budget_allocation import floor_share
+from .budget_engine import BudgetEngine
+from .budget_optimizer import BudgetOptimizer
+from .row_index import grow_rows, register_rows
+
+class BanditAllocator:
+    def __init__(
+        self,
+        daily_budget: float,
+        min_share: float = BudgetOptimizer.MIN_BUDGET_SHARE,
+        max_share: float = BudgetOptimizer.MAX_BUDGET_SHARE,
+        samples: int = 256,
+        click_prior: Tuple[float, float] = (1.0, 1.0),
+        conversion_prior: Tuple[float, float] = (1.0, 49.0),
+        decay: float = 1.0,
+        seed: Optional[int] = None
+    ):
+        self.daily_budget = daily_budget
+        self.min_share = min_share
+        self.max_share = max_share
+        self.samples = samples
+        self.click_prior = click_prior
+        self.conversion_prior = conversion_prior
+        self.decay = decay  # < 1 — забывание старых наблюдений при каждом обновлении
+        self.rng = np.random.default_rng(seed)
+
+        self.keys: List[str] = []
+        self.index: Dict[str, int] = {}
+        # Достаточные статистики: клики, конверсии, расходы
+        self.clicks = np.zeros(0, dtype=np.float64)
+        self.conversions = np.zeros(0, dtype=np.float64)
+        self.spend = np.zeros(0, dtype=np.float64)
+
+        self.budgets: Dict[str, float] = {}
+
+    def rows_for(self, keys: Sequence[str]) -> np.ndarray:
+        """Индексы строк для кампаний; новые кампании получают априорное распределение"""
+        rows = register_rows(self.index, self.keys, keys)
+        self.clicks = grow_rows(self.clicks, len(self.keys))
+        self.conversions = grow_rows(self.conversions, len(self.keys))
+        self.spend = grow_rows(self.spend, len(self.keys))
+        return rows
+
+    def update(
+        self,
+        keys: Sequence[str],
+        clicks: Sequence[float],
+        conversions: Sequence[float],
+        spend: Sequence[float]
+    ):
+        """Добавляет новые строки метрик (приращения, не накопленные значения)"""
+        rows = self.rows_for(keys)
+        if self.decay < 1.0:
+            self.clicks *= self.decay
+            self.conversions *= self.decay
+            self.spend *= self.decay
+        # add.at корректно суммирует повторяющиеся кампании в одной пачке
+        np.add.at(self.clicks, rows, np.asarray(clicks, dtype=np.float64))
+        np.add.at(self.conversions, rows, np.asarray(conversions, dtype=np.float64))
+        np.add.at(self.spend, rows, np.asarray(spend, dtype=np.float64))
+
+    def sample_rates(self, rows: np.ndarray) -> np.ndarray:
+        """Выборки конверсий на единицу расходов, форма (len(rows), samples)"""
+        click_shape, click_rate = self.click_prior
+        alpha, beta = self.conversion_prior
+        clicks = self.clicks[rows, None]
+        conversions = np.minimum(self.conversions[rows, None], clicks)
+        size = (len(rows), self.samples)
+
+        clicks_per_spend = self.rng.gamma(click_shape + clicks, size=size) / (click_rate + self.spend[rows, None])
+        conversion_rate = self.rng.beta(alpha + conversions, beta + clicks - conversions, size=size)
+        return clicks_per_spend * conversion_rate
+
+    def win_probabilities(self, rows: np.ndarray) -> np.ndarray:
+        """Доля выборок, в которых кампания лучшая"""
+        winners = self.sample_rates(rows).argmax(axis=0)
+        return np.bincount(winners, minlength=len(rows)) / self.samples
+
+    def allocate(self, keys: Sequence[str]) -> np.ndarray:
+        """
+        Бюджеты кампаний keys.
+
+        Returns:
+            np.ndarray: Бюджеты в порядке keys
+        """
+        if len(keys) == 0:
+            return np.zeros(0)
+        rows = self.rows_for(keys)
+        budgets = self._split(self.win_probabilities(rows))
+        self.budgets = dict(zip(keys, budgets.tolist()))
+        return budgets
+
+    def _split(self, weights: np.ndarray) -> np.ndarray:
+        """Минимум каждой кампании плюс остаток пропорционально весам с учетом максимума"""
+        count = len(weights)
+        lower = self.daily_budget * floor_share(self.min_share, count)
+        upper = self.daily_budget * self.max_share
+        if upper * count <= self.daily_budget:
+            return np.full(count, upper)
+
+        budgets = np.full(count, lower)
+        remaining = self.daily_budget - budgets.sum()
+        free = np.ones(count, dtype=bool)
+        while remaining > 1e-9 and free.any():
+            share = weights * free
+            if share.sum() <= 0:
+                share = free.astype(np.float64)
+            budgets += remaining * share / share.sum()
+            capped = budgets > upper
+            remaining = float((budgets[capped] - upper).sum())
+            budgets[capped] = upper
+            free &= budgets < upper
+        return budgets
+
+    def optimize_campaign_budgets(self, campaign_metrics: List[Dict]) -> Dict[str, float]:
+        """
+        Совместимый с BudgetOptimizer интерфейс: метрики (clicks, conversions, spend)
+        считаются новыми наблюдениями с прошлого вызова.
+        """
+        campaign_ids = [campaign['campaign_id'] for campaign in campaign_metrics]
+        self.update(
+            campaign_ids,
+            [campaign.get('clicks', 0) for campaign in campaign_metrics],
+            [campaign.get('conversions', 0) for campaign in campaign_metrics],
+            [campaign.get('spend', 0) for campaign in campaign_metrics]
+        )
+        return dict(zip(campaign_ids, self.allocate(campaign_ids).tolist()))
+
+    @property
+    def campaign_budgets(self) -> Dict[str, float]:
+        """Текущие бюджеты кампаний из последнего распределения"""
+        return dict(self.budgets)
+
+def replay(
+    campaign_ids: Sequence[str],
+    impressions: np.ndarray,
+    clicks: np.ndarray,
+    conversions: np.ndarray,
+    spend: np.ndarray,
+    revenue: np.ndarray,
+    daily_budget: float,
+    seed: int = 0,
+    samples: int = 256
+) -> Dict[str, Dict[str, float]]:
+    """
+    Офлайн-прогон стратегий по историческим дневным метрикам (массивы дни × кампании).
+
+    Каждый день стратегия видит только свои прошлые результаты. Результат кампании
+    при бюджете x оценивается линейным масштабированием фактических показателей
+    дня: x / spend. Кампании без расходов в этот день не участвуют.
+
+    Returns:
+        Dict: Итоги по стратегиям rules, bandit и uniform
+    """
+    campaign_ids = list(campaign_ids)
+    ids = np.array(campaign_ids, dtype=object)
+    engine = BudgetEngine(total_budget=daily_budget * len(spend), daily_budget=daily_budget)
+    bandit = BanditAllocator(daily_budget, samples=samples, seed=seed)
+    totals = {name: np.zeros(3) for name in ('rules', 'bandit', 'uniform')}  # расходы, конверсии, выручка
+    previous: Dict[str, Tuple[float, float, float]] = {}
+
+    for day in range(len(spend)):
+        active = spend[day] > 0
+        if not active.any():
+            continue
+        day_ids = ids[active].tolist()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            per_spend = np.stack([
+                clicks[day, active] / spend[day, active],
+                conversions[day, active] / spend[day, active],
+                revenue[day, active] / spend[day, active],
+            ])
+            ctr = np.nan_to_num(clicks[day, active] / impressions[day, active])
+            conversion_rate = np.nan_to_num(conversions[day, active] / clicks[day, active])
+
+        # Правила видят ROAS/CTR/CR предыдущего дня кампании
+        metrics = np.array([previous.get(campaign_id, (0.0, 0.0, 0.0)) for campaign_id in day_ids])
+        allocations = {
+            'rules': engine.optimize(day_ids, metrics[:, 0], metrics[:, 1], metrics[:, 2]),
+            'bandit': bandit.allocate(day_ids),
+            'uniform': np.full(len(day_ids), daily_budget / len(day_ids)),
+        }
+
+        for name, budgets in allocations.items():
+            totals[name] += [budgets.sum(), (budgets * per_spend[1]).sum(), (budgets * per_spend[2]).sum()]
+
+        bandit_budgets = allocations['bandit']
+        bandit.update(day_ids, bandit_budgets * per_spend[0], bandit_budgets * per_spend[1], bandit_budgets)
+        for i, campaign_id in enumerate(day_ids):
+            previous[campaign_id] = (float(per_spend[2, i]), float(ctr[i]), float(conversion_rate[i]))
+
+    report = {}
+    for name, (total_spend, total_conversions, total_revenue) in totals.items():
+        report[name] = {
+            'spend': round(float(total_spend), 2),
+            'conversions': round(float(total_conversions), 2),
+            'revenue': round(float(total_revenue), 2),
+            'cpa': round(float(total_spend / total_conversions), 4) if total_conversions else None,
+            'roas': round(float(total_revenue / total_spend), 4) if total_spend else None,
+        }
+    return report
+
+async def load_daily_metrics(
+    session: AsyncSession,
+    campaign_ids: Optional[Sequence[int]] = None,
+    since: Optional[date] = None
+) -> Tuple[List[str], Dict[str, np.ndarray]]:
+    """
+    Дневные метрики из campaign_metrics в виде массивов дни × кампании для replay().
+
+    Returns:
+        Tuple: (id кампаний, {'impressions', 'clicks', 'conversions', 'spend', 'revenue'})
+    """
+    query = select(CampaignMetric).where(CampaignMetric.granularity == 'day')
+    if campaign_ids is not None:
+        query = query.where(CampaignMetric.campaign_id.in_(campaign_ids))
+    if since is not None:
+        query = query.where(CampaignMetric.period_start >= since)
+    rows = (await session.execute(query.order_by(CampaignMetric.period_start))).scalars().all()
+
+    campaigns = sorted({row.campaign_id for row in rows})
+    days = sorted({row.period_start.date() for row in rows})
+    column = {campaign_id: i for i, campaign_id in enumerate(campaigns)}
+    day_index = {day: i for i, day in enumerate(days)}
+    fields = ('impressions', 'clicks', 'conversions', 'spend', 'revenue')
+    arrays = {field: np.zeros((len(days), len(campaigns))) for field in fields}
+    for row in rows:
+        position = (day_index[row.period_start.date()], column[row.campaign_id])
+        for field in fields:
+            arrays[field][position] += getattr(row, field) or 0
+    return [str(campaign_id) for campaign_id in campaigns], arrays
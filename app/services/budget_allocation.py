@@ -0,0 +1,160 @@
+"""
+Распределение бюджета как задача выпуклой оптимизации.
+
+Ожидаемые конверсии кампании при бюджете x моделируются вогнутой функцией
+с убывающей отдачей: c_i(x) = r_i * s_i * log(1 + x / s_i), где r_i — конверсии
+на единицу расходов при малом бюджете, s_i — масштаб насыщения.
+Максимизируется sum c_i(x_i) при sum x_i = B и lo_i <= x_i <= hi_i
+(минимум/максимум кампании и ограничение скорости изменения бюджета).
+
+Задача сепарабельна, поэтому решается точно через условие ККТ:
+x_i(λ) = clip(s_i * (r_i / λ - 1), lo_i, hi_i), а λ подбирается бисекцией
+так, чтобы сумма бюджетов равнялась B. Стартовый интервал для λ берется
+из прошлого решения (warm start).
+
+Минимум кампании — доля min_share дневного бюджета, но не больше
+MAX_FLOORS_SHARE / n: при большом числе кампаний минимумы вместе занимают
+не больше половины бюджета, а остальное распределяется по отдаче.
+"""
+from typing import Optional
+
+import numpy as np
+
+MAX_FLOORS_SHARE = 0.5  # сумма минимумов кампаний — не больше этой доли бюджета
+
+def floor_share(min_share: float, count: int) -> float:
+    """Доля минимума кампании, при которой минимумы count кампаний помещаются в бюджет"""
+    return min(min_share, MAX_FLOORS_SHARE / count) if count else min_share
+
+class ConvexBudgetAllocator:
+    def __init__(
+        self,
+        daily_budget: float,
+        min_share: float = 0.1,
+        max_share: float = 0.5,
+        ramp_limit: Optional[float] = 0.3,
+        tolerance: float = 1e-9,
+        max_iterations: int = 200
+    ):
+        self.daily_budget = daily_budget
+        self.min_share = min_share
+        self.max_share = max_share
+        self.ramp_limit = ramp_limit
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+
+        self.last_lambda: Optional[float] = None
+        self.last_iterations = 0
+        self.floors_scaled = False
+
+    def bounds(self, previous: np.ndarray) -> tuple:
+        """
+        Нижние и верхние границы бюджетов с учетом ограничения скорости изменения.
+        NaN в previous — новая кампания без прошлого бюджета, рампа к ней не применяется.
+        """
+        lower = np.full(len(previous), self.daily_budget * floor_share(self.min_share, len(previous)))
+        upper = np.full(len(previous), self.daily_budget * self.max_share)
+        if self.ramp_limit is not None:
+            known = ~np.isnan(previous)
+            lower[known] = np.maximum(lower[known], previous[known] * (1 - self.ramp_limit))
+            upper[known] = np.minimum(upper[known], previous[known] * (1 + self.ramp_limit))
+        # Если прошлый бюджет вне допустимой полосы, двигаемся к ней на шаг рампы
+        lower = np.minimum(lower, upper)
+        return lower, upper
+
+    def expected_conversions(self, budgets: np.ndarray, marginal_rates: np.ndarray,
+                             saturation: np.ndarray) -> float:
+        return float(np.sum(marginal_rates * saturation * np.log1p(budgets / saturation)))
+
+    def _budgets_at(self, lam: float, marginal_rates, saturation, lower, upper) -> np.ndarray:
+        return np.clip(saturation * (marginal_rates / lam - 1.0), lower, upper)
+
+    def allocate(
+        self,
+        marginal_rates: np.ndarray,
+        saturation: np.ndarray,
+        previous: np.ndarray,
+        total_budget: Optional[float] = None
+    ) -> np.ndarray:
+        """
+        Оптимальные бюджеты кампаний.
+
+        Args:
+            marginal_rates: Конверсии на единицу расходов при малом бюджете (r_i)
+            saturation: Масштаб насыщения (s_i), обычно текущий бюджет кампании
+            previous: Прошлое распределение (для ограничения скорости изменения, NaN — нет)
+            total_budget: Общий бюджет, по умолчанию дневной бюджет
+
+        Returns:
+            np.ndarray: Бюджеты кампаний
+        """
+        budget = self.daily_budget if total_budget is None else total_budget
+        marginal_rates = np.maximum(np.asarray(marginal_rates, dtype=np.float64), 0.0)
+        saturation = np.maximum(np.asarray(saturation, dtype=np.float64), 1e-9)
+        lower, upper = self.bounds(np.asarray(previous, dtype=np.float64))
+        self.last_iterations = 0
+        self.floors_scaled = False
+
+        # Минимумы рампы не помещаются в бюджет: пропорционально уменьшаем их
+        if lower.sum() >= budget:
+            self.floors_scaled = True
+            return lower * (budget / lower.sum()) if lower.sum() > 0 else lower
+        # Бюджет не ограничивает: все кампании получают максимум
+        if upper.sum() <= budget:
+            return upper.copy()
+
+        # Интервал для λ: при lam_high все кампании на минимуме, при lam_low — на максимуме
+        positive = marginal_rates > 0
+        if not positive.any():
+            return self._fill_uniformly(lower, upper, budget)
+        lam_high = float(marginal_rates.max())
+        lam_low = float(np.min(
+            marginal_rates[positive] / (1.0 + upper[positive] / saturation[positive])
+        )) or self.tolerance
+
+        if self.last_lambda is not None and lam_low < self.last_lambda < lam_high:
+            lam_low, lam_high = self._warm_bracket(
+                self.last_lambda, lam_low, lam_high, marginal_rates, saturation, lower, upper, budget
+            )
+
+        for _ in range(self.max_iterations):
+            self.last_iterations += 1
+            lam = 0.5 * (lam_low + lam_high)
+            allocated = self._budgets_at(lam, marginal_rates, saturation, lower, upper).sum()
+            if allocated > budget:
+                lam_low = lam
+            else:
+                lam_high = lam
+            if lam_high - lam_low <= self.tolerance * lam_high:
+                break
+
+        self.last_lambda = 0.5 * (lam_low + lam_high)
+        budgets = self._budgets_at(self.last_lambda, marginal_rates, saturation, lower, upper)
+        return self._close_gap(budgets, lower, upper, budget)
+
+    def _warm_bracket(self, lam, lam_low, lam_high, marginal_rates, saturation, lower, upper, budget):
+        """Сужает интервал поиска вокруг λ прошлого решения"""
+        step = 1.05
+        low, high = lam, lam
+        while low > lam_low and self._budgets_at(low, marginal_rates, saturation, lower, upper).sum() <= budget:
+            self.last_iterations += 1
+            low /= step
+        while high < lam_high and self._budgets_at(high, marginal_rates, saturation, lower, upper).sum() > budget:
+            self.last_iterations += 1
+            high *= step
+        return max(low, lam_low), min(high, lam_high)
+
+    def _close_gap(self, budgets, lower, upper, budget) -> np.ndarray:
+        """Распределяет остаток после бисекции по кампаниям, не упершимся в границы"""
+        gap = budget - budgets.sum()
+        if abs(gap) <= self.tolerance * budget:
+            return budgets
+        room = (upper - budgets) if gap > 0 else (budgets - lower)
+        if room.sum() <= 0:
+            return budgets
+        return budgets + np.sign(gap) * room * min(abs(gap) / room.sum(), 1.0)
+
+    def _fill_uniformly(self, lower, upper, budget) -> np.ndarray:
+        """Без сигнала о конверсиях: остаток над минимумами делится пропорционально запасу"""
+        room = upper - lower
+        return lower + room * ((budget - lower.sum()) / room.sum())
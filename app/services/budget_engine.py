@@ -0,0 +1,190 @@
+"""
+Векторизованный движок распределения бюджета.
+Повторяет правила BudgetOptimizer, но хранит оценки, историю и бюджеты
+в массивах NumPy, индексированных по кампаниям, и считает все кампании за один проход.
+
+Режим 'convex' вместо правил-множителей решает задачу максимизации ожидаемых
+конверсий (см. budget_allocation.ConvexBudgetAllocator).
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .budget_allocation import ConvexBudgetAllocator
+from .budget_optimizer import BudgetOptimizer
+from .performance_history import PerformanceHistory, history_capacity, to_timestamp
+from .row_index import grow_rows
+
+class BudgetEngine:
+    SCORE_WEIGHTS = BudgetOptimizer.SCORE_WEIGHTS
+    SCORE_THRESHOLDS = BudgetOptimizer.SCORE_THRESHOLDS
+    SCORE_MULTIPLIERS = BudgetOptimizer.SCORE_MULTIPLIERS
+    TREND_THRESHOLD = BudgetOptimizer.TREND_THRESHOLD
+    TREND_MULTIPLIERS = BudgetOptimizer.TREND_MULTIPLIERS
+    MIN_BUDGET_SHARE = BudgetOptimizer.MIN_BUDGET_SHARE
+    MAX_BUDGET_SHARE = BudgetOptimizer.MAX_BUDGET_SHARE
+    ALLOCATION_MODES = ('rules', 'convex')
+
+    def __init__(
+        self,
+        total_budget: float,
+        daily_budget: float,
+        days_history: int = 7,
+        history: Optional[PerformanceHistory] = None,
+        allocation_mode: str = 'rules',
+        ramp_limit: Optional[float] = 0.3,
+        evaluation_interval: timedelta = timedelta(hours=1)
+    ):
+        """
+        evaluation_interval — как часто вызывается optimize; по нему подбирается емкость
+        истории, чтобы тренд сравнивался с оценкой на краю окна days_history, а не раньше.
+        Переданная history должна иметь емкость не меньше history_capacity(окно, интервал).
+        """
+        if allocation_mode not in self.ALLOCATION_MODES:
+            raise ValueError(f"Неизвестный режим распределения: {allocation_mode}")
+        self.total_budget = total_budget
+        self.daily_budget = daily_budget
+        self.allocation_mode = allocation_mode
+        self.allocator = ConvexBudgetAllocator(
+            daily_budget, self.MIN_BUDGET_SHARE, self.MAX_BUDGET_SHARE, ramp_limit
+        )
+        self.window = int(timedelta(days=days_history).total_seconds() * 1_000_000)
+
+        # История оценок; ее индекс строк служит индексом кампаний движка
+        self.history = history or PerformanceHistory(
+            history_capacity(timedelta(days=days_history), evaluation_interval)
+        )
+
+        # Колонки по кампаниям
+        self.budgets = np.zeros(0, dtype=np.float64)
+        self.has_budget = np.zeros(0, dtype=bool)
+        self.allocated_count = 0
+
+    @property
+    def campaign_ids(self) -> List[str]:
+        return self.history.keys
+
+    def rows_for(self, campaign_ids: Sequence[str]) -> np.ndarray:
+        """Индексы строк для кампаний; новые кампании регистрируются"""
+        rows = self.history.rows_for(campaign_ids)
+        self.budgets = grow_rows(self.budgets, len(self.history))
+        self.has_budget = grow_rows(self.has_budget, len(self.history))
+        return rows
+
+    def optimize_rows(
+        self,
+        rows: np.ndarray,
+        roas: np.ndarray,
+        ctr: np.ndarray,
+        conversion_rate: np.ndarray,
+        now: Optional[datetime] = None,
+        marginal_rates: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Рассчитывает бюджеты для кампаний rows за один векторизованный проход.
+
+        В режиме 'convex' marginal_rates — конверсии на единицу расходов
+        (по умолчанию ROAS как ценность на единицу расходов).
+
+        Returns:
+            np.ndarray: Рекомендуемые дневные бюджеты в порядке rows
+        """
+        ts = to_timestamp(now or datetime.now())
+        roas_weight, ctr_weight, conversion_weight = self.SCORE_WEIGHTS
+        scores = roas * roas_weight + ctr * ctr_weight + conversion_rate * conversion_weight
+
+        self.history.append(rows, ts, scores)
+        self.history.evict_before(rows, ts - self.window)
+        oldest = self.history.oldest_scores(rows)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            trend = np.where(
+                (self.history.count[rows] > 1) & (oldest > 0),
+                (scores - oldest) / oldest,
+                0.0
+            )
+
+        excellent, good, fair = self.SCORE_THRESHOLDS
+        multipliers = np.select(
+            [scores > excellent, scores > good, scores > fair],
+            self.SCORE_MULTIPLIERS[:3],
+            self.SCORE_MULTIPLIERS[3]
+        )
+        multipliers = np.where(
+            trend > self.TREND_THRESHOLD,
+            multipliers * self.TREND_MULTIPLIERS[0],
+            np.where(trend < -self.TREND_THRESHOLD, multipliers * self.TREND_MULTIPLIERS[1], multipliers)
+        )
+
+        default_budget = (
+            self.daily_budget / self.allocated_count if self.allocated_count else self.daily_budget
+        )
+        current = np.where(self.has_budget[rows], self.budgets[rows], default_budget)
+
+        if self.allocation_mode == 'convex':
+            # Масштаб насыщения — текущий бюджет (для новых кампаний — равная доля):
+            # при таком бюджете предельная отдача падает вдвое
+            new_budgets = self.allocator.allocate(
+                roas if marginal_rates is None else marginal_rates,
+                saturation=np.where(self.has_budget[rows], current, self.daily_budget / len(rows)),
+                previous=np.where(self.has_budget[rows], current, np.nan)
+            )
+        else:
+            new_budgets = np.clip(
+                current * multipliers,
+                self.daily_budget * self.MIN_BUDGET_SHARE,
+                self.daily_budget * self.MAX_BUDGET_SHARE
+            )
+
+            total_allocated = new_budgets.sum()
+            if total_allocated > self.daily_budget:
+                new_budgets *= self.daily_budget / total_allocated
+
+        self.has_budget[:] = False
+        self.has_budget[rows] = True
+        self.budgets[rows] = new_budgets
+        self.allocated_count = len(rows)
+        return new_budgets
+
+    def optimize(
+        self,
+        campaign_ids: Sequence[str],
+        roas: Sequence[float],
+        ctr: Sequence[float],
+        conversion_rate: Sequence[float],
+        now: Optional[datetime] = None,
+        marginal_rates: Optional[Sequence[float]] = None
+    ) -> np.ndarray:
+        rows = self.rows_for(campaign_ids)
+        return self.optimize_rows(
+            rows,
+            np.asarray(roas, dtype=np.float64),
+            np.asarray(ctr, dtype=np.float64),
+            np.asarray(conversion_rate, dtype=np.float64),
+            now,
+            None if marginal_rates is None else np.asarray(marginal_rates, dtype=np.float64)
+        )
+
+    def optimize_campaign_budgets(self, campaign_metrics: List[Dict]) -> Dict[str, float]:
+        """Совместимый с BudgetOptimizer интерфейс"""
+        campaign_ids = [campaign['campaign_id'] for campaign in campaign_metrics]
+        marginal_rates = None
+        if all('conversions' in campaign and 'spend' in campaign for campaign in campaign_metrics):
+            marginal_rates = [
+                campaign['conversions'] / campaign['spend'] if campaign['spend'] > 0 else 0.0
+                for campaign in campaign_metrics
+            ]
+        budgets = self.optimize(
+            campaign_ids,
+            [campaign.get('roas', 0) for campaign in campaign_metrics],
+            [campaign.get('ctr', 0) for campaign in campaign_metrics],
+            [campaign.get('conversion_rate', 0) for campaign in campaign_metrics],
+            marginal_rates=marginal_rates
+        )
+        return dict(zip(campaign_ids, budgets.tolist()))
+
+    @property
+    def campaign_budgets(self) -> Dict[str, float]:
+        """Текущие бюджеты кампаний из последнего распределения"""
+        rows = np.flatnonzero(self.has_budget[:len(self.campaign_ids)])
+        return {self.campaign_ids[row]: float(self.budgets[row]) for row in rows}
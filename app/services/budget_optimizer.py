@@ -1,12 +1,29 @@
 from typing import List, Dict, Optional
 from datetime import datetime, timedelta
 
+from .performance_history import PerformanceHistory, to_timestamp
+from .rules_engine import CompiledRuleSet, default_rule_set, resolve_status
+
 class BudgetOptimizer:
-    def __init__(self, total_budget: float, daily_budget: float):
+    # Правила распределения бюджета (используются также в BudgetEngine)
+    SCORE_WEIGHTS = (0.5, 0.3, 0.2)  # ROAS, CTR, конверсия
+    SCORE_THRESHOLDS = (1.5, 1.0, 0.8)
+    SCORE_MULTIPLIERS = (1.2, 1.1, 1.0, 0.8)
+    TREND_THRESHOLD = 0.1
+    TREND_MULTIPLIERS = (1.1, 0.9)  # положительный, отрицательный тренд
+    MIN_BUDGET_SHARE = 0.1
+    MAX_BUDGET_SHARE = 0.5
+
+    def __init__(
+        self,
+        total_budget: float,
+        daily_budget: float,
+        performance_history: Optional[PerformanceHistory] = None
+    ):
         self.total_budget = total_budget
         self.daily_budget = daily_budget
         self.campaign_budgets = {}
-        self.performance_history = {}
+        self.performance_history = performance_history or PerformanceHistory()
 
     def calculate_campaign_budget(
         self,
@@ -30,51 +47,46 @@ class BudgetOptimizer:
         conversion_rate = performance_metrics.get('conversion_rate', 0)
         
         # Базовая оценка эффективности
+        roas_weight, ctr_weight, conversion_weight = self.SCORE_WEIGHTS
         performance_score = (
-            roas * 0.5 +  # ROAS имеет наибольший вес
-            ctr * 0.3 +   # CTR также важен
-            conversion_rate * 0.2  # Конверсия тоже учитывается
+            roas * roas_weight +  # ROAS имеет наибольший вес
+            ctr * ctr_weight +   # CTR также важен
+            conversion_rate * conversion_weight  # Конверсия тоже учитывается
         )
         
         # Сохраняем историю производительности
-        if campaign_id not in self.performance_history:
-            self.performance_history[campaign_id] = []
-        
-        self.performance_history[campaign_id].append({
-            'date': datetime.now(),
-            'score': performance_score
-        })
+        now = datetime.now()
+        rows = self.performance_history.rows_for([campaign_id])
+        self.performance_history.append(rows, to_timestamp(now), performance_score)
         
         # Очищаем старые записи
-        cutoff_date = datetime.now() - timedelta(days=days_history)
-        self.performance_history[campaign_id] = [
-            record for record in self.performance_history[campaign_id]
-            if record['date'] >= cutoff_date
-        ]
+        cutoff_date = now - timedelta(days=days_history)
+        self.performance_history.evict_before(rows, to_timestamp(cutoff_date))
         
         # Рассчитываем тренд производительности
-        if len(self.performance_history[campaign_id]) > 1:
-            old_score = self.performance_history[campaign_id][0]['score']
-            new_score = self.performance_history[campaign_id][-1]['score']
+        if self.performance_history.count[rows[0]] > 1:
+            old_score = float(self.performance_history.oldest_scores(rows)[0])
+            new_score = performance_score
             trend = (new_score - old_score) / old_score if old_score > 0 else 0
         else:
             trend = 0
         
         # Определяем коэффициент корректировки бюджета
-        if performance_score > 1.5:  # Отличная производительность
-            budget_multiplier = 1.2
-        elif performance_score > 1.0:  # Хорошая производительность
-            budget_multiplier = 1.1
-        elif performance_score > 0.8:  # Удовлетворительная производительность
-            budget_multiplier = 1.0
+        excellent, good, fair = self.SCORE_THRESHOLDS
+        if performance_score > excellent:  # Отличная производительность
+            budget_multiplier = self.SCORE_MULTIPLIERS[0]
+        elif performance_score > good:  # Хорошая производительность
+            budget_multiplier = self.SCORE_MULTIPLIERS[1]
+        elif performance_score > fair:  # Удовлетворительная производительность
+            budget_multiplier = self.SCORE_MULTIPLIERS[2]
         else:  # Низкая производительность
-            budget_multiplier = 0.8
+            budget_multiplier = self.SCORE_MULTIPLIERS[3]
         
         # Учитываем тренд
-        if trend > 0.1:  # Положительный тренд
-            budget_multiplier *= 1.1
-        elif trend < -0.1:  # Отрицательный тренд
-            budget_multiplier *= 0.9
+        if trend > self.TREND_THRESHOLD:  # Положительный тренд
+            budget_multiplier *= self.TREND_MULTIPLIERS[0]
+        elif trend < -self.TREND_THRESHOLD:  # Отрицательный тренд
+            budget_multiplier *= self.TREND_MULTIPLIERS[1]
         
         # Получаем текущий бюджет кампании
         current_budget = self.campaign_budgets.get(campaign_id, self.daily_budget / len(self.campaign_budgets) if self.campaign_budgets else self.daily_budget)
@@ -83,8 +95,8 @@ class BudgetOptimizer:
         new_budget = current_budget * budget_multiplier
         
         # Проверяем ограничения
-        min_budget = self.daily_budget * 0.1  # Минимум 10% от дневного бюджета
-        max_budget = self.daily_budget * 0.5  # Максимум 50% от дневного бюджета
+        min_budget = self.daily_budget * self.MIN_BUDGET_SHARE  # Минимум 10% от дневного бюджета
+        max_budget = self.daily_budget * self.MAX_BUDGET_SHARE  # Максимум 50% от дневного бюджета
         
         new_budget = max(min_budget, min(new_budget, max_budget))
         
@@ -130,7 +142,8 @@ class BudgetOptimizer:
     def get_campaign_recommendations(
         self,
         campaign_id: str,
-        performance_metrics: Dict
+        performance_metrics: Dict,
+        rules: Optional[CompiledRuleSet] = None
     ) -> Dict:
         """
         Генерирует рекомендации по оптимизации кампании.
@@ -138,43 +151,21 @@ class BudgetOptimizer:
         Args:
             campaign_id: ID кампании
             performance_metrics: Метрики производительности
+            rules: Правила пользователя (по умолчанию — DEFAULT_BUDGET_RULES)
         
         Returns:
             Dict: Рекомендации по оптимизации
         """
-        roas = performance_metrics.get('roas', 0)
-        ctr = performance_metrics.get('ctr', 0)
-        conversion_rate = performance_metrics.get('conversion_rate', 0)
-        
+        actions = (rules or default_rule_set('budget')).evaluate_one({
+            'roas': performance_metrics.get('roas', 0),
+            'ctr': performance_metrics.get('ctr', 0),
+            'conversion_rate': performance_metrics.get('conversion_rate', 0),
+            **performance_metrics
+        })
         recommendations = {
             'budget_change': None,
-            'status': None,
-            'optimization_tips': []
+            'status': resolve_status(actions),
+            'optimization_tips': [action['message'] for action in actions if action.get('message')]
         }
         
-        # Анализ ROAS
-        if roas < 1:
-            recommendations['optimization_tips'].append(
-                "Низкий ROAS. Рекомендуется пересмотреть таргетинг и креативы."
-            )
-            recommendations['status'] = 'warning'
-        elif roas > 2:
-            recommendations['optimization_tips'].append(
-                "Отличный ROAS. Рекомендуется увеличить бюджет для масштабирования."
-            )
-            recommendations['status'] = 'success'
-        
-        # Анализ CTR
-        if ctr < 0.01:
-            recommendations['optimization_tips'].append(
-                "Низкий CTR. Рекомендуется улучшить креативы и заголовки."
-            )
-            recommendations['status'] = 'warning'
-        
-        # Анализ конверсии
-        if conversion_rate < 0.02:
-            recommendations['optimization_tips'].append(
-                "Низкая конверсия. Проверьте релевантность целевой аудитории."
-            )
-        
         return recommendations
@@ -0,0 +1,38 @@
+"""
+Кеш процесса общего назначения: ограниченный LRU с временем жизни записей.
+Используется хранилищем токенов, идемпотентностью, состоянием диалогов и ботом.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+class LRUCache:
+    """Ограниченный LRU-кеш с временем жизни записей"""
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._items: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._items[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._items.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._items)
@@ -4,16 +4,54 @@
 import os
 import logging
 from typing import Dict, Any, List, Optional
-from datetime import datetime, timedelta
+from datetime import date, datetime
 import asyncio
 import json
+import uuid
+from urllib.parse import urlencode
+
+import httpx
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from ..config import settings
+from ..db.database import async_session_factory
+from .fake_graph import DEFAULT_ACCOUNTS, HOURLY_BREAKDOWN
+from .graph_api import graph_url, GRAPH_BATCH_LIMIT
+from .launch_pipeline import LaunchPipeline, LaunchStepError
+from .rules_engine import CompiledRuleSet, default_rule_set
+from .variant_generation import expand_variants
 
 logger = logging.getLogger(__name__)
 
+# Устаревшие цели кампаний -> цели ODAX, которые Graph принимает при создании
+OBJECTIVES = {
+    "CONVERSIONS": "OUTCOME_SALES",
+    "LINK_CLICKS": "OUTCOME_TRAFFIC",
+    "TRAFFIC": "OUTCOME_TRAFFIC",
+    "REACH": "OUTCOME_AWARENESS",
+    "BRAND_AWARENESS": "OUTCOME_AWARENESS",
+    "LEAD_GENERATION": "OUTCOME_LEADS",
+    "POST_ENGAGEMENT": "OUTCOME_ENGAGEMENT",
+}
+OPTIMIZATION_GOALS = {
+    "OUTCOME_SALES": "OFFSITE_CONVERSIONS",
+    "OUTCOME_TRAFFIC": "LINK_CLICKS",
+    "OUTCOME_AWARENESS": "REACH",
+    "OUTCOME_LEADS": "LEAD_GENERATION",
+    "OUTCOME_ENGAGEMENT": "POST_ENGAGEMENT",
+}
+CONVERSION_ACTION_TYPES = ("purchase", "offsite_conversion.fb_pixel_purchase", "lead", "complete_registration")
+REVENUE_ACTION_TYPES = ("purchase", "offsite_conversion.fb_pixel_purchase")
+
 class CampaignAutomationService:
-    def __init__(self):
-        self.mock_mode = os.getenv("MOCK_MODE", "true").lower() == "true"
-        self.fb_access_token = os.getenv("FB_ACCESS_TOKEN")
+    def __init__(self, session_factory: async_sessionmaker = async_session_factory,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        # В MOCK_MODE запросы уходят на фейковый Graph (settings.GRAPH_API_URL)
+        self.mock_mode = settings.MOCK_MODE
+        self.fb_access_token = os.getenv("FB_ACCESS_TOKEN") or ("mock_access_token" if self.mock_mode else None)
+        self.ad_account_id = os.getenv("FACEBOOK_AD_ACCOUNT_ID") or (DEFAULT_ACCOUNTS[0]["id"] if self.mock_mode else None)
+        self.session_factory = session_factory
+        self.transport = transport
         
     async def create_campaign_from_analysis(self, 
                                           analysis_data: Dict[str, Any], 
@@ -22,10 +60,6 @@ class CampaignAutomationService:
         Создает рекламную кампанию на основе анализа креатива
         """
         try:
-            if self.mock_mode:
-                return await self._create_mock_campaign(analysis_data, user_preferences)
-            
-            # Реальное создание кампании через Facebook API
             return await self._create_real_campaign(analysis_data, user_preferences)
             
         except Exception as e:
@@ -36,65 +70,398 @@ class CampaignAutomationService:
                 "campaign_id": None
             }
     
-    async def _create_mock_campaign(self, analysis_data: Dict[str, Any], user_preferences: Dict[str, Any] = None) -> Dict[str, Any]:
-        """Создание мок кампании для тестирования"""
-        
+    async def _graph(self, method: str, path: str, access_token: str, files=None, **params) -> Dict[str, Any]:
+        """Вызов Graph API; словари и списки в параметрах передаются как JSON"""
+        params = {key: json.dumps(value) if isinstance(value, (dict, list)) else value
+                  for key, value in params.items() if value is not None}
+        params["access_token"] = access_token
+        async with httpx.AsyncClient(transport=self.transport, timeout=60) as client:
+            if method == "GET":
+                response = await client.get(graph_url(path), params=params)
+            else:
+                response = await client.post(graph_url(path), data=params, files=files)
+        data = response.json() if response.content else {}
+        if response.status_code != 200 or "error" in data:
+            error = data.get("error", {})
+            raise Exception(error.get("message") or f"Graph API HTTP {response.status_code}")
+        return data
+
+    def _launch_stages(self, analysis: Dict[str, Any], preferences: Dict[str, Any],
+                       access_token: str, account: str) -> Dict:
+        """
+        Граф шагов запуска: таргетинг и загрузка изображения не зависят от кампании
+        и выполняются параллельно с ее созданием.
+
+            targeting ─────────┐
+            campaign ──────── adset ── ad
+            image ── creative ─────────┘
+        """
+        objective = OBJECTIVES.get(analysis.get("campaign_objective"), analysis.get("campaign_objective") or "OUTCOME_SALES")
+        name = preferences.get("campaign_name") or f"AI Generated Campaign - {datetime.now().strftime('%Y%m%d_%H%M')}"
+        daily_budget = preferences.get("budget") or analysis.get("budget_recommendation", {}).get("daily_budget", 50)
+        ad_copy = (analysis.get("ad_copy_suggestions") or ["Default ad copy"])[0]
+
+        async def targeting(results):
+            audience = analysis.get("target_audience", {})
+            interests = await self._search_interests(audience.get("interests", []), access_token)
+            spec = self._targeting_spec(audience.get("age_range", "18-65"), preferences.get("countries", ["US"]),
+                                        list(interests.values()))
+            return {"targeting": spec}
+
+        async def image(results):
+            if preferences.get("image_path"):
+                with open(preferences["image_path"], "rb") as f:
+                    content = f.read()
+                filename = os.path.basename(preferences["image_path"])
+                response = await self._graph("POST", f"{account}/adimages", access_token,
+                                             files={"filename": (filename, content)})
+                return {"image_hash": next(iter(response["images"].values()))["hash"]}
+            return {"image_url": preferences.get("image_url")}
+
+        async def campaign(results):
+            response = await self._graph(
+                "POST", f"{account}/campaigns", access_token,
+                name=name, objective=objective, status="PAUSED", special_ad_categories=[]
+            )
+            return {"campaign_id": response["id"], "name": name}
+
+        async def adset(results):
+            response = await self._graph(
+                "POST", f"{account}/adsets", access_token,
+                name=f"{name} - Ad Set",
+                campaign_id=results["campaign"]["campaign_id"],
+                daily_budget=int(round(float(daily_budget) * 100)),  # в минимальных единицах валюты
+                billing_event="IMPRESSIONS",
+                optimization_goal=OPTIMIZATION_GOALS.get(objective, "LINK_CLICKS"),
+                bid_strategy="LOWEST_COST_WITHOUT_CAP",
+                targeting=results["targeting"]["targeting"],
+                promoted_object=preferences.get("promoted_object"),
+                status="PAUSED"
+            )
+            return {"adset_id": response["id"]}
+
+        async def creative(results):
+            link_data = {"message": ad_copy, "link": preferences.get("link", "https://facebook.com")}
+            if results["image"].get("image_hash"):
+                link_data["image_hash"] = results["image"]["image_hash"]
+            elif results["image"].get("image_url"):
+                link_data["picture"] = results["image"]["image_url"]
+            response = await self._graph(
+                "POST", f"{account}/adcreatives", access_token,
+                name=f"{name} - Creative",
+                object_story_spec={"page_id": preferences.get("page_id"), "link_data": link_data}
+            )
+            return {"creative_id": response["id"]}
+
+        async def ad(results):
+            response = await self._graph(
+                "POST", f"{account}/ads", access_token,
+                name=f"{name} - Ad",
+                adset_id=results["adset"]["adset_id"],
+                creative={"creative_id": results["creative"]["creative_id"]},
+                status=preferences.get("status", "PAUSED")
+            )
+            return {"ad_id": response["id"]}
+
+        return {
+            "targeting": ((), targeting),
+            "image": ((), image),
+            "campaign": ((), campaign),
+            "adset": (("campaign", "targeting"), adset),
+            "creative": (("image",), creative),
+            "ad": (("adset", "creative"), ad),
+        }
+
+    async def _search_interests(self, terms: List[str], access_token: str) -> Dict[str, Dict[str, str]]:
+        """Интересы Graph по поисковым словам; независимые запросы выполняются одновременно"""
+        terms = list(dict.fromkeys(terms))
+        found = await asyncio.gather(*(
+            self._graph("GET", "search", access_token, type="adinterest", q=term, limit=1)
+            for term in terms
+        ))
+        return {term: {"id": item["id"], "name": item["name"]}
+                for term, response in zip(terms, found) for item in response.get("data", [])[:1]}
+
+    @staticmethod
+    def _targeting_spec(age_range: str, countries: List[str], interests: List[Dict[str, str]],
+                        placement: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        age_min, _, age_max = str(age_range).partition("-")
+        spec = {
+            "age_min": int(age_min or 18),
+            "age_max": int(age_max or 65),
+            "geo_locations": {"countries": countries},
+            **(placement or {}),
+        }
+        if interests:
+            spec["flexible_spec"] = [{"interests": interests}]
+        return spec
+
+    async def _graph_batch(self, access_token: str, operations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Один Graph batch-вызов (до GRAPH_BATCH_LIMIT операций).
+
+        Returns:
+            List: Ответ по каждой операции: тело при успехе или {"error": ...}
+        """
+        async with httpx.AsyncClient(transport=self.transport, timeout=60) as client:
+            response = await client.post(graph_url(), data={
+                "access_token": access_token,
+                "batch": json.dumps(operations),
+                "include_headers": "false",
+            })
+        data = response.json() if response.content else {}
+        if response.status_code != 200 or isinstance(data, dict):
+            error = data.get("error", {}) if isinstance(data, dict) else {}
+            raise Exception(error.get("message") or f"Graph API HTTP {response.status_code}")
+        items = []
+        for item in data:
+            try:
+                body = json.loads(item["body"]) if item and item.get("body") else {}
+            except ValueError:
+                body = {}
+            if not item or item.get("code") != 200:
+                body = {"error": body.get("error") or {"message": "Graph batch error"}}
+            items.append(body)
+        return items
+
+    async def _create_batched(self, access_token: str, account: str, edge: str,
+                              items: List[tuple]) -> Dict[str, str]:
+        """
+        Создает объекты пачками Graph batch; пачки отправляются одновременно.
+        Если часть объектов не создалась, созданные удаляются, чтобы повтор шага
+        не оставил дублей.
+
+        Args:
+            items: (ключ, параметры объекта)
+
+        Returns:
+            Dict: ключ -> id созданного объекта
+        """
+        operations = [
+            {"method": "POST", "relative_url": f"{account}/{edge}", "body": urlencode({
+                name: json.dumps(value) if isinstance(value, (dict, list)) else value
+                for name, value in params.items() if value is not None
+            })}
+            for _, params in items
+        ]
+        chunks = [operations[start:start + GRAPH_BATCH_LIMIT] for start in range(0, len(operations), GRAPH_BATCH_LIMIT)]
+        responses = await asyncio.gather(*(self._graph_batch(access_token, chunk) for chunk in chunks),
+                                         return_exceptions=True)
+
+        created, errors = {}, []
+        for (start, response) in zip(range(0, len(operations), GRAPH_BATCH_LIMIT), responses):
+            if isinstance(response, Exception):
+                errors.append(str(response))
+                continue
+            for (key, _), body in zip(items[start:start + GRAPH_BATCH_LIMIT], response):
+                if "id" in body:
+                    created[key] = body["id"]
+                else:
+                    errors.append(f"{key}: {body.get('error', {}).get('message')}")
+        if errors:
+            if created:
+                try:
+                    await self._graph_batch(access_token, [
+                        {"method": "DELETE", "relative_url": object_id} for object_id in created.values()
+                    ])
+                except Exception as e:
+                    logger.error(f"Не удалось удалить частично созданные объекты {edge}: {e}")
+            raise Exception(f"Не создано {edge}: {len(items) - len(created)} из {len(items)} ({errors[0]})")
+        return created
+
+    def _test_stages(self, plan: Dict[str, Any], analysis: Dict[str, Any], preferences: Dict[str, Any],
+                     access_token: str, account: str) -> Dict:
+        """
+        Граф шагов теста: группы объявлений, креативы и объявления создаются
+        пачками, поэтому цепочка вызовов та же, что у запуска одного объявления.
+
+            targeting ─────────┐
+            campaign ─────── adsets ── ads
+            image ── creatives ────────┘
+        """
+        single = self._launch_stages(analysis, preferences, access_token, account)
+        objective = OBJECTIVES.get(analysis.get("campaign_objective"), analysis.get("campaign_objective") or "OUTCOME_SALES")
+        countries = preferences.get("countries", ["US"])
+        status = preferences.get("status", "PAUSED")
+
+        async def targeting(results):
+            terms = [term for cell in plan["cells"] for term in cell["audience"]["interests"]]
+            return {"interests": await self._search_interests(terms, access_token)}
+
+        async def adsets(results):
+            name = results["campaign"]["name"]
+            interests = results["targeting"]["interests"]
+            items = [(cell["key"], {
+                "name": f"{name} - {cell['audience']['name']} / {cell['placement']['name']}",
+                "campaign_id": results["campaign"]["campaign_id"],
+                "daily_budget": cell["daily_budget"],
+                "billing_event": "IMPRESSIONS",
+                "optimization_goal": OPTIMIZATION_GOALS.get(objective, "LINK_CLICKS"),
+                "bid_strategy": "LOWEST_COST_WITHOUT_CAP",
+                "targeting": self._targeting_spec(
+                    cell["audience"]["age_range"], countries,
+                    [interests[term] for term in cell["audience"]["interests"] if term in interests],
+                    cell["placement"]["spec"]
+                ),
+                "promoted_object": preferences.get("promoted_object"),
+                "status": "PAUSED",
+            }) for cell in plan["cells"]]
+            return {"adsets": await self._create_batched(access_token, account, "adsets", items)}
+
+        async def creatives(results):
+            link = preferences.get("link", "https://facebook.com")
+            items = []
+            for index, copy in enumerate(plan["copies"]):
+                link_data = {"message": copy, "link": link}
+                if results["image"].get("image_hash"):
+                    link_data["image_hash"] = results["image"]["image_hash"]
+                elif results["image"].get("image_url"):
+                    link_data["picture"] = results["image"]["image_url"]
+                items.append((str(index), {
+                    "name": f"{results['campaign']['name']} - Creative {index + 1}",
+                    "object_story_spec": {"page_id": preferences.get("page_id"), "link_data": link_data},
+                }))
+            return {"creatives": await self._create_batched(access_token, account, "adcreatives", items)}
+
+        async def ads(results):
+            items = [(variant["variant_id"], {
+                "name": f"{results['campaign']['name']} - {variant['variant_id']}",
+                "adset_id": results["adsets"]["adsets"][variant["cell"]],
+                "creative": {"creative_id": results["creatives"]["creatives"][str(variant["copy_index"])]},
+                "status": status,
+            }) for variant in plan["variants"]]
+            return {"ads": await self._create_batched(access_token, account, "ads", items)}
+
+        return {
+            "targeting": ((), targeting),
+            "image": ((), single["image"][1]),
+            "campaign": ((), single["campaign"][1]),
+            "adsets": (("campaign", "targeting"), adsets),
+            "creatives": (("image", "campaign"), creatives),
+            "ads": (("adsets", "creatives"), ads),
+        }
+
+    async def create_test_from_analysis(self, analysis_data: Dict[str, Any],
+                                        user_preferences: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        Создает структурированный тест: одна кампания, группа объявлений на каждую
+        пару аудитория × размещение с равным бюджетом и объявление на каждый текст.
+        Повторный вызов с тем же launch_id продолжает запуск с незавершенного шага.
+        """
+        preferences = user_preferences or {}
         analysis = analysis_data.get("analysis", {})
-        
-        # Генерируем ID кампании
-        import random
-        campaign_id = f"camp_{random.randint(100000, 999999)}"
-        
-        # Создаем структуру кампании на основе анализа
-        campaign_data = {
-            "campaign_id": campaign_id,
-            "name": f"AI Generated Campaign - {datetime.now().strftime('%Y%m%d_%H%M')}",
-            "status": "ACTIVE",
-            "objective": analysis.get("campaign_objective", "CONVERSIONS"),
-            "budget": analysis.get("budget_recommendation", {}).get("daily_budget", 50),
-            "target_audience": analysis.get("target_audience", {}),
-            "placements": analysis.get("placement_suggestions", ["Facebook Feed"]),
-            "ad_creative": {
-                "ad_copy": analysis.get("ad_copy_suggestions", ["Default ad copy"])[0],
-                "keywords": analysis.get("keywords", []),
-                "creative_insights": analysis.get("creative_insights", {})
+        access_token = preferences.get("access_token") or self.fb_access_token
+        account = preferences.get("ad_account_id") or self.ad_account_id
+        if not access_token or not account:
+            return {"status": "error", "message": "Не задан токен Facebook или рекламный аккаунт", "campaign_id": None}
+        if not str(account).startswith("act_"):
+            account = f"act_{account}"
+
+        budget = preferences.get("budget") or analysis.get("budget_recommendation", {}).get("daily_budget", 50)
+        plan = expand_variants(analysis, preferences, budget)
+        launch_id = preferences.get("launch_id") or uuid.uuid4().hex
+        pipeline = LaunchPipeline(self._test_stages(plan, analysis, preferences, access_token, account), self.session_factory)
+        try:
+            results = await pipeline.run(launch_id)
+        except LaunchStepError as e:
+            return {
+                "status": "error",
+                "message": f"Ошибка на шаге {e.step}: {e}",
+                "campaign_id": None,
+                "launch_id": launch_id,
+                "failed_step": e.step
+            }
+
+        cells = {cell["key"]: cell for cell in plan["cells"]}
+        variants = []
+        for variant in plan["variants"]:
+            cell = cells[variant["cell"]]
+            variants.append({
+                "variant_id": variant["variant_id"],
+                "ad_copy": plan["copies"][variant["copy_index"]],
+                "audience": cell["audience"]["name"],
+                "placement": cell["placement"]["name"],
+                "adset_id": results["adsets"]["adsets"][cell["key"]],
+                "creative_id": results["creatives"]["creatives"][str(variant["copy_index"])],
+                "ad_id": results["ads"]["ads"][variant["variant_id"]],
+                "adset_daily_budget": cell["daily_budget"] / 100,
+            })
+        return {
+            "status": "success",
+            "message": f"Тест создан: {len(variants)} вариантов в {len(cells)} группах объявлений",
+            "campaign": {
+                "campaign_id": results["campaign"]["campaign_id"],
+                "name": results["campaign"]["name"],
+                "status": preferences.get("status", "PAUSED"),
+                "objective": OBJECTIVES.get(analysis.get("campaign_objective"), analysis.get("campaign_objective")),
+                "budget": budget,
+                "created_at": datetime.now().isoformat(),
             },
+            "variants": variants,
+            "pruned_ad_copies": plan["pruned"],
+            "launch_id": launch_id
+        }
+
+    async def _create_real_campaign(self, analysis_data: Dict[str, Any], user_preferences: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        Создание реальной кампании через Facebook API: кампания, группа объявлений,
+        креатив и объявление. Повторный вызов с тем же launch_id продолжает запуск
+        с первого незавершенного шага.
+        """
+        preferences = user_preferences or {}
+        analysis = analysis_data.get("analysis", {})
+        access_token = preferences.get("access_token") or self.fb_access_token
+        account = preferences.get("ad_account_id") or self.ad_account_id
+        if not access_token or not account:
+            return {
+                "status": "error",
+                "message": "Не задан токен Facebook или рекламный аккаунт",
+                "campaign_id": None
+            }
+        if not str(account).startswith("act_"):
+            account = f"act_{account}"
+
+        launch_id = preferences.get("launch_id") or uuid.uuid4().hex
+        pipeline = LaunchPipeline(self._launch_stages(analysis, preferences, access_token, account), self.session_factory)
+        try:
+            results = await pipeline.run(launch_id)
+        except LaunchStepError as e:
+            return {
+                "status": "error",
+                "message": f"Ошибка на шаге {e.step}: {e}",
+                "campaign_id": None,
+                "launch_id": launch_id,
+                "failed_step": e.step
+            }
+
+        campaign_data = {
+            "campaign_id": results["campaign"]["campaign_id"],
+            "adset_id": results["adset"]["adset_id"],
+            "creative_id": results["creative"]["creative_id"],
+            "ad_id": results["ad"]["ad_id"],
+            "name": results["campaign"]["name"],
+            "status": preferences.get("status", "PAUSED"),
+            "objective": OBJECTIVES.get(analysis.get("campaign_objective"), analysis.get("campaign_objective")),
+            "budget": preferences.get("budget") or analysis.get("budget_recommendation", {}).get("daily_budget", 50),
+            "target_audience": results["targeting"]["targeting"],
             "created_at": datetime.now().isoformat(),
             "updated_at": datetime.now().isoformat()
         }
-        
-        # Применяем пользовательские предпочтения
-        if user_preferences:
-            if "budget" in user_preferences:
-                campaign_data["budget"] = user_preferences["budget"]
-            if "campaign_name" in user_preferences:
-                campaign_data["name"] = user_preferences["campaign_name"]
-        
         return {
             "status": "success",
-            "message": "Кампания создана успешно (режим разработки)",
-            "campaign": campaign_data
-        }
-    
-    async def _create_real_campaign(self, analysis_data: Dict[str, Any], user_preferences: Dict[str, Any] = None) -> Dict[str, Any]:
-        """Создание реальной кампании через Facebook API"""
-        # Здесь будет реальная интеграция с Facebook Business API
-        # Пока возвращаем заглушку
-        return {
-            "status": "error",
-            "message": "Real Facebook API integration not implemented yet",
-            "campaign_id": None
+            "message": "Кампания создана успешно",
+            "campaign": campaign_data,
+            "launch_id": launch_id
         }
     
-    async def optimize_campaign(self, campaign_id: str) -> Dict[str, Any]:
+    async def optimize_campaign(self, campaign_id: str, rules: Optional[CompiledRuleSet] = None,
+                                access_token: Optional[str] = None) -> Dict[str, Any]:
         """
         Оптимизирует существующую кампанию на основе метрик
+        (access_token — токен владельца кампании, иначе токен сервиса)
         """
         try:
-            if self.mock_mode:
-                return await self._optimize_mock_campaign(campaign_id)
-            
-            return await self._optimize_real_campaign(campaign_id)
+            return await self._optimize_real_campaign(campaign_id, rules, access_token)
             
         except Exception as e:
             logger.error(f"Ошибка оптимизации кампании {campaign_id}: {e}")
@@ -104,74 +471,43 @@ class CampaignAutomationService:
                 "optimizations": []
             }
     
-    async def _optimize_mock_campaign(self, campaign_id: str) -> Dict[str, Any]:
-        """Мок оптимизация кампании"""
-        
-        # Генерируем случайные метрики
-        import random
+    @staticmethod
+    def _recommendations(metrics: Dict[str, Any], rules: Optional[CompiledRuleSet] = None) -> List[Dict[str, Any]]:
+        """Рекомендации по оптимизации на основе метрик кампании и правил пользователя"""
+        return [dict(action) for action in (rules or default_rule_set('campaign')).evaluate_one(metrics)]
+    
+    async def _optimize_real_campaign(self, campaign_id: str, rules: Optional[CompiledRuleSet] = None,
+                                      access_token: Optional[str] = None) -> Dict[str, Any]:
+        """Реальная оптимизация через Facebook API"""
+        performance = await self._get_real_performance(campaign_id, access_token)
+        if performance["status"] != "success":
+            return {"status": "error", "message": performance["message"], "optimizations": []}
         
+        totals = performance["total_metrics"]
         metrics = {
-            "impressions": random.randint(1000, 10000),
-            "clicks": random.randint(50, 500),
-            "conversions": random.randint(5, 50),
-            "cost_per_click": round(random.uniform(0.5, 3.0), 2),
-            "cost_per_conversion": round(random.uniform(10, 100), 2),
-            "ctr": round(random.uniform(1.0, 5.0), 2),
-            "conversion_rate": round(random.uniform(1.0, 10.0), 2)
+            "impressions": totals["total_impressions"],
+            "clicks": totals["total_clicks"],
+            "conversions": totals["total_conversions"],
+            "cost_per_click": totals["cost_per_click"],
+            "cost_per_conversion": totals["cost_per_conversion"],
+            "ctr": totals["ctr"],
+            "conversion_rate": totals["conversion_rate"]
         }
-        
-        # Генерируем рекомендации по оптимизации
-        optimizations = []
-        
-        if metrics["ctr"] < 2.0:
-            optimizations.append({
-                "type": "creative_optimization",
-                "message": "Низкий CTR. Рекомендуется обновить креатив",
-                "action": "update_creative",
-                "priority": "high"
-            })
-        
-        if metrics["cost_per_conversion"] > 50:
-            optimizations.append({
-                "type": "targeting_optimization", 
-                "message": "Высокая стоимость конверсии. Рекомендуется сузить аудиторию",
-                "action": "refine_targeting",
-                "priority": "medium"
-            })
-        
-        if metrics["conversion_rate"] < 2.0:
-            optimizations.append({
-                "type": "landing_page_optimization",
-                "message": "Низкий коэффициент конверсии. Проверьте посадочную страницу",
-                "action": "optimize_landing_page",
-                "priority": "high"
-            })
-        
         return {
             "status": "success",
             "campaign_id": campaign_id,
             "metrics": metrics,
-            "optimizations": optimizations,
+            "optimizations": self._recommendations(metrics, rules),
             "analyzed_at": datetime.now().isoformat()
         }
     
-    async def _optimize_real_campaign(self, campaign_id: str) -> Dict[str, Any]:
-        """Реальная оптимизация через Facebook API"""
-        return {
-            "status": "error",
-            "message": "Real Facebook API optimization not implemented yet",
-            "optimizations": []
-        }
-    
-    async def get_campaign_performance(self, campaign_id: str) -> Dict[str, Any]:
+    async def get_campaign_performance(self, campaign_id: str, access_token: Optional[str] = None) -> Dict[str, Any]:
         """
         Получает метрики производительности кампании
+        (access_token — токен владельца кампании, иначе токен сервиса)
         """
         try:
-            if self.mock_mode:
-                return await self._get_mock_performance(campaign_id)
-            
-            return await self._get_real_performance(campaign_id)
+            return await self._get_real_performance(campaign_id, access_token)
             
         except Exception as e:
             logger.error(f"Ошибка получения метрик кампании {campaign_id}: {e}")
@@ -181,22 +517,9 @@ class CampaignAutomationService:
                 "metrics": {}
             }
     
-    async def _get_mock_performance(self, campaign_id: str) -> Dict[str, Any]:
-        """Мок метрики производительности"""
-        import random
-        
-        # Генерируем данные за последние 7 дней
-        daily_metrics = []
-        for i in range(7):
-            date = (datetime.now() - timedelta(days=i)).strftime('%Y-%m-%d')
-            daily_metrics.append({
-                "date": date,
-                "impressions": random.randint(100, 1000),
-                "clicks": random.randint(10, 100),
-                "conversions": random.randint(1, 10),
-                "spend": round(random.uniform(10, 100), 2)
-            })
-        
+    @staticmethod
+    def _total_metrics(daily_metrics: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Итоги и производные метрики за период"""
         total_metrics = {
             "total_impressions": sum(day["impressions"] for day in daily_metrics),
             "total_clicks": sum(day["clicks"] for day in daily_metrics),
@@ -209,20 +532,76 @@ class CampaignAutomationService:
         total_metrics["cost_per_click"] = round(total_metrics["total_spend"] / total_metrics["total_clicks"], 2) if total_metrics["total_clicks"] > 0 else 0
         total_metrics["cost_per_conversion"] = round(total_metrics["total_spend"] / total_metrics["total_conversions"], 2) if total_metrics["total_conversions"] > 0 else 0
         total_metrics["conversion_rate"] = round((total_metrics["total_conversions"] / total_metrics["total_clicks"]) * 100, 2) if total_metrics["total_clicks"] > 0 else 0
+        return total_metrics
+    
+    async def _get_real_performance(self, campaign_id: str, access_token: Optional[str] = None) -> Dict[str, Any]:
+        """Реальные метрики через Facebook API"""
+        access_token = access_token or self.fb_access_token
+        if not access_token:
+            return {"status": "error", "message": "Не задан токен Facebook", "metrics": {}}
+        
+        response = await self._graph(
+            "GET", f"{campaign_id}/insights", access_token,
+            fields="impressions,clicks,spend,actions,action_values",
+            date_preset="last_7d",
+            time_increment=1,
+            limit=100
+        )
+        daily_metrics = [{"date": row.get("date_start"), **self._insight_metrics(row)}
+                         for row in response.get("data", [])]
+        daily_metrics.sort(key=lambda day: day["date"] or "", reverse=True)
         
         return {
             "status": "success",
             "campaign_id": campaign_id,
             "daily_metrics": daily_metrics,
-            "total_metrics": total_metrics,
+            "total_metrics": self._total_metrics(daily_metrics),
             "period": "last_7_days",
             "updated_at": datetime.now().isoformat()
         }
-    
-    async def _get_real_performance(self, campaign_id: str) -> Dict[str, Any]:
-        """Реальные метрики через Facebook API"""
+
+    @staticmethod
+    def _insight_metrics(row: Dict[str, Any]) -> Dict[str, Any]:
+        """Метрики одной строки insights"""
         return {
-            "status": "error",
-            "message": "Real Facebook API metrics not implemented yet",
-            "metrics": {}
+            "impressions": int(row.get("impressions", 0)),
+            "clicks": int(row.get("clicks", 0)),
+            "conversions": sum(int(float(action.get("value", 0))) for action in row.get("actions", [])
+                               if action.get("action_type") in CONVERSION_ACTION_TYPES),
+            "spend": round(float(row.get("spend", 0)), 2),
+            "revenue": round(sum(float(action.get("value", 0)) for action in row.get("action_values", [])
+                                 if action.get("action_type") in REVENUE_ACTION_TYPES), 2)
         }
+
+    async def get_hourly_performance(self, campaign_id: str, since: date, until: date,
+                                     access_token: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Почасовые метрики кампании за дни since..until (часы в часовом поясе рекламного аккаунта)
+        для прогноза расходов и поиска аномалий
+        """
+        access_token = access_token or self.fb_access_token
+        if not access_token:
+            return {"status": "error", "message": "Не задан токен Facebook", "hourly_metrics": []}
+        try:
+            response = await self._graph(
+                "GET", f"{campaign_id}/insights", access_token,
+                fields="impressions,clicks,spend,actions,action_values",
+                time_range={"since": since.isoformat(), "until": until.isoformat()},
+                time_increment=1,
+                breakdowns=HOURLY_BREAKDOWN,
+                limit=500
+            )
+        except Exception as e:
+            logger.error(f"Ошибка получения почасовых метрик кампании {campaign_id}: {e}")
+            return {"status": "error", "message": str(e), "hourly_metrics": []}
+
+        hourly_metrics = []
+        for row in response.get("data", []):
+            # Значение разбивки: "HH:00:00 - HH:59:59"
+            hour = int(row.get(HOURLY_BREAKDOWN, "00")[:2])
+            hourly_metrics.append({
+                "hour": datetime.fromisoformat(row["date_start"]).replace(hour=hour),
+                **self._insight_metrics(row)
+            })
+        hourly_metrics.sort(key=lambda item: item["hour"])
+        return {"status": "success", "campaign_id": campaign_id, "hourly_metrics": hourly_metrics}
@@ -0,0 +1,41 @@
+"""
+Сохранение кампаний, созданных через API, в таблицу campaigns.
+
+Бюджеты в campaigns хранятся в валюте аккаунта: Graph API принимает и
+возвращает их в минимальных единицах (центах), перевод делает вызывающий.
+"""
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..db.models import Campaign
+
+async def save_campaign(
+    session: AsyncSession,
+    fb_campaign_id: str,
+    user_id: Optional[int] = None,
+    name: Optional[str] = None,
+    status: Optional[str] = None,
+    objective: Optional[str] = None,
+    daily_budget: Optional[float] = None
+) -> Campaign:
+    """
+    Сохраняет кампанию (upsert по fb_campaign_id): повторный запуск с теми же
+    контрольными точками возвращает ту же кампанию и не создает дубликат.
+
+    Args:
+        daily_budget: Дневной бюджет в валюте аккаунта (не в центах)
+    """
+    result = await session.execute(select(Campaign).where(Campaign.fb_campaign_id == fb_campaign_id))
+    campaign = result.scalar_one_or_none()
+    if campaign is None:
+        campaign = Campaign(fb_campaign_id=fb_campaign_id)
+        session.add(campaign)
+    if user_id is not None:
+        campaign.user_id = user_id
+    campaign.name = name
+    campaign.status = status
+    campaign.objective = objective
+    campaign.daily_budget = daily_budget
+    return campaign
@@ -0,0 +1,99 @@
+"""
+Состояние диалогов Telegram-бота: хранится в БД с временем жизни, поэтому
+общее для всех воркеров uvicorn и переживает перезапуск. Запись идет сразу
+в БД и в кеш процесса; чтение из кеша в пределах короткого окна, после — из БД.
+"""
+import asyncio
+import copy
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import delete, func
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from ..config import settings
+from ..db.database import async_session_factory, insert_for
+from ..db.models import ConversationState
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+class ConversationStateStore:
+    def __init__(
+        self,
+        session_factory: async_sessionmaker = async_session_factory,
+        ttl_seconds: int = settings.CONVERSATION_STATE_TTL_SECONDS,
+        cache_ttl_seconds: float = settings.CONVERSATION_STATE_CACHE_TTL_SECONDS,
+        cache_max_size: int = settings.CONVERSATION_STATE_CACHE_MAX_SIZE
+    ):
+        self.session_factory = session_factory
+        self.ttl_seconds = ttl_seconds
+        self.cache = LRUCache(cache_max_size, cache_ttl_seconds)
+
+    async def get(self, user_id: int, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """Состояние пользователя (пустой словарь, если его нет или оно истекло)"""
+        cached = self.cache.get(user_id)
+        if cached is None:
+            async with self.session_factory() as session:
+                record = await session.get(ConversationState, user_id)
+                if record is not None and record.expires_at > (now or datetime.now()):
+                    cached = record.state or {}
+                else:
+                    cached = {}
+            self.cache.set(user_id, cached)
+        # Копия, чтобы изменения вызывающего не попадали в кеш без записи в БД
+        return copy.deepcopy(cached)
+
+    async def set(self, user_id: int, state: Dict[str, Any], now: Optional[datetime] = None):
+        """Заменяет состояние пользователя и продлевает его время жизни"""
+        expires_at = (now or datetime.now()) + timedelta(seconds=self.ttl_seconds)
+        async with self.session_factory() as session:
+            # Одна команда INSERT ... ON CONFLICT: первая запись от двух воркеров сразу не конфликтует
+            insert = insert_for(session)
+            statement = insert(ConversationState).values(
+                telegram_user_id=user_id, state=state, expires_at=expires_at, updated_at=func.now()
+            )
+            await session.execute(statement.on_conflict_do_update(
+                index_elements=[ConversationState.telegram_user_id],
+                set_={'state': statement.excluded.state, 'expires_at': statement.excluded.expires_at,
+                      'updated_at': func.now()}
+            ))
+            await session.commit()
+        self.cache.set(user_id, copy.deepcopy(state))
+
+    async def update(self, user_id: int, now: Optional[datetime] = None, **changes) -> Dict[str, Any]:
+        """Обновляет поля состояния; возвращает новое состояние"""
+        state = await self.get(user_id, now)
+        state.update(changes)
+        await self.set(user_id, state, now)
+        return state
+
+    async def clear(self, user_id: int):
+        async with self.session_factory() as session:
+            await session.execute(delete(ConversationState).where(ConversationState.telegram_user_id == user_id))
+            await session.commit()
+        self.cache.set(user_id, {})
+
+    async def purge_expired(self, now: Optional[datetime] = None) -> int:
+        """Удаляет истекшие состояния"""
+        async with self.session_factory() as session:
+            result = await session.execute(
+                delete(ConversationState).where(ConversationState.expires_at <= (now or datetime.now()))
+            )
+            await session.commit()
+        if result.rowcount:
+            logger.info(f"Удалено истекших состояний диалогов: {result.rowcount}")
+        return result.rowcount
+
+    async def run_forever(self, interval_seconds: int = settings.CONVERSATION_STATE_PURGE_INTERVAL_SECONDS):
+        """Фоновая очистка истекших состояний"""
+        while True:
+            try:
+                await self.purge_expired()
+            except Exception:
+                logger.error("Ошибка очистки состояний диалогов", exc_info=True)
+            await asyncio.sleep(interval_seconds)
+
+# Общий экземпляр на процесс, чтобы кеш состояний переиспользовался
+conversation_states = ConversationStateStore()
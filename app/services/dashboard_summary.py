@@ -0,0 +1,235 @@
+"""
+Материализованные сводки для дашбордов бота и API.
+Сводки пересчитываются инкрементально только для пользователей, у которых
+изменились метрики, кампании или бюджеты; чтение — поиск по первичному ключу.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Any, Iterable, List, Optional, Set
+
+from sqlalchemy import delete, select, func, case, or_
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from ..db.database import async_session_factory
+from ..db.models import (
+    Budget, Campaign, CampaignMetric, CampaignSummary, UserDashboardSummary
+)
+
+logger = logging.getLogger(__name__)
+
+class DashboardSummaryService:
+    def __init__(
+        self,
+        session_factory: async_sessionmaker = async_session_factory,
+        top_campaigns_limit: int = 5,
+        batch_size: int = 500
+    ):
+        self.session_factory = session_factory
+        self.top_campaigns_limit = top_campaigns_limit
+        self.batch_size = batch_size
+        self._dirty_users: Set[int] = set()
+        self._watermark: Optional[datetime] = None
+
+    def mark_dirty(self, user_id: Optional[int]):
+        """Помечает сводку пользователя для пересчета при ближайшем обновлении"""
+        if user_id is not None:
+            self._dirty_users.add(user_id)
+
+    async def refresh_users(
+        self,
+        session: AsyncSession,
+        user_ids: Iterable[int],
+        now: Optional[datetime] = None
+    ) -> int:
+        """
+        Пересчитывает сводки указанных пользователей (commit остается за вызывающим).
+        
+        Returns:
+            int: Количество обновленных сводок пользователей
+        """
+        now = now or datetime.now()
+        user_ids = sorted(set(user_ids))
+        for start in range(0, len(user_ids), self.batch_size):
+            await self._refresh_batch(session, user_ids[start:start + self.batch_size], now)
+        return len(user_ids)
+
+    async def _refresh_batch(self, session: AsyncSession, user_ids: List[int], now: datetime):
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        week_ago = today - timedelta(days=6)
+
+        campaigns = (await session.execute(
+            select(Campaign).where(Campaign.user_id.in_(user_ids))
+        )).scalars().all()
+        campaign_ids = [campaign.id for campaign in campaigns]
+
+        metrics = {}
+        if campaign_ids:
+            rows = await session.execute(
+                select(
+                    CampaignMetric.campaign_id,
+                    func.sum(case((CampaignMetric.period_start >= today, CampaignMetric.spend), else_=0.0)),
+                    func.sum(CampaignMetric.spend),
+                    func.sum(CampaignMetric.revenue),
+                )
+                .where(
+                    CampaignMetric.campaign_id.in_(campaign_ids),
+                    CampaignMetric.granularity == 'day',
+                    CampaignMetric.period_start >= week_ago
+                )
+                .group_by(CampaignMetric.campaign_id)
+            )
+            metrics = {row[0]: row[1:] for row in rows}
+
+        budget_rows = await session.execute(
+            select(Budget.user_id, func.sum(Budget.daily_budget))
+            .where(
+                Budget.user_id.in_(user_ids),
+                Budget.budget_type == 'daily',
+                or_(Budget.start_date.is_(None), Budget.start_date <= now),
+                or_(Budget.end_date.is_(None), Budget.end_date >= now)
+            )
+            .group_by(Budget.user_id)
+        )
+        budgets = {user_id: total or 0.0 for user_id, total in budget_rows}
+
+        # Сводки удаленных кампаний и кампаний, перешедших к другому пользователю
+        await session.execute(
+            delete(CampaignSummary)
+            .where(CampaignSummary.user_id.in_(user_ids), CampaignSummary.campaign_id.not_in(campaign_ids))
+            .execution_options(synchronize_session=False)
+        )
+
+        per_user: Dict[int, List[CampaignSummary]] = {user_id: [] for user_id in user_ids}
+        for campaign in campaigns:
+            spend_today, spend_7d, revenue_7d = metrics.get(campaign.id, (0.0, 0.0, 0.0))
+            summary = await session.merge(CampaignSummary(
+                campaign_id=campaign.id,
+                user_id=campaign.user_id,
+                fb_campaign_id=campaign.fb_campaign_id,
+                name=campaign.name,
+                status=campaign.status,
+                daily_budget=campaign.daily_budget,
+                spend_today=spend_today or 0.0,
+                spend_7d=spend_7d or 0.0,
+                revenue_7d=revenue_7d or 0.0,
+                roas_7d=(revenue_7d or 0.0) / spend_7d if spend_7d else 0.0,
+                refreshed_at=now
+            ))
+            per_user[campaign.user_id].append(summary)
+
+        for user_id, summaries in per_user.items():
+            active = [s for s in summaries if s.status == 'ACTIVE']
+            # Без явных бюджетов берем сумму дневных бюджетов активных кампаний
+            daily_budget = budgets.get(user_id)
+            if daily_budget is None:
+                daily_budget = sum(s.daily_budget or 0.0 for s in active)
+            spend_today = sum(s.spend_today for s in summaries)
+            top = sorted(
+                (s for s in summaries if s.spend_7d > 0),
+                key=lambda s: s.roas_7d,
+                reverse=True
+            )[:self.top_campaigns_limit]
+
+            await session.merge(UserDashboardSummary(
+                user_id=user_id,
+                daily_budget=daily_budget,
+                spend_today=spend_today,
+                remaining_budget=max(daily_budget - spend_today, 0.0),
+                active_campaigns=len(active),
+                top_campaigns=[{
+                    "campaign_id": s.fb_campaign_id,
+                    "name": s.name,
+                    "roas": round(s.roas_7d, 2),
+                    "spend": round(s.spend_7d, 2)
+                } for s in top],
+                refreshed_at=now
+            ))
+
+    async def find_changed_users(self, session: AsyncSession, since: datetime) -> Set[int]:
+        """
+        Пользователи, у которых метрики, кампании или бюджеты изменились после since,
+        а также прежние владельцы удаленных и переданных кампаний
+        """
+        changed_metrics = await session.execute(
+            select(Campaign.user_id)
+            .join(CampaignMetric, CampaignMetric.campaign_id == Campaign.id)
+            .where(CampaignMetric.updated_at >= since, Campaign.user_id.is_not(None))
+            .distinct()
+        )
+        changed_campaigns = await session.execute(
+            select(Campaign.user_id)
+            .where(Campaign.updated_at >= since, Campaign.user_id.is_not(None))
+            .distinct()
+        )
+        changed_budgets = await session.execute(
+            select(Budget.user_id)
+            .where(Budget.updated_at >= since, Budget.user_id.is_not(None))
+            .distinct()
+        )
+        # Прежние владельцы удаленных или переданных кампаний
+        stale_summaries = await session.execute(
+            select(CampaignSummary.user_id)
+            .outerjoin(Campaign, Campaign.id == CampaignSummary.campaign_id)
+            .where(
+                CampaignSummary.user_id.is_not(None),
+                or_(Campaign.id.is_(None), Campaign.user_id.is_distinct_from(CampaignSummary.user_id))
+            )
+            .distinct()
+        )
+        return (
+            set(changed_metrics.scalars())
+            | set(changed_campaigns.scalars())
+            | set(changed_budgets.scalars())
+            | set(stale_summaries.scalars())
+        )
+
+    async def refresh_pending(self, now: Optional[datetime] = None) -> int:
+        """Пересчитывает сводки помеченных и измененных с прошлого прохода пользователей"""
+        now = now or datetime.now()
+        async with self.session_factory() as session:
+            # Водяной знак берем по часам БД: updated_at заполняется через func.now()
+            db_now = (await session.execute(select(func.now()))).scalar()
+            user_ids = set(self._dirty_users)
+            self._dirty_users.clear()
+            if self._watermark is None:
+                # Первый проход после старта: пересчитываем всех пользователей с кампаниями
+                all_users = await session.execute(
+                    select(Campaign.user_id).where(Campaign.user_id.is_not(None)).distinct()
+                )
+                user_ids |= set(all_users.scalars())
+            else:
+                user_ids |= await self.find_changed_users(session, self._watermark)
+
+            refreshed = await self.refresh_users(session, user_ids, now)
+            await session.commit()
+
+        self._watermark = db_now
+        return refreshed
+
+    async def run_forever(self, interval_seconds: int = 30):
+        """Фоновое обновление сводок"""
+        while True:
+            try:
+                await self.refresh_pending()
+            except Exception:
+                logger.error("Ошибка обновления сводок дашборда", exc_info=True)
+            await asyncio.sleep(interval_seconds)
+
+async def get_user_summary(session: AsyncSession, user_id: int) -> Optional[UserDashboardSummary]:
+    """Сводка пользователя одним поиском по первичному ключу"""
+    return await session.get(UserDashboardSummary, user_id)
+
+def summary_to_dict(summary: UserDashboardSummary) -> Dict[str, Any]:
+    return {
+        "user_id": summary.user_id,
+        "daily_budget": round(summary.daily_budget, 2),
+        "spend_today": round(summary.spend_today, 2),
+        "remaining_budget": round(summary.remaining_budget, 2),
+        "active_campaigns": summary.active_campaigns,
+        "top_campaigns": summary.top_campaigns or [],
+        "refreshed_at": summary.refreshed_at.isoformat(),
+    }
+
+# Общий экземпляр на процесс
+dashboard_summary_service = DashboardSummaryService()
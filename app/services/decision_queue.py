@@ -0,0 +1,334 @@
+"""
+Очередь применения решений оптимизатора к кампаниям Facebook.
+
+Решения по одной кампании склеиваются в одну запись (последнее значение
+поля побеждает), изменения без эффекта и изменения бюджета меньше
+минимального шага отбрасываются. Остальное уходит пачками Graph batch
+(до 50 запросов в одном HTTP-вызове) с учетом заголовков лимитов
+X-App-Usage / X-Ad-Account-Usage / X-Business-Use-Case-Usage.
+Каждое решение, включая отброшенные, пишется в decision_audit.
+
+В режиме dry_run Graph не вызывается и локальная БД не меняется — только аудит.
+В режиме mock (по умолчанию MOCK_MODE) Graph не вызывается, изменения
+применяются к локальной БД.
+"""
+import asyncio
+import json
+import logging
+import time
+from urllib.parse import urlencode
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from ..config import settings
+from ..db.database import async_session_factory
+from ..db.models import Campaign, DecisionAudit
+from .graph_api import graph_url, GRAPH_BATCH_LIMIT
+from .token_vault import token_vault
+
+logger = logging.getLogger(__name__)
+
+USAGE_HEADERS = ('x-app-usage', 'x-ad-account-usage', 'x-business-use-case-usage')
+USAGE_FIELDS = ('call_count', 'total_cputime', 'total_time', 'acc_id_util_pct')
+RATE_LIMIT_ERROR_CODES = {4, 17, 32, 613, 80000, 80004}
+BUDGET_FIELDS = ('daily_budget', 'lifetime_budget')
+
+def parse_usage(headers) -> Tuple[float, float]:
+    """
+    Загрузка лимитов Graph из заголовков ответа.
+
+    Returns:
+        Tuple: (максимальный процент использования, минут до снятия блокировки)
+    """
+    usage, regain_minutes = 0.0, 0.0
+    for header in USAGE_HEADERS:
+        raw = headers.get(header)
+        if not raw:
+            continue
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            continue
+        # X-Business-Use-Case-Usage: {"<id>": [{...}, ...]}, остальные — плоский объект
+        entries = [entry for values in data.values() for entry in values] if header.endswith('use-case-usage') else [data]
+        for entry in entries:
+            usage = max([usage] + [float(entry.get(field, 0) or 0) for field in USAGE_FIELDS])
+            regain_minutes = max(regain_minutes, float(entry.get('estimated_time_to_regain_access', 0) or 0))
+    return usage, regain_minutes
+
+class DecisionQueue:
+    def __init__(
+        self,
+        session_factory: async_sessionmaker = async_session_factory,
+        dry_run: bool = False,
+        mock: Optional[bool] = None,
+        min_budget_delta: float = 0.05,
+        min_budget_delta_abs: float = 1.0,
+        batch_size: int = GRAPH_BATCH_LIMIT,
+        usage_slowdown_threshold: float = 75.0,
+        max_backoff_seconds: float = 30.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        sleep: Callable = asyncio.sleep
+    ):
+        self.session_factory = session_factory
+        self.dry_run = dry_run
+        self.mock = settings.MOCK_MODE if mock is None else mock
+        self.min_budget_delta = min_budget_delta  # относительный минимальный шаг бюджета
+        self.min_budget_delta_abs = min_budget_delta_abs
+        self.batch_size = min(batch_size, GRAPH_BATCH_LIMIT)
+        self.usage_slowdown_threshold = usage_slowdown_threshold
+        self.max_backoff_seconds = max_backoff_seconds
+        self.transport = transport
+        self.sleep = sleep
+
+        # fb_campaign_id -> склеенное решение
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        self.outcomes: Dict[str, str] = {}  # итог последнего flush по кампаниям
+        self.blocked_until = 0.0
+
+    def enqueue(
+        self,
+        campaign_id: str,
+        user_id: Optional[int] = None,
+        status: Optional[str] = None,
+        daily_budget: Optional[float] = None,
+        lifetime_budget: Optional[float] = None,
+        current: Optional[Dict[str, Any]] = None,
+        source: str = 'optimizer',
+        access_token: Optional[str] = None,
+        min_delta: bool = True
+    ):
+        """
+        Добавляет решение по кампании; повторные решения склеиваются.
+
+        Args:
+            campaign_id: fb_campaign_id
+            user_id: Владелец (по нему берется токен из хранилища)
+            status: Новый статус
+            daily_budget: Новый дневной бюджет в валюте аккаунта
+            lifetime_budget: Новый бюджет на весь срок в валюте аккаунта
+            current: Известные текущие значения полей (иначе берутся из БД)
+            source: Источник решения для аудита
+            access_token: Токен, если решение пришло не от пользователя из БД
+            min_delta: Отбрасывать изменения бюджета меньше минимального шага
+                (для явных действий пользователя — False)
+        """
+        entry = self.pending.setdefault(campaign_id, {
+            'user_id': user_id, 'fields': {}, 'current': {}, 'source': source,
+            'access_token': access_token, 'min_delta': min_delta
+        })
+        entry['min_delta'] = entry['min_delta'] and min_delta
+        entry['user_id'] = user_id if user_id is not None else entry['user_id']
+        entry['access_token'] = access_token or entry['access_token']
+        entry['source'] = source
+        if status is not None:
+            entry['fields']['status'] = status
+        if daily_budget is not None:
+            entry['fields']['daily_budget'] = round(float(daily_budget), 2)
+        if lifetime_budget is not None:
+            entry['fields']['lifetime_budget'] = round(float(lifetime_budget), 2)
+        for field, value in (current or {}).items():
+            # Первое известное значение — состояние до всех склеенных решений
+            entry['current'].setdefault(field, value)
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def _filter(self, field: str, new, current, min_delta: bool) -> Optional[str]:
+        """Причина отбросить изменение или None"""
+        if current is None:
+            return None
+        if field in BUDGET_FIELDS:
+            delta = abs(float(new) - float(current))
+            if delta == 0:
+                return 'noop'
+            if min_delta and (delta < self.min_budget_delta_abs or delta < self.min_budget_delta * float(current)):
+                return 'below_min_delta'
+            return None
+        return 'noop' if new == current else None
+
+    async def flush(self) -> Dict[str, int]:
+        """
+        Применяет накопленные решения.
+
+        Returns:
+            Dict[str, int]: Количество изменений полей по исходам
+        """
+        pending, self.pending = self.pending, {}
+        self.outcomes = {}
+        counts: Dict[str, int] = {}
+        if not pending:
+            return counts
+
+        try:
+            audit = await self._apply(pending)
+        except Exception:
+            # Аудит не записан: возвращаем решения в очередь до следующего flush
+            self._requeue(pending)
+            raise
+
+        for record in audit:
+            counts[record.outcome] = counts.get(record.outcome, 0) + 1
+            self.outcomes[record.campaign_id] = record.outcome
+        logger.info(f"Применение решений: {counts}")
+        return counts
+
+    def _requeue(self, pending: Dict[str, Dict[str, Any]]):
+        """Возвращает решения в очередь; решения, поступившие позже, побеждают"""
+        for campaign_id, entry in pending.items():
+            newer = self.pending.get(campaign_id)
+            if newer is not None:
+                entry['fields'].update(newer['fields'])
+                entry['current'] = {**newer['current'], **entry['current']}
+                entry['min_delta'] = entry['min_delta'] and newer['min_delta']
+                entry['source'] = newer['source']
+                entry['access_token'] = newer['access_token'] or entry['access_token']
+            self.pending[campaign_id] = entry
+
+    async def _apply(self, pending: Dict[str, Dict[str, Any]]) -> List[DecisionAudit]:
+        async with self.session_factory() as session:
+            campaigns = {campaign.fb_campaign_id: campaign for campaign in (await session.execute(
+                select(Campaign).where(Campaign.fb_campaign_id.in_(list(pending)))
+            )).scalars()}
+
+            audit: List[DecisionAudit] = []
+            requests_by_token: Dict[Optional[str], List[Tuple[str, Dict, Dict]]] = {}
+            for campaign_id, entry in pending.items():
+                local = campaigns.get(campaign_id)
+                changes = {}
+                for field, new in entry['fields'].items():
+                    known = field in entry['current']
+                    current = entry['current'][field] if known else getattr(local, field, None) if local else None
+                    # Явные действия пользователя не сверяются с локальной копией: она может отставать от Graph
+                    reason = self._filter(field, new, current if known or entry['min_delta'] else None,
+                                          entry['min_delta'])
+                    if reason:
+                        audit.append(self._audit(campaign_id, entry, field, current, new, reason))
+                    else:
+                        changes[field] = (current, new)
+                if not changes:
+                    continue
+                if self.dry_run:
+                    for field, (current, new) in changes.items():
+                        audit.append(self._audit(campaign_id, entry, field, current, new, 'dry_run'))
+                    continue
+
+                access_token = entry['access_token']
+                if access_token is None and not self.mock and entry['user_id'] is not None:
+                    access_token = await token_vault.get_token(session, entry['user_id'])
+                if access_token is None and not self.mock:
+                    for field, (current, new) in changes.items():
+                        audit.append(self._audit(campaign_id, entry, field, current, new, 'failed',
+                                                 'Нет токена Facebook'))
+                    continue
+                requests_by_token.setdefault(access_token, []).append((campaign_id, entry, changes))
+
+            for access_token, requests in requests_by_token.items():
+                for start in range(0, len(requests), self.batch_size):
+                    batch = requests[start:start + self.batch_size]
+                    if self.mock:
+                        results = [(True, None)] * len(batch)
+                    else:
+                        try:
+                            results = await self._send_batch(access_token, batch)
+                        except Exception as e:
+                            # Сбой одной пачки не должен терять решения остальных и их аудит
+                            logger.error(f"Ошибка Graph batch: {e}", exc_info=True)
+                            results = [(False, str(e) or 'Graph batch error')] * len(batch)
+                    for (campaign_id, entry, changes), (ok, error) in zip(batch, results):
+                        if ok:
+                            outcome = 'applied'
+                            local = campaigns.get(campaign_id)
+                            if local is not None:
+                                for field, (_, new) in changes.items():
+                                    setattr(local, field, new)
+                        elif error == 'rate_limited':
+                            outcome = 'rate_limited'
+                            # Вернем решение в очередь до следующего flush
+                            for field, (current, new) in changes.items():
+                                self.enqueue(campaign_id, entry['user_id'], current={field: current},
+                                             source=entry['source'], access_token=entry['access_token'],
+                                             min_delta=entry['min_delta'], **{field: new})
+                        else:
+                            outcome = 'failed'
+                        for field, (current, new) in changes.items():
+                            audit.append(self._audit(campaign_id, entry, field, current, new, outcome,
+                                                     None if ok else error))
+
+            session.add_all(audit)
+            await session.commit()
+        return audit
+
+    def _audit(self, campaign_id, entry, field, old, new, outcome, error=None) -> DecisionAudit:
+        return DecisionAudit(
+            user_id=entry['user_id'],
+            campaign_id=campaign_id,
+            field=field,
+            old_value=None if old is None else str(old),
+            new_value=str(new),
+            source=entry['source'],
+            outcome=outcome,
+            error=error
+        )
+
+    async def _send_batch(self, access_token: str, batch) -> List[Tuple[bool, Optional[str]]]:
+        """Один Graph batch-запрос; возвращает (успех, ошибка) по каждому элементу"""
+        if self.blocked_until > time.monotonic():
+            return [(False, 'rate_limited')] * len(batch)
+
+        operations = []
+        for campaign_id, _, changes in batch:
+            params = {}
+            for field, (_, new) in changes.items():
+                # Graph ожидает бюджет в минимальных единицах валюты
+                params[field] = int(round(new * 100)) if field in BUDGET_FIELDS else new
+            operations.append({'method': 'POST', 'relative_url': campaign_id, 'body': urlencode(params)})
+
+        try:
+            async with httpx.AsyncClient(transport=self.transport, timeout=30) as client:
+                response = await client.post(graph_url(), data={
+                    'access_token': access_token,
+                    'batch': json.dumps(operations),
+                    'include_headers': 'false',
+                })
+        except httpx.HTTPError as e:
+            return [(False, str(e))] * len(batch)
+
+        usage, regain_minutes = parse_usage(response.headers)
+        if regain_minutes > 0:
+            self.blocked_until = time.monotonic() + regain_minutes * 60
+        elif usage > self.usage_slowdown_threshold:
+            # Чем ближе к лимиту, тем длиннее пауза перед следующей пачкой
+            share = (usage - self.usage_slowdown_threshold) / (100 - self.usage_slowdown_threshold)
+            await self.sleep(min(share, 1.0) * self.max_backoff_seconds)
+
+        if response.status_code != 200:
+            try:
+                error = response.json().get('error', {})
+            except ValueError:
+                error = {}
+            reason = 'rate_limited' if error.get('code') in RATE_LIMIT_ERROR_CODES else f"HTTP {response.status_code}"
+            return [(False, reason)] * len(batch)
+
+        results = []
+        for item in response.json():
+            if item and item.get('code') == 200:
+                results.append((True, None))
+                continue
+            error = {}
+            if item and item.get('body'):
+                try:
+                    error = json.loads(item['body']).get('error', {})
+                except ValueError:
+                    pass
+            if error.get('code') in RATE_LIMIT_ERROR_CODES:
+                results.append((False, 'rate_limited'))
+            else:
+                results.append((False, error.get('message') or 'Graph batch error'))
+        return results
+
+# Общая очередь на процесс
+decision_queue = DecisionQueue()
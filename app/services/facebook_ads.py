@@ -7,14 +7,23 @@ import os
 from typing import Dict, List, Optional
 from datetime import datetime, timedelta
 
+from ..config import settings
+from .decision_queue import DecisionQueue
+from .fake_graph import DEFAULT_ACCOUNTS
+from .graph_api import configure_facebook_sdk
+
 class FacebookAdsService:
     def __init__(self):
         self.app_id = os.getenv("FACEBOOK_APP_ID")
         self.app_secret = os.getenv("FACEBOOK_APP_SECRET")
         self._access_token = os.getenv("FACEBOOK_ACCESS_TOKEN")
         self._ad_account_id = os.getenv("FACEBOOK_AD_ACCOUNT_ID")
+        if settings.MOCK_MODE:
+            # Фейковый Graph принимает любой токен и знает тестовый аккаунт
+            self._access_token = self._access_token or "mock_access_token"
+            self._ad_account_id = self._ad_account_id or DEFAULT_ACCOUNTS[0]["id"]
         
-        if not all([self.app_id, self.app_secret]):
+        if not settings.MOCK_MODE and not all([self.app_id, self.app_secret]):
             raise ValueError("Не установлены FACEBOOK_APP_ID или FACEBOOK_APP_SECRET")
         
         self._init_api()
@@ -23,6 +32,7 @@ class FacebookAdsService:
         """Инициализация Facebook Ads API"""
         if not self.access_token or not self.ad_account_id:
             return
+        configure_facebook_sdk()
         FacebookAdsApi.init(self.app_id, self.app_secret, self.access_token)
         self.account = AdAccount(self.ad_account_id)
     
@@ -531,15 +541,18 @@ class FacebookAdsService:
         except Exception as e:
             raise Exception(f"Ошибка при получении предложений по таргетингу: {str(e)}")
 
-    async def optimize_campaigns(self, target_roas: float = 1.0) -> List[Dict]:
+    async def optimize_campaigns(self, target_roas: float = 1.0, dry_run: bool = False) -> List[Dict]:
         """
         Оптимизирует рекламные кампании на основе их эффективности.
         Отключает кампании с ROAS ниже целевого значения.
+        Решения применяются одной пачкой через очередь решений (с аудитом);
+        при dry_run только записываются в аудит.
         """
         try:
             campaigns = self.account.get_campaigns(
                 fields=['id', 'name', 'status']
             )
+            decisions = DecisionQueue(dry_run=dry_run, mock=False)
 
             results = []
             for campaign in campaigns:
@@ -557,14 +570,15 @@ class FacebookAdsService:
 
                 current_roas = revenue / spend if spend > 0 else 0
 
-                # Если ROAS ниже целевого, отключаем кампанию
+                # Если ROAS ниже целевого, ставим отключение кампании в очередь
                 if current_roas < target_roas and spend > 0:
-                    campaign.api_update(
-                        params={'status': 'PAUSED'}
+                    decisions.enqueue(
+                        campaign['id'],
+                        status='PAUSED',
+                        current={'status': campaign['status']},
+                        source='optimize_campaigns',
+                        access_token=self.access_token
                     )
-                    action = 'paused'
-                else:
-                    action = 'running'
 
                 results.append({
                     'campaign_id': campaign['id'],
@@ -572,9 +586,17 @@ class FacebookAdsService:
                     'spend': spend,
                     'revenue': revenue,
                     'roas': current_roas,
-                    'action': action
+                    'action': 'running'
                 })
 
+            await decisions.flush()
+            for result in results:
+                outcome = decisions.outcomes.get(result['campaign_id'])
+                if outcome in ('applied', 'noop'):
+                    result['action'] = 'paused'
+                elif outcome is not None:
+                    result['action'] = outcome
+
             return results
         except Exception as e:
             raise Exception(f"Ошибка при оптимизации кампаний: {str(e)}")
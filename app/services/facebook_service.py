@@ -5,18 +5,26 @@ import os
 from dotenv import load_dotenv
 import logging
 
+from ..config import settings
+from .decision_queue import DecisionQueue
+from .graph_api import configure_facebook_sdk, graph_url
+
 logger = logging.getLogger(__name__)
 
 class FacebookAdsService:
     def __init__(self, access_token=None):
-        self.access_token = access_token or os.getenv("FACEBOOK_ACCESS_TOKEN")
+        self.access_token = access_token or os.getenv("FACEBOOK_ACCESS_TOKEN") or (
+            "mock_access_token" if settings.MOCK_MODE else None
+        )
         self.app_id = os.getenv("FACEBOOK_APP_ID")
         self.app_secret = os.getenv("FACEBOOK_APP_SECRET")
         self.api = None
+        self.decisions = DecisionQueue(mock=False)
         
     def initialize(self):
         """Инициализация API"""
         if not self.api:
+            configure_facebook_sdk()
             self.api = FacebookAdsApi.init(
                 self.app_id,
                 self.app_secret,
@@ -29,7 +37,7 @@ class FacebookAdsService:
             self.initialize()
             import requests
             response = requests.get(
-                "https://graph.facebook.com/v17.0/me/adaccounts",
+                graph_url("me/adaccounts"),
                 params={"access_token": self.access_token}
             )
             return response.json().get("data", [])
@@ -50,29 +58,42 @@ class FacebookAdsService:
             logger.error(f"Error getting campaigns: {e}")
             return []
 
+    def queue_campaign_update(self, campaign_id, status=None, daily_budget=None, lifetime_budget=None,
+                              source='user'):
+        """Ставит изменение кампании в очередь (бюджеты — в валюте аккаунта)"""
+        self.decisions.enqueue(
+            campaign_id,
+            status=status,
+            daily_budget=daily_budget,
+            lifetime_budget=lifetime_budget,
+            source=source,
+            access_token=self.access_token,
+            min_delta=source != 'user'
+        )
+
+    async def apply_queued_updates(self, dry_run=False):
+        """Применяет накопленные изменения пачками Graph batch"""
+        self.decisions.dry_run = dry_run
+        return await self.decisions.flush()
+
+    async def _apply_single(self, campaign_id, **fields):
+        self.queue_campaign_update(campaign_id, **fields)
+        await self.apply_queued_updates()
+        return self.decisions.outcomes.get(campaign_id) in ('applied', 'noop')
+
     async def update_campaign_status(self, campaign_id, new_status):
         """Обновление статуса кампании"""
         try:
-            self.initialize()
-            campaign = Campaign(campaign_id)
-            campaign.api_update(params={"status": new_status})
-            return True
+            return await self._apply_single(campaign_id, status=new_status)
         except Exception as e:
             logger.error(f"Error updating campaign status: {e}")
             return False
 
     async def update_campaign_budget(self, campaign_id, budget_type, amount):
-        """Обновление бюджета кампании"""
+        """Обновление бюджета кампании (amount — в минимальных единицах валюты, как в Graph API)"""
         try:
-            self.initialize()
-            campaign = Campaign(campaign_id)
-            params = {}
-            if budget_type == "daily":
-                params["daily_budget"] = amount
-            else:
-                params["lifetime_budget"] = amount
-            campaign.api_update(params=params)
-            return True
+            field = "daily_budget" if budget_type == "daily" else "lifetime_budget"
+            return await self._apply_single(campaign_id, **{field: amount / 100})
         except Exception as e:
             logger.error(f"Error updating campaign budget: {e}")
             return False
@@ -0,0 +1,416 @@
+"""
+Локальный фейковый Graph API для MOCK_MODE и нагрузочных тестов.
+
+Сервер хранит объекты (аккаунты, кампании, группы, креативы, объявления,
+изображения) в памяти, выдает последовательные числовые идентификаторы
+и детерминированную статистику (insights) по сиду, объекту и дате.
+Поведение приближено к настоящему Graph: задержка ответа с разбросом,
+лимит запросов на токен с заголовком X-App-Usage и ошибкой #17,
+случайные временные ошибки (#2) с заданной вероятностью, batch-запросы.
+Версия API в пути не проверяется, поэтому сервер обслуживает и httpx-клиенты
+приложения (v17.0), и facebook_business SDK (его версия по умолчанию).
+
+Запуск отдельным процессом: python scripts/fake_graph.py --port 8765 --seed 1
+"""
+import asyncio
+import json
+import logging
+import math
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+HOURLY_BREAKDOWN = 'hourly_stats_aggregated_by_advertiser_time_zone'
+
+# Аккаунт, который существует сразу после старта
+DEFAULT_ACCOUNTS = [
+    {"id": "act_123456789", "account_id": "123456789", "name": "Test Ad Account",
+     "currency": "USD", "timezone_name": "Europe/Moscow", "account_status": 1},
+]
+ACCOUNT_EDGES = {
+    'campaigns': 'campaign',
+    'adsets': 'adset',
+    'adcreatives': 'adcreative',
+    'ads': 'ad',
+    'adimages': 'adimage',
+    'advideos': 'advideo',
+}
+# Ребра объекта -> (тип дочерних объектов, поле ссылки на родителя)
+CHILD_EDGES = {
+    ('campaign', 'adsets'): ('adset', 'campaign_id'),
+    ('campaign', 'ads'): ('ad', 'campaign_id'),
+    ('adset', 'ads'): ('ad', 'adset_id'),
+}
+REQUIRED_FIELDS = {
+    'campaign': ('name', 'objective'),
+    'adset': ('name', 'campaign_id', 'targeting'),
+    'adcreative': ('object_story_spec',),
+    'ad': ('name', 'adset_id', 'creative'),
+}
+INSIGHT_TYPES = ('campaign', 'adset', 'ad')
+
+class GraphError(Exception):
+    def __init__(self, message: str, code: int = 100, status: int = 400, transient: bool = False):
+        super().__init__(message)
+        self.code = code
+        self.status = status
+        self.transient = transient
+
+    def payload(self) -> Dict[str, Any]:
+        return {"error": {"message": str(self), "type": "OAuthException", "code": self.code,
+                          "is_transient": self.transient, "fbtrace_id": "fake"}}
+
+def _decode(value: Any) -> Any:
+    """Параметры Graph приходят строками; объекты и списки — в JSON"""
+    if isinstance(value, str) and value[:1] in '{[':
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+class FakeGraphStore:
+    def __init__(self, seed: int = 0):
+        self.seed = seed
+        self.objects: Dict[str, Dict[str, Any]] = {}
+        self._next_id = 23850000000000000 + seed * 1_000_000
+        for account in DEFAULT_ACCOUNTS:
+            self.objects[account["id"]] = {"type": "adaccount", **account}
+
+    def new_id(self) -> str:
+        self._next_id += 1
+        return str(self._next_id)
+
+    def get(self, object_id: str) -> Dict[str, Any]:
+        obj = self.objects.get(object_id)
+        if obj is None or obj.get('status') == 'DELETED':
+            raise GraphError(f"Unsupported get request. Object with ID '{object_id}' does not exist", code=100)
+        return obj
+
+    def create(self, account_id: str, edge: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        self.get(account_id)
+        object_type = ACCOUNT_EDGES[edge]
+        for field in REQUIRED_FIELDS.get(object_type, ()):
+            if params.get(field) in (None, ''):
+                raise GraphError(f"(#100) The parameter {field} is required", code=100)
+
+        fields = {key: _decode(value) for key, value in params.items()}
+        if object_type == 'adset':
+            self.get(fields['campaign_id'])
+        if object_type == 'ad':
+            adset = self.get(fields['adset_id'])
+            fields['campaign_id'] = adset['campaign_id']
+            creative = fields['creative']
+            if isinstance(creative, dict) and 'creative_id' in creative:
+                self.get(creative['creative_id'])
+
+        if object_type == 'adimage':
+            name = fields.get('name') or 'image'
+            image_hash = f"{random.Random(f'{self.seed}:{name}:{self._next_id}').getrandbits(128):032x}"
+            obj = {"type": object_type, "id": f"{account_id.removeprefix('act_')}:{image_hash}",
+                   "hash": image_hash, "name": name, "account_id": account_id,
+                   "url": f"https://fake.fbcdn.net/{image_hash}.jpg", "created_time": datetime.now().isoformat()}
+            self.objects[obj["id"]] = obj
+            return {"images": {name: {"hash": image_hash, "url": obj["url"]}}}
+
+        object_id = self.new_id()
+        obj = {"type": object_type, "id": object_id, "account_id": account_id,
+               "created_time": datetime.now().isoformat(), **fields}
+        obj.setdefault('status', 'PAUSED')
+        self.objects[object_id] = obj
+        return {"id": object_id}
+
+    def update(self, object_id: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        obj = self.get(object_id)
+        for key, value in params.items():
+            obj[key] = _decode(value)
+        return {"success": True}
+
+    def delete(self, object_id: str) -> Dict[str, Any]:
+        self.get(object_id)['status'] = 'DELETED'
+        return {"success": True}
+
+    def children(self, parent_id: str, edge: str) -> List[Dict[str, Any]]:
+        parent = self.get(parent_id)
+        if parent['type'] == 'adaccount' and edge in ACCOUNT_EDGES:
+            object_type, link = ACCOUNT_EDGES[edge], 'account_id'
+        elif (parent['type'], edge) in CHILD_EDGES:
+            object_type, link = CHILD_EDGES[(parent['type'], edge)]
+        else:
+            raise GraphError(f"(#100) Tried accessing nonexisting field ({edge})", code=100)
+        return [obj for obj in self.objects.values()
+                if obj['type'] == object_type and obj.get(link) == parent_id and obj.get('status') != 'DELETED']
+
+    def daily_insights(self, object_id: str, day: date) -> Dict[str, Any]:
+        """Детерминированная статистика объекта за день"""
+        obj = self.get(object_id)
+        rng = random.Random(f"{self.seed}:{object_id}:{day.isoformat()}")
+        budget = float(obj.get('daily_budget') or 5000) / 100
+        spend = budget * rng.uniform(0.6, 1.0) if obj.get('status') == 'ACTIVE' else budget * rng.uniform(0.0, 0.05)
+        impressions = int(spend / rng.uniform(5.0, 15.0) * 1000)
+        clicks = int(impressions * rng.uniform(0.005, 0.03))
+        conversions = int(clicks * rng.uniform(0.01, 0.08))
+        revenue = conversions * rng.uniform(20.0, 60.0)
+        return {
+            "impressions": impressions,
+            "clicks": clicks,
+            "spend": round(spend, 2),
+            "reach": int(impressions * rng.uniform(0.6, 0.9)),
+            "conversions": conversions,
+            "revenue": round(revenue, 2),
+        }
+
+    def hourly_insights(self, object_id: str, day: date) -> List[Dict[str, Any]]:
+        """
+        Дневная статистика, разложенная по 24 часам с суточным профилем;
+        суммы по часам совпадают с daily_insights
+        """
+        totals = self.daily_insights(object_id, day)
+        rng = random.Random(f"{self.seed}:{object_id}:{day.isoformat()}:hours")
+        weights = [(0.2 + max(0.0, math.sin(math.pi * (hour - 6) / 18))) * rng.uniform(0.8, 1.2) for hour in range(24)]
+        cumulative = [sum(weights[:hour]) / sum(weights) for hour in range(25)]
+
+        def part(value, hour, digits=None):
+            # Разность округленных накопленных долей: части в сумме дают ровно value
+            if digits is None:
+                return int(value * cumulative[hour + 1]) - int(value * cumulative[hour])
+            return round(round(value * cumulative[hour + 1], digits) - round(value * cumulative[hour], digits), digits)
+
+        return [{
+            "impressions": part(totals["impressions"], hour),
+            "clicks": part(totals["clicks"], hour),
+            "spend": part(totals["spend"], hour, 2),
+            "reach": part(totals["reach"], hour),
+            "conversions": part(totals["conversions"], hour),
+            "revenue": part(totals["revenue"], hour, 2),
+        } for hour in range(24)]
+
+    def insights(self, object_id: str, params: Dict[str, Any], today: Optional[date] = None) -> List[Dict[str, Any]]:
+        obj = self.get(object_id)
+        if obj['type'] not in INSIGHT_TYPES:
+            raise GraphError("(#100) Insights are not available for this object", code=100)
+        today = today or date.today()
+        since, until = self._date_range(params, today)
+        created = datetime.fromisoformat(obj['created_time']).date() - timedelta(days=30)
+        days = [since + timedelta(days=i) for i in range((until - since).days + 1)
+                if since + timedelta(days=i) >= created]
+        if not days:
+            return []
+        if HOURLY_BREAKDOWN in str(params.get('breakdowns', '')):
+            # Текущий день — только завершившиеся и текущий час
+            rows = []
+            for day in days:
+                last_hour = datetime.now().hour if day == date.today() else 23
+                for hour, values in enumerate(self.hourly_insights(object_id, day)[:last_hour + 1]):
+                    rows.append({**self._insight_row(object_id, [(day, values)]),
+                                 HOURLY_BREAKDOWN: f"{hour:02d}:00:00 - {hour:02d}:59:59"})
+            return rows
+        per_day = [(day, self.daily_insights(object_id, day)) for day in days]
+        if str(params.get('time_increment', '')) == '1':
+            groups = [[item] for item in per_day]
+        else:
+            groups = [per_day]
+        return [self._insight_row(object_id, group) for group in groups]
+
+    @staticmethod
+    def _date_range(params: Dict[str, Any], today: date) -> Tuple[date, date]:
+        time_range = _decode(params.get('time_range'))
+        if isinstance(time_range, dict):
+            return date.fromisoformat(time_range['since']), date.fromisoformat(time_range['until'])
+        preset = params.get('date_preset', 'last_30d')
+        if preset == 'today':
+            return today, today
+        if preset == 'yesterday':
+            return today - timedelta(days=1), today - timedelta(days=1)
+        if preset.startswith('last_') and preset.endswith('d'):
+            days = int(preset[len('last_'):-1])
+            return today - timedelta(days=days), today - timedelta(days=1)
+        return today - timedelta(days=365), today  # lifetime и прочие
+
+    @staticmethod
+    def _insight_row(object_id: str, group: List[Tuple[date, Dict[str, Any]]]) -> Dict[str, Any]:
+        totals = {key: sum(item[key] for _, item in group) for key in group[0][1]}
+        return {
+            "campaign_id": object_id,
+            "date_start": group[0][0].isoformat(),
+            "date_stop": group[-1][0].isoformat(),
+            "impressions": str(totals['impressions']),
+            "clicks": str(totals['clicks']),
+            "spend": f"{totals['spend']:.2f}",
+            "reach": str(totals['reach']),
+            "ctr": f"{totals['clicks'] / totals['impressions'] * 100:.4f}" if totals['impressions'] else "0",
+            "cpc": f"{totals['spend'] / totals['clicks']:.4f}" if totals['clicks'] else "0",
+            "actions": [{"action_type": "link_click", "value": str(totals['clicks'])},
+                        {"action_type": "purchase", "value": str(totals['conversions'])}],
+            "action_values": [{"action_type": "purchase", "value": f"{totals['revenue']:.2f}"}],
+        }
+
+    def search(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        term = str(params.get('q', ''))
+        rng = random.Random(f"{self.seed}:search:{params.get('type')}:{term}")
+        limit = int(params.get('limit', 25))
+        return [{"id": str(6000000000000 + rng.getrandbits(32)), "name": term if i == 0 else f"{term} {i}",
+                 "audience_size_lower_bound": rng.randint(10_000, 5_000_000), "path": ["Interests", term]}
+                for i in range(min(limit, 3))]
+
+def _select_fields(obj: Dict[str, Any], fields: Optional[str]) -> Dict[str, Any]:
+    if not fields:
+        return {key: value for key, value in obj.items() if key not in ('type',)}
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    return {'id': obj['id'], **{name: obj[name] for name in names if name in obj}}
+
+class FakeGraph:
+    def __init__(
+        self,
+        seed: int = 0,
+        latency_ms: float = 80.0,
+        latency_jitter_ms: float = 40.0,
+        error_rate: float = 0.0,
+        rate_limit_per_minute: int = 600,
+        clock=time.monotonic
+    ):
+        self.store = FakeGraphStore(seed)
+        self.rng = random.Random(seed)
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_per_minute = rate_limit_per_minute
+        self.clock = clock
+        self._calls: Dict[str, List[float]] = {}  # токен -> время вызовов за последнюю минуту
+        self._lock = threading.Lock()  # сервер может работать в отдельном потоке
+        self.requests = 0
+
+    def _usage(self, token: str) -> float:
+        with self._lock:
+            now = self.clock()
+            calls = [t for t in self._calls.get(token, []) if now - t < 60]
+            calls.append(now)
+            self._calls[token] = calls
+            return len(calls) / max(self.rate_limit_per_minute, 1) * 100
+
+    def _delay(self) -> float:
+        with self._lock:
+            return max(0.0, self.rng.gauss(self.latency_ms, self.latency_jitter_ms)) / 1000
+
+    def _fails(self) -> bool:
+        with self._lock:
+            return self.error_rate > 0 and self.rng.random() < self.error_rate
+
+    def dispatch(self, method: str, path: str, params: Dict[str, Any]) -> Any:
+        """Обрабатывает один запрос Graph (без задержки и лимитов)"""
+        parts = [part for part in path.strip('/').split('/') if part]
+        if not parts:
+            raise GraphError("(#100) Missing object id", code=100)
+        if parts[0] == 'search' and method == 'GET':
+            return {"data": self.store.search(params)}
+        if parts[0] == 'me':
+            if len(parts) == 2 and parts[1] == 'adaccounts':
+                accounts = [obj for obj in self.store.objects.values() if obj['type'] == 'adaccount']
+                return {"data": [_select_fields(obj, params.get('fields')) for obj in accounts]}
+            return {"id": "100000000000001", "name": "Fake User"}
+
+        object_id = parts[0]
+        if len(parts) == 1:
+            if method == 'GET':
+                return _select_fields(self.store.get(object_id), params.get('fields'))
+            if method == 'POST':
+                return self.store.update(object_id, params)
+            if method == 'DELETE':
+                return self.store.delete(object_id)
+        edge = parts[1]
+        if edge == 'insights' and method == 'GET':
+            return {"data": self.store.insights(object_id, params)}
+        if method == 'POST' and edge in ACCOUNT_EDGES:
+            return self.store.create(object_id, edge, params)
+        if method == 'GET':
+            items = self.store.children(object_id, edge)
+            limit = int(params.get('limit', 25))
+            return {"data": [_select_fields(obj, params.get('fields')) for obj in items[:limit]]}
+        raise GraphError(f"Unsupported {method} request", code=100)
+
+    async def handle(self, method: str, path: str, params: Dict[str, Any]) -> Tuple[int, Any, Dict[str, str]]:
+        """Запрос с задержкой, лимитом и внедрением ошибок: (HTTP-статус, тело, заголовки)"""
+        self.requests += 1
+        token = str(params.pop('access_token', ''))
+        params.pop('appsecret_proof', None)
+        await asyncio.sleep(self._delay())
+
+        operations = None
+        if path.strip('/') == '' and method == 'POST' and 'batch' in params:
+            operations = _decode(params['batch'])
+        usage = 0.0
+        for _ in range(len(operations) if operations else 1):
+            usage = self._usage(token)
+        headers = {"x-app-usage": json.dumps({"call_count": min(int(usage), 100),
+                                              "total_cputime": min(int(usage / 2), 100),
+                                              "total_time": min(int(usage / 2), 100)})}
+        if not token:
+            error = GraphError("An active access token must be used to query information", code=2500)
+            return error.status, error.payload(), headers
+        if usage > 100:
+            error = GraphError("(#17) User request limit reached", code=17, transient=True)
+            return error.status, error.payload(), headers
+        if self._fails():
+            error = GraphError("An unexpected error has occurred. Please retry your request later.",
+                               code=2, status=500, transient=True)
+            return error.status, error.payload(), headers
+
+        if operations is not None:
+            return 200, [self._batch_item(operation) for operation in operations], headers
+        try:
+            return 200, self.dispatch(method, path, params), headers
+        except GraphError as e:
+            return e.status, e.payload(), headers
+
+    def _batch_item(self, operation: Dict[str, Any]) -> Dict[str, Any]:
+        relative_url, _, query = operation.get('relative_url', '').partition('?')
+        params = dict(parse_qsl(query, keep_blank_values=True))
+        params.update(parse_qsl(operation.get('body', ''), keep_blank_values=True))
+        try:
+            body = self.dispatch(operation.get('method', 'GET').upper(), relative_url, params)
+            return {"code": 200, "headers": [], "body": json.dumps(body)}
+        except GraphError as e:
+            return {"code": e.status, "headers": [], "body": json.dumps(e.payload())}
+
+def create_fake_graph_app(graph: Optional[FakeGraph] = None, **options) -> FastAPI:
+    """ASGI-приложение фейкового Graph; параметры — как у FakeGraph"""
+    graph = graph or FakeGraph(**options)
+    app = FastAPI(title="Fake Graph API", docs_url=None, redoc_url=None)
+    app.state.graph = graph
+
+    @app.api_route("/{version}/{path:path}", methods=["GET", "POST", "DELETE"])
+    async def graph_endpoint(version: str, path: str, request: Request):
+        params: Dict[str, Any] = dict(request.query_params)
+        if request.method in ("POST", "DELETE"):
+            form = await request.form()
+            for key, value in form.multi_items():
+                # Загружаемые файлы (adimages) храним только по имени
+                params[key] = getattr(value, 'filename', None) or value
+            if 'filename' in form and 'name' not in params:
+                params['name'] = params['filename']
+        status, body, headers = await graph.handle(request.method, path, params)
+        return JSONResponse(body, status_code=status, headers=headers)
+
+    return app
+
+def start_fake_graph_server(host: str = "127.0.0.1", port: int = 8765, **options):
+    """
+    Запускает фейковый Graph в отдельном потоке со своим циклом событий:
+    facebook_business SDK вызывается синхронно и не должен блокировать сервер.
+    """
+    import uvicorn
+
+    config = uvicorn.Config(create_fake_graph_app(**options), host=host, port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, name="fake-graph", daemon=True)
+    thread.start()
+    logger.info(f"Фейковый Graph API запущен на http://{host}:{port}")
+    return server
@@ -0,0 +1,18 @@
+"""
+Адрес Graph API для всех клиентов приложения.
+В MOCK_MODE запросы httpx-клиентов и facebook_business SDK уходят на фейковый
+Graph (app.services.fake_graph), в остальных режимах — на graph.facebook.com.
+"""
+from facebook_business.session import FacebookSession
+
+from ..config import settings
+
+GRAPH_API_VERSION = "v17.0"
+GRAPH_BATCH_LIMIT = 50  # запросов в одном batch-вызове
+
+def graph_url(path: str = "", version: str = GRAPH_API_VERSION) -> str:
+    return f"{settings.GRAPH_API_URL}/{version}/{path.lstrip('/')}"
+
+def configure_facebook_sdk():
+    """Направляет facebook_business SDK на текущий адрес Graph API"""
+    FacebookSession.GRAPH = settings.GRAPH_API_URL
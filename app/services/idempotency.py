@@ -0,0 +1,190 @@
+"""
+Идемпотентность создающих запросов: повтор с тем же Idempotency-Key
+(или то же тело в коротком окне без ключа) возвращает сохраненный ответ
+без повторного вызова Graph API
+"""
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from ..config import settings
+from ..db.database import async_session_factory
+from ..db.models import IdempotencyKey
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+Handler = Callable[[], Awaitable[Tuple[int, Dict[str, Any]]]]
+
+class IdempotencyConflict(Exception):
+    """Ключ занят выполняющимся запросом (409) или использован с другим телом (422)"""
+
+    def __init__(self, message: str, status_code: int = 409):
+        super().__init__(message)
+        self.status_code = status_code
+
+def request_fingerprint(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+class IdempotencyStore:
+    def __init__(
+        self,
+        session_factory: async_sessionmaker = async_session_factory,
+        ttl_seconds: int = settings.IDEMPOTENCY_TTL_SECONDS,
+        lease_seconds: int = settings.IDEMPOTENCY_LEASE_SECONDS,
+        dedup_window_seconds: int = settings.IDEMPOTENCY_DEDUP_WINDOW_SECONDS,
+        cache_ttl_seconds: float = settings.IDEMPOTENCY_CACHE_TTL_SECONDS,
+        cache_max_size: int = 1024
+    ):
+        self.session_factory = session_factory
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self.dedup_window_seconds = dedup_window_seconds
+        # Быстрый путь для повторов с ключом клиента: (хеш тела, код, ответ)
+        self.cache = LRUCache(cache_max_size, min(cache_ttl_seconds, ttl_seconds))
+        # Ключ -> [блокировка, число ожидающих]; двойное нажатие ждет первый запрос, а не получает 409
+        self._locks: Dict[str, List] = {}
+
+    async def execute(
+        self,
+        scope: str,
+        key: Optional[str],
+        payload: Any,
+        handler: Handler,
+        store_if: Callable[[int, Dict[str, Any]], bool] = lambda status_code, body: status_code < 500,
+        now: Optional[datetime] = None
+    ) -> Tuple[int, Dict[str, Any], bool]:
+        """
+        Выполняет handler не более одного раза на ключ.
+
+        Returns:
+            Tuple: (код ответа, тело, True если ответ взят из сохраненного)
+        """
+        fingerprint = request_fingerprint(payload)
+        if key:
+            record_key, ttl = f"{scope}:{key}", self.ttl_seconds
+        else:
+            record_key, ttl = f"{scope}:auto:{fingerprint}", self.dedup_window_seconds
+        if ttl <= 0:
+            status_code, body = await handler()
+            return status_code, body, False
+
+        entry = self._locks.setdefault(record_key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                stored = self._cached(record_key, fingerprint)
+                if stored is None:
+                    stored = await self._claim(record_key, fingerprint, now or datetime.now())
+                if stored is not None:
+                    if key:
+                        self.cache.set(record_key, (fingerprint, *stored))
+                    return stored[0], stored[1], True
+
+                try:
+                    status_code, body = await handler()
+                except Exception:
+                    await self._release(record_key)
+                    raise
+                if not store_if(status_code, body):
+                    # Неуспешный результат не сохраняем: повтор выполнит запрос заново
+                    await self._release(record_key)
+                    return status_code, body, False
+
+                await self._complete(record_key, status_code, body, (now or datetime.now()) + timedelta(seconds=ttl))
+                if key:
+                    self.cache.set(record_key, (fingerprint, status_code, body))
+                return status_code, body, False
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(record_key, None)
+
+    def _cached(self, record_key: str, fingerprint: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+        cached = self.cache.get(record_key)
+        if cached is None:
+            return None
+        request_hash, status_code, body = cached
+        if request_hash != fingerprint:
+            raise IdempotencyConflict("Ключ идемпотентности уже использован с другими параметрами", 422)
+        return status_code, body
+
+    async def _claim(self, record_key: str, fingerprint: str, now: datetime) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """
+        Занимает ключ строкой in_progress с коротким сроком аренды.
+        Возвращает сохраненный ответ, если запрос уже выполнен.
+        """
+        async with self.session_factory() as session:
+            record = await session.get(IdempotencyKey, record_key)
+            if record is not None and record.expires_at > now:
+                if record.request_hash != fingerprint:
+                    raise IdempotencyConflict("Ключ идемпотентности уже использован с другими параметрами", 422)
+                if record.status == 'completed':
+                    return record.status_code, record.response
+                raise IdempotencyConflict("Запрос с этим ключом еще выполняется")
+
+            if record is None:
+                record = IdempotencyKey(key=record_key)
+                session.add(record)
+            record.request_hash = fingerprint
+            record.status = 'in_progress'
+            record.status_code = None
+            record.response = None
+            record.expires_at = now + timedelta(seconds=self.lease_seconds)
+            try:
+                await session.commit()
+            except IntegrityError:
+                # Другой воркер занял ключ между чтением и записью
+                raise IdempotencyConflict("Запрос с этим ключом еще выполняется")
+        return None
+
+    async def _complete(self, record_key: str, status_code: int, body: Dict[str, Any], expires_at: datetime):
+        async with self.session_factory() as session:
+            record = await session.get(IdempotencyKey, record_key)
+            if record is None:
+                return
+            record.status = 'completed'
+            record.status_code = status_code
+            record.response = body
+            record.expires_at = expires_at
+            await session.commit()
+
+    async def _release(self, record_key: str):
+        async with self.session_factory() as session:
+            await session.execute(delete(IdempotencyKey).where(
+                IdempotencyKey.key == record_key, IdempotencyKey.status == 'in_progress'
+            ))
+            await session.commit()
+
+    async def purge_expired(self, now: Optional[datetime] = None) -> int:
+        """Удаляет истекшие ключи и брошенные незавершенные запросы"""
+        async with self.session_factory() as session:
+            result = await session.execute(
+                delete(IdempotencyKey).where(IdempotencyKey.expires_at <= (now or datetime.now()))
+            )
+            await session.commit()
+        if result.rowcount:
+            logger.info(f"Удалено истекших ключей идемпотентности: {result.rowcount}")
+        return result.rowcount
+
+    async def run_forever(self, interval_seconds: int = settings.IDEMPOTENCY_PURGE_INTERVAL_SECONDS):
+        """Фоновая очистка истекших ключей"""
+        while True:
+            try:
+                await self.purge_expired()
+            except Exception:
+                logger.error("Ошибка очистки ключей идемпотентности", exc_info=True)
+            await asyncio.sleep(interval_seconds)
+
+# Общий экземпляр на процесс, чтобы кеш ответов переиспользовался
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,116 @@
+"""
+Запуск кампании как граф асинхронных шагов с контрольными точками в БД.
+
+Шаг описывается зависимостями и корутиной, которая получает результаты
+уже выполненных шагов. Независимые шаги выполняются одновременно, поэтому
+время запуска определяется самой длинной цепочкой, а не суммой вызовов.
+Результат каждого успешного шага сохраняется в launch_steps: повторный
+запуск с тем же launch_id берет готовые результаты из БД и выполняет
+только незавершенные шаги.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from ..db.database import async_session_factory
+from ..db.models import LaunchStep
+
+logger = logging.getLogger(__name__)
+
+StageFunc = Callable[[Dict[str, Dict[str, Any]]], Awaitable[Dict[str, Any]]]
+
+class LaunchStepError(Exception):
+    def __init__(self, step: str, message: str):
+        super().__init__(message)
+        self.step = step
+
+class LaunchPipeline:
+    def __init__(
+        self,
+        stages: Dict[str, Tuple[Sequence[str], StageFunc]],
+        session_factory: async_sessionmaker = async_session_factory
+    ):
+        """
+        Args:
+            stages: Имя шага -> (зависимости, корутина шага)
+        """
+        for name, (dependencies, _) in stages.items():
+            unknown = set(dependencies) - set(stages)
+            if unknown:
+                raise ValueError(f"Шаг {name} зависит от неизвестных шагов: {sorted(unknown)}")
+        self.stages = stages
+        self.session_factory = session_factory
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        visiting, visited = set(), set()
+
+        def visit(name: str):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"Цикл в графе шагов запуска: {name}")
+            visiting.add(name)
+            for dependency in self.stages[name][0]:
+                visit(dependency)
+            visiting.discard(name)
+            visited.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    async def checkpoints(self, launch_id: str) -> Dict[str, Dict[str, Any]]:
+        """Результаты завершенных шагов запуска"""
+        async with self.session_factory() as session:
+            rows = (await session.execute(
+                select(LaunchStep).where(LaunchStep.launch_id == launch_id, LaunchStep.status == 'done')
+            )).scalars()
+            return {row.step: row.result or {} for row in rows}
+
+    async def _save(self, launch_id: str, step: str, status: str, result=None, error=None):
+        # Своя сессия на запись: шаги пишут контрольные точки параллельно
+        async with self.session_factory() as session:
+            await session.merge(LaunchStep(launch_id=launch_id, step=step, status=status, result=result, error=error))
+            await session.commit()
+
+    async def run(self, launch_id: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Выполняет незавершенные шаги запуска.
+
+        Returns:
+            Dict: Результаты всех шагов
+
+        Raises:
+            LaunchStepError: Первый упавший шаг; независимые от него ветки успевают завершиться
+        """
+        results = await self.checkpoints(launch_id)
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def run_stage(name: str) -> Dict[str, Any]:
+            dependencies, func = self.stages[name]
+            await asyncio.gather(*(tasks[dependency] for dependency in dependencies))
+            if name in results:
+                return results[name]
+            try:
+                result = await func(results)
+            except Exception as e:
+                await self._save(launch_id, name, 'failed', error=str(e))
+                logger.error(f"Запуск {launch_id}: ошибка шага {name}: {e}")
+                raise LaunchStepError(name, str(e)) from e
+            results[name] = result
+            await self._save(launch_id, name, 'done', result=result)
+            return result
+
+        for name in self.stages:
+            tasks[name] = asyncio.ensure_future(run_stage(name))
+        outcomes = await asyncio.gather(*tasks.values(), return_exceptions=True)
+        for outcome in outcomes:
+            if isinstance(outcome, LaunchStepError):
+                raise outcome
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                raise outcome
+        return results
@@ -0,0 +1,46 @@
+"""
+Подписанный параметр state для OAuth Facebook.
+
+state = <user_id>.<срок действия>.<nonce>.<HMAC-SHA256>, поэтому callback
+привязывает токен только к пользователю, для которого сервер начал авторизацию,
+а подставить чужой user_id без секрета нельзя.
+"""
+import hashlib
+import hmac
+import secrets
+import time
+from typing import Optional
+
+from ..config import settings
+
+class OAuthStateError(ValueError):
+    pass
+
+def _secret() -> bytes:
+    secret = settings.OAUTH_STATE_SECRET or settings.FACEBOOK_APP_SECRET
+    if not secret:
+        raise OAuthStateError("Не задан OAUTH_STATE_SECRET")
+    return secret.encode('utf-8')
+
+def _signature(payload: str) -> str:
+    return hmac.new(_secret(), payload.encode('utf-8'), hashlib.sha256).hexdigest()
+
+def issue_state(user_id: int, now: Optional[float] = None, ttl_seconds: int = settings.OAUTH_STATE_TTL_SECONDS) -> str:
+    """Подписанный state для ссылки авторизации пользователя"""
+    expires = int((now or time.time()) + ttl_seconds)
+    payload = f"{int(user_id)}.{expires}.{secrets.token_urlsafe(12)}"
+    return f"{payload}.{_signature(payload)}"
+
+def verify_state(state: str, now: Optional[float] = None) -> int:
+    """Проверяет подпись и срок действия state; возвращает user_id"""
+    try:
+        payload, signature = state.rsplit('.', 1)
+        user_id, expires, _ = payload.split('.', 2)
+        user_id, expires = int(user_id), int(expires)
+    except ValueError:
+        raise OAuthStateError("Некорректный state")
+    if not hmac.compare_digest(signature, _signature(payload)):
+        raise OAuthStateError("Неверная подпись state")
+    if expires < (now or time.time()):
+        raise OAuthStateError("Срок действия state истек")
+    return user_id
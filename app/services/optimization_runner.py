@@ -0,0 +1,353 @@
+"""
+Плановая оптимизация всех рекламных аккаунтов.
+
+Аккаунты (пользователи с fb_account_id) делятся на шарды, каждый шард
+обрабатывается в отдельном процессе: воркер сам читает метрики из локальной БД,
+прогоняет BudgetEngine с сохраненной историей оценок и возвращает изменения
+бюджетов и статусов. Координатор держит блокировку на аккаунт (повторный проход
+пропускает занятые аккаунты), ограничивает число одновременно работающих
+процессов и укладывает проход в дедлайн: процесс шарда, не успевший к дедлайну,
+завершается, и блокировки его аккаунтов снимаются только после его остановки.
+Изменения копятся в очереди и применяются пачками через DecisionQueue.
+"""
+import asyncio
+import logging
+import multiprocessing
+import time
+from datetime import datetime, timedelta
+from multiprocessing.process import BaseProcess
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set
+
+from sqlalchemy import create_engine, func, or_, select
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import Session
+
+from ..db.database import DATABASE_URL, async_session_factory
+from ..db.models import Budget, Campaign, CampaignMetric, OptimizerState, User
+from .budget_engine import BudgetEngine
+from .dashboard_summary import dashboard_summary_service
+from .decision_queue import DecisionQueue
+from .performance_history import DEFAULT_CAPACITY, PerformanceHistory, history_capacity
+
+logger = logging.getLogger(__name__)
+
+_engines: Dict[str, Engine] = {}
+
+def _sync_engine(database_url: str) -> Engine:
+    """Синхронный движок воркера (один на процесс)"""
+    engine = _engines.get(database_url)
+    if engine is None:
+        url = make_url(database_url)
+        url = url.set(drivername=url.drivername.split('+')[0])
+        connect_args = {'timeout': 30} if url.get_backend_name() == 'sqlite' else {}
+        engine = _engines[database_url] = create_engine(url, connect_args=connect_args)
+    return engine
+
+def _history_key(user_id: int) -> str:
+    return f"budget_engine:{user_id}"
+
+def _optimize_account(session: Session, user_id: int, now: datetime, days_history: int,
+                      target_roas: float, change_threshold: float, capacity: int) -> List[Dict]:
+    campaigns = session.execute(
+        select(Campaign).where(
+            Campaign.user_id == user_id,
+            Campaign.status == 'ACTIVE',
+            Campaign.fb_campaign_id.is_not(None)
+        )
+    ).scalars().all()
+    if not campaigns:
+        return []
+
+    since = now - timedelta(days=days_history)
+    metrics = {row[0]: row[1:] for row in session.execute(
+        select(
+            CampaignMetric.campaign_id,
+            func.sum(CampaignMetric.impressions),
+            func.sum(CampaignMetric.clicks),
+            func.sum(CampaignMetric.conversions),
+            func.sum(CampaignMetric.spend),
+            func.sum(CampaignMetric.revenue),
+        )
+        .where(
+            CampaignMetric.campaign_id.in_([campaign.id for campaign in campaigns]),
+            CampaignMetric.granularity == 'day',
+            CampaignMetric.period_start >= since
+        )
+        .group_by(CampaignMetric.campaign_id)
+    )}
+
+    daily_budget = session.execute(
+        select(func.sum(Budget.daily_budget)).where(
+            Budget.user_id == user_id,
+            Budget.budget_type == 'daily',
+            or_(Budget.start_date.is_(None), Budget.start_date <= now),
+            or_(Budget.end_date.is_(None), Budget.end_date >= now)
+        )
+    ).scalar()
+    if daily_budget is None:
+        daily_budget = sum(campaign.daily_budget or 0.0 for campaign in campaigns)
+    if not daily_budget:
+        return []
+
+    state = session.get(OptimizerState, _history_key(user_id))
+    # Емкость по частоте проходов: тренд сравнивается с оценкой days_history дней назад
+    history = PerformanceHistory.from_bytes(state.payload, capacity) if state else PerformanceHistory(capacity)
+    engine = BudgetEngine(daily_budget * days_history, daily_budget, days_history, history)
+
+    stats = []
+    for campaign in campaigns:
+        impressions, clicks, conversions, spend, revenue = (value or 0 for value in metrics.get(campaign.id, (0,) * 5))
+        stats.append((
+            revenue / spend if spend else 0.0,
+            clicks / impressions if impressions else 0.0,
+            conversions / clicks if clicks else 0.0,
+            spend
+        ))
+    rows = engine.rows_for([campaign.fb_campaign_id for campaign in campaigns])
+    # Текущие бюджеты кампаний — точка отсчета для множителей правил
+    engine.budgets[rows] = [campaign.daily_budget or 0.0 for campaign in campaigns]
+    engine.has_budget[rows] = [bool(campaign.daily_budget) for campaign in campaigns]
+    engine.allocated_count = len(campaigns)
+    budgets = engine.optimize(
+        [campaign.fb_campaign_id for campaign in campaigns],
+        [s[0] for s in stats], [s[1] for s in stats], [s[2] for s in stats],
+        now=now
+    )
+    session.merge(OptimizerState(key=_history_key(user_id), payload=engine.history.to_bytes()))
+
+    changes = []
+    for campaign, (roas, _, _, spend), budget in zip(campaigns, stats, budgets.tolist()):
+        if spend > 0 and roas < target_roas:
+            changes.append({'user_id': user_id, 'campaign_id': campaign.fb_campaign_id,
+                            'type': 'status', 'old': campaign.status, 'new': 'PAUSED'})
+            continue
+        current = campaign.daily_budget or 0.0
+        if abs(budget - current) > change_threshold * max(current, 1e-9):
+            changes.append({'user_id': user_id, 'campaign_id': campaign.fb_campaign_id,
+                            'type': 'budget', 'old': current, 'new': round(budget, 2)})
+    return changes
+
+def optimize_shard(database_url: str, user_ids: Sequence[int], now_iso: str, days_history: int,
+                   target_roas: float, change_threshold: float,
+                   history_size: int = DEFAULT_CAPACITY) -> Dict[int, List[Dict]]:
+    """
+    Выполняется в процессе шарда: оптимизирует аккаунты шарда.
+
+    Returns:
+        Dict[int, List[Dict]]: Изменения по пользователям (ошибка аккаунта — {'error': ...})
+    """
+    now = datetime.fromisoformat(now_iso)
+    results: Dict[int, List[Dict]] = {}
+    with Session(_sync_engine(database_url)) as session:
+        for user_id in user_ids:
+            try:
+                results[user_id] = _optimize_account(
+                    session, user_id, now, days_history, target_roas, change_threshold, history_size
+                )
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                results[user_id] = [{'user_id': user_id, 'type': 'error', 'error': str(e)}]
+    return results
+
+def _run_shard_process(connection, shard_function: Callable, args: Sequence[Any]):
+    """Точка входа процесса шарда: результат или текст ошибки уходит координатору по каналу"""
+    try:
+        connection.send((True, shard_function(*args)))
+    except Exception as e:
+        connection.send((False, repr(e)))
+    finally:
+        connection.close()
+
+class OptimizationRunner:
+    def __init__(
+        self,
+        session_factory: async_sessionmaker = async_session_factory,
+        database_url: str = DATABASE_URL,
+        max_workers: int = 4,
+        max_concurrency: int = 8,
+        shard_size: int = 25,
+        deadline_seconds: float = 15 * 60,
+        days_history: int = 7,
+        target_roas: float = 1.0,
+        change_threshold: float = 0.05,
+        interval_seconds: int = 3600,
+        shard_function: Callable = optimize_shard
+    ):
+        self.session_factory = session_factory
+        self.database_url = database_url
+        self.max_workers = max_workers
+        self.shard_size = shard_size
+        self.deadline_seconds = deadline_seconds
+        self.days_history = days_history
+        self.target_roas = target_roas
+        self.change_threshold = change_threshold
+        self.interval_seconds = interval_seconds
+        self.history_size = history_capacity(timedelta(days=days_history), timedelta(seconds=interval_seconds))
+        self.shard_function = shard_function
+
+        self._context = multiprocessing.get_context('spawn')
+        self._processes: Set[BaseProcess] = set()
+        # Один шард — один процесс, поэтому одновременных шардов не больше max_workers
+        self._semaphore = asyncio.Semaphore(min(max_workers, max_concurrency))
+        self._account_locks: Dict[int, asyncio.Lock] = {}
+        self.pending: Dict[int, List[Dict]] = {}
+        self.decisions = DecisionQueue(session_factory=session_factory)
+
+    def _lock(self, user_id: int) -> asyncio.Lock:
+        lock = self._account_locks.get(user_id)
+        if lock is None:
+            lock = self._account_locks[user_id] = asyncio.Lock()
+        return lock
+
+    async def _stop(self, process: BaseProcess):
+        """Завершает процесс шарда (если он еще работает) и ждет его остановки"""
+        if process.is_alive():
+            process.terminate()
+        # join в отдельном потоке, чтобы не блокировать цикл событий
+        await asyncio.get_running_loop().run_in_executor(None, process.join)
+        self._processes.discard(process)
+
+    async def _execute(self, args: Sequence[Any], timeout: float) -> Dict[int, List[Dict]]:
+        """
+        Выполняет шард в отдельном процессе.
+
+        Raises:
+            asyncio.TimeoutError: Шард не уложился в timeout (процесс уже остановлен)
+            RuntimeError: Ошибка в шарде или процесс завершился без результата
+        """
+        loop = asyncio.get_running_loop()
+        receiver, sender = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=_run_shard_process, args=(sender, self.shard_function, args),
+                                        daemon=True)
+        process.start()
+        sender.close()
+        self._processes.add(process)
+        received = loop.run_in_executor(None, receiver.recv)
+        try:
+            ok, payload = await asyncio.wait_for(asyncio.shield(received), timeout)
+        except EOFError:
+            raise RuntimeError(f"Процесс шарда завершился без результата (код {process.exitcode})")
+        finally:
+            await self._stop(process)
+            # После остановки процесса recv в потоке завершится (EOF), только затем закрываем канал
+            await asyncio.gather(received, return_exceptions=True)
+            receiver.close()
+        if not ok:
+            raise RuntimeError(payload)
+        return payload
+
+    async def shutdown(self):
+        """Останавливает работающие процессы шардов"""
+        await asyncio.gather(*(self._stop(process) for process in list(self._processes)))
+
+    async def account_ids(self) -> List[int]:
+        async with self.session_factory() as session:
+            rows = await session.execute(
+                select(User.id).where(User.fb_account_id.is_not(None)).order_by(User.id)
+            )
+            return list(rows.scalars())
+
+    async def run_pass(self, user_ids: Optional[List[int]] = None, now: Optional[datetime] = None) -> Dict:
+        """
+        Один проход по всем аккаунтам.
+
+        Returns:
+            Dict: Сводка прохода (обработано, пропущено, не уложилось в дедлайн, изменений)
+        """
+        started = time.monotonic()
+        deadline = started + self.deadline_seconds
+        now = now or datetime.now()
+        user_ids = await self.account_ids() if user_ids is None else user_ids
+
+        # Аккаунты, которые еще оптимизируются прошлым проходом, пропускаем
+        locked = [user_id for user_id in user_ids if not self._lock(user_id).locked()]
+        skipped = len(user_ids) - len(locked)
+        shards = [locked[i:i + self.shard_size] for i in range(0, len(locked), self.shard_size)]
+        report = {'accounts': len(user_ids), 'processed': 0, 'skipped': skipped,
+                  'timed_out': 0, 'failed': 0, 'changes': 0}
+
+        async def run_shard(shard: List[int]):
+            for user_id in shard:
+                await self._lock(user_id).acquire()
+            try:
+                async with self._semaphore:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        report['timed_out'] += len(shard)
+                        return
+                    try:
+                        results = await self._execute((
+                            self.database_url, shard, now.isoformat(), self.days_history,
+                            self.target_roas, self.change_threshold, self.history_size
+                        ), remaining)
+                    except asyncio.TimeoutError:
+                        report['timed_out'] += len(shard)
+                        return
+                    except Exception as e:
+                        report['failed'] += len(shard)
+                        logger.error(f"Шард {shard} не выполнен: {e}")
+                        return
+                for user_id, changes in results.items():
+                    if changes and changes[0]['type'] == 'error':
+                        report['failed'] += 1
+                        logger.error(f"Ошибка оптимизации аккаунта {user_id}: {changes[0]['error']}")
+                        continue
+                    report['processed'] += 1
+                    report['changes'] += len(changes)
+                    if changes:
+                        self.pending[user_id] = changes
+            finally:
+                for user_id in shard:
+                    self._lock(user_id).release()
+
+        await asyncio.gather(*(run_shard(shard) for shard in shards))
+
+        report['seconds'] = round(time.monotonic() - started, 3)
+        logger.info(f"Проход оптимизации: {report}")
+        return report
+
+    async def apply_pending(self) -> int:
+        """
+        Применяет накопленные изменения через очередь решений: одна пачка Graph batch
+        на токен, аудит каждого решения. В MOCK_MODE изменения пишутся только в локальную БД.
+
+        Returns:
+            int: Количество примененных изменений
+        """
+        pending, self.pending = self.pending, {}
+        for user_id, changes in pending.items():
+            for change in changes:
+                field = 'status' if change['type'] == 'status' else 'daily_budget'
+                self.decisions.enqueue(
+                    change['campaign_id'],
+                    user_id=user_id,
+                    current={field: change['old']},
+                    source='optimization_runner',
+                    **{field: change['new']}
+                )
+
+        locks = [self._lock(user_id) for user_id in sorted(pending)]
+        for lock in locks:
+            await lock.acquire()
+        try:
+            counts = await self.decisions.flush()
+        finally:
+            for lock in locks:
+                lock.release()
+
+        for user_id in pending:
+            dashboard_summary_service.mark_dirty(user_id)
+        return counts.get('applied', 0)
+
+    async def run_forever(self, interval_seconds: Optional[int] = None):
+        """Периодически выполняет проход по всем аккаунтам и применяет изменения"""
+        interval_seconds = interval_seconds or self.interval_seconds
+        while True:
+            try:
+                await self.run_pass()
+                await self.apply_pending()
+            except Exception:
+                logger.error("Ошибка планового прохода оптимизации", exc_info=True)
+            await asyncio.sleep(interval_seconds)
@@ -0,0 +1,260 @@
+"""
+Пейсинг бюджетов: прогноз расхода на конец дня и конец периода (flight)
+по почасовым кривым расхода и расчет корректировки, нужной для попадания в цель.
+
+Модель: по почасовым строкам campaign_metrics за последние дни строится
+средний профиль распределения дневного расхода по часам. Доля дня,
+прошедшая к текущему моменту, берется из профиля; остаток дня оценивается
+смесью темпа сегодняшнего дня и среднего дневного расхода с весом,
+равным прошедшей доле. Все кампании считаются одним проходом NumPy,
+прогнозы кешируются на пару (кампания, час).
+"""
+import bisect
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..db.models import Budget, Campaign, CampaignMetric
+
+logger = logging.getLogger(__name__)
+
+HOURS = 24
+
+def _start_of_hour(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+def forecast_end_of_day(
+    history: np.ndarray,
+    today: np.ndarray,
+    hour: int,
+    minute_fraction: float = 0.0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Векторизованный прогноз расхода на конец дня.
+
+    Args:
+        history: Почасовой расход прошлых дней, форма (кампании, дни, 24)
+        today: Почасовой расход сегодня, форма (кампании, 24)
+        hour: Текущий час
+        minute_fraction: Прошедшая доля текущего часа
+
+    Returns:
+        Tuple: (прогноз на конец дня, средний дневной расход) по кампаниям
+    """
+    daily_totals = history.sum(axis=2)
+    valid_days = daily_totals > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = np.where(valid_days[:, :, None], history / daily_totals[:, :, None], 0.0)
+        day_count = valid_days.sum(axis=1)
+        profile = np.where(
+            day_count[:, None] > 0,
+            shares.sum(axis=1) / day_count[:, None],
+            1.0 / HOURS  # без истории — равномерный расход
+        )
+        average_daily = np.where(day_count > 0, daily_totals.sum(axis=1) / day_count, 0.0)
+
+    elapsed = profile[:, :hour].sum(axis=1) + profile[:, hour] * minute_fraction
+    elapsed = np.clip(elapsed, 0.0, 1.0)
+    spent = today.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        todays_pace = np.where(elapsed > 0, spent / elapsed, spent)
+    # Утром доверяем истории, к вечеру — темпу сегодняшнего дня
+    weight = np.where(average_daily > 0, elapsed, 1.0)
+    blended_daily = weight * todays_pace + (1.0 - weight) * average_daily
+    return spent + (1.0 - elapsed) * blended_daily, average_daily
+
+class PacingService:
+    def __init__(self, curve_days: int = 14, tolerance: float = 0.1):
+        self.curve_days = curve_days
+        self.tolerance = tolerance
+        # (campaign_id, час) -> (расход сегодня, прогноз на конец дня, средний дневной расход)
+        self._cache: Dict[Tuple[int, datetime], Tuple[float, float, float]] = {}
+        self._cache_hour: Optional[datetime] = None
+
+    async def forecast_campaigns(
+        self,
+        session: AsyncSession,
+        campaign_ids: Sequence[int],
+        now: Optional[datetime] = None
+    ) -> Dict[int, Tuple[float, float, float]]:
+        """Прогнозы на конец дня; из БД читаются только кампании без прогноза на этот час"""
+        now = now or datetime.now()
+        hour = _start_of_hour(now)
+        if hour != self._cache_hour:
+            self._cache.clear()
+            self._cache_hour = hour
+
+        missing = sorted({campaign_id for campaign_id in campaign_ids if (campaign_id, hour) not in self._cache})
+        if missing:
+            await self._compute(session, missing, now)
+        return {campaign_id: self._cache[(campaign_id, hour)] for campaign_id in campaign_ids}
+
+    async def _compute(self, session: AsyncSession, campaign_ids: List[int], now: datetime):
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        first_day = today - timedelta(days=self.curve_days)
+        rows = await session.execute(
+            select(CampaignMetric.campaign_id, CampaignMetric.period_start, CampaignMetric.spend)
+            .where(
+                CampaignMetric.campaign_id.in_(campaign_ids),
+                CampaignMetric.granularity == 'hour',
+                CampaignMetric.period_start >= first_day,
+                CampaignMetric.period_start < today + timedelta(days=1)
+            )
+        )
+
+        position = {campaign_id: i for i, campaign_id in enumerate(campaign_ids)}
+        spend = np.zeros((len(campaign_ids), self.curve_days + 1, HOURS))
+        for campaign_id, period_start, value in rows:
+            day = (period_start - first_day).days
+            spend[position[campaign_id], day, period_start.hour] += value or 0.0
+
+        forecast, average_daily = forecast_end_of_day(
+            spend[:, :-1], spend[:, -1], now.hour, now.minute / 60
+        )
+        spent_today = spend[:, -1].sum(axis=1)
+        hour = _start_of_hour(now)
+        for i, campaign_id in enumerate(campaign_ids):
+            self._cache[(campaign_id, hour)] = (
+                float(spent_today[i]), float(forecast[i]), float(average_daily[i])
+            )
+
+    async def pace_budgets(
+        self,
+        session: AsyncSession,
+        user_id: Optional[int] = None,
+        now: Optional[datetime] = None
+    ) -> List[Dict]:
+        """
+        Пейсинг действующих бюджетов (бюджет кампании или, без campaign_id, всех активных
+        кампаний пользователя).
+
+        Returns:
+            List[Dict]: Прогнозы и рекомендуемые корректировки по бюджетам
+        """
+        now = now or datetime.now()
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        query = select(Budget).where(
+            or_(Budget.start_date.is_(None), Budget.start_date <= now),
+            or_(Budget.end_date.is_(None), Budget.end_date >= today)
+        )
+        if user_id is not None:
+            query = query.where(Budget.user_id == user_id)
+        budgets = (await session.execute(query)).scalars().all()
+        if not budgets:
+            return []
+
+        user_ids = {budget.user_id for budget in budgets}
+        campaigns = (await session.execute(
+            select(Campaign.id, Campaign.user_id, Campaign.fb_campaign_id, Campaign.daily_budget)
+            .where(Campaign.user_id.in_(user_ids), Campaign.status == 'ACTIVE')
+        )).all()
+        by_fb_id = {campaign.fb_campaign_id: campaign for campaign in campaigns}
+        by_user: Dict[int, list] = {}
+        for campaign in campaigns:
+            by_user.setdefault(campaign.user_id, []).append(campaign)
+
+        # Бюджет кампании относится к ней одной, бюджет пользователя — ко всем его активным кампаниям
+        scopes = {
+            budget.id: (
+                [by_fb_id[budget.campaign_id]] if budget.campaign_id in by_fb_id else []
+            ) if budget.campaign_id else by_user.get(budget.user_id, [])
+            for budget in budgets
+        }
+        forecasts = await self.forecast_campaigns(session, [campaign.id for campaign in campaigns], now)
+        flight_spend = await self._flight_spend(session, budgets, scopes, today)
+
+        results = []
+        for budget in budgets:
+            scope = scopes[budget.id]
+            spent_today, forecast_today, average_daily = (
+                sum(values) for values in zip(*(forecasts[c.id] for c in scope))
+            ) if scope else (0.0, 0.0, 0.0)
+            results.append(self._pace(budget, scope, spent_today, forecast_today, average_daily,
+                                      flight_spend.get(budget.id, 0.0), today))
+        return results
+
+    async def _flight_spend(self, session, budgets, scopes, today) -> Dict[int, float]:
+        """Расход с начала периода до вчерашнего дня включительно — один запрос на все бюджеты"""
+        flights = [budget for budget in budgets if budget.total_budget and scopes[budget.id]]
+        if not flights:
+            return {}
+        campaign_ids = {campaign.id for budget in flights for campaign in scopes[budget.id]}
+        starts = [budget.start_date for budget in flights]
+        query = select(CampaignMetric.campaign_id, CampaignMetric.period_start, CampaignMetric.spend).where(
+            CampaignMetric.campaign_id.in_(campaign_ids),
+            CampaignMetric.granularity == 'day',
+            CampaignMetric.period_start < today
+        )
+        if all(start is not None for start in starts):
+            query = query.where(CampaignMetric.period_start >= min(starts))
+        query = query.order_by(CampaignMetric.campaign_id, CampaignMetric.period_start)
+
+        # Накопленный расход по каждой кампании строится один раз; расход бюджета с его начала —
+        # разность накопленных сумм, найденная бинарным поиском по дате
+        days: Dict[int, List[datetime]] = {}
+        cumulative: Dict[int, List[float]] = {}
+        for campaign_id, period_start, spend in (await session.execute(query)).all():
+            sums = cumulative.setdefault(campaign_id, [0.0])
+            days.setdefault(campaign_id, []).append(period_start)
+            sums.append(sums[-1] + (spend or 0.0))
+
+        totals = {}
+        for budget in flights:
+            total = 0.0
+            for campaign in scopes[budget.id]:
+                sums = cumulative.get(campaign.id)
+                if sums is None:
+                    continue
+                first = 0 if budget.start_date is None else bisect.bisect_left(days[campaign.id], budget.start_date)
+                total += sums[-1] - sums[first]
+            totals[budget.id] = total
+        return totals
+
+    def _pace(self, budget: Budget, scope, spent_today: float, forecast_today: float,
+              average_daily: float, spent_before_today: float, today: datetime) -> Dict:
+        strategy = budget.spend_strategy or {}
+        tolerance = strategy.get('tolerance', self.tolerance)
+        current_daily = sum(campaign.daily_budget or 0.0 for campaign in scope)
+        daily_target = budget.daily_budget or current_daily
+
+        result = {
+            'budget_id': budget.id,
+            'user_id': budget.user_id,
+            'campaign_id': budget.campaign_id,
+            'spent_today': round(spent_today, 2),
+            'forecast_today': round(forecast_today, 2),
+            'daily_target': round(daily_target, 2),
+            # Во сколько раз изменить текущие бюджеты, чтобы день закрылся в цель
+            'daily_adjustment': round(daily_target / forecast_today, 4) if forecast_today > 0 else None,
+            'status': 'on_track',
+        }
+
+        if budget.total_budget and budget.end_date is not None:
+            days_after_today = max((budget.end_date.date() - today.date()).days, 0)
+            forecast_flight = spent_before_today + forecast_today + days_after_today * average_daily
+            remaining = budget.total_budget - spent_before_today - forecast_today
+            recommended_daily = remaining / days_after_today if days_after_today else None
+            result.update({
+                'total_budget': budget.total_budget,
+                'spent_to_date': round(spent_before_today + spent_today, 2),
+                'forecast_flight': round(forecast_flight, 2),
+                'recommended_daily_budget': (
+                    round(max(recommended_daily, 0.0), 2) if recommended_daily is not None else None
+                ),
+            })
+            ratio = forecast_flight / budget.total_budget
+        else:
+            ratio = forecast_today / daily_target if daily_target else 1.0
+
+        if ratio > 1 + tolerance:
+            result['status'] = 'overpacing'
+        elif ratio < 1 - tolerance:
+            result['status'] = 'underpacing'
+        return result
+
+# Общий экземпляр на процесс: кеш прогнозов живет между запросами
+pacing_service = PacingService()
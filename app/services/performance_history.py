@@ -0,0 +1,146 @@
+"""
+История оценок эффективности кампаний в виде кольцевых буферов фиксированной емкости.
+Для каждой кампании хранится строка: метки времени int64 (микросекунды) и оценки float32.
+Добавление записи и поиск самой старой записи в окне выполняются за O(1).
+
+Емкость ограничивает окно: буфер помнит не больше capacity последних оценок, поэтому
+для окна в N дней при оценке раз в интервал нужна емкость history_capacity(окно, интервал).
+"""
+import io
+import json
+import math
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..db.models import OptimizerState
+from .row_index import grow_rows, register_rows
+
+DEFAULT_CAPACITY = 64
+
+def history_capacity(window: timedelta, interval: timedelta) -> int:
+    """Емкость буфера, вмещающая все оценки окна при оценке раз в interval"""
+    return max(math.ceil(window / interval) + 1, 2)
+
+def to_timestamp(moment: datetime) -> int:
+    """datetime -> микросекунды (int64)"""
+    return int(round(moment.timestamp() * 1_000_000))
+
+class PerformanceHistory:
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.keys: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.timestamps = np.zeros((0, capacity), dtype=np.int64)
+        self.scores = np.zeros((0, capacity), dtype=np.float32)
+        self.first = np.zeros(0, dtype=np.int64)  # позиция самой старой записи
+        self.count = np.zeros(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index
+
+    def rows_for(self, keys: Sequence[str]) -> np.ndarray:
+        """Индексы строк для кампаний; новые кампании регистрируются"""
+        rows = register_rows(self.index, self.keys, keys)
+        count = len(self.keys)
+        self.timestamps = grow_rows(self.timestamps, count)
+        self.scores = grow_rows(self.scores, count)
+        self.first = grow_rows(self.first, count)
+        self.count = grow_rows(self.count, count)
+        return rows
+
+    def append(self, rows: np.ndarray, ts: int, scores) -> None:
+        """Добавляет по одной записи в каждую строку rows (строки не повторяются)"""
+        first = self.first[rows]
+        count = self.count[rows]
+        position = (first + count) % self.capacity
+        self.timestamps[rows, position] = ts
+        self.scores[rows, position] = scores
+
+        # Переполненный буфер затирает самую старую запись
+        full = count == self.capacity
+        self.first[rows] = np.where(full, (first + 1) % self.capacity, first)
+        self.count[rows] = np.where(full, count, count + 1)
+
+    def evict_before(self, rows: np.ndarray, cutoff: int) -> None:
+        """
+        Удаляет записи старше cutoff.
+        Метки времени в строке возрастают, поэтому удаление идет только с начала буфера
+        и в сумме стоит O(1) на запись.
+        """
+        while True:
+            has_records = self.count[rows] > 0
+            stale = has_records & (self.timestamps[rows, self.first[rows]] < cutoff)
+            if not stale.any():
+                return
+            stale_rows = rows[stale]
+            self.first[stale_rows] = (self.first[stale_rows] + 1) % self.capacity
+            self.count[stale_rows] -= 1
+
+    def oldest_scores(self, rows: np.ndarray) -> np.ndarray:
+        """Самая старая сохраненная оценка (край окна) для каждой строки"""
+        return self.scores[rows, self.first[rows]].astype(np.float64)
+
+    def records(self, key: str) -> List[Tuple[int, float]]:
+        """Записи кампании от старых к новым"""
+        row = self.index.get(key)
+        if row is None:
+            return []
+        positions = (self.first[row] + np.arange(self.count[row])) % self.capacity
+        return list(zip(self.timestamps[row, positions].tolist(), self.scores[row, positions].tolist()))
+
+    def to_bytes(self) -> bytes:
+        """Компактная сериализация: только живые записи каждой кампании"""
+        rows = np.arange(len(self.keys))
+        counts = self.count[rows]
+        offsets = (self.first[rows, None] + np.arange(self.capacity)[None, :]) % self.capacity
+        alive = np.arange(self.capacity)[None, :] < counts[:, None]
+        ts = np.take_along_axis(self.timestamps[rows], offsets, axis=1)[alive]
+        scores = np.take_along_axis(self.scores[rows], offsets, axis=1)[alive]
+
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            capacity=np.array([self.capacity], dtype=np.int64),
+            keys=np.frombuffer(json.dumps(self.keys).encode('utf-8'), dtype=np.uint8),
+            counts=counts.astype(np.int32),
+            timestamps=ts,
+            scores=scores,
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, payload: bytes, capacity: Optional[int] = None) -> "PerformanceHistory":
+        data = np.load(io.BytesIO(payload))
+        history = cls(capacity or int(data['capacity'][0]))
+        keys = json.loads(data['keys'].tobytes().decode('utf-8'))
+        counts = data['counts'].astype(np.int64)
+        ts, scores = data['timestamps'], data['scores']
+
+        rows = history.rows_for(keys)
+        start = 0
+        for row, count in zip(rows, counts):
+            # При уменьшении емкости сохраняются самые новые записи
+            kept = min(int(count), history.capacity)
+            begin = start + int(count) - kept
+            history.timestamps[row, :kept] = ts[begin:start + int(count)]
+            history.scores[row, :kept] = scores[begin:start + int(count)]
+            history.count[row] = kept
+            start += int(count)
+        return history
+
+async def load_history(session: AsyncSession, key: str, capacity: int = DEFAULT_CAPACITY) -> PerformanceHistory:
+    """Загружает историю из БД или возвращает пустую"""
+    state = await session.get(OptimizerState, key)
+    if state is None:
+        return PerformanceHistory(capacity)
+    return PerformanceHistory.from_bytes(state.payload, capacity)
+
+async def save_history(session: AsyncSession, key: str, history: PerformanceHistory):
+    """Сохраняет историю в БД (commit остается за вызывающим)"""
+    await session.merge(OptimizerState(key=key, payload=history.to_bytes()))
@@ -0,0 +1,178 @@
+"""
+Локальное хранилище метрик кампаний для GET /api/campaign/{id}/performance.
+
+Фоновый загрузчик периодически получает метрики за 7 дней (Graph insights
+или мок-данные в MOCK_MODE) с токеном владельца кампании из token_vault,
+только для кампаний из таблицы campaigns, один раз считает производные поля и сохраняет
+их в campaign_performance вместе с ETag. Эндпоинт читает одну строку
+по первичному ключу и отвечает 304, если у клиента актуальная версия.
+
+Тот же проход пишет строки campaign_metrics, которые читают сводки, оптимизатор,
+бандит, правила, прогноз расходов и поиск аномалий: дневные за 7 дней и почасовые
+за последние hourly_days дней (upsert по кампании, гранулярности и началу периода;
+строка с теми же значениями не перезаписывается и не сдвигает updated_at).
+"""
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from ..db.database import async_session_factory, insert_for
+from ..db.models import Campaign, CampaignMetric, CampaignPerformance
+from .campaign_automation import CampaignAutomationService
+from .token_vault import TokenVault, token_vault
+
+logger = logging.getLogger(__name__)
+
+TOTAL_FIELDS = (
+    'total_impressions', 'total_clicks', 'total_conversions', 'total_spend',
+    'ctr', 'cost_per_click', 'cost_per_conversion', 'conversion_rate'
+)
+METRIC_FIELDS = ('impressions', 'clicks', 'conversions', 'spend', 'revenue')
+
+def performance_etag(daily_metrics: List[Dict[str, Any]], total_metrics: Dict[str, Any]) -> str:
+    payload = json.dumps([daily_metrics, total_metrics], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def performance_to_dict(row: CampaignPerformance) -> Dict[str, Any]:
+    return {
+        "status": "success",
+        "campaign_id": row.fb_campaign_id,
+        "daily_metrics": row.daily_metrics,
+        "total_metrics": {field: getattr(row, field) for field in TOTAL_FIELDS},
+        "period": "last_7_days",
+        "updated_at": row.refreshed_at.isoformat()
+    }
+
+class PerformanceStore:
+    def __init__(
+        self,
+        session_factory: async_sessionmaker = async_session_factory,
+        automation: Optional[CampaignAutomationService] = None,
+        vault: TokenVault = token_vault,
+        max_concurrency: int = 8,
+        hourly_days: int = 2
+    ):
+        self.session_factory = session_factory
+        self.automation = automation or CampaignAutomationService()
+        self.vault = vault
+        self.max_concurrency = max_concurrency
+        self.hourly_days = hourly_days  # почасовые метрики за сегодня и предыдущие дни (поздние поправки Graph)
+
+    async def campaign_ids(self) -> List[str]:
+        async with self.session_factory() as session:
+            rows = await session.execute(
+                select(Campaign.fb_campaign_id).where(
+                    Campaign.fb_campaign_id.is_not(None),
+                    Campaign.status != 'DELETED'
+                )
+            )
+            return list(rows.scalars())
+
+    async def ingest(self, campaign_ids: Optional[Iterable[str]] = None, now: Optional[datetime] = None) -> int:
+        """
+        Загружает метрики кампаний и сохраняет изменившиеся.
+
+        Returns:
+            int: Количество кампаний, у которых изменились метрики
+        """
+        now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+        campaign_ids = list(campaign_ids) if campaign_ids is not None else await self.campaign_ids()
+
+        # Только известные кампании; метрики запрашиваются токеном их владельца
+        async with self.session_factory() as session:
+            known = {fb_campaign_id: (row_id, user_id) for fb_campaign_id, row_id, user_id in (await session.execute(
+                select(Campaign.fb_campaign_id, Campaign.id, Campaign.user_id)
+                .where(Campaign.fb_campaign_id.in_(campaign_ids))
+            )).all()}
+            tokens = {user_id: await self.vault.get_token(session, user_id)
+                      for _, user_id in known.values() if user_id is not None} if self.vault.configured else {}
+        campaign_ids = [campaign_id for campaign_id in campaign_ids if campaign_id in known]
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        until = now.date()
+        since = until - timedelta(days=self.hourly_days - 1)
+
+        async def fetch(campaign_id: str):
+            token = tokens.get(known[campaign_id][1])
+            async with semaphore:
+                return await asyncio.gather(
+                    self.automation.get_campaign_performance(campaign_id, token),
+                    self.automation.get_hourly_performance(campaign_id, since, until, token)
+                )
+
+        results = await asyncio.gather(*(fetch(campaign_id) for campaign_id in campaign_ids))
+
+        changed = 0
+        async with self.session_factory() as session:
+            existing = {row.fb_campaign_id: row for row in (await session.execute(
+                select(CampaignPerformance).where(CampaignPerformance.fb_campaign_id.in_(campaign_ids))
+            )).scalars()}
+            metric_rows = []
+            for campaign_id, (result, hourly) in zip(campaign_ids, results):
+                row_id = known[campaign_id][0]
+                if hourly.get("status") == "success":
+                    metric_rows += [self._metric_row(row_id, 'hour', item["hour"], item)
+                                    for item in hourly["hourly_metrics"]]
+                else:
+                    logger.warning(f"Почасовые метрики кампании {campaign_id} не загружены: {hourly.get('message')}")
+                if result.get("status") != "success":
+                    logger.warning(f"Метрики кампании {campaign_id} не загружены: {result.get('message')}")
+                    continue
+                daily_metrics, totals = result["daily_metrics"], result["total_metrics"]
+                etag = performance_etag(daily_metrics, totals)
+                metric_rows += [self._metric_row(row_id, 'day', datetime.fromisoformat(day["date"]), day)
+                                for day in daily_metrics if day.get("date")]
+                row = existing.get(campaign_id)
+                if row is not None and row.etag == etag:
+                    continue
+                if row is None:
+                    row = CampaignPerformance(fb_campaign_id=campaign_id)
+                    session.add(row)
+                row.daily_metrics = daily_metrics
+                for field in TOTAL_FIELDS:
+                    setattr(row, field, totals.get(field, 0))
+                row.etag = etag
+                row.refreshed_at = now
+                changed += 1
+            await self._upsert_metrics(session, metric_rows)
+            await session.commit()
+        return changed
+
+    @staticmethod
+    def _metric_row(campaign_row_id: int, granularity: str, period_start: datetime,
+                    metrics: Dict[str, Any]) -> Dict[str, Any]:
+        return {"campaign_id": campaign_row_id, "granularity": granularity, "period_start": period_start,
+                **{field: metrics.get(field, 0) for field in METRIC_FIELDS}}
+
+    async def _upsert_metrics(self, session: AsyncSession, rows: List[Dict[str, Any]], batch_size: int = 500):
+        """Строки campaign_metrics одним INSERT ... ON CONFLICT на пачку; неизменные строки не трогаются"""
+        insert = insert_for(session)
+        table = CampaignMetric.__table__
+        for start in range(0, len(rows), batch_size):
+            statement = insert(table).values(rows[start:start + batch_size])
+            await session.execute(statement.on_conflict_do_update(
+                index_elements=[table.c.campaign_id, table.c.granularity, table.c.period_start],
+                set_={**{field: statement.excluded[field] for field in METRIC_FIELDS}, 'updated_at': func.now()},
+                where=or_(*(table.c[field].is_distinct_from(statement.excluded[field]) for field in METRIC_FIELDS))
+            ))
+
+    async def get(self, session: AsyncSession, campaign_id: str) -> Optional[CampaignPerformance]:
+        """Метрики кампании одним поиском по первичному ключу"""
+        return await session.get(CampaignPerformance, campaign_id)
+
+    async def run_forever(self, interval_seconds: int = 900):
+        """Фоновая загрузка метрик"""
+        while True:
+            try:
+                changed = await self.ingest()
+                logger.info(f"Загрузка метрик кампаний: изменилось {changed}")
+            except Exception:
+                logger.error("Ошибка загрузки метрик кампаний", exc_info=True)
+            await asyncio.sleep(interval_seconds)
+
+performance_store = PerformanceStore()
@@ -0,0 +1,239 @@
+"""
+Сервис хранения исторических данных: прореживание метрик, архивация
+сырых ответов модели и инкрементальное сжатие SQLite
+"""
+import asyncio
+import logging
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import select, delete, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncEngine
+
+from ..config import settings
+from ..db.database import engine as default_engine, async_session_factory
+from ..db.models import CampaignMetric, Creative, CreativeRawResponse
+
+logger = logging.getLogger(__name__)
+
+class RetentionPolicy:
+    def __init__(
+        self,
+        daily_metrics_days: int = settings.RETENTION_DAILY_METRICS_DAYS,
+        raw_response_days: int = settings.RETENTION_RAW_RESPONSE_DAYS,
+        vacuum_pages: int = settings.RETENTION_VACUUM_PAGES,
+        off_peak_hours: Tuple[int, int] = (
+            settings.RETENTION_OFF_PEAK_START_HOUR,
+            settings.RETENTION_OFF_PEAK_END_HOUR
+        ),
+        batch_size: int = 5000
+    ):
+        self.daily_metrics_days = daily_metrics_days
+        self.raw_response_days = raw_response_days
+        self.vacuum_pages = vacuum_pages
+        self.off_peak_hours = off_peak_hours
+        self.batch_size = batch_size
+
+    def is_off_peak(self, now: datetime) -> bool:
+        start, end = self.off_peak_hours
+        if start <= end:
+            return start <= now.hour < end
+        return now.hour >= start or now.hour < end
+
+def week_start(moment: datetime) -> datetime:
+    """Начало недели (понедельник 00:00) для даты"""
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return day - timedelta(days=day.weekday())
+
+class RetentionService:
+    def __init__(
+        self,
+        policy: Optional[RetentionPolicy] = None,
+        session_factory: async_sessionmaker = async_session_factory,
+        engine: AsyncEngine = default_engine
+    ):
+        self.policy = policy or RetentionPolicy()
+        self.session_factory = session_factory
+        self.engine = engine
+
+    async def downsample_daily_metrics(self, now: Optional[datetime] = None) -> int:
+        """
+        Сворачивает дневные метрики старше политики в недельные.
+        Обрабатывает данные пачками, чтобы не держать долгую транзакцию.
+        
+        Returns:
+            int: Количество удаленных дневных строк
+        """
+        cutoff = (now or datetime.now()) - timedelta(days=self.policy.daily_metrics_days)
+        removed = 0
+
+        while True:
+            async with self.session_factory() as session:
+                result = await session.execute(
+                    select(CampaignMetric)
+                    .where(
+                        CampaignMetric.granularity == 'day',
+                        CampaignMetric.period_start < cutoff
+                    )
+                    .order_by(CampaignMetric.id)
+                    .limit(self.policy.batch_size)
+                )
+                daily_rows = result.scalars().all()
+                if not daily_rows:
+                    break
+
+                weekly: Dict[Tuple[int, datetime], Dict[str, float]] = {}
+                for row in daily_rows:
+                    key = (row.campaign_id, week_start(row.period_start))
+                    totals = weekly.setdefault(key, {
+                        'impressions': 0, 'clicks': 0, 'conversions': 0,
+                        'spend': 0.0, 'revenue': 0.0
+                    })
+                    totals['impressions'] += row.impressions or 0
+                    totals['clicks'] += row.clicks or 0
+                    totals['conversions'] += row.conversions or 0
+                    totals['spend'] += row.spend or 0.0
+                    totals['revenue'] += row.revenue or 0.0
+
+                for (campaign_id, period_start), totals in weekly.items():
+                    existing = await session.execute(
+                        select(CampaignMetric).where(
+                            CampaignMetric.campaign_id == campaign_id,
+                            CampaignMetric.granularity == 'week',
+                            CampaignMetric.period_start == period_start
+                        )
+                    )
+                    week_row = existing.scalar_one_or_none()
+                    if week_row is None:
+                        session.add(CampaignMetric(
+                            campaign_id=campaign_id,
+                            granularity='week',
+                            period_start=period_start,
+                            **totals
+                        ))
+                    else:
+                        for field, value in totals.items():
+                            setattr(week_row, field, (getattr(week_row, field) or 0) + value)
+
+                await session.execute(
+                    delete(CampaignMetric).where(
+                        CampaignMetric.id.in_([row.id for row in daily_rows])
+                    )
+                )
+                await session.commit()
+                removed += len(daily_rows)
+
+        if removed:
+            logger.info(f"Дневные метрики свернуты в недельные: {removed} строк")
+        return removed
+
+    async def archive_raw_responses(self, now: Optional[datetime] = None) -> int:
+        """
+        Переносит raw_response из creatives.analysis в сжатую таблицу.
+        
+        Returns:
+            int: Количество заархивированных ответов
+        """
+        cutoff = (now or datetime.now()) - timedelta(days=self.policy.raw_response_days)
+        archived = 0
+        last_id = 0
+
+        while True:
+            async with self.session_factory() as session:
+                result = await session.execute(
+                    select(Creative)
+                    .where(Creative.id > last_id, Creative.created_at < cutoff)
+                    .order_by(Creative.id)
+                    .limit(self.policy.batch_size)
+                )
+                creatives = result.scalars().all()
+                if not creatives:
+                    break
+                last_id = creatives[-1].id
+
+                for creative in creatives:
+                    analysis = creative.analysis or {}
+                    raw_response = analysis.get('raw_response')
+                    if raw_response is None:
+                        continue
+                    raw_bytes = str(raw_response).encode('utf-8')
+                    await session.merge(CreativeRawResponse(
+                        creative_id=creative.id,
+                        compressed_response=zlib.compress(raw_bytes, 6),
+                        original_size=len(raw_bytes)
+                    ))
+                    # JSON-колонка не отслеживает изменения на месте, поэтому присваиваем новый dict
+                    creative.analysis = {
+                        key: value for key, value in analysis.items() if key != 'raw_response'
+                    }
+                    archived += 1
+                await session.commit()
+
+        if archived:
+            logger.info(f"Заархивировано сырых ответов модели: {archived}")
+        return archived
+
+    async def compact(self) -> Dict[str, int]:
+        """
+        Освобождает место в SQLite и обновляет статистику планировщика.
+        При auto_vacuum=INCREMENTAL освобождает не более vacuum_pages страниц за раз,
+        иначе выполняет полный VACUUM, который переводит БД в инкрементальный режим.
+        
+        Returns:
+            Dict: page_size, освобожденные страницы и байты
+        """
+        if self.engine.dialect.name != 'sqlite':
+            async with self.engine.connect() as conn:
+                conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                await conn.execute(text("ANALYZE"))
+            return {'page_size': 0, 'pages_freed': 0, 'reclaimed_bytes': 0}
+
+        async with self.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            page_size = (await conn.execute(text("PRAGMA page_size"))).scalar()
+            pages_before = (await conn.execute(text("PRAGMA page_count"))).scalar()
+            auto_vacuum = (await conn.execute(text("PRAGMA auto_vacuum"))).scalar()
+
+            if auto_vacuum == 2:
+                await conn.execute(text(f"PRAGMA incremental_vacuum({int(self.policy.vacuum_pages)})"))
+            else:
+                await conn.execute(text("PRAGMA auto_vacuum=INCREMENTAL"))
+                await conn.execute(text("VACUUM"))
+
+            await conn.execute(text("PRAGMA optimize"))
+            pages_after = (await conn.execute(text("PRAGMA page_count"))).scalar()
+
+        pages_freed = max(pages_before - pages_after, 0)
+        return {
+            'page_size': page_size,
+            'pages_freed': pages_freed,
+            'reclaimed_bytes': pages_freed * page_size
+        }
+
+    async def run(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Полный проход политики хранения с отчетом"""
+        report = {
+            'downsampled_rows': await self.downsample_daily_metrics(now),
+            'archived_responses': await self.archive_raw_responses(now),
+        }
+        report.update(await self.compact())
+        logger.info(f"Обслуживание хранилища завершено: {report}")
+        return report
+
+    async def run_forever(self, interval_seconds: int = 3600):
+        """Периодически запускает обслуживание в непиковые часы"""
+        while True:
+            try:
+                if self.policy.is_off_peak(datetime.now()):
+                    await self.run()
+            except Exception:
+                logger.error("Ошибка обслуживания хранилища", exc_info=True)
+            await asyncio.sleep(interval_seconds)
+
+async def load_raw_response(session, creative_id: int) -> Optional[str]:
+    """Возвращает заархивированный сырой ответ модели для креатива"""
+    archived = await session.get(CreativeRawResponse, creative_id)
+    if archived is None:
+        return None
+    return zlib.decompress(archived.compressed_response).decode('utf-8')
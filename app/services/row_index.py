@@ -0,0 +1,27 @@
+"""
+Индекс строк для векторизованных сервисов: ключ кампании -> номер строки
+в массивах NumPy. Новые ключи получают следующий номер, массивы растут
+с удвоением емкости, поэтому регистрация кампании в среднем стоит O(1).
+"""
+from typing import Dict, Hashable, List, Sequence
+
+import numpy as np
+
+def register_rows(index: Dict[Hashable, int], keys: List[Hashable], new_keys: Sequence[Hashable]) -> np.ndarray:
+    """Индексы строк для new_keys; незнакомые ключи дописываются в keys и index"""
+    rows = np.empty(len(new_keys), dtype=np.intp)
+    for i, key in enumerate(new_keys):
+        row = index.get(key)
+        if row is None:
+            row = index[key] = len(keys)
+            keys.append(key)
+        rows[i] = row
+    return rows
+
+def grow_rows(array: np.ndarray, rows: int, minimum: int = 16) -> np.ndarray:
+    """Массив как минимум с rows строками (новые строки нулевые)"""
+    capacity = len(array)
+    if rows <= capacity:
+        return array
+    extra = max(rows, capacity * 2, minimum) - capacity
+    return np.concatenate([array, np.zeros((extra, *array.shape[1:]), dtype=array.dtype)])
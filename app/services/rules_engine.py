@@ -0,0 +1,340 @@
+"""
+Декларативные правила рекомендаций по кампаниям.
+
+Правило — словарь, который хранится в БД как JSON и редактируется через API:
+
+    {
+        "name": "low_ctr",
+        "priority": 20,
+        "window": "7d",
+        "when": [{"metric": "ctr", "op": "<", "value": 2.0}],
+        "action": {"type": "creative_optimization", "action": "update_creative",
+                   "message": "Низкий CTR...", "priority": "high", "status": "warning"},
+        "stop": false
+    }
+
+Все условия правила объединяются через И. Окно условия ("1d", "7d", "30d")
+выбирает столбец метрики ctr@7d; без окна берется окно правила, без окна
+правила — столбец без суффикса. Набор правил компилируется один раз: каждое
+уникальное условие становится векторным сравнением над столбцом метрик
+всех кампаний, правило — И по строкам матрицы условий. Правила применяются
+по убыванию приоритета; "stop" отключает менее приоритетные правила для
+кампаний, где правило сработало.
+"""
+import copy
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import case, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..db.models import Campaign, CampaignMetric, UserRuleSet
+
+logger = logging.getLogger(__name__)
+
+OPERATORS = {
+    '<': np.less,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '==': np.equal,
+    '!=': np.not_equal,
+}
+WINDOWS = {'1d': 1, '7d': 7, '30d': 30}
+STATUS_SEVERITY = ('success', 'warning', 'critical')
+SCOPES = ('campaign', 'budget')
+
+# Правила оптимизации кампании (CTR и конверсия в процентах)
+DEFAULT_CAMPAIGN_RULES = [
+    {
+        "name": "low_ctr",
+        "priority": 30,
+        "when": [{"metric": "ctr", "op": "<", "value": 2.0}],
+        "action": {"type": "creative_optimization", "message": "Низкий CTR. Рекомендуется обновить креатив",
+                   "action": "update_creative", "priority": "high"}
+    },
+    {
+        "name": "expensive_conversions",
+        "priority": 20,
+        "when": [{"metric": "cost_per_conversion", "op": ">", "value": 50}],
+        "action": {"type": "targeting_optimization",
+                   "message": "Высокая стоимость конверсии. Рекомендуется сузить аудиторию",
+                   "action": "refine_targeting", "priority": "medium"}
+    },
+    {
+        "name": "low_conversion_rate",
+        "priority": 10,
+        "when": [{"metric": "conversion_rate", "op": "<", "value": 2.0}],
+        "action": {"type": "landing_page_optimization",
+                   "message": "Низкий коэффициент конверсии. Проверьте посадочную страницу",
+                   "action": "optimize_landing_page", "priority": "high"}
+    },
+]
+
+# Правила рекомендаций BudgetOptimizer (CTR и конверсия — доли)
+DEFAULT_BUDGET_RULES = [
+    {
+        "name": "low_roas",
+        "priority": 30,
+        "when": [{"metric": "roas", "op": "<", "value": 1}],
+        "action": {"message": "Низкий ROAS. Рекомендуется пересмотреть таргетинг и креативы.", "status": "warning"}
+    },
+    {
+        "name": "high_roas",
+        "priority": 30,
+        "when": [{"metric": "roas", "op": ">", "value": 2}],
+        "action": {"message": "Отличный ROAS. Рекомендуется увеличить бюджет для масштабирования.",
+                   "status": "success"}
+    },
+    {
+        "name": "low_ctr",
+        "priority": 20,
+        "when": [{"metric": "ctr", "op": "<", "value": 0.01}],
+        "action": {"message": "Низкий CTR. Рекомендуется улучшить креативы и заголовки.", "status": "warning"}
+    },
+    {
+        "name": "low_conversion_rate",
+        "priority": 10,
+        "when": [{"metric": "conversion_rate", "op": "<", "value": 0.02}],
+        "action": {"message": "Низкая конверсия. Проверьте релевантность целевой аудитории."}
+    },
+]
+
+DEFAULT_RULES = {'campaign': DEFAULT_CAMPAIGN_RULES, 'budget': DEFAULT_BUDGET_RULES}
+
+class CompiledRuleSet:
+    def __init__(self, rules: Sequence[Dict[str, Any]]):
+        """
+        Проверяет и компилирует правила.
+
+        Raises:
+            ValueError: Некорректное правило (сообщение пригодно для ответа API)
+        """
+        self.rules = [self._validate(rule, i) for i, rule in enumerate(rules)]
+        # Стабильная сортировка: при равном приоритете сохраняется порядок объявления
+        self.order = sorted(range(len(self.rules)), key=lambda i: -self.rules[i].get('priority', 0))
+
+        self.conditions: List[Tuple[str, str, float]] = []
+        index: Dict[Tuple[str, str, float], int] = {}
+        self.rule_conditions: List[List[int]] = []
+        for rule in self.rules:
+            ids = []
+            for condition in rule['when']:
+                window = condition.get('window', rule.get('window'))
+                column = f"{condition['metric']}@{window}" if window else condition['metric']
+                key = (column, condition['op'], float(condition['value']))
+                if key not in index:
+                    index[key] = len(self.conditions)
+                    self.conditions.append(key)
+                ids.append(index[key])
+            self.rule_conditions.append(ids)
+
+        # Матрица правило × условие для И по условиям одним умножением
+        self.membership = np.zeros((len(self.rules), len(self.conditions)), dtype=np.int64)
+        for i, ids in enumerate(self.rule_conditions):
+            self.membership[i, ids] = 1
+        self.required = self.membership.sum(axis=1)
+
+    @staticmethod
+    def _validate(rule: Dict[str, Any], position: int) -> Dict[str, Any]:
+        if not isinstance(rule, dict):
+            raise ValueError(f"Правило #{position}: ожидается объект")
+        name = rule.get('name') or f"#{position}"
+        when = rule.get('when')
+        if not isinstance(when, list) or not when or not all(isinstance(c, dict) for c in when):
+            raise ValueError(f"Правило {name}: нужен непустой список условий when")
+        if not isinstance(rule.get('action'), dict):
+            raise ValueError(f"Правило {name}: нужно действие action")
+        for window in [rule.get('window')] + [condition.get('window') for condition in when]:
+            if window is not None and window not in WINDOWS:
+                raise ValueError(f"Правило {name}: неизвестное окно {window}")
+        for condition in when:
+            if condition.get('op') not in OPERATORS:
+                raise ValueError(f"Правило {name}: неизвестный оператор {condition.get('op')}")
+            if not condition.get('metric'):
+                raise ValueError(f"Правило {name}: у условия нет метрики")
+            try:
+                float(condition.get('value'))
+            except (TypeError, ValueError):
+                raise ValueError(f"Правило {name}: значение условия должно быть числом")
+        status = rule['action'].get('status')
+        if status is not None and status not in STATUS_SEVERITY:
+            raise ValueError(f"Правило {name}: неизвестный статус {status}")
+        return rule
+
+    @property
+    def columns(self) -> List[str]:
+        return sorted({column for column, _, _ in self.conditions})
+
+    def match(self, metrics: Dict[str, Any]) -> np.ndarray:
+        """
+        Матрица срабатывания правил (правила × кампании) с учетом приоритетов и stop.
+
+        Args:
+            metrics: Столбцы метрик одинаковой длины; отсутствующий столбец или NaN — условие не выполнено
+        """
+        size = len(next(iter(metrics.values()))) if metrics else 0
+        satisfied = np.zeros((len(self.conditions), size), dtype=np.int64)
+        with np.errstate(invalid='ignore'):
+            for i, (column, op, value) in enumerate(self.conditions):
+                if column in metrics:
+                    satisfied[i] = OPERATORS[op](np.asarray(metrics[column], dtype=np.float64), value)
+        matched = (self.membership @ satisfied) == self.required[:, None]
+
+        blocked = np.zeros(size, dtype=bool)
+        for i in self.order:
+            matched[i] &= ~blocked
+            if self.rules[i].get('stop'):
+                blocked |= matched[i]
+        return matched
+
+    def evaluate(self, metrics: Dict[str, Any]) -> List[List[Dict[str, Any]]]:
+        """Действия сработавших правил для каждой кампании, по убыванию приоритета"""
+        matched = self.match(metrics)
+        actions: List[List[Dict[str, Any]]] = [[] for _ in range(matched.shape[1])]
+        for i in self.order:
+            for campaign in np.flatnonzero(matched[i]):
+                actions[campaign].append(self.rules[i]['action'])
+        return actions
+
+    def evaluate_one(self, metrics: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return self.evaluate({key: [value] for key, value in metrics.items()
+                              if isinstance(value, (int, float))})[0]
+
+def resolve_status(actions: Sequence[Dict[str, Any]]) -> Optional[str]:
+    """Самый тяжелый статус среди действий"""
+    statuses = [action['status'] for action in actions if action.get('status')]
+    return max(statuses, key=STATUS_SEVERITY.index) if statuses else None
+
+_default_rule_sets = {scope: CompiledRuleSet(rules) for scope, rules in DEFAULT_RULES.items()}
+
+def default_rule_set(scope: str) -> CompiledRuleSet:
+    return _default_rule_sets[scope]
+
+async def load_window_metrics(
+    session: AsyncSession,
+    campaign_ids: Sequence[int],
+    now: Optional[datetime] = None,
+    windows: Dict[str, int] = WINDOWS
+) -> Dict[str, np.ndarray]:
+    """
+    Метрики кампаний по окнам одним запросом по дневным строкам.
+    Производные метрики — в процентах (ctr, conversion_rate) и в валюте (cpc, cost_per_conversion).
+    Столбцы без суффикса окна соответствуют окну 7d.
+    """
+    now = now or datetime.now()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    fields = ('impressions', 'clicks', 'conversions', 'spend', 'revenue')
+    longest = max(windows.values())
+
+    columns = []
+    for days in windows.values():
+        since = today - timedelta(days=days - 1)
+        for field in fields:
+            column = getattr(CampaignMetric, field)
+            columns.append(func.sum(case((CampaignMetric.period_start >= since, column), else_=0)))
+    rows = {row[0]: row[1:] for row in await session.execute(
+        select(CampaignMetric.campaign_id, *columns)
+        .where(
+            CampaignMetric.campaign_id.in_(list(campaign_ids)),
+            CampaignMetric.granularity == 'day',
+            CampaignMetric.period_start >= today - timedelta(days=longest - 1)
+        )
+        .group_by(CampaignMetric.campaign_id)
+    )}
+
+    raw = np.array([[value or 0 for value in rows.get(campaign_id, (0,) * len(columns))]
+                    for campaign_id in campaign_ids], dtype=np.float64).reshape(len(campaign_ids), len(columns))
+    metrics: Dict[str, np.ndarray] = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for w, name in enumerate(windows):
+            impressions, clicks, conversions, spend, revenue = raw[:, w * len(fields):(w + 1) * len(fields)].T
+            window = {
+                'impressions': impressions,
+                'clicks': clicks,
+                'conversions': conversions,
+                'spend': spend,
+                'revenue': revenue,
+                'ctr': np.where(impressions > 0, clicks / impressions * 100, 0.0),
+                'cost_per_click': np.where(clicks > 0, spend / clicks, 0.0),
+                'cost_per_conversion': np.where(conversions > 0, spend / conversions, 0.0),
+                'conversion_rate': np.where(clicks > 0, conversions / clicks * 100, 0.0),
+                'roas': np.where(spend > 0, revenue / spend, 0.0),
+            }
+            for metric, values in window.items():
+                metrics[f"{metric}@{name}"] = values
+                if name == '7d':
+                    metrics[metric] = values
+    return metrics
+
+def rules_digest(rules: List[Dict[str, Any]]) -> str:
+    return hashlib.sha1(json.dumps(rules, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+class RulesService:
+    """
+    Наборы правил пользователей с кешем скомпилированных правил.
+    Кеш заполняется только из прочитанных строк и проверяется по хешу содержимого:
+    два писателя с одинаковым номером версии не оставят в кеше чужие правила.
+    """
+
+    def __init__(self):
+        self._compiled: Dict[Tuple[int, str], Tuple[str, CompiledRuleSet]] = {}
+
+    async def get_rules(self, session: AsyncSession, user_id: Optional[int], scope: str) -> CompiledRuleSet:
+        if user_id is None:
+            return default_rule_set(scope)
+        row = await session.get(UserRuleSet, (user_id, scope))
+        if row is None:
+            return default_rule_set(scope)
+        digest = rules_digest(row.rules)
+        cached = self._compiled.get((user_id, scope))
+        if cached and cached[0] == digest:
+            return cached[1]
+        compiled = CompiledRuleSet(row.rules)
+        self._compiled[(user_id, scope)] = (digest, compiled)
+        return compiled
+
+    async def rules_for(self, session: AsyncSession, user_id: int, scope: str) -> Dict[str, Any]:
+        row = await session.get(UserRuleSet, (user_id, scope))
+        if row is None:
+            return {"user_id": user_id, "scope": scope, "version": 0, "rules": copy.deepcopy(DEFAULT_RULES[scope])}
+        return {"user_id": user_id, "scope": scope, "version": row.version, "rules": row.rules}
+
+    async def save_rules(self, session: AsyncSession, user_id: int, scope: str,
+                         rules: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Проверяет и сохраняет правила пользователя (commit остается за вызывающим).
+
+        Raises:
+            ValueError: Неизвестная область или некорректные правила
+        """
+        if scope not in SCOPES:
+            raise ValueError(f"Неизвестная область правил: {scope}")
+        CompiledRuleSet(rules)  # проверка правил; в кеш попадут только после commit, при чтении
+        row = await session.get(UserRuleSet, (user_id, scope))
+        if row is None:
+            row = UserRuleSet(user_id=user_id, scope=scope, version=0)
+            session.add(row)
+        row.rules = rules
+        row.version += 1
+        return {"user_id": user_id, "scope": scope, "version": row.version, "rules": rules}
+
+    async def evaluate_account(self, session: AsyncSession, user_id: int,
+                               now: Optional[datetime] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """Рекомендации по всем кампаниям пользователя за один проход правил"""
+        campaigns = (await session.execute(
+            select(Campaign.id, Campaign.fb_campaign_id).where(Campaign.user_id == user_id).order_by(Campaign.id)
+        )).all()
+        if not campaigns:
+            return {}
+        rules = await self.get_rules(session, user_id, 'campaign')
+        metrics = await load_window_metrics(session, [campaign.id for campaign in campaigns], now)
+        actions = rules.evaluate(metrics)
+        return {campaign.fb_campaign_id or str(campaign.id): campaign_actions
+                for campaign, campaign_actions in zip(campaigns, actions)}
+
+rules_service = RulesService()
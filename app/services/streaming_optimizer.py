@@ -0,0 +1,188 @@
+"""
+Инкрементальный оптимизатор бюджета для потока событий метрик.
+
+Вместо пересчета всего списка кампаний при каждом вызове хранит по каждой
+кампании скользящие агрегаты (EWMA метрик, быструю и медленную EWMA оценки
+для тренда) и итоги портфеля. flush() пересчитывает только кампании,
+получившие новые события, и возвращает лишь те изменения бюджета,
+которые превышают порог.
+
+Правила те же, что в BudgetOptimizer (веса, пороги, множители, доли),
+но множитель применяется к базовому бюджету кампании, а не к последнему
+выданному, чтобы частота событий не влияла на результат.
+"""
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .budget_optimizer import BudgetOptimizer
+from .row_index import grow_rows, register_rows
+
+METRIC_FIELDS = ('impressions', 'clicks', 'conversions', 'spend', 'revenue')
+
+class StreamingBudgetOptimizer:
+    SCORE_WEIGHTS = BudgetOptimizer.SCORE_WEIGHTS
+    SCORE_THRESHOLDS = BudgetOptimizer.SCORE_THRESHOLDS
+    SCORE_MULTIPLIERS = BudgetOptimizer.SCORE_MULTIPLIERS
+    TREND_THRESHOLD = BudgetOptimizer.TREND_THRESHOLD
+    TREND_MULTIPLIERS = BudgetOptimizer.TREND_MULTIPLIERS
+    MIN_BUDGET_SHARE = BudgetOptimizer.MIN_BUDGET_SHARE
+    MAX_BUDGET_SHARE = BudgetOptimizer.MAX_BUDGET_SHARE
+
+    def __init__(
+        self,
+        daily_budget: float,
+        metrics_alpha: float = 0.3,
+        fast_alpha: float = 0.5,
+        slow_alpha: float = 0.1,
+        change_threshold: float = 0.05
+    ):
+        self.daily_budget = daily_budget
+        self.metrics_alpha = metrics_alpha
+        self.fast_alpha = fast_alpha
+        self.slow_alpha = slow_alpha
+        self.change_threshold = change_threshold  # относительное изменение для выдачи
+
+        self.keys: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.metrics = np.zeros((0, len(METRIC_FIELDS)))  # EWMA приращений метрик
+        self.fast_score = np.zeros(0)
+        self.slow_score = np.zeros(0)
+        self.events = np.zeros(0, dtype=np.int64)
+        self.base_budgets = np.zeros(0)
+        self.raw_budgets = np.zeros(0)  # бюджет по правилам до нормировки портфеля
+        self.emitted = np.zeros(0)      # последние выданные бюджеты
+
+        self.totals = dict.fromkeys(METRIC_FIELDS, 0.0)  # итоги портфеля
+        self.raw_total = 0.0
+        self.emitted_scale = 1.0
+        self.dirty: set = set()
+        self.last_recomputed = 0
+
+    def _row(self, campaign_id: str) -> int:
+        row = self.index.get(campaign_id)
+        if row is not None:
+            return row
+        row = int(register_rows(self.index, self.keys, [campaign_id])[0])
+        count = len(self.keys)
+        self.metrics = grow_rows(self.metrics, count)
+        self.fast_score = grow_rows(self.fast_score, count)
+        self.slow_score = grow_rows(self.slow_score, count)
+        self.events = grow_rows(self.events, count)
+        self.base_budgets = grow_rows(self.base_budgets, count)
+        self.raw_budgets = grow_rows(self.raw_budgets, count)
+        self.emitted = grow_rows(self.emitted, count)
+        # Новая кампания стартует с равной доли дневного бюджета
+        self.base_budgets[row] = self.daily_budget / len(self.keys)
+        return row
+
+    def set_budget(self, campaign_id: str, budget: float):
+        """Задает базовый бюджет кампании (например, фактический бюджет из Facebook)"""
+        row = self._row(campaign_id)
+        self.base_budgets[row] = budget
+        self.emitted[row] = budget
+        self.dirty.add(row)
+
+    def update(self, campaign_id: str, delta_metrics: Dict[str, float]):
+        """
+        Учитывает событие метрик кампании за O(1).
+
+        Args:
+            campaign_id: ID кампании
+            delta_metrics: Приращения impressions, clicks, conversions, spend, revenue
+        """
+        row = self._row(campaign_id)
+        delta = np.array([float(delta_metrics.get(field, 0) or 0) for field in METRIC_FIELDS])
+        for field, value in zip(METRIC_FIELDS, delta):
+            self.totals[field] += value
+
+        alpha = self.metrics_alpha if self.events[row] else 1.0
+        self.metrics[row] += alpha * (delta - self.metrics[row])
+        impressions, clicks, conversions, spend, revenue = self.metrics[row]
+
+        roas = revenue / spend if spend > 0 else 0.0
+        ctr = clicks / impressions if impressions > 0 else 0.0
+        conversion_rate = conversions / clicks if clicks > 0 else 0.0
+        roas_weight, ctr_weight, conversion_weight = self.SCORE_WEIGHTS
+        score = roas * roas_weight + ctr * ctr_weight + conversion_rate * conversion_weight
+
+        if self.events[row]:
+            self.fast_score[row] += self.fast_alpha * (score - self.fast_score[row])
+            self.slow_score[row] += self.slow_alpha * (score - self.slow_score[row])
+        else:
+            self.fast_score[row] = self.slow_score[row] = score
+        self.events[row] += 1
+        self.dirty.add(row)
+
+    def trend(self, campaign_id: str) -> float:
+        row = self.index[campaign_id]
+        slow = self.slow_score[row]
+        return (self.fast_score[row] - slow) / slow if self.events[row] > 1 and slow > 0 else 0.0
+
+    def _recompute(self, rows: np.ndarray):
+        """Бюджеты по правилам до нормировки, только для строк rows"""
+        fast, slow = self.fast_score[rows], self.slow_score[rows]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            trend = np.where((self.events[rows] > 1) & (slow > 0), (fast - slow) / slow, 0.0)
+
+        excellent, good, fair = self.SCORE_THRESHOLDS
+        multipliers = np.select(
+            [fast > excellent, fast > good, fast > fair],
+            self.SCORE_MULTIPLIERS[:3],
+            self.SCORE_MULTIPLIERS[3]
+        )
+        multipliers = np.where(
+            trend > self.TREND_THRESHOLD,
+            multipliers * self.TREND_MULTIPLIERS[0],
+            np.where(trend < -self.TREND_THRESHOLD, multipliers * self.TREND_MULTIPLIERS[1], multipliers)
+        )
+        raw = np.clip(
+            self.base_budgets[rows] * multipliers,
+            self.daily_budget * self.MIN_BUDGET_SHARE,
+            self.daily_budget * self.MAX_BUDGET_SHARE
+        )
+        self.raw_total += raw.sum() - self.raw_budgets[rows].sum()
+        self.raw_budgets[rows] = raw
+
+    def flush(self, threshold: Optional[float] = None) -> Dict[str, float]:
+        """
+        Пересчитывает кампании с новыми событиями и возвращает изменения бюджетов.
+
+        Returns:
+            Dict[str, float]: Новые бюджеты кампаний, изменившиеся больше порога
+        """
+        threshold = self.change_threshold if threshold is None else threshold
+        dirty = np.fromiter(self.dirty, dtype=np.intp, count=len(self.dirty))
+        self.dirty.clear()
+        self.last_recomputed = len(dirty)
+        if len(dirty):
+            self._recompute(dirty)
+
+        count = len(self.keys)
+        scale = min(1.0, self.daily_budget / self.raw_total) if self.raw_total > 0 else 1.0
+        if scale == self.emitted_scale:
+            candidates = dirty
+        else:
+            # Нормировка портфеля изменилась: затронуты все кампании, сверяем заодно сумму
+            candidates = np.arange(count)
+            self.raw_total = float(self.raw_budgets[:count].sum())
+            scale = min(1.0, self.daily_budget / self.raw_total) if self.raw_total > 0 else 1.0
+            self.emitted_scale = scale
+
+        budgets = self.raw_budgets[candidates] * scale
+        previous = self.emitted[candidates]
+        changed = (previous <= 0) | (np.abs(budgets - previous) > threshold * previous)
+        rows = candidates[changed]
+        self.emitted[rows] = budgets[changed]
+        return {self.keys[row]: float(budget) for row, budget in zip(rows, budgets[changed])}
+
+    def update_many(self, events: Sequence[tuple]) -> Dict[str, float]:
+        """Пачка событий (campaign_id, delta_metrics) и сразу flush()"""
+        for campaign_id, delta_metrics in events:
+            self.update(campaign_id, delta_metrics)
+        return self.flush()
+
+    @property
+    def campaign_budgets(self) -> Dict[str, float]:
+        """Последние выданные бюджеты кампаний"""
+        return {key: float(self.emitted[row]) for key, row in self.index.items()}
@@ -0,0 +1,242 @@
+"""
+Исходящие сообщения Telegram с учетом лимитов: общий и по каждому чату
+token bucket, приоритеты (ответы пользователю раньше массовых алертов),
+склейка ожидающих алертов одного чата в одно сообщение и автоматический
+повтор после RetryAfter.
+
+FloodControlRateLimiter подключается к приложению PTB, поэтому через него
+проходят все вызовы Bot API, включая reply_text и edit_message_text в обработчиках.
+"""
+import asyncio
+import bisect
+import itertools
+import logging
+import time
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, BULK = 0, 1  # полосы приоритета: меньше — раньше
+MAX_MESSAGE_LENGTH = 4096
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Секунд до появления токена"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+class FloodControlRateLimiter(BaseRateLimiter):
+    """
+    Ограничитель запросов Bot API.
+
+    Ожидающие запросы упорядочены по (приоритет, очередь поступления). Запрос,
+    чат которого еще не готов, пропускается и не задерживает другие чаты;
+    общий токен получает первый готовый запрос по приоритету.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = settings.TELEGRAM_GLOBAL_MESSAGES_PER_SECOND,
+        chat_rate: float = settings.TELEGRAM_CHAT_MESSAGES_PER_SECOND,
+        chat_burst: int = settings.TELEGRAM_CHAT_BURST,
+        group_rate_per_minute: float = settings.TELEGRAM_GROUP_MESSAGES_PER_MINUTE,
+        max_retries: int = 3,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate_per_minute / 60
+        self.max_retries = max_retries
+        self.clock = clock
+        self.global_bucket = TokenBucket(global_rate, global_rate, clock())
+        self.blocked_until = 0.0
+        # id чата -> {"bucket": TokenBucket, "blocked_until": float}
+        self._chats: Dict[Any, Dict[str, Any]] = {}
+        self._waiters: List[tuple] = []  # (приоритет, номер, чат, future)
+        self._sequence = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    def _chat(self, chat_id, now: float) -> Dict[str, Any]:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            # Группы и каналы (отрицательный id или @username) — 20 сообщений в минуту
+            is_group = not isinstance(chat_id, int) or chat_id < 0
+            rate = self.group_rate if is_group else self.chat_rate
+            chat = {"bucket": TokenBucket(rate, 1 if is_group else self.chat_burst, now), "blocked_until": 0.0}
+            self._chats[chat_id] = chat
+        return chat
+
+    async def acquire(self, chat_id=None, priority: int = INTERACTIVE):
+        """Ждет разрешения на один запрос к чату (без чата — только общий лимит)"""
+        future = asyncio.get_running_loop().create_future()
+        waiter = (priority, next(self._sequence), chat_id, future)
+        bisect.insort(self._waiters, waiter)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+
+    def _dispatch(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        now = self.clock()
+        waits = []
+        seen = set()
+        for waiter in list(self._waiters):
+            _, _, chat_id, future = waiter
+            if future.done():
+                self._waiters.remove(waiter)
+                continue
+            # Порядок внутри чата сохраняется: после неготового запроса чата остальные его запросы ждут
+            if chat_id is not None:
+                if chat_id in seen:
+                    continue
+                chat = self._chat(chat_id, now)
+                chat_wait = max(chat["bucket"].wait_time(now), chat["blocked_until"] - now)
+                if chat_wait > 0:
+                    seen.add(chat_id)
+                    waits.append(chat_wait)
+                    continue
+            global_wait = max(self.global_bucket.wait_time(now), self.blocked_until - now)
+            if global_wait > 0:
+                # Общий токен достанется запросу с наивысшим приоритетом
+                waits.append(global_wait)
+                break
+            self.global_bucket.take(now)
+            if chat_id is not None:
+                chat["bucket"].take(now)
+            self._waiters.remove(waiter)
+            future.set_result(None)
+
+        if len(self._chats) > 1000:
+            waiting = {waiter[2] for waiter in self._waiters}
+            for chat_id in [c for c, chat in self._chats.items()
+                            if c not in waiting and chat["blocked_until"] <= now and chat["bucket"].is_full(now)]:
+                del self._chats[chat_id]
+
+        if waits:
+            self._timer = asyncio.get_running_loop().call_later(min(waits), self._dispatch)
+
+    def _block(self, chat_id, retry_after: Union[int, float, timedelta]):
+        seconds = retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+        until = self.clock() + seconds
+        if chat_id is None:
+            self.blocked_until = max(self.blocked_until, until)
+        else:
+            chat = self._chat(chat_id, self.clock())
+            chat["blocked_until"] = max(chat["blocked_until"], until)
+        logger.warning(f"Telegram RetryAfter {seconds:.0f} с для чата {chat_id}")
+
+    async def process_request(
+        self,
+        callback: Callable[..., Awaitable[Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]]
+    ):
+        rate_limit_args = rate_limit_args or {}
+        chat_id = data.get("chat_id")
+        priority = rate_limit_args.get("priority", INTERACTIVE)
+        acquired = rate_limit_args.get("acquired", False)
+        for attempt in range(self.max_retries + 1):
+            if not acquired:
+                await self.acquire(chat_id, priority)
+            acquired = False
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self._block(chat_id, e.retry_after)
+
+class NotificationOutbox:
+    """
+    Массовые уведомления (алерты, отчеты). Пока сообщение ждет своей очереди,
+    новые уведомления тому же чату дописываются в него, а не отправляются отдельно.
+    """
+
+    def __init__(
+        self,
+        limiter: FloodControlRateLimiter,
+        send: Callable[[Any, str], Awaitable[Any]],
+        max_length: int = MAX_MESSAGE_LENGTH,
+        separator: str = "\n\n"
+    ):
+        self.limiter = limiter
+        self.send = send
+        self.max_length = max_length
+        self.separator = separator
+        self._pending: Dict[Any, List[str]] = {}
+        self._tasks: Dict[Any, asyncio.Task] = {}
+
+    def enqueue(self, chat_id, text: str):
+        self._pending.setdefault(chat_id, []).append(text[:self.max_length])
+        if chat_id not in self._tasks:
+            self._tasks[chat_id] = asyncio.create_task(self._deliver(chat_id))
+
+    def _take_batch(self, chat_id) -> str:
+        texts = self._pending[chat_id]
+        batch = [texts.pop(0)]
+        length = len(batch[0])
+        while texts and length + len(self.separator) + len(texts[0]) <= self.max_length:
+            length += len(self.separator) + len(texts[0])
+            batch.append(texts.pop(0))
+        return self.separator.join(batch)
+
+    async def _deliver(self, chat_id):
+        try:
+            while self._pending.get(chat_id):
+                await self.limiter.acquire(chat_id, BULK)
+                # Склеиваем все, что накопилось, пока ждали лимит
+                text = self._take_batch(chat_id)
+                try:
+                    await self.send(chat_id, text)
+                except Exception:
+                    logger.error(f"Не удалось отправить уведомление в чат {chat_id}", exc_info=True)
+        finally:
+            self._tasks.pop(chat_id, None)
+            if not self._pending.get(chat_id):
+                self._pending.pop(chat_id, None)
+
+    async def drain(self):
+        """Ждет отправки всех накопленных уведомлений"""
+        while self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
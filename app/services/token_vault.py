@@ -0,0 +1,185 @@
+"""
+Хранилище токенов Facebook: шифрование в БД, кеш расшифрованных токенов
+и фоновое продление долгоживущих токенов
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+import httpx
+from cryptography.fernet import Fernet, InvalidToken
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..db.database import async_session_factory
+from ..db.models import TokenVault as TokenVaultRecord, User
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+GRAPH_TOKEN_URL = "https://graph.facebook.com/v17.0/oauth/access_token"
+PENDING_TOKENS_KEY = "token_vault_pending"
+
+class TokenVault:
+    def __init__(
+        self,
+        encryption_key: Optional[str] = None,
+        session_factory: async_sessionmaker = async_session_factory,
+        cache_ttl_seconds: float = settings.TOKEN_CACHE_TTL_SECONDS,
+        cache_max_size: int = settings.TOKEN_CACHE_MAX_SIZE
+    ):
+        self._encryption_key = encryption_key or settings.TOKEN_ENCRYPTION_KEY
+        self._fernet: Optional[Fernet] = None
+        self.session_factory = session_factory
+        self.cache = LRUCache(cache_max_size, cache_ttl_seconds)
+
+    @property
+    def configured(self) -> bool:
+        return bool(self._encryption_key)
+
+    @property
+    def fernet(self) -> Fernet:
+        if self._fernet is None:
+            if not self._encryption_key:
+                raise ValueError("Не установлен TOKEN_ENCRYPTION_KEY")
+            self._fernet = Fernet(self._encryption_key)
+        return self._fernet
+
+    async def store_token(
+        self,
+        session: AsyncSession,
+        user_id: int,
+        access_token: str,
+        expires_at: Optional[datetime] = None
+    ):
+        """Шифрует и сохраняет токен пользователя (commit остается за вызывающим)"""
+        record = await session.get(TokenVaultRecord, user_id)
+        if record is None:
+            record = TokenVaultRecord(user_id=user_id)
+            session.add(record)
+        record.encrypted_token = self.fernet.encrypt(access_token.encode('utf-8'))
+        record.expires_at = expires_at
+
+        # Токен больше не хранится в открытом виде
+        user = await session.get(User, user_id)
+        if user is not None and user.fb_access_token:
+            user.fb_access_token = None
+
+        # В кеш токен попадет только после commit (см. _publish_stored_tokens)
+        self.cache.invalidate(user_id)
+        session.sync_session.info.setdefault(PENDING_TOKENS_KEY, []).append(
+            (self, user_id, access_token, expires_at)
+        )
+
+    async def get_token(self, session: AsyncSession, user_id: int) -> Optional[str]:
+        """
+        Возвращает токен пользователя.
+        Расшифровка выполняется только при промахе кеша.
+        """
+        cached = self.cache.get(user_id)
+        if cached is not None:
+            access_token, expires_at = cached
+            if expires_at is None or expires_at > datetime.now():
+                return access_token
+            self.cache.invalidate(user_id)
+
+        record = await session.get(TokenVaultRecord, user_id)
+        if record is None:
+            return None
+        if record.expires_at and record.expires_at <= datetime.now():
+            logger.warning(f"Токен пользователя {user_id} истек")
+            return None
+        try:
+            access_token = self.fernet.decrypt(record.encrypted_token).decode('utf-8')
+        except InvalidToken:
+            logger.error(f"Не удалось расшифровать токен пользователя {user_id}")
+            return None
+
+        self.cache.set(user_id, (access_token, record.expires_at))
+        return access_token
+
+    async def migrate_plaintext_tokens(self) -> int:
+        """Переносит токены из users.fb_access_token в зашифрованное хранилище"""
+        migrated = 0
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(User).where(User.fb_access_token.is_not(None))
+            )
+            for user in result.scalars():
+                await self.store_token(session, user.id, user.fb_access_token)
+                migrated += 1
+            await session.commit()
+        if migrated:
+            logger.info(f"Токены перенесены в зашифрованное хранилище: {migrated}")
+        return migrated
+
+    async def exchange_token(self, access_token: str) -> Tuple[str, Optional[datetime]]:
+        """Обменивает токен на долгоживущий через Graph API"""
+        params = {
+            "grant_type": "fb_exchange_token",
+            "client_id": settings.FACEBOOK_APP_ID,
+            "client_secret": settings.FACEBOOK_APP_SECRET,
+            "fb_exchange_token": access_token,
+        }
+        async with httpx.AsyncClient() as client:
+            response = await client.get(GRAPH_TOKEN_URL, params=params)
+            response.raise_for_status()
+            token_data = response.json()
+
+        expires_in = token_data.get("expires_in")
+        expires_at = datetime.now() + timedelta(seconds=int(expires_in)) if expires_in else None
+        return token_data["access_token"], expires_at
+
+    async def refresh_expiring_tokens(self, now: Optional[datetime] = None) -> int:
+        """Продлевает токены, срок действия которых скоро истекает"""
+        now = now or datetime.now()
+        threshold = now + timedelta(days=settings.TOKEN_REFRESH_BEFORE_DAYS)
+        refreshed = 0
+
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(TokenVaultRecord).where(
+                    TokenVaultRecord.expires_at.is_not(None),
+                    TokenVaultRecord.expires_at > now,
+                    TokenVaultRecord.expires_at < threshold
+                )
+            )
+            for record in result.scalars().all():
+                try:
+                    current = await self.get_token(session, record.user_id)
+                    if current is None:
+                        continue
+                    new_token, expires_at = await self.exchange_token(current)
+                    await self.store_token(session, record.user_id, new_token, expires_at)
+                    refreshed += 1
+                except Exception as e:
+                    logger.error(f"Не удалось продлить токен пользователя {record.user_id}: {e}")
+            await session.commit()
+
+        if refreshed:
+            logger.info(f"Продлено токенов: {refreshed}")
+        return refreshed
+
+    async def run_forever(self, interval_seconds: int = 3600):
+        """Фоновое продление токенов"""
+        while True:
+            try:
+                await self.refresh_expiring_tokens()
+            except Exception:
+                logger.error("Ошибка фонового продления токенов", exc_info=True)
+            await asyncio.sleep(interval_seconds)
+
+@event.listens_for(Session, "after_commit")
+def _publish_stored_tokens(session: Session):
+    for vault, user_id, access_token, expires_at in session.info.pop(PENDING_TOKENS_KEY, []):
+        vault.cache.set(user_id, (access_token, expires_at))
+
+@event.listens_for(Session, "after_rollback")
+def _discard_stored_tokens(session: Session):
+    session.info.pop(PENDING_TOKENS_KEY, None)
+
+# Общий экземпляр на процесс, чтобы кеш расшифрованных токенов переиспользовался
+token_vault = TokenVault()
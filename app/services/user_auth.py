@@ -0,0 +1,118 @@
+"""
+Идентификация пользователя в API по проверяемому credential, а не по user_id из запроса.
+
+Поддерживаются два способа:
+- подписанная сессия: Authorization: Bearer <session>, где
+  session = <user_id>.<срок действия>.<nonce>.<HMAC-SHA256>; ее выдает бот
+  (например, в ссылке подключения Facebook) для пользователя, которого он знает по telegram_id;
+- initData Telegram Mini App в заголовке X-Telegram-Init-Data, подписанная токеном бота;
+  пользователь находится по telegram_id.
+
+Подпись сессии считается с другим префиксом, чем OAuth state, поэтому state из
+ссылки авторизации нельзя использовать как сессию.
+"""
+import hashlib
+import hmac
+import json
+import secrets
+import time
+from typing import Optional
+from urllib.parse import parse_qsl
+
+from fastapi import Depends, Header, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from ..db.database import get_readonly_session
+from ..db.models import User
+
+INIT_DATA_HEADER = "X-Telegram-Init-Data"
+
+class AuthError(ValueError):
+    pass
+
+def _secret() -> bytes:
+    secret = settings.SESSION_SECRET or settings.OAUTH_STATE_SECRET or settings.FACEBOOK_APP_SECRET
+    if not secret:
+        raise AuthError("Не задан SESSION_SECRET")
+    return secret.encode('utf-8')
+
+def _signature(payload: str) -> str:
+    return hmac.new(_secret(), f"session:{payload}".encode('utf-8'), hashlib.sha256).hexdigest()
+
+def issue_session(user_id: int, now: Optional[float] = None, ttl_seconds: int = settings.SESSION_TTL_SECONDS) -> str:
+    """Подписанная сессия пользователя"""
+    expires = int((now or time.time()) + ttl_seconds)
+    payload = f"{int(user_id)}.{expires}.{secrets.token_urlsafe(12)}"
+    return f"{payload}.{_signature(payload)}"
+
+def verify_session(token: str, now: Optional[float] = None) -> int:
+    """Проверяет подпись и срок действия сессии; возвращает user_id"""
+    try:
+        payload, signature = token.rsplit('.', 1)
+        user_id, expires, _ = payload.split('.', 2)
+        user_id, expires = int(user_id), int(expires)
+    except ValueError:
+        raise AuthError("Некорректная сессия")
+    if not hmac.compare_digest(signature, _signature(payload)):
+        raise AuthError("Неверная подпись сессии")
+    if expires < (now or time.time()):
+        raise AuthError("Срок действия сессии истек")
+    return user_id
+
+def verify_init_data(
+    init_data: str,
+    bot_token: Optional[str] = None,
+    now: Optional[float] = None,
+    max_age_seconds: int = settings.TELEGRAM_INIT_DATA_TTL_SECONDS
+) -> int:
+    """
+    Проверяет initData Telegram Mini App (hash = HMAC-SHA256 от отсортированных полей
+    ключом HMAC-SHA256("WebAppData", токен бота)); возвращает telegram_id пользователя.
+    """
+    bot_token = bot_token or settings.TELEGRAM_BOT_TOKEN
+    if not bot_token:
+        raise AuthError("Не задан TELEGRAM_BOT_TOKEN")
+    fields = dict(parse_qsl(init_data, keep_blank_values=True))
+    received = fields.pop('hash', None)
+    if not received:
+        raise AuthError("В initData нет hash")
+    check_string = "\n".join(f"{key}={value}" for key, value in sorted(fields.items()))
+    secret = hmac.new(b"WebAppData", bot_token.encode('utf-8'), hashlib.sha256).digest()
+    expected = hmac.new(secret, check_string.encode('utf-8'), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(received, expected):
+        raise AuthError("Неверная подпись initData")
+    try:
+        auth_date = int(fields['auth_date'])
+        telegram_id = int(json.loads(fields['user'])['id'])
+    except (KeyError, ValueError, TypeError):
+        raise AuthError("Некорректные initData")
+    if auth_date + max_age_seconds < (now or time.time()):
+        raise AuthError("Срок действия initData истек")
+    return telegram_id
+
+async def user_id_for_telegram(session: AsyncSession, telegram_id: int) -> Optional[int]:
+    result = await session.execute(select(User.id).where(User.telegram_id == telegram_id))
+    return result.scalar()
+
+async def current_user_id(
+    authorization: Optional[str] = Header(None),
+    init_data: Optional[str] = Header(None, alias=INIT_DATA_HEADER),
+    session: AsyncSession = Depends(get_readonly_session)
+) -> int:
+    """Зависимость FastAPI: user_id из подписанной сессии или initData Telegram, иначе 401"""
+    try:
+        if authorization:
+            scheme, _, token = authorization.partition(' ')
+            if scheme.lower() != 'bearer' or not token:
+                raise AuthError("Ожидается Authorization: Bearer <session>")
+            return verify_session(token.strip())
+        if init_data:
+            user_id = await user_id_for_telegram(session, verify_init_data(init_data))
+            if user_id is None:
+                raise AuthError("Пользователь Telegram не зарегистрирован")
+            return user_id
+    except AuthError as e:
+        raise HTTPException(status_code=401, detail=str(e), headers={"WWW-Authenticate": "Bearer"})
+    raise HTTPException(status_code=401, detail="Требуется авторизация", headers={"WWW-Authenticate": "Bearer"})
@@ -0,0 +1,136 @@
+"""
+Разворачивание анализа креатива в структурированный тест:
+тексты объявлений × аудитории × места размещения.
+
+Почти одинаковые тексты отбрасываются по сходству символьных триграмм
+(матрица вхождений, пересечения считаются одним матричным умножением).
+Каждая пара аудитория × размещение — отдельная группа объявлений с равной
+долей бюджета, каждый текст — отдельное объявление внутри группы.
+"""
+import re
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# Рекомендации анализа -> параметры размещения Graph API
+PLACEMENTS = {
+    "facebook feed": {"publisher_platforms": ["facebook"], "facebook_positions": ["feed"]},
+    "facebook video feeds": {"publisher_platforms": ["facebook"], "facebook_positions": ["video_feeds"]},
+    "facebook stories": {"publisher_platforms": ["facebook"], "facebook_positions": ["story"]},
+    "facebook reels": {"publisher_platforms": ["facebook"], "facebook_positions": ["facebook_reels"]},
+    "instagram feed": {"publisher_platforms": ["instagram"], "instagram_positions": ["stream"]},
+    "instagram stories": {"publisher_platforms": ["instagram"], "instagram_positions": ["story"]},
+    "instagram reels": {"publisher_platforms": ["instagram"], "instagram_positions": ["reels"]},
+    "instagram explore": {"publisher_platforms": ["instagram"], "instagram_positions": ["explore"]},
+}
+AUTOMATIC_PLACEMENT = {"name": "Automatic", "spec": {}}
+DEFAULT_MAX_VARIANTS = 30
+DEFAULT_SIMILARITY_THRESHOLD = 0.6
+MIN_ADSET_DAILY_BUDGET = 1.0  # минимальный дневной бюджет группы объявлений, в валюте аккаунта
+
+def _shingles(text: str, size: int = 3) -> set:
+    normalized = " ".join(re.findall(r"\w+", text.lower()))
+    if len(normalized) <= size:
+        return {normalized}
+    return {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+
+def similarity_matrix(texts: Sequence[str]) -> np.ndarray:
+    """Попарное сходство Жаккара по символьным триграммам"""
+    shingles = [_shingles(text) for text in texts]
+    vocabulary = {shingle: i for i, shingle in enumerate(set().union(*shingles))} if shingles else {}
+    matrix = np.zeros((len(texts), max(len(vocabulary), 1)), dtype=np.float32)
+    for row, items in enumerate(shingles):
+        matrix[row, [vocabulary[item] for item in items]] = 1.0
+    intersection = matrix @ matrix.T
+    sizes = matrix.sum(axis=1)
+    union = sizes[:, None] + sizes[None, :] - intersection
+    return intersection / np.maximum(union, 1.0)
+
+def prune_near_duplicates(texts: Sequence[str], threshold: float = DEFAULT_SIMILARITY_THRESHOLD) -> List[int]:
+    """Индексы оставленных текстов: каждый следующий сравнивается с уже оставленными"""
+    similarity = similarity_matrix(texts)
+    kept: List[int] = []
+    for i, text in enumerate(texts):
+        if not text.strip():
+            continue
+        if not kept or similarity[i, kept].max() < threshold:
+            kept.append(i)
+    return kept
+
+def audience_variants(target_audience: Dict[str, Any], max_single_interest: int = 3) -> List[Dict[str, Any]]:
+    """Широкая аудитория, все интересы вместе и несколько аудиторий по одному интересу"""
+    age_range = str(target_audience.get("age_range", "18-65"))
+    interests = [term for term in target_audience.get("interests", []) if term]
+    audiences = [{"name": "Broad", "age_range": age_range, "interests": []}]
+    if interests:
+        audiences.append({"name": "Interests", "age_range": age_range, "interests": interests})
+    if len(interests) > 1:
+        audiences += [{"name": f"Interest: {term}", "age_range": age_range, "interests": [term]}
+                      for term in interests[:max_single_interest]]
+    return audiences
+
+def placement_variants(suggestions: Sequence[str]) -> List[Dict[str, Any]]:
+    """Известные места размещения из рекомендаций; без них — автоматические"""
+    placements, seen = [], set()
+    for suggestion in suggestions:
+        key = str(suggestion).strip().lower()
+        if key in PLACEMENTS and key not in seen:
+            seen.add(key)
+            placements.append({"name": str(suggestion).strip(), "spec": PLACEMENTS[key]})
+    return placements or [AUTOMATIC_PLACEMENT]
+
+def balanced_budgets(total: float, count: int) -> List[int]:
+    """Делит дневной бюджет поровну в минимальных единицах валюты; остаток — по одной единице первым"""
+    cents = int(round(float(total) * 100))
+    base, remainder = divmod(cents, count)
+    return [base + 1 if i < remainder else base for i in range(count)]
+
+def expand_variants(
+    analysis: Dict[str, Any],
+    preferences: Dict[str, Any],
+    total_budget: float
+) -> Dict[str, Any]:
+    """
+    Строит план теста.
+
+    Returns:
+        Dict: copies — тексты, cells — группы объявлений (аудитория × размещение, бюджет),
+              variants — объявления (текст × группа), pruned — сколько текстов отброшено
+    """
+    max_variants = int(preferences.get("max_variants") or DEFAULT_MAX_VARIANTS)
+    threshold = float(preferences.get("similarity_threshold") or DEFAULT_SIMILARITY_THRESHOLD)
+
+    candidates = [str(copy) for copy in (preferences.get("ad_copies") or analysis.get("ad_copy_suggestions") or [])]
+    kept = prune_near_duplicates(candidates, threshold)
+    copies = [candidates[i] for i in kept][:max_variants] or ["Default ad copy"]
+
+    audiences = audience_variants(analysis.get("target_audience", {}))
+    placements = placement_variants(preferences.get("placements") or analysis.get("placement_suggestions") or [])
+
+    # Сначала самые разнообразные сочетания: по диагоналям сетки аудитория × размещение
+    grid: List[Tuple[int, int]] = sorted(
+        ((a, p) for a in range(len(audiences)) for p in range(len(placements))),
+        key=lambda cell: (cell[0] + cell[1], cell[0])
+    )
+    max_cells = max(1, max_variants // len(copies))
+    affordable = max(1, int(float(total_budget) // MIN_ADSET_DAILY_BUDGET))
+    grid = grid[:min(max_cells, affordable)]
+
+    cells = []
+    for index, ((a, p), budget) in enumerate(zip(grid, balanced_budgets(total_budget, len(grid)))):
+        cells.append({
+            "key": f"cell_{index + 1:02d}",
+            "audience": audiences[a],
+            "placement": placements[p],
+            "daily_budget": budget,
+        })
+    variants = [
+        {"variant_id": f"{cell['key']}_copy_{c + 1:02d}", "cell": cell["key"], "copy_index": c}
+        for cell in cells for c in range(len(copies))
+    ]
+    return {
+        "copies": copies,
+        "cells": cells,
+        "variants": variants,
+        "pruned": len(candidates) - len(kept),
+    }
@@ -1,9 +1,16 @@
 import asyncio
 import os
 import logging
+from typing import Any, Awaitable, Dict, List
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
+from telegram.ext import (
+    Application, BaseUpdateProcessor, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
+)
+
+from .config import settings
+from .services.conversation_state import conversation_states
+from .services.telegram_outbox import FloodControlRateLimiter, NotificationOutbox, BULK
 
 # Загрузка переменных окружения из .env файла для локальной разработки
 load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"))
@@ -18,7 +25,72 @@ logger = logging.getLogger(__name__)
 # Глобальная переменная для хранения экземпляра приложения
 application: Application | None = None
 
-user_states = {}
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обновления одного чата обрабатываются строго по очереди, разных чатов — параллельно.
+
+    Семафор базового класса ограничивает число обновлений в работе, включая ждущие
+    свой чат; отдельный семафор ограничивает число одновременно работающих
+    обработчиков и берется только после блокировки чата, чтобы очередь одного
+    активного чата не занимала слоты остальных.
+    """
+
+    def __init__(self, max_workers: int, max_pending_updates: int):
+        super().__init__(max(max_pending_updates, max_workers))
+        self.max_workers = max_workers
+        self._workers = asyncio.Semaphore(max_workers)
+        # id чата -> [блокировка, число обновлений в работе]
+        self._chats: Dict[Any, List] = {}
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            async with self._workers:
+                await coroutine
+            return
+
+        entry = self._chats.setdefault(chat.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0], self._workers:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._chats.pop(chat.id, None)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+async def _send_bulk(chat_id, text: str):
+    # Разрешение лимитера уже получено очередью уведомлений
+    await application.bot.send_message(
+        chat_id=chat_id, text=text, parse_mode='Markdown',
+        rate_limit_args={"acquired": True, "priority": BULK}
+    )
+
+# Общие на процесс: лимиты Telegram считаются на бота, а не на запрос
+rate_limiter = FloodControlRateLimiter()
+notification_outbox = NotificationOutbox(rate_limiter, _send_bulk)
+
+def build_application(token: str) -> Application:
+    """Приложение PTB с обработчиками и параллельной обработкой обновлений по чатам"""
+    app = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(PerChatUpdateProcessor(
+            settings.TELEGRAM_CONCURRENT_UPDATES, settings.TELEGRAM_MAX_PENDING_UPDATES
+        ))
+        .rate_limiter(rate_limiter)
+        .build()
+    )
+    app.add_handler(CommandHandler("start", start_command_handler))
+    app.add_handler(CallbackQueryHandler(callback_query_handler))
+    app.add_handler(MessageHandler(filters.PHOTO | filters.VIDEO, handle_media))
+    return app
 
 async def start_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отправляет приветственное сообщение с кнопками в ответ на команду /start."""
@@ -38,7 +110,7 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
     query = update.callback_query
     user_id = query.from_user.id
     if query.data == "create_campaign":
-        user_states[user_id] = {"state": "awaiting_media"}
+        await conversation_states.set(user_id, {"state": "awaiting_media"})
         await query.answer()
         await query.edit_message_text(
             text="🎨 *Создание новой кампании*\n\nЗагрузите изображение или видео вашего креатива.",
@@ -49,7 +121,7 @@ async def callback_query_handler(update: Update, context: ContextTypes.DEFAULT_T
 
 async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    state = user_states.get(user_id, {}).get("state")
+    state = (await conversation_states.get(user_id)).get("state")
     if state != "awaiting_media":
         await update.message.reply_text("Сначала нажмите 'Создать кампанию' в меню.")
         return
@@ -67,8 +139,7 @@ async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
         file_bytes = await file.download_as_bytearray()
         # Здесь должен быть реальный анализ, пока мок
         analysis_result = await analyze_media_mock(file_bytes, file_name)
-        user_states[user_id]["analysis"] = analysis_result
-        user_states[user_id]["state"] = "analysis_complete"
+        await conversation_states.update(user_id, analysis=analysis_result, state="analysis_complete")
         await update.message.reply_text(f"Результат анализа: {analysis_result}")
     except Exception as e:
         logger.error(f"Ошибка обработки медиа: {e}")
@@ -88,17 +159,12 @@ async def start_bot():
         return
 
     try:
-        builder = Application.builder().token(TELEGRAM_TOKEN)
-        application = builder.build()
-
-
-        # Добавление обработчиков команд и событий
-        application.add_handler(CommandHandler("start", start_command_handler))
-        application.add_handler(CallbackQueryHandler(callback_query_handler))
-        application.add_handler(MessageHandler(filters.PHOTO | filters.VIDEO, handle_media))
+        application = build_application(TELEGRAM_TOKEN)
 
-        # Инициализация приложения
+        # Приложение живет все время работы сервиса: инициализация один раз,
+        # start() запускает разбор очереди обновлений (и вебхука, и поллинга)
         await application.initialize()
+        await application.start()
 
         if IS_PRODUCTION:
             # Установка вебхука в продакшене
@@ -134,25 +200,39 @@ async def stop_bot():
                 if application.updater and application.updater.is_running:
                     await application.updater.stop()
                     logger.info("Поллинг Telegram остановлен.")
-            
+
+            # Дожидается обработки уже принятых обновлений и отправки накопленных уведомлений
+            await application.stop()
+            await notification_outbox.drain()
             await application.shutdown()
             logger.info("Приложение Telegram успешно завершило работу.")
         except Exception:
             logger.error("Произошла ошибка при остановке бота.", exc_info=True)
 
-async def process_telegram_update(data: dict):
+def enqueue_telegram_update(data: dict) -> bool:
     """
-    Обрабатывает одно обновление от вебхука Telegram.
-    Эта функция вызывается эндпоинтом вебхука в main.py.
+    Ставит обновление от вебхука Telegram в очередь приложения и сразу возвращает управление.
+    Обработка идет в фоне: по очереди внутри чата, параллельно между чатами.
     """
-    if not application:
-        logger.warning("Бот не инициализирован; обработка обновления пропущена.")
-        return
-
+    if not application or not application.running:
+        logger.warning("Бот не инициализирован; обновление пропущено.")
+        return False
     try:
-        async with application:
-            update = Update.de_json(data, application.bot)
-            await application.process_update(update)
+        update = Update.de_json(data, application.bot)
     except Exception:
-        logger.error("Произошла ошибка при обработке обновления Telegram.", exc_info=True)
+        logger.error("Не удалось разобрать обновление Telegram.", exc_info=True)
+        return False
+    application.update_queue.put_nowait(update)
+    return True
 
+async def send_notification(chat_id: int, text: str) -> bool:
+    """
+    Ставит уведомление (алерты, отчеты фоновых задач) в очередь массовых сообщений.
+    Уведомления одному чату, ждущие отправки, склеиваются в одно сообщение;
+    ответы пользователям отправляются раньше. Возвращает False, если бот не запущен.
+    """
+    if not application:
+        logger.warning("Бот не инициализирован; уведомление не отправлено.")
+        return False
+    notification_outbox.enqueue(chat_id, text)
+    return True
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Бэктест правил распределения бюджета на исторических метриках из campaign_metrics.
+
+Дневные метрики выгружаются в .npy (memmap) и прогоняются через BudgetEngine
+для каждой конфигурации параллельно на всех ядрах. Конфигурации задаются
+JSON-файлом (список словарей с переопределениями правил BudgetOptimizer)
+или строятся по сетке по умолчанию.
+
+Пример:
+    python scripts/backtest_sweep.py --daily-budget 1000 --since 2024-01-01 --top 20
+    python scripts/backtest_sweep.py --daily-budget 1000 --configs sweep.json --output results.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.db.database import readonly_session_factory
+from app.services.backtest import parameter_grid, run_sweep, save_metric_arrays
+from app.services.bandit_allocator import load_daily_metrics
+from app.services.budget_optimizer import BudgetOptimizer
+
+def default_grid():
+    """Сетка вокруг текущих правил: масштабы порогов, порог тренда, максимальная доля"""
+    excellent, good, fair = BudgetOptimizer.SCORE_THRESHOLDS
+    return parameter_grid(
+        SCORE_THRESHOLDS=[
+            (excellent * scale, good * scale, fair * scale)
+            for scale in (0.6, 0.7, 0.8, 0.9, 1.0, 1.1, 1.2, 1.35, 1.5, 1.75)
+        ],
+        TREND_THRESHOLD=[0.05, 0.1, 0.15, 0.2, 0.3],
+        MAX_BUDGET_SHARE=[0.3, 0.4, 0.5, 0.6],
+        mode=['rules', 'convex'],
+    )
+
+async def export_metrics(directory: str, since) -> int:
+    async with readonly_session_factory() as session:
+        campaign_ids, arrays = await load_daily_metrics(session, since=since)
+    if campaign_ids:
+        save_metric_arrays(directory, campaign_ids, arrays)
+    return len(campaign_ids)
+
+def main():
+    parser = argparse.ArgumentParser(description="Бэктест стратегий бюджета")
+    parser.add_argument("--daily-budget", type=float, required=True, help="Дневной бюджет портфеля")
+    parser.add_argument("--since", default=None, help="Начальная дата YYYY-MM-DD")
+    parser.add_argument("--configs", default=None, help="JSON-файл со списком конфигураций")
+    parser.add_argument("--workers", type=int, default=None, help="Процессов (по умолчанию все ядра)")
+    parser.add_argument("--workdir", default=None, help="Каталог для .npy (по умолчанию временный)")
+    parser.add_argument("--top", type=int, default=10, help="Сколько лучших конфигураций вывести")
+    parser.add_argument("--output", default=None, help="Файл для полного JSON-отчета")
+    args = parser.parse_args()
+
+    if args.configs:
+        with open(args.configs, encoding="utf-8") as f:
+            configs = json.load(f)
+    else:
+        configs = default_grid()
+    since = date.fromisoformat(args.since) if args.since else None
+
+    with tempfile.TemporaryDirectory(dir=args.workdir) as directory:
+        if not asyncio.run(export_metrics(directory, since)):
+            print("❌ Нет дневных метрик для бэктеста")
+            return
+        started = time.perf_counter()
+        results = run_sweep(directory, configs, args.daily_budget, args.workers)
+        elapsed = time.perf_counter() - started
+
+    results.sort(key=lambda result: result['roas'], reverse=True)
+    print(f"✅ {len(results)} конфигураций за {elapsed:.1f} с")
+    for result in results[:args.top]:
+        print(f"ROAS {result['roas']:.3f}  впустую {result['wasted_share']:.1%}  {result['config']}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
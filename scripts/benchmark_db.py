@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк базы данных на ORM-моделях проекта.
+
+Заполняет SQLite синтетическими пользователями, кампаниями, креативами,
+бюджетами и метриками, измеряет скорость вставки, типовые запросы,
+чтение JSON-колонок и конкуренцию нескольких процессов-писателей
+в режимах WAL и rollback journal. Результаты пишутся в JSON,
+который можно сравнить с прогоном на другом коммите (--compare).
+
+Пример:
+    python scripts/benchmark_db.py --scales 1000,100000 --output bench.json
+    python scripts/benchmark_db.py --scales 1000 --compare bench.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine, event, insert, select, func, text, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.db.models import Base, User, Campaign, Creative, Budget, CampaignMetric
+
+JOURNAL_MODES = {"wal": "WAL", "rollback": "DELETE"}
+INSERT_CHUNK = 10000
+
+def _set_pragmas(journal_mode: str):
+    def listener(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+    return listener
+
+def _timings_report(durations: List[float]) -> Dict[str, float]:
+    """Сводка по списку длительностей операций (в секундах)"""
+    ordered = sorted(durations)
+    total = sum(ordered)
+    return {
+        "ops": len(ordered),
+        "seconds": round(total, 6),
+        "ops_per_sec": round(len(ordered) / total, 2) if total > 0 else 0.0,
+        "p50_ms": round(statistics.median(ordered) * 1000, 4),
+        "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 4),
+    }
+
+def _synthetic_rows(scale: int, seed: int) -> Dict[str, Iterator[dict]]:
+    """
+    Синтетические данные: scale кампаний, креативов и дневных метрик.
+    Строки генерируются лениво, у каждой таблицы свой генератор случайных чисел,
+    поэтому в памяти одновременно только одна пачка вставки.
+    """
+    users_count = max(scale // 100, 1)
+    start_day = datetime(2025, 1, 1)
+
+    def users():
+        for i in range(users_count):
+            yield {
+                "id": i + 1,
+                "telegram_id": 10_000_000 + i,
+                "fb_account_id": f"act_{i}",
+            }
+
+    def campaigns():
+        rng = random.Random(f"{seed}:campaigns")
+        for i in range(scale):
+            yield {
+                "id": i + 1,
+                "fb_campaign_id": f"bench_{i}",
+                "user_id": rng.randint(1, users_count),
+                "name": f"Campaign {i}",
+                "status": rng.choice(["ACTIVE", "ACTIVE", "PAUSED"]),
+                "objective": "CONVERSIONS",
+                "daily_budget": round(rng.uniform(10, 500), 2),
+                "total_spent": 0.0,
+                "stats": {"impressions": rng.randint(0, 10000), "clicks": rng.randint(0, 500)},
+            }
+
+    def creatives():
+        rng = random.Random(f"{seed}:creatives")
+        for i in range(scale):
+            yield {
+                "campaign_id": rng.randint(1, scale),
+                "fb_creative_id": f"creative_{i}",
+                "type": rng.choice(["image", "video"]),
+                "analysis": {
+                    "score": round(rng.random(), 3),
+                    "analysis": {"keywords": ["a", "b", "c"], "campaign_objective": "CONVERSIONS"},
+                    "raw_response": "x" * rng.randint(200, 2000),
+                },
+                "performance": {"impressions": rng.randint(0, 10000), "clicks": rng.randint(0, 500)},
+            }
+
+    def budgets():
+        rng = random.Random(f"{seed}:budgets")
+        for i in range(users_count):
+            yield {
+                "user_id": i + 1,
+                "budget_type": "daily",
+                "daily_budget": round(rng.uniform(100, 5000), 2),
+                "total_budget": round(rng.uniform(1000, 50000), 2),
+                "start_date": start_day,
+                "end_date": start_day + timedelta(days=90),
+            }
+
+    def metrics():
+        rng = random.Random(f"{seed}:metrics")
+        for i in range(scale):
+            yield {
+                "campaign_id": (i % scale) + 1,
+                "granularity": "day",
+                "period_start": start_day + timedelta(days=i // scale),
+                "impressions": rng.randint(0, 5000),
+                "clicks": rng.randint(0, 200),
+                "conversions": rng.randint(0, 20),
+                "spend": round(rng.uniform(0, 100), 2),
+                "revenue": round(rng.uniform(0, 300), 2),
+            }
+
+    return {"users": users(), "campaigns": campaigns(), "creatives": creatives(),
+            "budgets": budgets(), "metrics": metrics()}
+
+async def _seed(session_factory, rows: Dict[str, Iterator[dict]]) -> Dict[str, Dict[str, float]]:
+    """
+    Вставка пачками по INSERT_CHUNK строк (executemany через ORM bulk insert).
+    Замеряется только работа с БД: генерация пачек в замер не входит.
+    """
+    results = {}
+    for name, model in (("users", User), ("campaigns", Campaign), ("creatives", Creative),
+                        ("budgets", Budget), ("metrics", CampaignMetric)):
+        count, elapsed = 0, 0.0
+        async with session_factory() as session:
+            while True:
+                chunk = list(itertools.islice(rows[name], INSERT_CHUNK))
+                if not chunk:
+                    break
+                started = time.perf_counter()
+                await session.execute(insert(model), chunk)
+                elapsed += time.perf_counter() - started
+                count += len(chunk)
+            started = time.perf_counter()
+            await session.commit()
+            elapsed += time.perf_counter() - started
+        results[f"insert_{name}"] = {
+            "rows": count,
+            "seconds": round(elapsed, 6),
+            "rows_per_sec": round(count / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+    return results
+
+async def _measure(session_factory, iterations: int, make_query) -> Dict[str, float]:
+    durations = []
+    async with session_factory() as session:
+        for i in range(iterations):
+            started = time.perf_counter()
+            await make_query(session, i)
+            durations.append(time.perf_counter() - started)
+    return _timings_report(durations)
+
+async def _query_patterns(session_factory, scale: int, iterations: int, seed: int) -> Dict[str, Dict[str, float]]:
+    """Типовые запросы API и бота"""
+    rng = random.Random(seed)
+    users_count = max(scale // 100, 1)
+    user_ids = [rng.randint(1, users_count) for _ in range(iterations)]
+    campaign_ids = [rng.randint(1, scale) for _ in range(iterations)]
+    period_from = datetime(2025, 1, 1)
+
+    async def user_by_telegram_id(session, i):
+        await session.execute(select(User).where(User.telegram_id == 10_000_000 + user_ids[i] - 1))
+
+    async def campaign_by_pk(session, i):
+        await session.get(Campaign, campaign_ids[i])
+
+    async def active_campaigns_for_user(session, i):
+        result = await session.execute(
+            select(Campaign).where(Campaign.user_id == user_ids[i], Campaign.status == "ACTIVE")
+        )
+        result.scalars().all()
+
+    async def budget_totals_for_user(session, i):
+        await session.execute(
+            select(func.sum(Budget.daily_budget)).where(Budget.user_id == user_ids[i])
+        )
+
+    async def user_spend_last_week(session, i):
+        await session.execute(
+            select(func.sum(CampaignMetric.spend))
+            .join(Campaign, Campaign.id == CampaignMetric.campaign_id)
+            .where(Campaign.user_id == user_ids[i], CampaignMetric.period_start >= period_from)
+        )
+
+    async def creative_json_read(session, i):
+        result = await session.execute(
+            select(Creative.analysis).where(Creative.campaign_id == campaign_ids[i])
+        )
+        for analysis in result.scalars():
+            analysis.get("score")
+
+    async def creative_json_extract(session, i):
+        await session.execute(
+            select(func.json_extract(Creative.analysis, "$.score"))
+            .where(Creative.id == campaign_ids[i])
+        )
+
+    patterns = {
+        "user_by_telegram_id": user_by_telegram_id,
+        "campaign_by_pk": campaign_by_pk,
+        "active_campaigns_for_user": active_campaigns_for_user,
+        "budget_totals_for_user": budget_totals_for_user,
+        "user_spend_last_week": user_spend_last_week,
+        "creative_json_read": creative_json_read,
+        "creative_json_extract": creative_json_extract,
+    }
+    return {
+        f"query_{name}": await _measure(session_factory, iterations, query)
+        for name, query in patterns.items()
+    }
+
+def _writer_process(db_path: str, journal_mode: str, writer_id: int, writes: int, scale: int, queue):
+    """Процесс-писатель: короткие транзакции обновления кампаний, как у воркера uvicorn"""
+    engine = create_engine(f"sqlite:///{db_path}")
+    event.listen(engine, "connect", _set_pragmas(journal_mode))
+    rng = random.Random(writer_id)
+    durations, busy_errors = [], 0
+    with engine.connect() as conn:
+        for _ in range(writes):
+            started = time.perf_counter()
+            try:
+                with conn.begin():
+                    conn.execute(
+                        update(Campaign)
+                        .where(Campaign.id == rng.randint(1, scale))
+                        .values(total_spent=Campaign.total_spent + 1.0)
+                    )
+            except OperationalError:
+                busy_errors += 1
+            durations.append(time.perf_counter() - started)
+    engine.dispose()
+    queue.put((durations, busy_errors))
+
+def _writer_contention(db_path: str, journal_mode: str, writers: int, writes: int, scale: int) -> Dict[str, float]:
+    """Одновременные писатели в отдельных процессах"""
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    processes = [
+        ctx.Process(target=_writer_process, args=(db_path, journal_mode, i, writes, scale, queue))
+        for i in range(writers)
+    ]
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    collected = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+    wall = time.perf_counter() - started
+
+    durations = [d for chunk, _ in collected for d in chunk]
+    report = _timings_report(durations)
+    report.update({
+        "writers": writers,
+        "wall_seconds": round(wall, 6),
+        "throughput_per_sec": round(len(durations) / wall, 2) if wall > 0 else 0.0,
+        "busy_errors": sum(errors for _, errors in collected),
+    })
+    return report
+
+async def run_scale(scale: int, mode: str, workdir: str, iterations: int,
+                    writers: int, writes: int, seed: int) -> Dict[str, Dict[str, float]]:
+    """Полный прогон для одного масштаба и режима журнала"""
+    journal_mode = JOURNAL_MODES[mode]
+    db_path = os.path.join(workdir, f"bench_{scale}_{mode}.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    event.listen(engine.sync_engine, "connect", _set_pragmas(journal_mode))
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    results = await _seed(session_factory, _synthetic_rows(scale, seed))
+    results.update(await _query_patterns(session_factory, scale, iterations, seed))
+    async with engine.connect() as conn:
+        page_count = (await conn.execute(text("PRAGMA page_count"))).scalar()
+        page_size = (await conn.execute(text("PRAGMA page_size"))).scalar()
+    results["db_size"] = {"bytes": page_count * page_size}
+    await engine.dispose()
+
+    results["writer_contention"] = _writer_contention(db_path, journal_mode, writers, writes, scale)
+    return results
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).decode().strip()
+    except Exception:
+        return None
+
+def run_benchmarks(scales: List[int], modes: List[str], workdir: Optional[str] = None,
+                   iterations: int = 200, writers: int = 4, writes: int = 200,
+                   seed: int = 42) -> Dict:
+    """Запускает бенчмарк и возвращает машиночитаемый отчет"""
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "params": {"iterations": iterations, "writers": writers, "writes": writes, "seed": seed},
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory(dir=workdir) as tmpdir:
+        for scale in scales:
+            for mode in modes:
+                print(f"▶ scale={scale} mode={mode}", file=sys.stderr)
+                report["results"][f"{scale}/{mode}"] = asyncio.run(
+                    run_scale(scale, mode, tmpdir, iterations, writers, writes, seed)
+                )
+    return report
+
+def compare_reports(current: Dict, previous: Dict) -> List[str]:
+    """Сравнивает два отчета по ключевым метрикам (отношение текущее/прошлое)"""
+    lines = []
+    for key, benchmarks in current["results"].items():
+        old_benchmarks = previous.get("results", {}).get(key)
+        if not old_benchmarks:
+            continue
+        for name, values in benchmarks.items():
+            old_values = old_benchmarks.get(name, {})
+            for metric in ("rows_per_sec", "ops_per_sec", "throughput_per_sec", "p99_ms", "bytes"):
+                if metric in values and old_values.get(metric):
+                    ratio = values[metric] / old_values[metric]
+                    lines.append(f"{key:>16} {name:<34} {metric:<18} {ratio:6.2f}x")
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк БД на ORM-моделях")
+    parser.add_argument("--scales", default="1000,100000,1000000",
+                        help="Масштабы (количество кампаний) через запятую")
+    parser.add_argument("--modes", default="wal,rollback", help="Режимы журнала: wal,rollback")
+    parser.add_argument("--iterations", type=int, default=200, help="Повторов каждого запроса")
+    parser.add_argument("--writers", type=int, default=4, help="Процессов-писателей")
+    parser.add_argument("--writes", type=int, default=200, help="Транзакций на писателя")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", default=None, help="Каталог для временных БД")
+    parser.add_argument("--output", default=None, help="Файл для JSON-отчета (по умолчанию stdout)")
+    parser.add_argument("--compare", default=None, help="JSON-отчет прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    report = run_benchmarks(
+        scales=[int(s) for s in args.scales.split(",") if s],
+        modes=[m for m in args.modes.split(",") if m],
+        workdir=args.workdir,
+        iterations=args.iterations,
+        writers=args.writers,
+        writes=args.writes,
+        seed=args.seed,
+    )
+
+    payload = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload)
+    else:
+        print(payload)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+        print("\n".join(compare_reports(report, previous)), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
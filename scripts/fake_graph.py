@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Фейковый Graph API для офлайн-разработки и нагрузочных тестов.
+Приложение в MOCK_MODE обращается к нему по FAKE_GRAPH_URL
+(при FAKE_GRAPH_EMBEDDED=false сервер нужно запустить этим скриптом).
+
+Пример:
+    python scripts/fake_graph.py --port 8765 --seed 1 --latency-ms 120 --error-rate 0.01
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import uvicorn
+
+from app.services.fake_graph import create_fake_graph_app
+
+def main():
+    parser = argparse.ArgumentParser(description="Фейковый Graph API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=80.0)
+    parser.add_argument("--latency-jitter-ms", type=float, default=40.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля запросов с временной ошибкой #2")
+    parser.add_argument("--rate-limit", type=int, default=600, help="Запросов в минуту на токен до ошибки #17")
+    args = parser.parse_args()
+
+    app = create_fake_graph_app(
+        seed=args.seed,
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit_per_minute=args.rate_limit
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
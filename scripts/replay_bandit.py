@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Офлайн-сравнение распределения бюджета Thompson sampling с текущими правилами
+BudgetOptimizer на исторических дневных метриках из campaign_metrics.
+
+Пример:
+    python scripts/replay_bandit.py --daily-budget 1000 --since 2025-01-01
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.db.database import readonly_session_factory
+from app.services.bandit_allocator import load_daily_metrics, replay
+
+async def run(args) -> dict:
+    campaign_ids = [int(value) for value in args.campaigns.split(",")] if args.campaigns else None
+    since = date.fromisoformat(args.since) if args.since else None
+    async with readonly_session_factory() as session:
+        ids, arrays = await load_daily_metrics(session, campaign_ids, since)
+    if not ids:
+        return {}
+    return replay(ids, daily_budget=args.daily_budget, seed=args.seed, samples=args.samples, **arrays)
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay: Thompson sampling против правил")
+    parser.add_argument("--daily-budget", type=float, required=True, help="Дневной бюджет портфеля")
+    parser.add_argument("--campaigns", default=None, help="ID кампаний через запятую (по умолчанию все)")
+    parser.add_argument("--since", default=None, help="Начальная дата YYYY-MM-DD")
+    parser.add_argument("--samples", type=int, default=256, help="Выборок на одно распределение")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if not report:
+        print("❌ Нет дневных метрик для прогона")
+        return
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.db.models import Base, User, Campaign, CampaignMetric
+from app.services.anomaly_detection import AnomalyMonitor, StreamingAnomalyDetector
+
+def _train(detector, keys, hours=48, seed=0):
+    rng = np.random.default_rng(seed)
+    for step in range(hours):
+        spend = rng.normal(10.0, 1.0, len(keys))
+        impressions = np.full(len(keys), 1000)
+        clicks = rng.binomial(1000, 0.02, len(keys))
+        detector.update(keys, step % 24, spend, impressions, clicks)
+
+def test_flags_spend_spike_and_ctr_collapse_only():
+    detector = StreamingAnomalyDetector()
+    keys = list(range(2000))
+    _train(detector, keys)
+
+    spend = np.full(len(keys), 10.0)
+    clicks = np.full(len(keys), 20)
+    spend[7] = 60.0
+    clicks[42] = 2
+    anomalies = detector.evaluate(keys, 5, spend, np.full(len(keys), 1000), clicks)
+
+    assert {(a['campaign_id'], a['kind']) for a in anomalies} == {(7, 'spend_spike'), (42, 'ctr_collapse')}
+
+def test_partial_hour_spend_is_extrapolated():
+    detector = StreamingAnomalyDetector()
+    _train(detector, [1])
+    # За 15 минут потрачено 15 — темп 60 в час
+    anomalies = detector.evaluate([1], 3, [15.0], [250], [5], elapsed=0.25)
+    assert [a['kind'] for a in anomalies] == ['spend_spike']
+    assert anomalies[0]['value'] == pytest.approx(60.0)
+
+def test_no_alerts_before_warmup():
+    detector = StreamingAnomalyDetector()
+    detector.update([1], 0, [10.0], [1000], [20])
+    assert detector.evaluate([1], 1, [100.0], [1000], [0]) == []
+
+@pytest.mark.asyncio
+async def test_monitor_alerts_once_per_hour(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/anomaly.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    now = datetime(2025, 3, 10, 12, 30)
+    current_hour = now.replace(minute=0)
+
+    async with session_factory() as session:
+        user = User(telegram_id=555)
+        session.add(user)
+        await session.flush()
+        campaign = Campaign(fb_campaign_id="fb_1", name="Весна", user_id=user.id, status="ACTIVE")
+        session.add(campaign)
+        await session.flush()
+        for hours_ago in range(1, 49):
+            session.add(CampaignMetric(campaign_id=campaign.id, granularity='hour',
+                                       period_start=current_hour - timedelta(hours=hours_ago),
+                                       spend=10.0 + hours_ago % 3, impressions=1000, clicks=20))
+        session.add(CampaignMetric(campaign_id=campaign.id, granularity='hour', period_start=current_hour,
+                                   spend=40.0, impressions=500, clicks=10))
+        await session.commit()
+
+    sent = []
+    async def notify(chat_id, text):
+        sent.append((chat_id, text))
+        return True
+
+    monitor = AnomalyMonitor(session_factory=session_factory, notify=notify)
+    await monitor.warm_up(days=3, now=now)
+    anomalies = await monitor.tick(now)
+    assert [a['kind'] for a in anomalies] == ['spend_spike']
+    assert sent and sent[0][0] == 555 and "Весна" in sent[0][1]
+
+    assert await monitor.tick(now + timedelta(minutes=2)) == []
+    assert len(sent) == 1
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from app.services.backtest import backtest, load_metric_arrays, parameter_grid, run_sweep, save_metric_arrays
+
+def _arrays(days=60, campaigns=6, seed=1):
+    rng = np.random.default_rng(seed)
+    spend = rng.uniform(20, 80, (days, campaigns))
+    clicks = spend * rng.uniform(0.5, 1.5, campaigns)
+    conversions = clicks * np.linspace(0.01, 0.06, campaigns)
+    return {
+        'impressions': clicks * 40,
+        'clicks': clicks,
+        'conversions': conversions,
+        'spend': spend,
+        'revenue': conversions * 50,
+    }
+
+def test_backtest_reports_roas_and_wasted_spend():
+    result = backtest(_arrays(), {'mode': 'rules'}, daily_budget=300)
+    assert 0 < result['spend'] <= 60 * 300 + 1e-6
+    assert result['roas'] == pytest.approx(result['revenue'] / result['spend'], rel=1e-3)
+    assert 0 <= result['wasted_share'] <= 1
+
+def test_parameter_grid_is_cartesian():
+    grid = parameter_grid(TREND_THRESHOLD=[0.05, 0.1], mode=['rules', 'convex'])
+    assert len(grid) == 4
+    assert {'TREND_THRESHOLD': 0.1, 'mode': 'convex'} in grid
+
+def test_sweep_over_memmap_matches_single_run(tmp_path):
+    arrays = _arrays()
+    save_metric_arrays(str(tmp_path), [f"c{i}" for i in range(6)], arrays)
+    loaded = load_metric_arrays(str(tmp_path))
+    assert isinstance(loaded['spend'], np.memmap)
+
+    configs = parameter_grid(TREND_THRESHOLD=[0.05, 0.2], MAX_BUDGET_SHARE=[0.3, 0.5])
+    results = run_sweep(str(tmp_path), configs, daily_budget=300, max_workers=2, chunk_size=1)
+    assert [result['config'] for result in results] == configs
+    assert results[1] == backtest(loaded, configs[1], daily_budget=300)
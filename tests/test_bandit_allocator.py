@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from app.services.bandit_allocator import BanditAllocator, replay
+
+def test_allocation_respects_budget_and_shares():
+    allocator = BanditAllocator(daily_budget=1000, seed=1)
+    allocator.update(["a", "b", "c", "d"], [500, 500, 500, 500], [50, 10, 5, 1], [1000, 1000, 1000, 1000])
+    budgets = allocator.allocate(["a", "b", "c", "d"])
+
+    assert budgets.sum() == pytest.approx(1000)
+    assert budgets.min() >= 100 - 1e-9 and budgets.max() <= 500 + 1e-9
+    assert budgets[0] == budgets.max()
+
+def test_many_arms_follow_sampling_not_uniform_split():
+    allocator = BanditAllocator(daily_budget=1000, seed=4)
+    keys = [f"c{i}" for i in range(25)]
+    conversions = np.linspace(1, 60, 25)
+    allocator.update(keys, np.full(25, 1000), conversions, np.full(25, 1000))
+    budgets = allocator.allocate(keys)
+
+    assert budgets.sum() == pytest.approx(1000)
+    assert budgets.min() >= 1000 * 0.5 / 25 - 1e-9
+    assert budgets.argmax() == 24
+    assert budgets[24] > 5 * budgets[0]
+
+def test_incremental_updates_accumulate_repeated_rows():
+    allocator = BanditAllocator(daily_budget=100, seed=2)
+    allocator.update(["a", "a", "b"], [10, 5, 3], [1, 2, 0], [20, 10, 6])
+    allocator.update(["b"], [2], [1], [4])
+    rows = allocator.rows_for(["a", "b"])
+    assert allocator.clicks[rows].tolist() == [15, 5]
+    assert allocator.conversions[rows].tolist() == [3, 1]
+    assert allocator.spend[rows].tolist() == [30, 10]
+
+def test_low_data_campaign_keeps_exploration_budget():
+    allocator = BanditAllocator(daily_budget=1000, min_share=0.0, max_share=1.0, seed=3)
+    # Кампания с малым объемом данных и та же точечная оценка, что у проверенной
+    allocator.update(["proven", "new"], [10000, 10], [200, 0], [10000, 10])
+    budgets = allocator.allocate(["proven", "new"])
+    assert budgets[1] > 0
+
+def test_replay_scores_strategies():
+    rng = np.random.default_rng(5)
+    days, campaigns = 30, 8
+    spend = rng.uniform(50, 150, (days, campaigns))
+    clicks = spend * rng.uniform(0.5, 1.5, campaigns)
+    conversions = clicks * np.linspace(0.005, 0.08, campaigns)
+    revenue = conversions * 40
+    impressions = clicks * 50
+
+    report = replay([f"c{i}" for i in range(campaigns)], impressions, clicks, conversions,
+                    spend, revenue, daily_budget=1000, seed=5)
+    assert set(report) == {'rules', 'bandit', 'uniform'}
+    assert report['bandit']['spend'] == pytest.approx(days * 1000, rel=1e-6)
+    assert report['bandit']['conversions'] > report['uniform']['conversions']
@@ -0,0 +1,77 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.bot import handlers
+from app.db.models import Base, Campaign, CampaignSummary, User, UserDashboardSummary
+
+class FakeQuery:
+    def __init__(self, data):
+        self.data = data
+        self.edits = []
+
+    async def answer(self):
+        pass
+
+    async def edit_message_text(self, text, reply_markup=None, parse_mode=None):
+        self.edits.append((text, reply_markup))
+
+async def _callback(handler, data, telegram_id=777):
+    query = FakeQuery(data)
+    await handler(SimpleNamespace(callback_query=query, effective_user=SimpleNamespace(id=telegram_id)), None)
+    return query.edits[-1]
+
+@pytest.mark.asyncio
+async def test_campaign_pages_and_budget_come_from_summaries(tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/bot.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    now = datetime(2025, 3, 10, 12)
+
+    async with session_factory() as session:
+        user = User(telegram_id=777)
+        session.add(user)
+        await session.flush()
+        for i in range(250):
+            campaign = Campaign(fb_campaign_id=f"fb_{i}", user_id=user.id, name=f"Campaign_{i}",
+                                status="ACTIVE" if i % 10 else "PAUSED")
+            session.add(campaign)
+            await session.flush()
+            session.add(CampaignSummary(campaign_id=campaign.id, user_id=user.id, name=campaign.name,
+                                        status=campaign.status, daily_budget=10.0, spend_today=1.5,
+                                        roas_7d=2.0, refreshed_at=now))
+        session.add(UserDashboardSummary(user_id=user.id, daily_budget=2250.0, spend_today=337.5,
+                                         remaining_budget=1912.5, active_campaigns=225,
+                                         top_campaigns=[{"name": "Campaign_1", "roas": 2.0, "spend": 10.0}],
+                                         refreshed_at=now))
+        await session.commit()
+
+    monkeypatch.setattr(handlers, "readonly_session_factory", session_factory)
+    statements = []
+    event.listen(engine.sync_engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+
+    text, markup = await _callback(handlers.show_campaigns, "campaigns_active")
+    assert text.count("Campaign\\_") == handlers.CAMPAIGNS_PAGE_SIZE
+    assert markup.inline_keyboard[0][0].callback_data == "campaigns_active_1"
+    assert len(statements) == 1
+
+    text, markup = await _callback(handlers.show_campaigns, "campaigns_active_22")
+    assert text.count("Campaign\\_") == 5 and "225. " in text
+    assert [button.callback_data for button in markup.inline_keyboard[0]] == ["campaigns_active_21"]
+
+    text, _ = await _callback(handlers.show_campaigns, "campaigns_paused_2")
+    assert text.count("Campaign\\_") == 5
+
+    statements.clear()
+    text, markup = await _callback(handlers.budget_handler, "budget")
+    assert "Осталось: $1912.50" in text and "Активных кампаний: 225" in text
+    assert markup is handlers.BUDGET_KEYBOARD
+    assert len(statements) == 1
+
+    _, markup = await _callback(handlers.back_to_main, "back_to_main")
+    assert markup is handlers.MAIN_MENU_KEYBOARD
@@ -0,0 +1,99 @@
+import time
+
+import numpy as np
+import pytest
+
+from app.services.budget_allocation import ConvexBudgetAllocator
+from app.services.budget_engine import BudgetEngine
+
+def _portfolio(rng, size, daily_budget):
+    marginal_rates = rng.uniform(0.01, 0.2, size)
+    previous = rng.uniform(0.5, 1.5, size) * daily_budget / size
+    return marginal_rates, previous
+
+def test_allocation_satisfies_constraints_and_optimality():
+    rng = np.random.default_rng(3)
+    allocator = ConvexBudgetAllocator(daily_budget=1000, min_share=0.01, max_share=0.2, ramp_limit=0.5)
+    marginal_rates, previous = _portfolio(rng, 40, 1000)
+    budgets = allocator.allocate(marginal_rates, previous, previous)
+    lower, upper = allocator.bounds(previous)
+
+    assert budgets.sum() == pytest.approx(1000, rel=1e-9)
+    assert np.all(budgets >= lower - 1e-9) and np.all(budgets <= upper + 1e-9)
+
+    # Условие ККТ: у кампаний внутри границ одинаковая предельная отдача
+    marginal = marginal_rates / (1 + budgets / previous)
+    free = (budgets > lower + 1e-6) & (budgets < upper - 1e-6)
+    assert free.sum() > 1
+    assert np.ptp(marginal[free]) < 1e-6 * marginal[free].max()
+
+    # Сдвиг бюджета между свободными кампаниями не увеличивает конверсии
+    best = allocator.expected_conversions(budgets, marginal_rates, previous)
+    i, j = np.flatnonzero(free)[:2]
+    shifted = budgets.copy()
+    shifted[i] += 1
+    shifted[j] -= 1
+    assert allocator.expected_conversions(shifted, marginal_rates, previous) <= best
+
+def test_share_floors_fit_campaign_count():
+    allocator = ConvexBudgetAllocator(daily_budget=100, min_share=0.1, max_share=0.5, ramp_limit=None)
+    budgets = allocator.allocate(np.linspace(0.01, 0.2, 20), np.full(20, 5.0), np.full(20, 5.0))
+    lower, _ = allocator.bounds(np.full(20, 5.0))
+    assert not allocator.floors_scaled
+    assert lower.sum() == pytest.approx(50)
+    assert budgets.sum() == pytest.approx(100)
+    assert np.ptp(budgets) > 1
+
+def test_ramp_floors_are_scaled_when_they_exceed_budget():
+    allocator = ConvexBudgetAllocator(daily_budget=100, min_share=0.1, max_share=0.5, ramp_limit=0.3)
+    # Прошлые бюджеты вдвое больше нового общего: минимумы рампы не помещаются
+    budgets = allocator.allocate(np.ones(20), np.ones(20), np.full(20, 10.0))
+    assert allocator.floors_scaled
+    assert budgets.sum() == pytest.approx(100)
+
+def test_warm_start_reallocates_large_portfolio_quickly():
+    rng = np.random.default_rng(11)
+    allocator = ConvexBudgetAllocator(daily_budget=50000, min_share=1e-5, max_share=1e-3, ramp_limit=0.3)
+    marginal_rates, previous = _portfolio(rng, 5000, 50000)
+
+    allocator.allocate(marginal_rates, previous, previous)
+    cold_iterations = allocator.last_iterations
+
+    drifted = marginal_rates * rng.uniform(0.98, 1.02, 5000)
+    started = time.perf_counter()
+    budgets = allocator.allocate(drifted, previous, previous)
+    assert time.perf_counter() - started < 1.0
+    assert allocator.last_iterations < cold_iterations
+    assert budgets.sum() == pytest.approx(50000, rel=1e-9)
+
+def test_engine_convex_mode_prefers_efficient_campaigns():
+    engine = BudgetEngine(total_budget=10000, daily_budget=1000, allocation_mode='convex')
+    metrics = [
+        {'campaign_id': 'a', 'roas': 3.0, 'ctr': 0.02, 'conversion_rate': 0.05, 'conversions': 30, 'spend': 200},
+        {'campaign_id': 'b', 'roas': 1.0, 'ctr': 0.02, 'conversion_rate': 0.05, 'conversions': 5, 'spend': 200},
+        {'campaign_id': 'c', 'roas': 2.0, 'ctr': 0.02, 'conversion_rate': 0.05, 'conversions': 15, 'spend': 200},
+    ]
+    budgets = engine.optimize_campaign_budgets(metrics)
+    assert sum(budgets.values()) == pytest.approx(1000)
+    assert budgets['a'] > budgets['c'] > budgets['b']
+    assert max(budgets.values()) <= 1000 * engine.MAX_BUDGET_SHARE + 1e-9
+
+def test_engine_convex_mode_allocates_many_campaigns():
+    engine = BudgetEngine(total_budget=10000, daily_budget=1000, allocation_mode='convex')
+    rng = np.random.default_rng(4)
+    metrics = [
+        {'campaign_id': f"c{i}", 'roas': 2.0, 'ctr': 0.02, 'conversion_rate': 0.05,
+         'conversions': conversions, 'spend': 100}
+        for i, conversions in enumerate(rng.uniform(1, 20, 20))
+    ]
+    for _ in range(3):
+        budgets = np.array(list(engine.optimize_campaign_budgets(metrics).values()))
+        assert not engine.allocator.floors_scaled
+        assert budgets.sum() == pytest.approx(1000)
+        assert np.ptp(budgets) > 1
+    best = max(range(20), key=lambda i: metrics[i]['conversions'])
+    assert budgets.argmax() == best
+
+def test_engine_rejects_unknown_mode():
+    with pytest.raises(ValueError):
+        BudgetEngine(total_budget=1000, daily_budget=100, allocation_mode='greedy')
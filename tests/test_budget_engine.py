@@ -0,0 +1,44 @@
+import random
+import pytest
+from datetime import datetime, timedelta
+
+from app.services.budget_optimizer import BudgetOptimizer
+from app.services.budget_engine import BudgetEngine
+
+def _random_metrics(rng, campaign_ids):
+    return [{
+        'campaign_id': campaign_id,
+        'roas': rng.uniform(0, 4),
+        'ctr': rng.uniform(0, 0.05),
+        'conversion_rate': rng.uniform(0, 0.1),
+    } for campaign_id in campaign_ids]
+
+def test_engine_matches_budget_optimizer():
+    rng = random.Random(7)
+    optimizer = BudgetOptimizer(total_budget=10000, daily_budget=1000)
+    engine = BudgetEngine(total_budget=10000, daily_budget=1000)
+    all_ids = [f"c{i}" for i in range(40)]
+
+    for round_number in range(6):
+        # Состав кампаний меняется между вызовами
+        campaign_ids = rng.sample(all_ids, rng.randint(3, 40))
+        metrics = _random_metrics(rng, campaign_ids)
+        expected = optimizer.optimize_campaign_budgets(metrics)
+        actual = engine.optimize_campaign_budgets(metrics)
+        assert actual.keys() == expected.keys()
+        for campaign_id, budget in expected.items():
+            assert actual[campaign_id] == pytest.approx(budget, rel=1e-12)
+        assert engine.campaign_budgets == pytest.approx(optimizer.campaign_budgets, rel=1e-12)
+
+def test_engine_trend_uses_oldest_score_in_window():
+    engine = BudgetEngine(total_budget=1000, daily_budget=100, days_history=7)
+    start = datetime(2025, 1, 1)
+    engine.optimize(["a"], [1.0], [0.0], [0.0], now=start)
+    engine.optimize(["a"], [2.0], [0.0], [0.0], now=start + timedelta(days=3))
+    rows = engine.rows_for(["a"])
+    assert engine.history.oldest_scores(rows)[0] == pytest.approx(0.5)
+
+    # Через 10 дней первая запись выходит из окна
+    engine.optimize(["a"], [2.0], [0.0], [0.0], now=start + timedelta(days=10))
+    assert engine.history.count[rows[0]] == 2
+    assert engine.history.oldest_scores(rows)[0] == pytest.approx(1.0)
@@ -0,0 +1,14 @@
+from app.services.cache import LRUCache
+
+def test_lru_cache_bounds_and_ttl():
+    cache = LRUCache(max_size=2, ttl_seconds=60)
+    cache.set(1, "a")
+    cache.set(2, "b")
+    cache.get(1)
+    cache.set(3, "c")
+    assert cache.get(2) is None
+    assert cache.get(1) == "a"
+
+    expired = LRUCache(max_size=2, ttl_seconds=-1)
+    expired.set(1, "a")
+    assert expired.get(1) is None
@@ -0,0 +1,56 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.db.models import Base
+from app.services.conversation_state import ConversationStateStore
+
+async def _session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/states.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+@pytest.mark.asyncio
+async def test_state_is_shared_between_workers_and_survives_restart(tmp_path):
+    session_factory = await _session_factory(tmp_path)
+    worker_a = ConversationStateStore(session_factory=session_factory)
+    worker_b = ConversationStateStore(session_factory=session_factory)
+
+    await worker_a.set(42, {"state": "awaiting_media"})
+    # Фото пришло на другой воркер
+    assert await worker_b.get(42) == {"state": "awaiting_media"}
+    await worker_b.update(42, state="analysis_complete", analysis={"status": "success"})
+
+    restarted = ConversationStateStore(session_factory=session_factory)
+    assert await restarted.get(42) == {"state": "analysis_complete", "analysis": {"status": "success"}}
+
+    # Изменение возвращенного словаря не меняет сохраненное состояние
+    (await restarted.get(42))["state"] = "broken"
+    assert (await restarted.get(42))["state"] == "analysis_complete"
+
+    started = time.perf_counter()
+    for _ in range(1000):
+        await restarted.get(42)
+    assert (time.perf_counter() - started) / 1000 < 0.001
+
+@pytest.mark.asyncio
+async def test_states_expire(tmp_path):
+    store = ConversationStateStore(session_factory=await _session_factory(tmp_path), ttl_seconds=60, cache_ttl_seconds=0)
+    now = datetime(2025, 3, 10, 12)
+    await store.set(1, {"state": "awaiting_media"}, now=now)
+    await store.set(2, {"state": "awaiting_media"}, now=now + timedelta(seconds=30))
+
+    assert await store.get(1, now=now + timedelta(seconds=61)) == {}
+    assert await store.purge_expired(now=now + timedelta(seconds=61)) == 1
+    assert await store.get(2, now=now + timedelta(seconds=61)) == {"state": "awaiting_media"}
+
+@pytest.mark.asyncio
+async def test_concurrent_first_writes_do_not_conflict(tmp_path):
+    session_factory = await _session_factory(tmp_path)
+    workers = [ConversationStateStore(session_factory=session_factory) for _ in range(5)]
+    await asyncio.gather(*(worker.set(7, {"state": f"s{i}"}) for i, worker in enumerate(workers)))
+    assert (await ConversationStateStore(session_factory=session_factory).get(7))["state"] in {f"s{i}" for i in range(5)}
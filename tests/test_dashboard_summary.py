@@ -0,0 +1,112 @@
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import select, text, update
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.db.database import add_missing_columns
+from app.db.models import Base, User, Campaign, CampaignMetric, CampaignSummary, Budget
+from app.services.dashboard_summary import DashboardSummaryService, get_user_summary
+
+@pytest.mark.asyncio
+async def test_refresh_and_read_summary(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/summary.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    now = datetime.now()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    async with session_factory() as session:
+        user = User(telegram_id=42)
+        session.add(user)
+        await session.flush()
+        good = Campaign(fb_campaign_id="good", user_id=user.id, name="Good", status="ACTIVE", daily_budget=60.0)
+        bad = Campaign(fb_campaign_id="bad", user_id=user.id, name="Bad", status="ACTIVE", daily_budget=40.0)
+        paused = Campaign(fb_campaign_id="paused", user_id=user.id, name="Paused", status="PAUSED", daily_budget=10.0)
+        session.add_all([good, bad, paused])
+        await session.flush()
+        for days_ago in range(3):
+            day = today - timedelta(days=days_ago)
+            session.add(CampaignMetric(campaign_id=good.id, granularity='day', period_start=day, spend=10.0, revenue=40.0))
+            session.add(CampaignMetric(campaign_id=bad.id, granularity='day', period_start=day, spend=20.0, revenue=10.0))
+        await session.commit()
+        user_id = user.id
+
+    service = DashboardSummaryService(session_factory=session_factory)
+    assert await service.refresh_pending(now) == 1
+
+    async with session_factory() as session:
+        summary = await get_user_summary(session, user_id)
+        assert summary.active_campaigns == 2
+        assert summary.daily_budget == pytest.approx(100.0)
+        assert summary.spend_today == pytest.approx(30.0)
+        assert summary.remaining_budget == pytest.approx(70.0)
+        assert [c["campaign_id"] for c in summary.top_campaigns] == ["good", "bad"]
+        assert summary.top_campaigns[0]["roas"] == pytest.approx(4.0)
+
+    # Явный дневной бюджет пользователя имеет приоритет
+    async with session_factory() as session:
+        session.add(Budget(user_id=user_id, budget_type='daily', daily_budget=200.0))
+        await session.commit()
+    service.mark_dirty(user_id)
+    await service.refresh_pending(now)
+
+    async with session_factory() as session:
+        summary = await get_user_summary(session, user_id)
+        assert summary.daily_budget == pytest.approx(200.0)
+        assert summary.remaining_budget == pytest.approx(170.0)
+
+    # Изменение существующего бюджета и удаление кампании находятся без mark_dirty
+    async with session_factory() as session:
+        await session.execute(update(Budget).where(Budget.user_id == user_id).values(daily_budget=150.0))
+        paused = (await session.execute(select(Campaign).where(Campaign.fb_campaign_id == "paused"))).scalar_one()
+        await session.delete(paused)
+        await session.commit()
+    assert await service.refresh_pending(now) == 1
+
+    async with session_factory() as session:
+        summary = await get_user_summary(session, user_id)
+        assert summary.daily_budget == pytest.approx(150.0)
+        names = set((await session.execute(select(CampaignSummary.fb_campaign_id))).scalars())
+        assert names == {"good", "bad"}
+    await engine.dispose()
+
+@pytest.mark.asyncio
+async def test_refresh_runs_on_database_created_before_updated_at(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/old.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_factory() as session:
+        user = User(telegram_id=42)
+        session.add(user)
+        await session.flush()
+        campaign = Campaign(fb_campaign_id="a", user_id=user.id, status="ACTIVE", daily_budget=50.0)
+        session.add(campaign)
+        await session.flush()
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        session.add(CampaignMetric(campaign_id=campaign.id, granularity='day', period_start=today, spend=10.0))
+        session.add(Budget(user_id=user.id, budget_type='daily', daily_budget=80.0))
+        await session.commit()
+        user_id = user.id
+
+    # Схема до появления updated_at у бюджетов и метрик
+    async with engine.begin() as conn:
+        for table in ("budgets", "campaign_metrics"):
+            await conn.execute(text(f"DROP INDEX ix_{table}_updated_at"))
+            await conn.execute(text(f"ALTER TABLE {table} DROP COLUMN updated_at"))
+
+    async with engine.begin() as conn:
+        added = await conn.run_sync(add_missing_columns, Base.metadata)
+        assert sorted(added) == ["budgets.updated_at", "campaign_metrics.updated_at"]
+        assert await conn.run_sync(add_missing_columns, Base.metadata) == []
+        assert (await conn.execute(text("SELECT count(*) FROM budgets WHERE updated_at IS NULL"))).scalar() == 0
+
+    service = DashboardSummaryService(session_factory=session_factory)
+    assert await service.refresh_pending() == 1
+    assert await service.refresh_pending() == 0
+    async with session_factory() as session:
+        summary = await get_user_summary(session, user_id)
+        assert summary.daily_budget == pytest.approx(80.0)
+        assert summary.spend_today == pytest.approx(10.0)
+    await engine.dispose()
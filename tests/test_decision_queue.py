@@ -0,0 +1,118 @@
+import json
+
+import httpx
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.db.models import Base, Campaign, DecisionAudit
+from app.services.decision_queue import DecisionQueue, parse_usage
+
+async def _session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/decisions.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with session_factory() as session:
+        session.add_all([
+            Campaign(fb_campaign_id=f"c{i}", status="ACTIVE", daily_budget=100.0) for i in range(3)
+        ])
+        await session.commit()
+    return session_factory
+
+async def _audit(session_factory):
+    async with session_factory() as session:
+        rows = (await session.execute(select(DecisionAudit).order_by(DecisionAudit.id))).scalars().all()
+    return {(row.campaign_id, row.field): row.outcome for row in rows}
+
+@pytest.mark.asyncio
+async def test_coalesces_and_drops_noops(tmp_path):
+    session_factory = await _session_factory(tmp_path)
+    requests = []
+
+    def handler(request: httpx.Request):
+        batch = json.loads(dict(httpx.QueryParams(request.content.decode()))['batch'])
+        requests.append(batch)
+        return httpx.Response(200, json=[{'code': 200, 'body': '{"success": true}'}] * len(batch),
+                              headers={'x-app-usage': '{"call_count": 10}'})
+
+    queue = DecisionQueue(session_factory=session_factory, mock=False, transport=httpx.MockTransport(handler))
+    queue.enqueue("c0", daily_budget=110.0, access_token="token")
+    queue.enqueue("c0", daily_budget=130.0, access_token="token")  # склеивается с предыдущим
+    queue.enqueue("c1", status="ACTIVE", access_token="token")      # без изменений
+    queue.enqueue("c2", daily_budget=102.0, access_token="token")   # меньше минимального шага
+    assert len(queue) == 3
+
+    assert await queue.flush() == {'applied': 1, 'noop': 1, 'below_min_delta': 1}
+    assert len(requests) == 1 and len(requests[0]) == 1
+    assert requests[0][0] == {'method': 'POST', 'relative_url': 'c0', 'body': 'daily_budget=13000'}
+    assert await _audit(session_factory) == {
+        ('c0', 'daily_budget'): 'applied', ('c1', 'status'): 'noop', ('c2', 'daily_budget'): 'below_min_delta'
+    }
+    async with session_factory() as session:
+        campaign = (await session.execute(select(Campaign).where(Campaign.fb_campaign_id == "c0"))).scalar_one()
+        assert campaign.daily_budget == 130.0
+
+@pytest.mark.asyncio
+async def test_dry_run_only_audits(tmp_path):
+    session_factory = await _session_factory(tmp_path)
+    queue = DecisionQueue(session_factory=session_factory, dry_run=True, mock=False,
+                          transport=httpx.MockTransport(lambda request: pytest.fail("Graph не должен вызываться")))
+    queue.enqueue("c0", status="PAUSED", access_token="token")
+    assert await queue.flush() == {'dry_run': 1}
+    async with session_factory() as session:
+        campaign = (await session.execute(select(Campaign).where(Campaign.fb_campaign_id == "c0"))).scalar_one()
+        assert campaign.status == "ACTIVE"
+
+@pytest.mark.asyncio
+async def test_rate_limited_items_are_requeued_and_slow_down(tmp_path):
+    session_factory = await _session_factory(tmp_path)
+    sleeps = []
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+
+    def handler(request):
+        error = json.dumps({'error': {'code': 17, 'message': 'User request limit reached'}})
+        return httpx.Response(200, json=[{'code': 200, 'body': '{}'}, {'code': 400, 'body': error}],
+                              headers={'x-app-usage': '{"call_count": 95, "total_time": 40}'})
+
+    queue = DecisionQueue(session_factory=session_factory, mock=False, sleep=fake_sleep,
+                          transport=httpx.MockTransport(handler))
+    queue.enqueue("c0", status="PAUSED", access_token="token")
+    queue.enqueue("c1", status="PAUSED", access_token="token")
+    assert await queue.flush() == {'applied': 1, 'rate_limited': 1}
+    assert list(queue.pending) == ["c1"]
+    assert sleeps and sleeps[0] == pytest.approx(0.8 * 30)
+
+def test_parse_usage_reads_business_use_case_header():
+    headers = {'x-business-use-case-usage': json.dumps(
+        {"123": [{"type": "ads_management", "call_count": 50, "total_cputime": 80, "estimated_time_to_regain_access": 5}]}
+    )}
+    assert parse_usage(headers) == (80.0, 5.0)
+
+@pytest.mark.asyncio
+async def test_user_changes_skip_min_delta_and_local_noop(tmp_path):
+    session_factory = await _session_factory(tmp_path)
+    requests = []
+
+    def handler(request: httpx.Request):
+        batch = json.loads(dict(httpx.QueryParams(request.content.decode()))['batch'])
+        requests.extend(batch)
+        return httpx.Response(200, json=[{'code': 200, 'body': '{"success": true}'}] * len(batch))
+
+    queue = DecisionQueue(session_factory=session_factory, mock=False, transport=httpx.MockTransport(handler))
+    queue.enqueue("c0", daily_budget=104.0, source='user', access_token="token", min_delta=False)
+    # Локально уже 100, но в Graph значение могло отличаться — явное действие отправляется
+    queue.enqueue("c1", daily_budget=100.0, source='user', access_token="token", min_delta=False)
+    assert await queue.flush() == {'applied': 2}
+    assert [item['body'] for item in requests] == ['daily_budget=10400', 'daily_budget=10000']
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_audited_not_lost(tmp_path):
+    session_factory = await _session_factory(tmp_path)
+    queue = DecisionQueue(session_factory=session_factory, mock=False,
+                          transport=httpx.MockTransport(lambda request: httpx.Response(200, text="<html>")))
+    queue.enqueue("c0", status="PAUSED", access_token="token")
+    assert await queue.flush() == {'failed': 1}
+    assert await _audit(session_factory) == {('c0', 'status'): 'failed'}
@@ -0,0 +1,127 @@
+import socket
+import time
+from datetime import date, timedelta
+
+import httpx
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.db.models import Base, Campaign
+from app.services.campaign_automation import CampaignAutomationService
+from app.services.decision_queue import DecisionQueue
+from app.services.fake_graph import FakeGraph, create_fake_graph_app, start_fake_graph_server
+
+ANALYSIS = {"analysis": {"campaign_objective": "CONVERSIONS", "target_audience": {"interests": ["спорт"]}}}
+
+async def _session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/fake_graph.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+def _service(session_factory, graph):
+    service = CampaignAutomationService(session_factory=session_factory,
+                                        transport=httpx.ASGITransport(app=create_fake_graph_app(graph)))
+    service.fb_access_token = "token"
+    service.ad_account_id = "act_123456789"
+    return service
+
+@pytest.mark.asyncio
+async def test_seeded_launch_and_insights_are_reproducible(tmp_path):
+    session_factory = await _session_factory(tmp_path)
+    results = []
+    for _ in range(2):
+        graph = FakeGraph(seed=7, latency_ms=20, latency_jitter_ms=0)
+        service = _service(session_factory, graph)
+        launch = await service.create_campaign_from_analysis(ANALYSIS, {"budget": 80})
+        campaign_id = launch["campaign"]["campaign_id"]
+        graph.store.objects[campaign_id]["status"] = "ACTIVE"
+        performance = await service.get_campaign_performance(campaign_id)
+        results.append((campaign_id, launch["campaign"]["ad_id"], performance["daily_metrics"]))
+
+    assert results[0] == results[1]
+    campaign_id, ad_id, daily = results[0]
+    assert campaign_id != ad_id and campaign_id.isdigit()
+    assert len(daily) == 7 and all(day["spend"] > 0 for day in daily)
+
+@pytest.mark.asyncio
+async def test_hourly_breakdown_adds_up_to_daily_insights(tmp_path):
+    graph = FakeGraph(seed=3, latency_ms=0, latency_jitter_ms=0)
+    service = _service(await _session_factory(tmp_path), graph)
+    launch = await service.create_campaign_from_analysis(ANALYSIS, {"budget": 80})
+    campaign_id = launch["campaign"]["campaign_id"]
+    graph.store.objects[campaign_id]["status"] = "ACTIVE"
+
+    day = date.today() - timedelta(days=2)
+    hourly = (await service.get_hourly_performance(campaign_id, day, day))["hourly_metrics"]
+    daily = next(item for item in (await service.get_campaign_performance(campaign_id))["daily_metrics"]
+                 if item["date"] == day.isoformat())
+    assert [item["hour"].hour for item in hourly] == list(range(24))
+    for field in ("impressions", "clicks", "conversions"):
+        assert sum(item[field] for item in hourly) == daily[field]
+    assert sum(item["spend"] for item in hourly) == pytest.approx(daily["spend"])
+    assert sum(item["revenue"] for item in hourly) == pytest.approx(daily["revenue"])
+
+@pytest.mark.asyncio
+async def test_latency_throttling_and_errors(tmp_path):
+    graph = FakeGraph(latency_ms=30, latency_jitter_ms=0, rate_limit_per_minute=3)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=create_fake_graph_app(graph)),
+                                 base_url="http://graph") as client:
+        started = time.monotonic()
+        statuses = [(await client.get("/v17.0/act_123456789", params={"access_token": "t"})).status_code
+                    for _ in range(4)]
+        assert time.monotonic() - started >= 4 * 0.03
+        assert statuses == [200, 200, 200, 400]
+        throttled = await client.get("/v17.0/act_123456789", params={"access_token": "t"})
+        assert throttled.json()["error"]["code"] == 17
+        assert '"call_count": 100' in throttled.headers["x-app-usage"]
+
+        graph.error_rate = 1.0
+        failed = await client.get("/v17.0/act_123456789", params={"access_token": "other"})
+        assert failed.status_code == 500 and failed.json()["error"]["is_transient"]
+
+@pytest.mark.asyncio
+async def test_decision_queue_batches_against_fake_graph(tmp_path):
+    session_factory = await _session_factory(tmp_path)
+    graph = FakeGraph(latency_ms=0, latency_jitter_ms=0)
+    campaign_id = graph.store.create("act_123456789", "campaigns", {"name": "A", "objective": "OUTCOME_SALES",
+                                                                    "daily_budget": "10000"})["id"]
+    async with session_factory() as session:
+        session.add(Campaign(fb_campaign_id=campaign_id, status="ACTIVE", daily_budget=100.0))
+        await session.commit()
+
+    queue = DecisionQueue(session_factory=session_factory, mock=False,
+                          transport=httpx.ASGITransport(app=create_fake_graph_app(graph)))
+    queue.enqueue(campaign_id, daily_budget=150.0, status="PAUSED", access_token="token")
+    queue.enqueue("404", status="PAUSED", current={"status": "ACTIVE"}, access_token="token")
+    counts = await queue.flush()
+
+    assert counts == {"applied": 2, "failed": 1}
+    assert int(graph.store.objects[campaign_id]["daily_budget"]) == 15000
+    assert graph.store.objects[campaign_id]["status"] == "PAUSED"
+
+def test_facebook_sdk_talks_to_embedded_server():
+    from facebook_business.api import FacebookAdsApi
+    from facebook_business.adobjects.adaccount import AdAccount
+    from facebook_business.session import FacebookSession
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = start_fake_graph_server("127.0.0.1", port, latency_ms=0, latency_jitter_ms=0)
+    previous = FacebookSession.GRAPH
+    try:
+        for _ in range(100):
+            if server.started:
+                break
+            time.sleep(0.05)
+        FacebookSession.GRAPH = f"http://127.0.0.1:{port}"
+        api = FacebookAdsApi.init(access_token="token", crash_log=False)
+        account = AdAccount("act_123456789", api=api)
+        created = account.create_campaign(params={"name": "SDK", "objective": "OUTCOME_TRAFFIC",
+                                                  "special_ad_categories": []})
+        campaigns = [c.export_all_data() for c in account.get_campaigns(fields=["name", "status"])]
+        assert campaigns == [{"id": created["id"], "name": "SDK", "status": "PAUSED"}]
+    finally:
+        FacebookSession.GRAPH = previous
+        server.should_exit = True
@@ -0,0 +1,184 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.db.database import get_session
+from app.db.models import Base, Campaign
+from app.routers import facebook
+from app.services import user_auth
+from app.services.idempotency import IdempotencyStore, IdempotencyConflict
+
+async def _session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/idempotency.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+@pytest.mark.asyncio
+async def test_double_tap_runs_handler_once_and_keys_expire(tmp_path):
+    store = IdempotencyStore(session_factory=await _session_factory(tmp_path), ttl_seconds=60)
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 201, {"id": str(len(calls))}
+
+    first, second = await asyncio.gather(
+        store.execute("scope", "k1", {"name": "A"}, handler),
+        store.execute("scope", "k1", {"name": "A"}, handler),
+    )
+    assert len(calls) == 1
+    assert first == (201, {"id": "1"}, False) and second == (201, {"id": "1"}, True)
+
+    with pytest.raises(IdempotencyConflict) as conflict:
+        await store.execute("scope", "k1", {"name": "B"}, handler)
+    assert conflict.value.status_code == 422
+
+    # Ответ читается из БД, когда кеша процесса нет (другой воркер)
+    store.cache = type(store.cache)(16, 60)
+    assert await store.execute("scope", "k1", {"name": "A"}, handler) == (201, {"id": "1"}, True)
+
+    assert await store.purge_expired(now=datetime.now() + timedelta(seconds=61)) == 1
+    store.cache = type(store.cache)(16, 60)
+    assert (await store.execute("scope", "k1", {"name": "A"}, handler))[1] == {"id": "2"}
+
+@pytest.mark.asyncio
+async def test_failed_request_releases_key(tmp_path):
+    store = IdempotencyStore(session_factory=await _session_factory(tmp_path))
+
+    async def failing():
+        raise RuntimeError("graph down")
+
+    async def ok():
+        return 200, {"status": "success"}
+
+    with pytest.raises(RuntimeError):
+        await store.execute("scope", "k", {}, failing)
+    assert await store.execute("scope", "k", {}, ok) == (200, {"status": "success"}, False)
+
+@pytest.mark.asyncio
+async def test_facebook_create_endpoint_is_idempotent(tmp_path, monkeypatch):
+    session_factory = await _session_factory(tmp_path)
+    monkeypatch.setattr(facebook, "idempotency_store", IdempotencyStore(session_factory=session_factory))
+    created = []
+
+    def create_campaign_sync(api, ad_account_id, params):
+        created.append(params)
+        return {"id": f"fb_{len(created)}"}
+
+    monkeypatch.setattr(facebook, "_create_campaign_sync", create_campaign_sync)
+
+    async def session_override():
+        async with session_factory() as session:
+            yield session
+            await session.commit()
+
+    app = FastAPI()
+    app.include_router(facebook.router)
+    app.dependency_overrides[get_session] = session_override
+    monkeypatch.setattr(user_auth.settings, "SESSION_SECRET", "secret")
+    form = {"ad_account_id": "act_1", "name": "A", "objective": "OUTCOME_SALES", "daily_budget": "5000"}
+    headers = {"Idempotency-Key": "tap-1", "Authorization": f"Bearer {user_auth.issue_session(1)}"}
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        first = await client.post("/api/facebook/campaigns", data=form, headers=headers)
+        retry = await client.post("/api/facebook/campaigns", data=form, headers=headers)
+        assert first.status_code == retry.status_code == 201
+        assert retry.json() == first.json() == {"id": "fb_1"}
+        assert retry.headers["idempotent-replayed"] == "true"
+
+        other = await client.post("/api/facebook/campaigns", data={**form, "name": "B"}, headers=headers)
+        assert other.status_code == 422
+
+    assert len(created) == 1 and created[0]["daily_budget"] == 5000
+    async with session_factory() as session:
+        campaign = (await session.execute(select(Campaign))).scalar_one()
+        # Graph получает центы, в campaigns бюджет хранится в валюте аккаунта
+        assert campaign.daily_budget == 50.0
+
+@pytest.mark.asyncio
+async def test_launch_keys_are_per_caller_and_completed_after_commit(tmp_path, monkeypatch):
+    from app.routers import ai_services
+
+    session_factory = await _session_factory(tmp_path)
+    monkeypatch.setattr(ai_services, "idempotency_store", IdempotencyStore(session_factory=session_factory))
+    launches = []
+
+    async def launch(analysis, preferences):
+        launches.append(preferences["launch_id"])
+        return {"status": "success", "campaign": {"campaign_id": f"fb_{len(launches)}", "name": "A", "budget": 50}}
+
+    monkeypatch.setattr(ai_services.campaign_automation_service, "create_campaign_from_analysis", launch)
+
+    async def session_override():
+        async with session_factory() as session:
+            yield session
+            await session.commit()
+
+    app = FastAPI()
+    app.include_router(ai_services.router)
+    app.dependency_overrides[get_session] = session_override
+    body = {"analysis_data": {"campaign_objective": "CONVERSIONS"}}
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        # Один и тот же ключ у разных пользователей — разные запуски
+        first = await client.post("/api/create-campaign", json={**body, "user_id": 1}, headers={"Idempotency-Key": "k"})
+        second = await client.post("/api/create-campaign", json={**body, "user_id": 2}, headers={"Idempotency-Key": "k"})
+        assert first.status_code == second.status_code == 200
+        assert "idempotent-replayed" not in second.headers
+        assert len(launches) == 2 and launches[0] != launches[1]
+
+        # Кампания не сохранилась — ключ не отмечен выполненным, повтор запускает заново
+        save_campaign = ai_services.save_campaign
+        failures = [RuntimeError("database is locked")]
+
+        async def flaky_save(*args, **kwargs):
+            if failures:
+                raise failures.pop()
+            return await save_campaign(*args, **kwargs)
+
+        monkeypatch.setattr(ai_services, "save_campaign", flaky_save)
+        failed = await client.post("/api/create-campaign", json={**body, "user_id": 3}, headers={"Idempotency-Key": "x"})
+        assert failed.status_code == 500
+        retry = await client.post("/api/create-campaign", json={**body, "user_id": 3}, headers={"Idempotency-Key": "x"})
+        assert retry.status_code == 200 and "idempotent-replayed" not in retry.headers
+        assert len(launches) == 4
+
+@pytest.mark.asyncio
+async def test_resumed_launch_updates_the_saved_campaign(tmp_path, monkeypatch):
+    from app.routers import ai_services
+
+    session_factory = await _session_factory(tmp_path)
+    # Ключи истекают сразу: повтор после TTL снова проходит через запуск
+    monkeypatch.setattr(ai_services, "idempotency_store", IdempotencyStore(session_factory=session_factory, ttl_seconds=0))
+
+    async def launch(analysis, preferences):
+        # Запуск с тем же launch_id продолжается с контрольных точек и возвращает ту же кампанию
+        return {"status": "success", "campaign": {"campaign_id": "fb_1", "name": "A", "status": "PAUSED", "budget": 50}}
+
+    monkeypatch.setattr(ai_services.campaign_automation_service, "create_campaign_from_analysis", launch)
+
+    async def session_override():
+        async with session_factory() as session:
+            yield session
+            await session.commit()
+
+    app = FastAPI()
+    app.include_router(ai_services.router)
+    app.dependency_overrides[get_session] = session_override
+    body = {"analysis_data": {"campaign_objective": "CONVERSIONS"}, "user_id": 1}
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        for _ in range(2):
+            response = await client.post("/api/create-campaign", json=body, headers={"Idempotency-Key": "k"})
+            assert response.status_code == 200 and "idempotent-replayed" not in response.headers
+
+    async with session_factory() as session:
+        campaign = (await session.execute(select(Campaign))).scalar_one()
+        assert campaign.fb_campaign_id == "fb_1" and campaign.daily_budget == 50
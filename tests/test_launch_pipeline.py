@@ -0,0 +1,96 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.db.models import Base, LaunchStep
+from app.services.campaign_automation import CampaignAutomationService
+from app.services.launch_pipeline import LaunchPipeline
+
+ANALYSIS = {
+    "analysis": {
+        "campaign_objective": "CONVERSIONS",
+        "target_audience": {"age_range": "25-45", "interests": ["технологии", "бизнес"]},
+        "ad_copy_suggestions": ["Попробуйте сегодня"],
+        "budget_recommendation": {"daily_budget": 40},
+    }
+}
+
+async def _session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/launch.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+class FakeGraph:
+    def __init__(self, delay=0.05, fail_ads=0):
+        self.delay = delay
+        self.fail_ads = fail_ads
+        self.calls = []
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(self.delay)
+        path = request.url.path.split('/v17.0/')[1]
+        self.calls.append(path)
+        if path == 'search':
+            return httpx.Response(200, json={"data": [{"id": f"int_{request.url.params['q']}", "name": "x"}]})
+        if path.endswith('/ads') and self.fail_ads:
+            self.fail_ads -= 1
+            return httpx.Response(400, json={"error": {"message": "Invalid creative", "code": 100}})
+        if path.endswith('/adsets'):
+            form = dict(httpx.QueryParams(request.content.decode()))
+            assert form['daily_budget'] == '4000'
+            assert json.loads(form['targeting'])['flexible_spec'][0]['interests'][0]['id'] == 'int_технологии'
+        return httpx.Response(200, json={"id": f"{path.split('/')[-1]}_1"})
+
+def _service(session_factory, graph):
+    service = CampaignAutomationService(session_factory=session_factory, transport=httpx.MockTransport(graph))
+    service.fb_access_token = "token"
+    service.ad_account_id = "123"
+    return service
+
+@pytest.mark.asyncio
+async def test_launch_runs_independent_branches_concurrently(tmp_path):
+    session_factory = await _session_factory(tmp_path)
+    graph = FakeGraph(delay=0.1)
+    service = _service(session_factory, graph)
+
+    started = time.monotonic()
+    result = await service._create_real_campaign(ANALYSIS, {"launch_id": "l1", "page_id": "p1"})
+    elapsed = time.monotonic() - started
+
+    assert result["status"] == "success"
+    assert result["campaign"]["campaign_id"] == "campaigns_1"
+    assert result["campaign"]["ad_id"] == "ads_1"
+    # 6 вызовов Graph, но самая длинная цепочка — campaign -> adset -> ad
+    assert len(graph.calls) == 6
+    assert elapsed < 5 * graph.delay
+
+@pytest.mark.asyncio
+async def test_failed_launch_resumes_from_checkpoint(tmp_path):
+    session_factory = await _session_factory(tmp_path)
+    graph = FakeGraph(delay=0, fail_ads=1)
+    service = _service(session_factory, graph)
+
+    failed = await service._create_real_campaign(ANALYSIS, {"launch_id": "l2", "page_id": "p1"})
+    assert failed["status"] == "error" and failed["failed_step"] == "ad"
+    async with session_factory() as session:
+        steps = {row.step: row.status for row in (await session.execute(select(LaunchStep))).scalars()}
+    assert steps["ad"] == "failed" and steps["campaign"] == "done"
+
+    graph.calls.clear()
+    result = await service._create_real_campaign(ANALYSIS, {"launch_id": "l2", "page_id": "p1"})
+    assert result["status"] == "success"
+    assert graph.calls == ["act_123/ads"]
+
+@pytest.mark.asyncio
+async def test_pipeline_rejects_cycles(tmp_path):
+    session_factory = await _session_factory(tmp_path)
+    async def stage(results):
+        return {}
+    with pytest.raises(ValueError):
+        LaunchPipeline({"a": (("b",), stage), "b": (("a",), stage)}, session_factory)
@@ -0,0 +1,109 @@
+import asyncio
+import os
+import time
+
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.db.models import Base, User, Campaign, CampaignMetric, OptimizerState
+from app.services.optimization_runner import OptimizationRunner, optimize_shard
+
+def slow_shard(database_url, user_ids, *args):
+    """Шард, не укладывающийся в дедлайн (выполняется в процессе пула)"""
+    with open(database_url.split(':///')[1] + '.pid', 'w') as f:
+        f.write(str(os.getpid()))
+    time.sleep(60)
+    return {}
+
+async def _seed(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/runner.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    async with session_factory() as session:
+        users = [User(telegram_id=i, fb_account_id=f"act_{i}") for i in range(3)]
+        session.add_all(users)
+        await session.flush()
+        for user in users:
+            good = Campaign(fb_campaign_id=f"good_{user.id}", user_id=user.id, status="ACTIVE", daily_budget=30.0)
+            bad = Campaign(fb_campaign_id=f"bad_{user.id}", user_id=user.id, status="ACTIVE", daily_budget=50.0)
+            session.add_all([good, bad])
+            await session.flush()
+            for days_ago in range(3):
+                day = today - timedelta(days=days_ago)
+                session.add(CampaignMetric(campaign_id=good.id, period_start=day, impressions=1000,
+                                           clicks=30, conversions=3, spend=10.0, revenue=40.0))
+                session.add(CampaignMetric(campaign_id=bad.id, period_start=day, impressions=1000,
+                                           clicks=5, conversions=0, spend=10.0, revenue=5.0))
+        await session.commit()
+    return session_factory
+
+@pytest.mark.asyncio
+async def test_shard_worker_reads_db_and_saves_history(tmp_path):
+    session_factory = await _seed(tmp_path)
+    results = optimize_shard(f"sqlite:///{tmp_path}/runner.db", [1, 2], datetime.now().isoformat(), 7, 1.0, 0.05)
+
+    assert set(results) == {1, 2}
+    changes = {change['campaign_id']: change for change in results[1]}
+    assert changes['bad_1'] == {'user_id': 1, 'campaign_id': 'bad_1', 'type': 'status', 'old': 'ACTIVE', 'new': 'PAUSED'}
+    assert changes['good_1']['type'] == 'budget' and changes['good_1']['new'] == pytest.approx(36.0)
+
+    async with session_factory() as session:
+        assert await session.get(OptimizerState, "budget_engine:1") is not None
+
+@pytest.mark.asyncio
+async def test_run_pass_queues_and_applies_changes(tmp_path):
+    session_factory = await _seed(tmp_path)
+    runner = OptimizationRunner(session_factory=session_factory, database_url=f"sqlite:///{tmp_path}/runner.db",
+                                max_workers=2, shard_size=2)
+    report = await runner.run_pass()
+    assert report['processed'] == 3 and report['skipped'] == 0 and report['timed_out'] == 0
+    assert set(runner.pending) == {1, 2, 3}
+
+    assert await runner.apply_pending() == report['changes']
+    await runner.shutdown()
+    async with session_factory() as session:
+        statuses = dict((await session.execute(select(Campaign.fb_campaign_id, Campaign.status))).all())
+    assert statuses['bad_3'] == 'PAUSED' and statuses['good_3'] == 'ACTIVE'
+
+@pytest.mark.asyncio
+async def test_locked_accounts_are_skipped(tmp_path):
+    session_factory = await _seed(tmp_path)
+    runner = OptimizationRunner(session_factory=session_factory, database_url=f"sqlite:///{tmp_path}/runner.db",
+                                max_workers=1)
+    await runner._lock(2).acquire()
+    report = await runner.run_pass()
+    assert report['skipped'] == 1 and report['processed'] == 2
+    assert 2 not in runner.pending
+    await runner.shutdown()
+
+@pytest.mark.asyncio
+async def test_deadline_terminates_overrunning_workers(tmp_path):
+    session_factory = await _seed(tmp_path)
+    runner = OptimizationRunner(session_factory=session_factory, database_url=f"sqlite:///{tmp_path}/runner.db",
+                                max_workers=1, shard_size=2, deadline_seconds=3, shard_function=slow_shard)
+    started = time.monotonic()
+    ticks = 0
+
+    async def heartbeat():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.1)
+            ticks += 1
+
+    beat = asyncio.create_task(heartbeat())
+    report = await runner.run_pass()
+    beat.cancel()
+
+    assert report['timed_out'] == 3 and report['processed'] == 0
+    assert time.monotonic() - started < 10
+    assert ticks >= 20  # цикл событий не блокировался ожиданием воркера
+    # Воркер остановлен до снятия блокировок
+    with pytest.raises(ProcessLookupError):
+        os.kill(int((tmp_path / "runner.db.pid").read_text()), 0)
+    assert not any(runner._lock(user_id).locked() for user_id in (1, 2, 3))
+    assert not runner._processes
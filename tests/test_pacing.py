@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.db.models import Base, User, Campaign, CampaignMetric, Budget
+from app.services.pacing import PacingService, forecast_end_of_day
+
+def test_forecast_follows_hourly_profile():
+    # Весь расход прошлых дней приходится на вторую половину суток
+    profile = np.r_[np.zeros(12), np.full(12, 10.0)]
+    history = np.tile(profile, (1, 7, 1))
+    today = np.zeros((1, 24))
+    today[0, 12:15] = 10.0
+
+    forecast, average_daily = forecast_end_of_day(history, today, hour=15)
+    assert average_daily[0] == pytest.approx(120.0)
+    assert forecast[0] == pytest.approx(120.0)
+
+def test_forecast_without_history_uses_todays_pace():
+    today = np.zeros((1, 24))
+    today[0, :6] = 5.0
+    forecast, _ = forecast_end_of_day(np.zeros((1, 7, 24)), today, hour=6)
+    assert forecast[0] == pytest.approx(120.0)
+
+@pytest.mark.asyncio
+async def test_pace_budgets_and_cache(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/pacing.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    now = datetime(2025, 3, 10, 12, 0)
+    today = now.replace(hour=0)
+
+    async with session_factory() as session:
+        user = User(telegram_id=1)
+        session.add(user)
+        await session.flush()
+        campaign = Campaign(fb_campaign_id="fb_1", user_id=user.id, status="ACTIVE", daily_budget=100.0)
+        session.add(campaign)
+        await session.flush()
+        for days_ago in range(1, 4):
+            day = today - timedelta(days=days_ago)
+            session.add(CampaignMetric(campaign_id=campaign.id, granularity='day', period_start=day, spend=96.0))
+            for hour in range(24):
+                session.add(CampaignMetric(campaign_id=campaign.id, granularity='hour',
+                                           period_start=day + timedelta(hours=hour), spend=4.0))
+        for hour in range(12):
+            session.add(CampaignMetric(campaign_id=campaign.id, granularity='hour',
+                                       period_start=today + timedelta(hours=hour), spend=8.0))
+        session.add(Budget(user_id=user.id, campaign_id="fb_1", budget_type='daily', daily_budget=100.0,
+                           total_budget=1000.0, start_date=today - timedelta(days=3),
+                           end_date=today + timedelta(days=4)))
+        # Бюджет аккаунта с более поздним началом периода
+        session.add(Budget(user_id=user.id, budget_type='daily', total_budget=500.0,
+                           start_date=today - timedelta(days=1), end_date=today + timedelta(days=4)))
+        await session.commit()
+
+    service = PacingService()
+    async with session_factory() as session:
+        pacing, account = sorted(await service.pace_budgets(session, user.id, now),
+                                 key=lambda budget: budget['campaign_id'] is None)
+    # Полдня при темпе 8/час против истории 4/час: 96 + 0.5 * (0.5 * 192 + 0.5 * 96)
+    assert pacing['spent_today'] == pytest.approx(96.0)
+    assert pacing['forecast_today'] == pytest.approx(168.0)
+    assert pacing['daily_adjustment'] == pytest.approx(100 / 168, rel=1e-3)
+    assert pacing['forecast_flight'] == pytest.approx(288 + 168 + 4 * 96)
+    assert pacing['recommended_daily_budget'] == pytest.approx((1000 - 288 - 168) / 4)
+    assert pacing['status'] == 'underpacing'
+    assert account['spent_to_date'] == pytest.approx(96 + 96)
+
+    # В пределах часа прогноз берется из кеша без чтения почасовых строк
+    async with session_factory() as session:
+        session.add(CampaignMetric(campaign_id=campaign.id, granularity='hour',
+                                   period_start=today + timedelta(hours=12), spend=50.0))
+        await session.commit()
+        cached = next(budget for budget in await service.pace_budgets(session, user.id, now + timedelta(minutes=30))
+                      if budget['campaign_id'] == "fb_1")
+    assert cached['forecast_today'] == pacing['forecast_today']
@@ -0,0 +1,74 @@
+import pytest
+import numpy as np
+from datetime import datetime, timedelta
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.db.models import Base
+from app.services.budget_engine import BudgetEngine
+from app.services.performance_history import PerformanceHistory, history_capacity, load_history, save_history
+from app.services.row_index import grow_rows, register_rows
+
+def test_ring_buffer_append_and_evict():
+    history = PerformanceHistory(capacity=4)
+    rows = history.rows_for(["a", "b"])
+    for ts in range(1, 7):
+        history.append(rows, ts, np.array([ts, ts * 10], dtype=np.float32))
+
+    # Емкость 4: остались записи 3..6
+    assert [ts for ts, _ in history.records("a")] == [3, 4, 5, 6]
+    assert history.oldest_scores(rows).tolist() == [3.0, 30.0]
+
+    history.evict_before(rows[:1], 5)
+    assert [ts for ts, _ in history.records("a")] == [5, 6]
+    assert [ts for ts, _ in history.records("b")] == [3, 4, 5, 6]
+
+def test_row_index_helpers():
+    keys, index = [], {}
+    assert register_rows(index, keys, ["a", "b", "a"]).tolist() == [0, 1, 0]
+    assert register_rows(index, keys, ["c"]).tolist() == [2] and keys == ["a", "b", "c"]
+    grown = grow_rows(np.ones((3, 2)), 4)
+    assert grown.shape == (16, 2) and grown[:3].sum() == 6 and grown[3:].sum() == 0
+
+def test_hourly_history_covers_full_trend_window():
+    assert history_capacity(timedelta(days=7), timedelta(hours=1)) == 169
+    engine = BudgetEngine(total_budget=7000, daily_budget=1000, days_history=7)
+    start = datetime(2025, 3, 1)
+    for hour in range(24 * 8):
+        engine.optimize(["a"], [1.0], [0.01], [0.05], now=start + timedelta(hours=hour))
+    # Край окна — неделя назад, а не последние 64 часа
+    first_ts, _ = engine.history.records("a")[0]
+    last = start + timedelta(hours=24 * 8 - 1)
+    assert datetime.fromtimestamp(first_ts / 1_000_000) == last - timedelta(days=7)
+
+def test_serialization_roundtrip():
+    history = PerformanceHistory(capacity=8)
+    rows = history.rows_for(["a", "b", "c"])
+    for ts in range(10):
+        history.append(rows[:2], ts, np.array([ts, -ts], dtype=np.float32))
+    history.evict_before(rows, 6)
+
+    restored = PerformanceHistory.from_bytes(history.to_bytes())
+    for key in ["a", "b", "c"]:
+        assert restored.records(key) == history.records(key)
+
+    # При меньшей емкости сохраняются самые новые записи
+    smaller = PerformanceHistory.from_bytes(history.to_bytes(), capacity=2)
+    assert [ts for ts, _ in smaller.records("a")] == [8, 9]
+
+@pytest.mark.asyncio
+async def test_history_persisted_in_db(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/history.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    history = PerformanceHistory()
+    history.append(history.rows_for(["a"]), 100, 1.5)
+    async with session_factory() as session:
+        await save_history(session, "account_1", history)
+        await session.commit()
+    async with session_factory() as session:
+        restored = await load_history(session, "account_1")
+        assert restored.records("a") == [(100, 1.5)]
+        assert len(await load_history(session, "missing")) == 0
+    await engine.dispose()
@@ -0,0 +1,149 @@
+import pytest
+from datetime import datetime, timedelta
+from cryptography.fernet import Fernet
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.db.database import get_readonly_session
+from app.db.models import Base, Campaign, CampaignMetric, User
+from app.routers import ai_services
+from app.services.performance_store import PerformanceStore
+from app.services.token_vault import TokenVault
+
+class FakeAutomation:
+    def __init__(self):
+        self.calls = 0
+        self.clicks = 50
+        self.tokens = {}
+
+    async def get_campaign_performance(self, campaign_id, access_token=None):
+        self.calls += 1
+        self.tokens[campaign_id] = access_token
+        daily = [{"date": "2025-03-09", "impressions": 1000, "clicks": self.clicks, "conversions": 5, "spend": 25.0}]
+        return {"status": "success", "campaign_id": campaign_id, "daily_metrics": daily,
+                "total_metrics": ai_services.CampaignAutomationService._total_metrics(daily)}
+
+    async def get_hourly_performance(self, campaign_id, since, until, access_token=None):
+        start = datetime.combine(since, datetime.min.time())
+        hours = [start + timedelta(hours=hour) for hour in range(((until - since).days + 1) * 24)]
+        return {"status": "success", "campaign_id": campaign_id, "hourly_metrics": [
+            {"hour": hour, "impressions": 40, "clicks": 2, "conversions": 0, "spend": 1.0, "revenue": 0.0}
+            for hour in hours
+        ]}
+
+async def _store(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/performance.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    vault = TokenVault(encryption_key=Fernet.generate_key().decode(), session_factory=session_factory)
+    async with session_factory() as session:
+        user = User(telegram_id=42)
+        session.add(user)
+        await session.flush()
+        session.add(Campaign(fb_campaign_id="c1", user_id=user.id, status="ACTIVE"))
+        await vault.store_token(session, user.id, "owner_token")
+        await session.commit()
+    return PerformanceStore(session_factory=session_factory, automation=FakeAutomation(), vault=vault)
+
+@pytest.mark.asyncio
+async def test_ingest_computes_derived_fields_once(tmp_path):
+    store = await _store(tmp_path)
+    assert await store.ingest(["c1"], now=datetime(2025, 3, 10, 12)) == 1
+    assert store.automation.tokens == {"c1": "owner_token"}
+    # Метрики не изменились — строка и ее ETag не перезаписываются
+    assert await store.ingest(["c1"], now=datetime(2025, 3, 10, 13)) == 0
+
+    async with store.session_factory() as session:
+        row = await store.get(session, "c1")
+    assert row.ctr == 5.0 and row.cost_per_click == 0.5 and row.conversion_rate == 10.0
+    assert row.refreshed_at == datetime(2025, 3, 10, 12)
+
+@pytest.mark.asyncio
+async def test_ingest_upserts_day_and_hour_metric_rows(tmp_path):
+    store = await _store(tmp_path)
+    await store.ingest(["c1"], now=datetime(2025, 3, 10, 12))
+
+    async with store.session_factory() as session:
+        rows = (await session.execute(select(CampaignMetric))).scalars().all()
+        days = [row for row in rows if row.granularity == 'day']
+        hours = sorted(row.period_start for row in rows if row.granularity == 'hour')
+        assert [(row.period_start, row.clicks, row.spend) for row in days] == [(datetime(2025, 3, 9), 50, 25.0)]
+        # Сегодня и вчера по часам
+        assert hours[0] == datetime(2025, 3, 9) and hours[-1] == datetime(2025, 3, 10, 23) and len(hours) == 48
+        await session.execute(update(CampaignMetric).values(updated_at=datetime(2025, 1, 1)))
+        await session.commit()
+
+    # Повторная загрузка обновляет строки, а не дублирует; неизменные строки не трогаются
+    store.automation.clicks = 80
+    await store.ingest(["c1"], now=datetime(2025, 3, 10, 13))
+    async with store.session_factory() as session:
+        rows = (await session.execute(select(CampaignMetric))).scalars().all()
+        assert len(rows) == 49
+        day = next(row for row in rows if row.granularity == 'day')
+        assert day.clicks == 80 and day.updated_at > datetime(2025, 1, 1)
+        assert all(row.updated_at == datetime(2025, 1, 1) for row in rows if row.granularity == 'hour')
+
+@pytest.mark.asyncio
+async def test_endpoint_serves_store_with_conditional_requests(tmp_path, monkeypatch):
+    store = await _store(tmp_path)
+    monkeypatch.setattr(ai_services, "performance_store", store)
+
+    async def session_override():
+        async with store.session_factory() as session:
+            yield session
+
+    app = FastAPI()
+    app.include_router(ai_services.router)
+    app.dependency_overrides[get_readonly_session] = session_override
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        first = await client.get("/api/campaign/c1/performance")
+        assert first.status_code == 200
+        assert first.json()["total_metrics"]["ctr"] == 5.0
+        etag, last_modified = first.headers["etag"], first.headers["last-modified"]
+
+        assert (await client.get("/api/campaign/c1/performance", headers={"If-None-Match": etag})).status_code == 304
+        assert (await client.get("/api/campaign/c1/performance",
+                                 headers={"If-Modified-Since": last_modified})).status_code == 304
+        # Загрузчик не вызывается на чтение: отвечаем из хранилища
+        assert store.automation.calls == 1
+
+        store.automation.clicks = 80
+        await store.ingest(["c1"])
+        changed = await client.get("/api/campaign/c1/performance", headers={"If-None-Match": etag})
+        assert changed.status_code == 200 and changed.headers["etag"] != etag
+
+        # Неизвестная кампания не загружается по запросу клиента
+        unknown = await client.get("/api/campaign/other/performance")
+        assert unknown.status_code == 404
+        assert "other" not in store.automation.tokens
+
+@pytest.mark.asyncio
+async def test_optimize_endpoint_fetches_with_owner_token(tmp_path, monkeypatch):
+    store = await _store(tmp_path)
+    monkeypatch.setattr(ai_services, "token_vault", store.vault)
+    automation = FakeAutomation()
+
+    async def get_real_performance(campaign_id, access_token=None):
+        return await automation.get_campaign_performance(campaign_id, access_token)
+
+    monkeypatch.setattr(ai_services.campaign_automation_service, "_get_real_performance", get_real_performance)
+
+    async def session_override():
+        async with store.session_factory() as session:
+            yield session
+
+    app = FastAPI()
+    app.include_router(ai_services.router)
+    app.dependency_overrides[get_readonly_session] = session_override
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/api/campaign/c1/optimize")
+        assert response.status_code == 200 and response.json()["status"] == "success"
+        assert automation.tokens == {"c1": "owner_token"}
+
+        assert (await client.post("/api/campaign/other/optimize")).status_code == 404
+        assert "other" not in automation.tokens
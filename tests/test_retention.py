@@ -0,0 +1,74 @@
+import zlib
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.db.models import Base, Campaign, CampaignMetric, Creative, CreativeRawResponse
+from app.services.retention import RetentionPolicy, RetentionService, load_raw_response, week_start
+
+@pytest.mark.asyncio
+async def test_retention_run(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/retention.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    now = datetime(2025, 6, 30, 3, 0)
+    async with session_factory() as session:
+        campaign = Campaign(fb_campaign_id="retention_1", name="Retention")
+        session.add(campaign)
+        await session.flush()
+        for day in range(200):
+            session.add(CampaignMetric(
+                campaign_id=campaign.id,
+                granularity='day',
+                period_start=datetime(2025, 1, 1) + timedelta(days=day),
+                impressions=100, clicks=10, conversions=1, spend=5.0, revenue=12.0
+            ))
+        session.add(Creative(
+            campaign_id=campaign.id,
+            analysis={"analysis": {"keywords": ["a"]}, "raw_response": "x" * 10000},
+            created_at=now - timedelta(days=60)
+        ))
+        await session.commit()
+        campaign_id = campaign.id
+
+    service = RetentionService(
+        policy=RetentionPolicy(daily_metrics_days=90, raw_response_days=30),
+        session_factory=session_factory,
+        engine=engine
+    )
+    report = await service.run(now=now)
+
+    cutoff = now - timedelta(days=90)
+    expected_daily = sum(
+        1 for day in range(200)
+        if datetime(2025, 1, 1) + timedelta(days=day) < cutoff
+    )
+    assert report['downsampled_rows'] == expected_daily
+    assert report['archived_responses'] == 1
+    assert report['reclaimed_bytes'] >= 0
+
+    async with session_factory() as session:
+        rows = (await session.execute(
+            select(CampaignMetric).where(CampaignMetric.campaign_id == campaign_id)
+        )).scalars().all()
+        weekly = [r for r in rows if r.granularity == 'week']
+        # Суммарные показатели сохраняются при свертке
+        assert sum(r.impressions for r in rows) == 200 * 100
+        assert sum(r.spend for r in rows) == pytest.approx(200 * 5.0)
+        assert all(r.period_start == week_start(r.period_start) for r in weekly)
+        assert not any(r.period_start < cutoff for r in rows if r.granularity == 'day')
+
+        creative = (await session.execute(select(Creative))).scalar_one()
+        assert 'raw_response' not in creative.analysis
+        assert await load_raw_response(session, creative.id) == "x" * 10000
+        archived = await session.get(CreativeRawResponse, creative.id)
+        assert len(archived.compressed_response) < archived.original_size
+
+    # Повторный запуск ничего не меняет
+    report = await service.run(now=now)
+    assert report['downsampled_rows'] == 0
+    assert report['archived_responses'] == 0
+    await engine.dispose()
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.db.models import Base, User, Campaign, CampaignMetric, UserRuleSet
+from app.services.budget_optimizer import BudgetOptimizer
+from app.services.rules_engine import CompiledRuleSet, RulesService, default_rule_set
+
+def test_vectorized_rules_respect_priority_and_stop():
+    rules = CompiledRuleSet([
+        {"name": "tip", "priority": 1, "when": [{"metric": "ctr", "op": "<", "value": 2}], "action": {"message": "tip"}},
+        {"name": "pause", "priority": 10, "stop": True, "window": "1d",
+         "when": [{"metric": "spend", "op": ">", "value": 100}, {"metric": "roas", "op": "<", "value": 0.5}],
+         "action": {"message": "pause"}},
+    ])
+    metrics = {
+        "ctr": np.array([1.0, 1.0, 3.0, np.nan]),
+        "spend@1d": np.array([200.0, 50.0, 200.0, 200.0]),
+        "roas@1d": np.array([0.1, 0.1, 0.1, 0.1]),
+    }
+    actions = rules.evaluate(metrics)
+    assert [[a["message"] for a in campaign] for campaign in actions] == [["pause"], ["tip"], ["pause"], ["pause"]]
+    # Одинаковые условия компилируются один раз
+    assert len(rules.conditions) == 3
+
+def test_invalid_rules_are_rejected():
+    with pytest.raises(ValueError):
+        CompiledRuleSet([{"when": [{"metric": "ctr", "op": "~", "value": 1}], "action": {}}])
+    with pytest.raises(ValueError):
+        CompiledRuleSet([{"when": [{"metric": "ctr", "op": "<", "value": 1, "window": "2w"}], "action": {}}])
+
+def test_budget_recommendations_match_previous_behaviour():
+    optimizer = BudgetOptimizer(1000, 100)
+    result = optimizer.get_campaign_recommendations("c1", {"roas": 3.0, "ctr": 0.005, "conversion_rate": 0.05})
+    assert result["status"] == "warning"
+    assert len(result["optimization_tips"]) == 2
+    assert result["optimization_tips"][0].startswith("Отличный ROAS")
+
+    assert optimizer.get_campaign_recommendations("c1", {"roas": 1.5, "ctr": 0.02, "conversion_rate": 0.05}) == {
+        "budget_change": None, "status": None, "optimization_tips": []
+    }
+
+@pytest.mark.asyncio
+async def test_user_rules_apply_without_restart(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/rules.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    now = datetime(2025, 3, 10, 12)
+    today = now.replace(hour=0)
+
+    async with session_factory() as session:
+        user = User(telegram_id=1)
+        session.add(user)
+        await session.flush()
+        for i, clicks in enumerate((5, 50)):
+            campaign = Campaign(fb_campaign_id=f"fb_{i}", user_id=user.id, status="ACTIVE")
+            session.add(campaign)
+            await session.flush()
+            for days_ago in range(10):
+                session.add(CampaignMetric(campaign_id=campaign.id, granularity='day',
+                                           period_start=today - timedelta(days=days_ago),
+                                           impressions=1000, clicks=clicks, conversions=1, spend=20.0))
+        await session.commit()
+        user_id = user.id
+
+    service = RulesService()
+    async with session_factory() as session:
+        assert (await service.get_rules(session, user_id, 'campaign')) is default_rule_set('campaign')
+        result = await service.evaluate_account(session, user_id, now)
+        assert [a["action"] for a in result["fb_0"]][0] == "update_creative"
+
+        await service.save_rules(session, user_id, 'campaign', [
+            {"name": "month_ctr", "when": [{"metric": "ctr", "window": "30d", "op": ">", "value": 4}],
+             "action": {"action": "scale_up"}}
+        ])
+        await session.commit()
+
+    async with session_factory() as session:
+        result = await service.evaluate_account(session, user_id, now)
+    assert result == {"fb_0": [], "fb_1": [{"action": "scale_up"}]}
+
+@pytest.mark.asyncio
+async def test_lost_write_with_same_version_is_not_served_from_cache(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/rules_cache.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    mine = [{"name": "mine", "when": [{"metric": "ctr", "op": ">", "value": 1}], "action": {"action": "scale_up"}}]
+    theirs = [{"name": "theirs", "when": [{"metric": "ctr", "op": "<", "value": 1}], "action": {"action": "pause"}}]
+
+    service = RulesService()
+    async with session_factory() as session:
+        user = User(telegram_id=7)
+        session.add(user)
+        await session.flush()
+        saved = await service.save_rules(session, user.id, 'campaign', mine)
+        await session.commit()
+        user_id = user.id
+    async with session_factory() as session:
+        assert (await service.get_rules(session, user_id, 'campaign')).rules[0]["name"] == "mine"
+
+    # Другой процесс записал свои правила с тем же номером версии, и его запись победила
+    async with session_factory() as session:
+        await session.execute(update(UserRuleSet).where(UserRuleSet.user_id == user_id)
+                              .values(rules=theirs, version=saved["version"]))
+        await session.commit()
+    async with session_factory() as session:
+        assert (await service.get_rules(session, user_id, 'campaign')).rules[0]["name"] == "theirs"
+    await engine.dispose()
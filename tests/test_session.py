@@ -0,0 +1,51 @@
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.db import database
+from app.db.database import get_session, get_readonly_session
+from app.db.models import Base, User
+
+async def _use_temporary_db(tmp_path, monkeypatch):
+    """Подменяет фабрики сессий на временную БД, общий файл приложения не трогаем"""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/session.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    monkeypatch.setattr(database, "async_session_factory",
+                        async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False))
+    monkeypatch.setattr(database, "readonly_session_factory",
+                        async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False, autoflush=False))
+    return engine
+
+@pytest.mark.asyncio
+async def test_session_commits_on_success(tmp_path, monkeypatch):
+    engine = await _use_temporary_db(tmp_path, monkeypatch)
+    sessions = get_session()
+    session = await sessions.__anext__()
+    session.add(User(telegram_id=555000001))
+    with pytest.raises(StopAsyncIteration):
+        await sessions.__anext__()
+
+    readonly = get_readonly_session()
+    session = await readonly.__anext__()
+    result = await session.execute(select(User).where(User.telegram_id == 555000001))
+    user = result.scalar_one()
+    assert user.telegram_id == 555000001
+    await readonly.aclose()
+    await engine.dispose()
+
+@pytest.mark.asyncio
+async def test_session_rolls_back_on_error(tmp_path, monkeypatch):
+    engine = await _use_temporary_db(tmp_path, monkeypatch)
+    sessions = get_session()
+    session = await sessions.__anext__()
+    session.add(User(telegram_id=555000002))
+    with pytest.raises(RuntimeError):
+        await sessions.athrow(RuntimeError("ошибка в эндпоинте"))
+
+    readonly = get_readonly_session()
+    session = await readonly.__anext__()
+    result = await session.execute(select(User).where(User.telegram_id == 555000002))
+    assert result.scalar_one_or_none() is None
+    await readonly.aclose()
+    await engine.dispose()
@@ -0,0 +1,39 @@
+import pytest
+
+from app.services.streaming_optimizer import StreamingBudgetOptimizer
+
+def _event(roas, spend=100.0):
+    return {'impressions': 1000, 'clicks': 20, 'conversions': 1, 'spend': spend, 'revenue': roas * spend}
+
+def test_flush_emits_only_changes_above_threshold():
+    optimizer = StreamingBudgetOptimizer(daily_budget=1000, change_threshold=0.05)
+    for campaign_id in ("a", "b", "c", "d"):
+        optimizer.set_budget(campaign_id, 200)
+    optimizer.flush()
+
+    optimizer.update("a", _event(roas=4.0))
+    changes = optimizer.flush()
+    assert optimizer.last_recomputed == 1
+    assert set(changes) == {"a"}
+    assert changes["a"] == pytest.approx(200 * 1.2)
+
+    # Та же эффективность: бюджет не меняется, diff пустой
+    optimizer.update("a", _event(roas=4.0))
+    assert optimizer.flush() == {}
+
+def test_trend_follows_fast_and_slow_ewma():
+    optimizer = StreamingBudgetOptimizer(daily_budget=1000)
+    optimizer.update("a", _event(roas=2.0))
+    assert optimizer.trend("a") == 0.0
+    optimizer.update("a", _event(roas=3.0))
+    assert optimizer.trend("a") > 0
+    assert optimizer.totals['spend'] == 200
+    assert optimizer.totals['revenue'] == 500
+
+def test_portfolio_is_normalized_to_daily_budget():
+    optimizer = StreamingBudgetOptimizer(daily_budget=1000)
+    for campaign_id in ("a", "b", "c"):
+        optimizer.set_budget(campaign_id, 400)
+        optimizer.update(campaign_id, _event(roas=4.0))
+    optimizer.flush()
+    assert sum(optimizer.campaign_budgets.values()) == pytest.approx(1000)
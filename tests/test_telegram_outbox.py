@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+import pytest
+from telegram.error import RetryAfter
+
+from app.services.telegram_outbox import BULK, INTERACTIVE, FloodControlRateLimiter, NotificationOutbox
+
+@pytest.mark.asyncio
+async def test_interactive_requests_jump_ahead_of_bulk():
+    limiter = FloodControlRateLimiter(global_rate=20, chat_rate=100, chat_burst=1)
+    granted = []
+
+    async def request(name, chat_id, priority):
+        await limiter.acquire(chat_id, priority)
+        granted.append(name)
+
+    bulk = [asyncio.create_task(request(f"bulk_{i}", i, BULK)) for i in range(1, 31)]
+    await asyncio.sleep(0)
+    interactive = asyncio.create_task(request("reply", 999, INTERACTIVE))
+    await asyncio.gather(interactive, *bulk)
+
+    # 20 токенов ушли сразу, следующий общий токен — ответу пользователю
+    assert granted.index("reply") == 20
+
+@pytest.mark.asyncio
+async def test_per_chat_limit_does_not_block_other_chats():
+    limiter = FloodControlRateLimiter(global_rate=100, chat_rate=10, chat_burst=1)
+    finished = {}
+    started = time.monotonic()
+
+    async def request(name, chat_id):
+        await limiter.acquire(chat_id)
+        finished[name] = time.monotonic() - started
+
+    await asyncio.gather(*(request(f"a{i}", 1) for i in range(3)), request("b", 2), request("group", -100))
+    assert finished["a2"] >= 0.18
+    assert finished["b"] < 0.05 and finished["group"] < 0.05
+
+@pytest.mark.asyncio
+async def test_retry_after_pauses_chat_and_retries():
+    limiter = FloodControlRateLimiter(global_rate=100, chat_rate=100, chat_burst=1)
+    calls = []
+
+    async def send_message(**kwargs):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise RetryAfter(0.2)
+        return True
+
+    result = await limiter.process_request(send_message, (), {}, "sendMessage", {"chat_id": 5}, None)
+    assert result is True
+    assert len(calls) == 2 and calls[1] - calls[0] >= 0.19
+
+@pytest.mark.asyncio
+async def test_pending_alerts_to_one_chat_are_coalesced():
+    limiter = FloodControlRateLimiter(global_rate=100, chat_rate=5, chat_burst=1)
+    sent = []
+
+    async def send(chat_id, text):
+        sent.append((chat_id, text))
+
+    outbox = NotificationOutbox(limiter, send, max_length=40)
+    for i in range(3):
+        outbox.enqueue(1, f"alert {i}")
+    outbox.enqueue(2, "other chat")
+    await asyncio.sleep(0.05)
+    # Чат 1 ждет свой лимит: новые алерты дописываются в ожидающее сообщение
+    for i in range(3, 8):
+        outbox.enqueue(1, f"alert {i}")
+    await outbox.drain()
+
+    assert sent[0] == (1, "alert 0\n\nalert 1\n\nalert 2")
+    assert (2, "other chat") in sent
+    chat_1 = [text for chat_id, text in sent if chat_id == 1]
+    # Длина сообщения ограничена: остаток ушел следующим сообщением
+    assert chat_1[1:] == ["alert 3\n\nalert 4\n\nalert 5\n\nalert 6", "alert 7"]
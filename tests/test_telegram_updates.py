@@ -0,0 +1,58 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from telegram import Update
+
+from app import telegram_integration
+from app.routers import telegram as telegram_router
+from app.telegram_integration import PerChatUpdateProcessor
+
+def _update(update_id: int, chat_id: int) -> Update:
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "text": "hi",
+                    "chat": {"id": chat_id, "type": "private"}},
+    }, None)
+
+@pytest.mark.asyncio
+async def test_updates_are_serialized_per_chat_and_parallel_across_chats():
+    processor = PerChatUpdateProcessor(max_workers=2, max_pending_updates=10)
+    events, running, peak = [], 0, 0
+
+    async def handle(update: Update, delay: float):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        events.append(("start", update.update_id))
+        await asyncio.sleep(delay)
+        events.append(("end", update.update_id))
+        running -= 1
+
+    updates = [(_update(1, 100), 0.05), (_update(2, 100), 0.01), (_update(3, 200), 0.01), (_update(4, 300), 0.01)]
+    await asyncio.gather(*(processor.process_update(update, handle(update, delay)) for update, delay in updates))
+
+    # Второе сообщение чата 100 начинается только после первого
+    assert events.index(("start", 2)) > events.index(("end", 1))
+    # Чат 200 не ждет медленный чат 100
+    assert events.index(("end", 3)) < events.index(("end", 1))
+    assert peak == 2
+    assert processor._chats == {}
+
+@pytest.mark.asyncio
+async def test_webhook_only_enqueues(monkeypatch):
+    queue = asyncio.Queue()
+    monkeypatch.setattr(telegram_integration, "application",
+                        SimpleNamespace(running=True, bot=None, update_queue=queue))
+    monkeypatch.setattr(telegram_router.settings, "RENDER", True)
+    app = FastAPI()
+    app.include_router(telegram_router.router)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.post("/webhook/telegram", json={
+            "update_id": 7, "message": {"message_id": 1, "date": 0, "text": "/start",
+                                        "chat": {"id": 5, "type": "private"}}})
+    assert response.status_code == 200 and response.json() == {"status": "ok"}
+    assert queue.get_nowait().update_id == 7
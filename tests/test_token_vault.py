@@ -0,0 +1,63 @@
+import pytest
+from datetime import datetime, timedelta
+from cryptography.fernet import Fernet
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.db.models import Base, User, TokenVault as TokenVaultRecord
+from app.services.token_vault import TokenVault
+
+@pytest.mark.asyncio
+async def test_token_vault_encrypts_and_caches(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/vault.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    vault = TokenVault(encryption_key=Fernet.generate_key().decode(), session_factory=session_factory)
+
+    async with session_factory() as session:
+        user = User(telegram_id=777, fb_access_token="plain_token")
+        session.add(user)
+        await session.commit()
+        user_id = user.id
+
+    assert await vault.migrate_plaintext_tokens() == 1
+
+    async with session_factory() as session:
+        record = await session.get(TokenVaultRecord, user_id)
+        assert b"plain_token" not in record.encrypted_token
+        assert (await session.get(User, user_id)).fb_access_token is None
+
+    # Новый экземпляр (другой процесс) расшифровывает токен один раз
+    fresh = TokenVault(encryption_key=vault._encryption_key, session_factory=session_factory)
+    async with session_factory() as session:
+        assert await fresh.get_token(session, user_id) == "plain_token"
+    assert len(fresh.cache) == 1
+    fresh._fernet = None
+    fresh._encryption_key = None
+    async with session_factory() as session:
+        # Попадание в кеш не требует ключа шифрования
+        assert await fresh.get_token(session, user_id) == "plain_token"
+
+    async with session_factory() as session:
+        await vault.store_token(session, user_id, "expired", datetime.now() - timedelta(days=1))
+        await session.commit()
+        # Истекший токен не отдается и из кеша
+        assert await vault.get_token(session, user_id) is None
+
+    async with session_factory() as session:
+        await vault.store_token(session, user_id, "not_committed")
+        await session.rollback()
+    assert vault.cache.get(user_id) is None
+    await engine.dispose()
+
+def test_oauth_state_is_signed_and_expires(monkeypatch):
+    from app.services import oauth_state
+    monkeypatch.setattr(oauth_state.settings, "OAUTH_STATE_SECRET", "secret")
+
+    state = oauth_state.issue_state(42, now=1000, ttl_seconds=600)
+    assert oauth_state.verify_state(state, now=1500) == 42
+    # Чужой user_id с подписью от другого пользователя не проходит
+    forged = "43" + state[state.index("."):]
+    for bad in (forged, "42", state, "garbage"):
+        with pytest.raises(oauth_state.OAuthStateError):
+            oauth_state.verify_state(bad, now=1700 if bad == state else 1500)
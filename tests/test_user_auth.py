@@ -0,0 +1,92 @@
+import hashlib
+import hmac
+import json
+from urllib.parse import urlencode
+
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.db.database import get_readonly_session
+from app.db.models import Base, User
+from app.routers import facebook
+from app.services import user_auth
+from app.services.oauth_state import issue_state
+
+BOT_TOKEN = "123:bot-token"
+
+async def _session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/user_auth.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+def _init_data(telegram_id: int, auth_date: int, bot_token: str = BOT_TOKEN) -> str:
+    fields = {"auth_date": str(auth_date), "query_id": "q1", "user": json.dumps({"id": telegram_id})}
+    check_string = "\n".join(f"{key}={value}" for key, value in sorted(fields.items()))
+    secret = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    fields["hash"] = hmac.new(secret, check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+def test_session_is_signed_and_expires(monkeypatch):
+    monkeypatch.setattr(user_auth.settings, "SESSION_SECRET", "secret")
+    monkeypatch.setattr(user_auth.settings, "OAUTH_STATE_SECRET", "secret")
+
+    token = user_auth.issue_session(42, now=1000, ttl_seconds=600)
+    assert user_auth.verify_session(token, now=1500) == 42
+    forged = "43" + token[token.index("."):]
+    # OAuth state с тем же ключом не является сессией
+    for bad in (forged, token, issue_state(42, now=1000), "garbage"):
+        with pytest.raises(user_auth.AuthError):
+            user_auth.verify_session(bad, now=1700 if bad == token else 1500)
+
+def test_init_data_is_checked_with_bot_token():
+    init_data = _init_data(777, auth_date=1000)
+    assert user_auth.verify_init_data(init_data, BOT_TOKEN, now=1100, max_age_seconds=600) == 777
+    for bad, now in ((_init_data(777, 1000, "other:token"), 1100), (init_data.replace("777", "778"), 1100),
+                     (init_data, 2000)):
+        with pytest.raises(user_auth.AuthError):
+            user_auth.verify_init_data(bad, BOT_TOKEN, now=now, max_age_seconds=600)
+
+@pytest.mark.asyncio
+async def test_facebook_endpoints_use_authenticated_user(tmp_path, monkeypatch):
+    session_factory = await _session_factory(tmp_path)
+    async with session_factory() as session:
+        session.add_all([User(id=1, telegram_id=777), User(id=2, telegram_id=888)])
+        await session.commit()
+    monkeypatch.setattr(user_auth.settings, "SESSION_SECRET", "secret")
+    monkeypatch.setattr(user_auth.settings, "TELEGRAM_BOT_TOKEN", BOT_TOKEN)
+    tokens_for = []
+
+    async def get_user_token(session, user_id):
+        tokens_for.append(user_id)
+        return "token"
+
+    monkeypatch.setattr(facebook, "_get_user_token", get_user_token)
+    monkeypatch.setattr(facebook, "_get_ad_accounts_sync", lambda api: [])
+
+    async def session_override():
+        async with session_factory() as session:
+            yield session
+
+    app = FastAPI()
+    app.include_router(facebook.router)
+    app.dependency_overrides[get_readonly_session] = session_override
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        # user_id из запроса больше не дает доступа к чужому токену
+        anonymous = await client.get("/api/facebook/ad-accounts", params={"user_id": 2})
+        assert anonymous.status_code == 401
+        forged = await client.get("/api/facebook/ad-accounts", headers={"Authorization": "Bearer 2.9999999999.x.sig"})
+        assert forged.status_code == 401
+
+        by_session = await client.get("/api/facebook/ad-accounts", params={"user_id": 2},
+                                      headers={"Authorization": f"Bearer {user_auth.issue_session(1)}"})
+        by_init_data = await client.get("/api/facebook/ad-accounts",
+                                        headers={user_auth.INIT_DATA_HEADER: _init_data(888, int(1e10))})
+        assert by_session.status_code == by_init_data.status_code == 200
+        assert tokens_for == [1, 2]
+
+        auth = await client.get("/api/facebook/auth", params={"token": "1.9999999999.x.sig"})
+        assert auth.status_code == 401
@@ -0,0 +1,71 @@
+import time
+
+import httpx
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.db.models import Base
+from app.services.campaign_automation import CampaignAutomationService
+from app.services.fake_graph import FakeGraph, create_fake_graph_app
+from app.services.variant_generation import balanced_budgets, expand_variants, prune_near_duplicates
+
+ANALYSIS = {
+    "campaign_objective": "CONVERSIONS",
+    "target_audience": {"age_range": "25-45", "interests": ["технологии", "бизнес"]},
+    "ad_copy_suggestions": [
+        "Революционное решение для вашего бизнеса",
+        "Революционное решение для вашего бизнеса!",
+        "Присоединяйтесь к тысячам довольных клиентов",
+    ],
+    "placement_suggestions": ["Facebook Feed", "Instagram Feed", "Instagram Stories", "Audience Network"],
+}
+
+async def _session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/variants.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+def test_plan_prunes_duplicates_and_balances_budget():
+    assert prune_near_duplicates(ANALYSIS["ad_copy_suggestions"]) == [0, 2]
+    assert balanced_budgets(10, 3) == [334, 333, 333]
+
+    plan = expand_variants(ANALYSIS, {}, 60)
+    assert plan["pruned"] == 1 and len(plan["copies"]) == 2
+    # 4 аудитории × 3 известных размещения
+    assert len(plan["cells"]) == 12 and len(plan["variants"]) == 24
+    assert {cell["daily_budget"] for cell in plan["cells"]} == {500}
+
+    capped = expand_variants(ANALYSIS, {"max_variants": 10}, 3)
+    assert len(capped["cells"]) == 3 and len(capped["variants"]) == 6
+    assert sum(cell["daily_budget"] for cell in capped["cells"]) == 300
+    # Первые группы покрывают разные аудитории и размещения
+    assert len({cell["audience"]["name"] for cell in capped["cells"]}) == 2
+    assert len({cell["placement"]["name"] for cell in capped["cells"]}) == 2
+
+@pytest.mark.asyncio
+async def test_thirty_variants_launch_in_batched_round_trips(tmp_path):
+    latency = 0.1
+    graph = FakeGraph(seed=1, latency_ms=latency * 1000, latency_jitter_ms=0)
+    service = CampaignAutomationService(session_factory=await _session_factory(tmp_path),
+                                        transport=httpx.ASGITransport(app=create_fake_graph_app(graph)))
+    service.fb_access_token = "token"
+    service.ad_account_id = "act_123456789"
+    analysis = {**ANALYSIS, "ad_copy_suggestions": ANALYSIS["ad_copy_suggestions"] + [
+        "Экономьте время с нашим сервисом", "Попробуйте бесплатно уже сегодня"]}
+
+    started = time.monotonic()
+    result = await service.create_test_from_analysis({"analysis": analysis}, {"budget": 70, "max_variants": 30})
+    elapsed = time.monotonic() - started
+
+    assert result["status"] == "success"
+    assert len(result["variants"]) == 28  # 4 текста × 7 групп
+    # Цепочка: кампания -> пачка групп -> пачка объявлений, как у одного объявления
+    assert elapsed < 6 * latency
+    assert graph.requests <= 8
+
+    adsets = [obj for obj in graph.store.objects.values() if obj["type"] == "adset"]
+    ads = [obj for obj in graph.store.objects.values() if obj["type"] == "ad"]
+    assert len(adsets) == 7 and len(ads) == 28
+    assert {int(adset["daily_budget"]) for adset in adsets} == {1000}
+    assert any(adset["targeting"].get("instagram_positions") == ["story"] for adset in adsets)